@@ -1,15 +1,43 @@
 import cv2
+import functools
+import hashlib
 import keras
-import base64
+import io
+import threading
+import uuid
+import numpy as np
+import tensorflow as tf
 from pathlib import Path
 from flask import Flask
 from flask import request
+from flask import session
 from flask import redirect
 from flask import url_for
 from flask import render_template
 from flask import flash
+from flask import jsonify
+from flask import abort
+from flask import send_file
 from werkzeug.utils import secure_filename
 from fruit_classifier.predict.__main__ import main
+from fruit_classifier.predict.predict_utils import load_classifier
+from fruit_classifier.embeddings.embedding_utils import get_embedding_model
+from fruit_classifier.embeddings.embedding_utils import get_index_dir
+from fruit_classifier.embeddings.embedding_utils import load_index
+from fruit_classifier.utils.image_utils import open_image
+from fruit_classifier.utils.image_utils import read_image
+from fruit_classifier.utils.image_utils import check_image
+from fruit_classifier.utils.image_utils import MAX_IMAGE_BYTES
+from app.upload_store import UploadStore
+from app.admission import AdmissionController
+from app.admission import OverloadedError
+from app.speculation import SpeculativeRunner
+from fruit_classifier.execution.execution_utils import \
+    load_execution_profile
+from fruit_classifier.execution.execution_utils import \
+    get_session_config
+from fruit_classifier.preprocessing.preprocessing_utils import \
+    preprocess_image
 
 
 app = Flask(__name__)
@@ -24,6 +52,70 @@ if not UPLOAD_DIR.is_dir():
 
 
 app.config['UPLOAD_DIR'] = str(UPLOAD_DIR)
+# Flask answers larger requests with 413 without reading them
+app.config['MAX_CONTENT_LENGTH'] = MAX_IMAGE_BYTES
+# Uploads expire an hour after they were last viewed, and the oldest
+# uploads are evicted when they take up more than the budget
+app.config['UPLOAD_TTL'] = 3600
+app.config['UPLOAD_MAX_BYTES'] = 256 << 20
+
+# NOTE: The store owns the upload directory. Files are evicted by its
+#       janitor thread, never by the request handlers
+UPLOAD_STORE = UploadStore(UPLOAD_DIR,
+                           ttl=app.config['UPLOAD_TTL'],
+                           max_bytes=app.config['UPLOAD_MAX_BYTES']).start()
+
+# The thread settings are read once, instead of on every request
+EXECUTION_PROFILE = load_execution_profile()
+
+# The pages reference the images by url, so browsers can cache them.
+# Uploads are shown downscaled so that their long side is one of
+# DISPLAY_SIZES, and the last DISPLAY_CACHE_SIZE downscaled images are
+# kept in memory
+app.config['IMAGE_MAX_AGE'] = 3600
+app.config['DISPLAY_SIZES'] = (256, 512, 1024)
+app.config['DISPLAY_SIZE'] = 512
+app.config['DISPLAY_CACHE_SIZE'] = 64
+
+# Browsers with canvas support downscale photos so that their long side
+# is at most UPLOAD_MAX_DIMENSION before uploading them. Full size
+# uploads from other clients are still accepted
+app.config['CLIENT_RESIZE'] = True
+app.config['UPLOAD_MAX_DIMENSION'] = 1024
+
+# Predictions run on a single inference thread behind a bounded queue.
+# When the queue is full, requests are answered with 503 at once
+app.config['ADMISSION_WORKERS'] = 1
+app.config['ADMISSION_QUEUE_SIZE'] = 8
+app.config['ADMISSION_DEADLINE'] = 30
+ADMISSION = AdmissionController(
+    n_workers=app.config['ADMISSION_WORKERS'],
+    max_queue=app.config['ADMISSION_QUEUE_SIZE'],
+    deadline=app.config['ADMISSION_DEADLINE'])
+
+# Uploads are classified in the background while the user looks at the
+# confirmation page. Speculation only starts when the admission queue
+# is at most SPECULATION_QUEUE_FRACTION full, and the results of the
+# last SPECULATION_MAX_ENTRIES uploads are kept
+app.config['SPECULATION_MAX_ENTRIES'] = 32
+app.config['SPECULATION_QUEUE_FRACTION'] = 0.5
+SPECULATION = SpeculativeRunner(
+    ADMISSION,
+    max_entries=app.config['SPECULATION_MAX_ENTRIES'],
+    max_queue_fraction=app.config['SPECULATION_QUEUE_FRACTION'])
+
+# Similar images are searched in the index built by
+# python -m fruit_classifier.embeddings build. If the index has inverted
+# lists, SIMILAR_N_PROBE of them are scanned instead of all the images
+app.config['SIMILAR_MAX_K'] = 100
+app.config['SIMILAR_N_PROBE'] = 8
+# The index loaded by get_embedding_index and its modification time
+_INDEX_CACHE = dict()
+_INDEX_LOCK = threading.Lock()
+# The embedding model loaded by get_resident_embedding_model, together
+# with its graph, its session and the modification time of the model
+_EMBEDDING_CACHE = dict()
+_EMBEDDING_LOCK = threading.Lock()
 
 # http://flask.pocoo.org/docs/latest/quickstart/#sessions
 # Secret needed for flash()
@@ -31,6 +123,20 @@ app.config['UPLOAD_DIR'] = str(UPLOAD_DIR)
 app.secret_key = b'_5#y2L"F4Q8z\n\xec]/'
 
 
+def get_session_id():
+    """
+    Returns the id used to namespace the uploads of this session
+
+    Returns
+    -------
+    session_id : str
+        The id of the session, created on the first call
+    """
+    if 'upload_session' not in session:
+        session['upload_session'] = uuid.uuid4().hex
+    return session['upload_session']
+
+
 def allowed_file(filename):
     """
     Checks whether the filename has an allowed extension
@@ -88,14 +194,28 @@ def index():
 
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
+            extension = filename.rsplit('.', 1)[1]
             # NOTE: Storing the file on server because:
             #       - The files can be too large to store in session
             #       - Base64 strings of the images can have more than
             #         the allowed 2083 characters for the URL
             #       - It's usually a bad idea to keep in memory for
             #         several parallel sessions
-            file.save(str(Path(app.config['UPLOAD_DIR']).
-                          joinpath(filename)))
+            data = file.read()
+            # Refuse images which are too large to decode before they
+            # are stored
+            try:
+                check_image(io.BytesIO(data), len(data))
+            except ValueError as error:
+                flash('Not a valid image: {}'.format(error))
+                return redirect(request.url)
+
+            session_id = get_session_id()
+            filename = UPLOAD_STORE.put(session_id, data, extension)
+            # Start classifying while the user confirms
+            SPECULATION.start((session_id, filename),
+                              predict_image,
+                              UPLOAD_STORE.get_path(session_id, filename))
             return redirect(url_for('confirm_file',
                                     filename=filename))
 
@@ -104,10 +224,10 @@ def index():
             return redirect(request.url)
 
     elif request.method == 'GET':
-        # Clean uploaded files
-        for f in UPLOAD_DIR.glob('**/*'):
-            f.unlink()
-        return render_template('index.html')
+        return render_template(
+            'index.html',
+            client_resize=app.config['CLIENT_RESIZE'],
+            max_dimension=app.config['UPLOAD_MAX_DIMENSION'])
 
 
 @app.route('/confirm/<filename>', methods=['GET'])
@@ -125,14 +245,16 @@ def confirm_file(filename):
     Response
         Displays confirm.html which gives the user the choice to
         start from scratch or classify the image
+        Redirects to index() if the upload has expired
     """
-    path = Path(app.config['UPLOAD_DIR']).joinpath(filename)
+    path = UPLOAD_STORE.get_path(get_session_id(), filename)
+    if path is None:
+        flash('The upload has expired, please upload it again')
+        return redirect(url_for('index'))
 
-    # The image is encoded to base64 in order to display it
-    image_b64 = base64.b64encode(path.read_bytes()).decode('utf-8')
     return render_template('confirm.html',
-                           image_b64=image_b64,
-                           filename=filename)
+                           filename=filename,
+                           display_size=app.config['DISPLAY_SIZE'])
 
 
 @app.route('/classify/<filename>', methods=['GET'])
@@ -150,19 +272,413 @@ def classify_file(filename):
     Response
         Displays the predicted image in prediction.html
         This webpage also contains a button to start over
+        Redirects to index() if the upload has expired
+    """
+    path = UPLOAD_STORE.get_path(get_session_id(), filename)
+    if path is None:
+        flash('The upload has expired, please upload it again')
+        return redirect(url_for('index'))
+
+    # NOTE: The result is usually ready, as the classification was
+    #       started at upload. Raises OverloadedError if the request
+    #       can not be served in time, which is answered by overloaded()
+    SPECULATION.run((get_session_id(), filename), predict_image, path)
+
+    # The kept result is served by result_image
+    return render_template('prediction.html', filename=filename)
+
+
+@app.route('/uploads/<filename>', methods=['GET'])
+def upload_image(filename):
+    """
+    Serves an uploaded image, optionally downscaled for display
+
+    The long side of the displayed image is given by the query
+    parameter size, which is rounded up to one of DISPLAY_SIZES
+
+    Parameters
+    ----------
+    filename : str
+        The file name of the image
+
+    Returns
+    -------
+    Response
+        The image with caching headers, or 304 if the browser has it
+        404 if the upload has expired
+    """
+    path = UPLOAD_STORE.get_path(get_session_id(), filename)
+    if path is None:
+        abort(404)
+
+    size = request.args.get('size', type=int)
+    if size is None:
+        # NOTE: The file is streamed from disk, and send_file answers
+        #       conditional requests from its ETag and Last-Modified
+        response = send_file(str(path),
+                             conditional=True,
+                             cache_timeout=app.config['IMAGE_MAX_AGE'])
+        return make_private(response)
+
+    size = get_display_size(size)
+    try:
+        data = get_display_image(str(path), size)
+    except ValueError:
+        abort(404)
+    response = app.response_class(data, mimetype='image/jpeg')
+    # The uploads are named by their content, so the name and the size
+    # identify the displayed image
+    response.set_etag('{}-{}'.format(filename, size))
+    response.last_modified = path.stat().st_mtime
+
+    return make_private(response).make_conditional(request)
+
+
+@app.route('/results/<filename>', methods=['GET'])
+def result_image(filename):
+    """
+    Serves the annotated image of a classified upload
+
+    Parameters
+    ----------
+    filename : str
+        The file name of the uploaded image
+
+    Returns
+    -------
+    Response
+        The png with caching headers, or 304 if the browser has it
+        404 if the upload has expired or was not classified
+    """
+    if UPLOAD_STORE.get_path(get_session_id(), filename) is None:
+        abort(404)
+
+    # NOTE: The result is kept from classify_file, so this is only a
+    #       lookup. Inference is never started from here, as the page
+    #       showing the result has already been served
+    try:
+        result = SPECULATION.get((get_session_id(), filename))
+    except KeyError:
+        abort(404)
+
+    response = app.response_class(result, mimetype='image/png')
+    response.set_etag(hashlib.sha1(result).hexdigest())
+
+    return make_private(response).make_conditional(request)
+
+
+def make_private(response):
+    """
+    Lets only the browser of the session cache the response
+
+    Parameters
+    ----------
+    response : Response
+        The response
+
+    Returns
+    -------
+    response : Response
+        The response with the Cache-Control header set
     """
-    path = Path(app.config['UPLOAD_DIR']).joinpath(filename)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.max_age = app.config['IMAGE_MAX_AGE']
+    return response
+
+
+def get_display_size(size):
+    """
+    Rounds a requested display size up to one of DISPLAY_SIZES
+
+    Only a few sizes are allowed, so the cache of displayed images is
+    not filled with one copy per requested size
+
+    Parameters
+    ----------
+    size : int
+        The requested length of the long side
+
+    Returns
+    -------
+    size : int
+        The smallest allowed size at least as large, or the largest
+    """
+    sizes = sorted(app.config['DISPLAY_SIZES'])
+    for allowed_size in sizes:
+        if allowed_size >= size:
+            return allowed_size
+    return sizes[-1]
+
+
+@functools.lru_cache(maxsize=app.config['DISPLAY_CACHE_SIZE'])
+def get_display_image(path, size):
+    """
+    Returns an image downscaled so that its long side is size pixels
+
+    The results are cached, as the uploads are named by their content
+
+    Parameters
+    ----------
+    path : str
+        The path to the image
+    size : int
+        The maximum length of the long side
+
+    Returns
+    -------
+    data : bytes
+        The image encoded as jpg. Small images are not upscaled
+
+    Raises
+    ------
+    ValueError
+        If the image can not be decoded
+    """
+    # NOTE: Large jpgs are decoded at a reduced size. The decoded image
+    #       has more than size * size pixels, so its long side is still
+    #       at least size
+    image = read_image(Path(path), max_decode_pixels=4 * size * size)
+    if image is None:
+        raise ValueError('{} can not be decoded'.format(path))
+    scale = size / max(image.shape[:2])
+    if scale < 1:
+        image = cv2.resize(image,
+                           (max(int(round(image.shape[1] * scale)), 1),
+                            max(int(round(image.shape[0] * scale)), 1)),
+                           interpolation=cv2.INTER_AREA)
+    _, data = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 85])
+
+    return data.tobytes()
+
+
+def predict_image(path):
+    """
+    Classifies the image and encodes the annotated output
+
+    This runs on the inference thread of the admission controller
+
+    Parameters
+    ----------
+    path : Path
+        The path to the image
 
+    Returns
+    -------
+    result : bytes
+        The annotated image encoded as png
+    """
     # Clear any existing keras sessions and predict
     keras.backend.clear_session()
-    output = main(path)
+    output = main(path, execution_profile=EXECUTION_PROFILE)
+
+    # NOTE: The output is encoded in memory, as the stored upload is
+    #       named by its content and must not be overwritten
+    _, result = cv2.imencode('.png', output)
+
+    return result.tobytes()
+
+
+@app.route('/similar/<filename>', methods=['GET'])
+def similar_file(filename):
+    """
+    Finds the images in the dataset most similar to the uploaded image
+
+    The number of images is given by the query parameter k
+
+    Parameters
+    ----------
+    filename : str
+        The file name of the image
+
+    Returns
+    -------
+    Response
+        JSON with the path, label and similarity of the similar images
+        404 if the upload has expired or there is no index
+    """
+    path = UPLOAD_STORE.get_path(get_session_id(), filename)
+    if path is None:
+        response = jsonify(error='The upload has expired')
+        response.status_code = 404
+        return response
+
+    index = get_embedding_index()
+    if index is None:
+        response = jsonify(error='No embedding index, build it with '
+                                 'python -m fruit_classifier.embeddings '
+                                 'build')
+        response.status_code = 404
+        return response
+
+    k = request.args.get('k', 10, type=int)
+    k = min(max(k, 1), app.config['SIMILAR_MAX_K'])
+
+    # NOTE: Only the embedding runs on the inference thread. The search
+    #       runs on the request thread, as it does not use the model
+    embedding = ADMISSION.run(embed_image, path)
+    indices, scores = index.search(embedding,
+                                   k=k,
+                                   n_probe=app.config['SIMILAR_N_PROBE'])
+
+    neighbours = [dict(index.items[i], similarity=float(score))
+                  for i, score in zip(indices[0], scores[0]) if i >= 0]
+    return jsonify(neighbours=neighbours)
+
+
+def get_embedding_index():
+    """
+    Returns the embedding index
+
+    The index is loaded on the first call, and again if it is rebuilt
+
+    Returns
+    -------
+    index : None or EmbeddingIndex
+        The index. None if it has not been built
+    """
+    metadata_path = get_index_dir().joinpath('index.json')
+    if not metadata_path.is_file():
+        return None
+
+    with _INDEX_LOCK:
+        mtime = metadata_path.stat().st_mtime
+        if _INDEX_CACHE.get('mtime') != mtime:
+            _INDEX_CACHE['index'], _ = load_index()
+            _INDEX_CACHE['mtime'] = mtime
+
+        return _INDEX_CACHE['index']
+
+
+def get_resident_embedding_model():
+    """
+    Returns the embedding model
+
+    The model is loaded on the first call, and again if the classifier
+    is retrained. It lives in a graph and session of its own, so it is
+    kept when predict_image clears the Keras session
+
+    Returns
+    -------
+    embedding_model : Model
+        The model mapping images to embeddings
+    graph : tf.Graph
+        The graph of the model
+    session : tf.Session
+        The session to run the model in
+    """
+    model_path = Path(__file__).absolute().parents[1].joinpath(
+        'generated_data', 'models', 'model.h5')
+
+    with _EMBEDDING_LOCK:
+        mtime = model_path.stat().st_mtime
+        if _EMBEDDING_CACHE.get('mtime') != mtime:
+            if 'session' in _EMBEDDING_CACHE:
+                _EMBEDDING_CACHE['session'].close()
+
+            graph = tf.Graph()
+            session = tf.Session(graph=graph,
+                                 config=get_session_config(
+                                     EXECUTION_PROFILE))
+            with graph.as_default(), session.as_default():
+                model = load_classifier(model_path)
+                embedding_model = get_embedding_model(model)
+                # NOTE: The predict function is built in the graph of
+                #       the model, instead of on the first query
+                embedding_model._make_predict_function()
+
+            _EMBEDDING_CACHE['model'] = embedding_model
+            _EMBEDDING_CACHE['graph'] = graph
+            _EMBEDDING_CACHE['session'] = session
+            _EMBEDDING_CACHE['mtime'] = mtime
+
+        return (_EMBEDDING_CACHE['model'],
+                _EMBEDDING_CACHE['graph'],
+                _EMBEDDING_CACHE['session'])
+
+
+def embed_image(path):
+    """
+    Returns the embedding of an image
+
+    This runs on the inference thread of the admission controller
 
-    # Store the output image
-    cv2.imwrite(str(path), output)
+    Parameters
+    ----------
+    path : Path
+        The path to the image
+
+    Returns
+    -------
+    embedding : np.array, shape (1, dim)
+        The embedding of the image
+    """
+    embedding_model, graph, session = get_resident_embedding_model()
+
+    height, width = embedding_model.input_shape[1:3]
+    image = preprocess_image(open_image(path), height, width)
+    with graph.as_default(), session.as_default():
+        embedding = embedding_model.predict(np.expand_dims(image,
+                                                           axis=0))
+
+    return embedding
+
+
+@app.errorhandler(413)
+def too_large(error):
+    """
+    Redirects to the main page when the upload is too large
+
+    Parameters
+    ----------
+    error : RequestEntityTooLarge
+        The error raised by Flask
+
+    Returns
+    -------
+    Response
+        A redirection to index()
+    """
+    flash('The file is too large, at most {} MB is '
+          'allowed'.format(MAX_IMAGE_BYTES >> 20))
+    return redirect(url_for('index'))
 
-    # The image is encoded to base64 in order to display it
-    result_b64 = base64.b64encode(path.read_bytes()).decode('utf-8')
-    return render_template('prediction.html', result_b64=result_b64)
+
+@app.errorhandler(OverloadedError)
+def overloaded(error):
+    """
+    Sheds load when the admission queue is full or a deadline passed
+
+    Parameters
+    ----------
+    error : OverloadedError
+        The error raised by the admission controller
+
+    Returns
+    -------
+    Response
+        503 with a Retry-After header
+    """
+    response = jsonify(error=str(error), retry_after=error.retry_after)
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Exposes the state of the admission queue
+
+    Returns
+    -------
+    Response
+        JSON with the queue depth, the number of requests in flight and
+        the number of admitted, completed, shed and expired requests,
+        and the counters of the speculative classifications
+    """
+    return jsonify(dict(ADMISSION.get_stats(),
+                        speculation=SPECULATION.get_stats()))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,254 @@
+import math
+import queue
+import threading
+import time
+from concurrent.futures import CancelledError
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+
+class OverloadedError(Exception):
+    """
+    Raised when a request is not served because of overload
+
+    Parameters
+    ----------
+    message : str
+        The error message
+    retry_after : int
+        Seconds the client should wait before retrying
+    """
+
+    def __init__(self, message, retry_after):
+        super(OverloadedError, self).__init__(message)
+        self.retry_after = retry_after
+
+
+class QueueFullError(OverloadedError):
+    """
+    Raised when the admission queue is full
+    """
+
+
+class DeadlineExceededError(OverloadedError):
+    """
+    Raised when a request was not served before its deadline
+    """
+
+
+class AdmissionController(object):
+    """
+    Runs jobs on worker threads behind a bounded admission queue
+
+    A job is rejected at once if the queue is full, instead of waiting
+    behind everybody else. Jobs which are still queued when their
+    deadline passes are dropped without being run, as their client has
+    given up on them.
+
+    Parameters
+    ----------
+    n_workers : int
+        The number of worker threads
+    max_queue : int
+        The number of jobs which may wait for a worker
+    deadline : float
+        Default number of seconds a request may take in total
+    """
+
+    def __init__(self, n_workers=1, max_queue=8, deadline=30.0):
+        self.n_workers = n_workers
+        self.max_queue = max_queue
+        self.deadline = deadline
+
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.lock = threading.Lock()
+        self.stats = {'admitted': 0,
+                      'completed': 0,
+                      'failed': 0,
+                      'shed': 0,
+                      'expired': 0,
+                      'timed_out': 0}
+        self.in_flight = 0
+        # Exponentially weighted mean of the seconds a job runs
+        self.service_time = None
+
+        self.workers = [threading.Thread(target=self._run, daemon=True)
+                        for _ in range(n_workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def get_retry_after(self):
+        """
+        Estimates when the queue will have drained
+
+        Returns
+        -------
+        retry_after : int
+            Seconds until the queued jobs are expected to be served
+        """
+
+        service_time = self.service_time or 1.0
+        waiting = self.queue.qsize() + self.in_flight
+        retry_after = math.ceil(service_time * waiting / self.n_workers)
+
+        return max(retry_after, 1)
+
+    def submit(self, function, *args, deadline=None, **kwargs):
+        """
+        Queues a job
+
+        Parameters
+        ----------
+        function : callable
+            The job
+        args : tuple
+            Positional arguments passed to function
+        deadline : None or float
+            Seconds from now the job must start before.
+            If None, the default deadline is used
+        kwargs : dict
+            Keyword arguments passed to function
+
+        Returns
+        -------
+        future : Future
+            The future result of the job
+
+        Raises
+        ------
+        QueueFullError
+            If the queue is full
+        """
+
+        if deadline is None:
+            deadline = self.deadline
+
+        future = Future()
+        job = (time.monotonic() + deadline, future, function, args, kwargs)
+
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            with self.lock:
+                self.stats['shed'] += 1
+            raise QueueFullError('The server is overloaded',
+                                 self.get_retry_after())
+
+        with self.lock:
+            self.stats['admitted'] += 1
+
+        return future
+
+    def run(self, function, *args, deadline=None, **kwargs):
+        """
+        Runs a job and waits for its result within the deadline
+
+        Parameters
+        ----------
+        function : callable
+            The job
+        args : tuple
+            Positional arguments passed to function
+        deadline : None or float
+            Seconds from now the result must be ready within.
+            If None, the default deadline is used
+        kwargs : dict
+            Keyword arguments passed to function
+
+        Returns
+        -------
+        result : object
+            The return value of the job
+
+        Raises
+        ------
+        QueueFullError
+            If the queue is full
+        DeadlineExceededError
+            If the job did not finish before the deadline
+        """
+
+        if deadline is None:
+            deadline = self.deadline
+
+        future = self.submit(function, *args, deadline=deadline, **kwargs)
+        try:
+            return future.result(timeout=deadline)
+        except (FutureTimeoutError, CancelledError):
+            # A job which has not started yet is never run
+            future.cancel()
+            with self.lock:
+                self.stats['timed_out'] += 1
+            raise DeadlineExceededError('The request took too long',
+                                        self.get_retry_after())
+
+    def get_stats(self):
+        """
+        Returns the counters of the controller
+
+        Returns
+        -------
+        stats : dict
+            Dictionary containing
+            - queue_depth
+            - max_queue
+            - in_flight
+            - workers
+            - admitted
+            - completed
+            - failed
+            - shed (rejected because the queue was full)
+            - expired (dropped from the queue after the deadline)
+            - timed_out (not finished before the deadline)
+            - service_time (mean seconds per job)
+        """
+
+        with self.lock:
+            stats = dict(self.stats)
+            stats['in_flight'] = self.in_flight
+        stats['queue_depth'] = self.queue.qsize()
+        stats['max_queue'] = self.max_queue
+        stats['workers'] = self.n_workers
+        stats['service_time'] = self.service_time
+
+        return stats
+
+    def _run(self):
+        """
+        Runs the queued jobs
+        """
+
+        while True:
+            deadline, future, function, args, kwargs = self.queue.get()
+
+            if time.monotonic() > deadline:
+                with self.lock:
+                    self.stats['expired'] += 1
+                future.cancel()
+                continue
+
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            with self.lock:
+                self.in_flight += 1
+
+            start = time.monotonic()
+            try:
+                result = function(*args, **kwargs)
+            except BaseException as error:
+                future.set_exception(error)
+                succeeded = False
+            else:
+                future.set_result(result)
+                succeeded = True
+            duration = time.monotonic() - start
+
+            with self.lock:
+                self.in_flight -= 1
+                self.stats['completed' if succeeded else 'failed'] += 1
+                if self.service_time is None:
+                    self.service_time = duration
+                else:
+                    self.service_time = \
+                        0.8 * self.service_time + 0.2 * duration
@@ -0,0 +1,688 @@
+import argparse
+import hashlib
+import http.cookiejar
+import json
+import math
+import random
+import struct
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+
+# NOTE: Only the standard library is used, so the load can be generated
+#       from a machine without the dependencies of the app
+
+# The image sizes used when none are given, as (side, weight)
+DEFAULT_SIZES = ((64, 0.2), (256, 0.5), (1024, 0.3))
+PERCENTILES = (50, 95, 99)
+
+
+def make_png(width, height, seed=None):
+    """
+    Returns a synthetic png image of the given size
+
+    The image is random noise on a random background, so it does not
+    compress to nothing and each image is different
+
+    Parameters
+    ----------
+    width : int
+        The pixel width of the image
+    height : int
+        The pixel height of the image
+    seed : None or int
+        The seed of the pixels
+
+    Returns
+    -------
+    data : bytes
+        The encoded png
+    """
+
+    if seed is None:
+        seed = random.getrandbits(63)
+    row_bytes = width * 3
+    # Hashing a counter gives seeded random bytes much faster than the
+    # random module does
+    n_blocks = -(-row_bytes * height // 64)
+    noise = b''.join(hashlib.blake2b(struct.pack('>QQ', seed, i)).digest()
+                     for i in range(n_blocks))
+    # Keep 5 bits of noise above the background, which compresses
+    # roughly like a photo
+    background = seed % 224
+    table = bytes(background + (b & 0x1F) for b in range(256))
+    pixels = noise[:row_bytes * height].translate(table)
+    # Each row starts with the filter type (0, none)
+    rows = b''.join(b'\x00' + pixels[i:i + row_bytes]
+                    for i in range(0, row_bytes * height, row_bytes))
+
+    def chunk(kind, body):
+        return struct.pack('>I', len(body)) + kind + body + \
+            struct.pack('>I', zlib.crc32(kind + body) & 0xFFFFFFFF)
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    data = b'\x89PNG\r\n\x1a\n' + \
+        chunk(b'IHDR', header) + \
+        chunk(b'IDAT', zlib.compress(rows, 6)) + \
+        chunk(b'IEND', b'')
+
+    return data
+
+
+def parse_sizes(values):
+    """
+    Parses an image size distribution
+
+    Parameters
+    ----------
+    values : list
+        Strings of the form '<side>' or '<side>:<weight>'.
+        The weight defaults to 1
+
+    Returns
+    -------
+    sizes : tuple
+        Tuples of (side, weight)
+
+    Raises
+    ------
+    ValueError
+        If a value can not be parsed or is not positive
+    """
+
+    sizes = list()
+    for value in values:
+        side, _, weight = str(value).partition(':')
+        side = int(side)
+        weight = float(weight) if weight else 1.0
+        if side <= 0 or weight <= 0:
+            raise ValueError('Sizes and weights must be positive, got '
+                             '{}'.format(value))
+        sizes.append((side, weight))
+
+    return tuple(sizes)
+
+
+def encode_multipart(field, filename, data):
+    """
+    Encodes a file as a multipart/form-data body
+
+    Parameters
+    ----------
+    field : str
+        The name of the form field
+    filename : str
+        The file name sent to the server
+    data : bytes
+        The content of the file
+
+    Returns
+    -------
+    body : bytes
+        The request body
+    content_type : str
+        The value of the Content-Type header
+    """
+
+    boundary = uuid.uuid4().hex
+    body = ('--{}\r\n'
+            'Content-Disposition: form-data; name="{}"; filename="{}"\r\n'
+            'Content-Type: application/octet-stream\r\n\r\n'
+            ).format(boundary, field, filename).encode('utf-8') + \
+        data + '\r\n--{}--\r\n'.format(boundary).encode('utf-8')
+    content_type = 'multipart/form-data; boundary={}'.format(boundary)
+
+    return body, content_type
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """
+    Makes redirects visible instead of following them
+    """
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+def _request(opener, route, url, timeout, data=None, headers=None):
+    """
+    Sends a request and measures its latency
+
+    Returns
+    -------
+    sample : dict
+        Dictionary containing
+        - route
+        - status (0 if no response was received)
+        - latency (seconds)
+        - location (of a redirect, or None)
+        - error (or None)
+    """
+
+    request = urllib.request.Request(url, data=data, headers=headers or {})
+    start = time.perf_counter()
+    location = None
+    error = None
+    try:
+        with opener.open(request, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as http_error:
+        http_error.read()
+        status = http_error.code
+        location = http_error.headers.get('Location')
+        if status >= 400:
+            error = 'HTTP {}'.format(status)
+    except (OSError, ValueError) as os_error:
+        status = 0
+        error = str(os_error)
+
+    return {'route': route,
+            'status': status,
+            'latency': time.perf_counter() - start,
+            'location': location,
+            'error': error}
+
+
+def run_flow(base_url, image, timeout=60.0, similar=False):
+    """
+    Uploads an image, confirms it and classifies it, like a user would
+
+    Each flow has its own cookies, so it is its own session
+
+    Parameters
+    ----------
+    base_url : str
+        The url of the app, e.g. 'http://127.0.0.1:5000'
+    image : bytes
+        The png to upload
+    timeout : float
+        Seconds to wait for each response
+    similar : bool
+        Whether to also request the similar images
+
+    Returns
+    -------
+    samples : list
+        The samples of the requests (see _request). The flow stops at
+        the first failed request
+    """
+
+    opener = urllib.request.build_opener(
+        urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+        _NoRedirect())
+
+    body, content_type = encode_multipart('file', 'image.png', image)
+    upload = _request(opener,
+                      'upload',
+                      urllib.parse.urljoin(base_url, '/'),
+                      timeout,
+                      data=body,
+                      headers={'Content-Type': content_type})
+    samples = [upload]
+
+    # A successful upload redirects to /confirm/<filename>
+    location = upload['location'] or ''
+    path = urllib.parse.urlparse(location).path
+    if not path.startswith('/confirm/'):
+        upload['error'] = upload['error'] or \
+            'Upload was not accepted (status {}, location {!r})'.format(
+                upload['status'], location)
+        return samples
+    filename = path[len('/confirm/'):]
+
+    routes = [('confirm', '/confirm/'), ('classify', '/classify/')]
+    if similar:
+        routes.append(('similar', '/similar/'))
+    for route, prefix in routes:
+        sample = _request(opener,
+                          route,
+                          urllib.parse.urljoin(base_url, prefix + filename),
+                          timeout)
+        samples.append(sample)
+        if not is_success(sample):
+            break
+
+    return samples
+
+
+def is_success(sample):
+    """
+    Returns whether a request succeeded
+
+    Only the upload is expected to redirect, to the confirmation page.
+    A redirect from the other routes means that the upload expired
+
+    Parameters
+    ----------
+    sample : dict
+        The sample of the request
+
+    Returns
+    -------
+    bool
+        Whether the request succeeded
+    """
+
+    if sample['route'] == 'upload':
+        return sample['status'] in (302, 303) and \
+            '/confirm/' in (sample['location'] or '')
+    return 200 <= sample['status'] < 300
+
+
+def run_load(base_url,
+             n_flows=100,
+             concurrency=8,
+             rate=None,
+             sizes=DEFAULT_SIZES,
+             timeout=60.0,
+             similar=False,
+             seed=42):
+    """
+    Runs many flows against the app at once
+
+    Without a rate, concurrency flows run back to back (closed loop).
+    With a rate, flows start at random (Poisson) times with rate flows
+    per second on average, whether or not the earlier flows are done
+    (open loop), which is how real users arrive. At most concurrency
+    flows run at a time, and the delay of flows waiting for a slot is
+    counted in their latency
+
+    Parameters
+    ----------
+    base_url : str
+        The url of the app
+    n_flows : int
+        The number of flows to run
+    concurrency : int
+        The maximum number of flows running at a time
+    rate : None or float
+        The number of flows started per second
+    sizes : tuple
+        Tuples of (side, weight) of the square images
+    timeout : float
+        Seconds to wait for each response
+    similar : bool
+        Whether to also request the similar images
+    seed : int
+        The seed of the images and the arrival times
+
+    Returns
+    -------
+    samples : list
+        The samples of all the requests
+    duration : float
+        Seconds from the start of the first flow to the end of the last
+    """
+
+    random_state = random.Random(seed)
+    sides = [side for side, _ in sizes]
+    weights = [weight for _, weight in sizes]
+
+    # The images are made before the clock starts
+    images = dict()
+    flow_sides = random_state.choices(sides, weights=weights, k=n_flows)
+    for side in set(flow_sides):
+        images[side] = [make_png(side, side, seed=seed + i)
+                        for i in range(min(8, n_flows))]
+
+    samples = list()
+    lock = threading.Lock()
+
+    def flow(i, scheduled):
+        # In open loop mode, the time a flow waited for a free slot is
+        # part of the latency of its first request
+        waited = 0.0
+        if scheduled is not None:
+            waited = max(time.perf_counter() - scheduled, 0.0)
+        image = images[flow_sides[i]][i % len(images[flow_sides[i]])]
+        flow_samples = run_flow(base_url, image, timeout, similar)
+        flow_samples[0]['latency'] += waited
+        with lock:
+            samples.extend(flow_samples)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        next_start = start
+        for i in range(n_flows):
+            scheduled = None
+            if rate is not None:
+                now = time.perf_counter()
+                if next_start > now:
+                    time.sleep(next_start - now)
+                scheduled = next_start
+                next_start += random_state.expovariate(rate)
+            executor.submit(flow, i, scheduled)
+    duration = time.perf_counter() - start
+
+    return samples, duration
+
+
+def get_percentile(values, percentile):
+    """
+    Returns a percentile with the nearest rank method
+
+    Parameters
+    ----------
+    values : list
+        The sorted values
+    percentile : float
+        The percentile from 0 to 100
+
+    Returns
+    -------
+    value : float
+        The smallest value which is at least as large as percentile
+        percent of the values. NaN if there are no values
+    """
+
+    if not values:
+        return float('nan')
+
+    rank = max(int(math.ceil(percentile / 100 * len(values))), 1)
+
+    return values[rank - 1]
+
+
+def summarize(samples, duration):
+    """
+    Returns the throughput, error rate and latencies of each route
+
+    Parameters
+    ----------
+    samples : list
+        The samples of the requests
+    duration : float
+        Seconds the load was run
+
+    Returns
+    -------
+    summary : dict
+        For each route (and 'all') a dict containing
+        - requests
+        - throughput (requests per second)
+        - error_rate
+        - shed (requests answered with 503)
+        - p50, p95 and p99 (latency in milliseconds)
+        - statuses (number of requests with each status)
+    """
+
+    routes = dict()
+    for sample in samples:
+        routes.setdefault(sample['route'], list()).append(sample)
+    routes['all'] = list(samples)
+
+    summary = dict()
+    for route, route_samples in routes.items():
+        latencies = sorted(sample['latency'] * 1000
+                           for sample in route_samples)
+        n_errors = sum(not is_success(sample) for sample in route_samples)
+        statuses = dict()
+        for sample in route_samples:
+            statuses[sample['status']] = statuses.get(sample['status'], 0) + 1
+
+        summary[route] = {
+            'requests': len(route_samples),
+            'throughput': len(route_samples) / duration if duration else 0.0,
+            'error_rate': n_errors / len(route_samples)
+            if route_samples else 0.0,
+            'shed': statuses.get(503, 0),
+            'statuses': statuses}
+        for percentile in PERCENTILES:
+            summary[route]['p{}'.format(percentile)] = \
+                get_percentile(latencies, percentile)
+
+    return summary
+
+
+def print_report(summary, duration):
+    """
+    Prints the summary as a table
+
+    Parameters
+    ----------
+    summary : dict
+        The result of summarize
+    duration : float
+        Seconds the load was run
+    """
+
+    print('\nRan for {:.1f} s\n'.format(duration))
+    print('{:<10}{:>9}{:>9}{:>8}{:>7}{:>9}{:>9}{:>9}'.format(
+        'route', 'requests', 'req/s', 'errors', 'shed',
+        'p50 ms', 'p95 ms', 'p99 ms'))
+    # The routes in the order of the flow
+    order = ('upload', 'confirm', 'classify', 'similar', 'all')
+    for route in (r for r in order if r in summary):
+        row = summary[route]
+        print('{:<10}{:>9}{:>9.2f}{:>7.1f}%{:>7}{:>9.1f}{:>9.1f}'
+              '{:>9.1f}'.format(route,
+                                row['requests'],
+                                row['throughput'],
+                                row['error_rate'] * 100,
+                                row['shed'],
+                                row['p50'],
+                                row['p95'],
+                                row['p99']))
+
+
+def start_server(base_url, timeout=120.0):
+    """
+    Starts the app in a subprocess and waits until it answers
+
+    Parameters
+    ----------
+    base_url : str
+        The url the app will answer on
+    timeout : float
+        Seconds to wait for the app to start
+
+    Returns
+    -------
+    process : subprocess.Popen
+        The process of the app
+
+    Raises
+    ------
+    RuntimeError
+        If the app exits or does not answer in time
+    """
+
+    root_dir = Path(__file__).absolute().parents[1]
+    process = subprocess.Popen([sys.executable, '-m', 'app'],
+                               cwd=str(root_dir))
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('The app exited with code {}'.format(
+                process.returncode))
+        try:
+            with urllib.request.urlopen(base_url, timeout=1):
+                return process
+        except (OSError, ValueError):
+            time.sleep(0.5)
+
+    process.terminate()
+    raise RuntimeError('The app did not answer within {} s'.format(timeout))
+
+
+def get_metrics(base_url, timeout=10.0):
+    """
+    Returns the admission counters of the app
+
+    Parameters
+    ----------
+    base_url : str
+        The url of the app
+    timeout : float
+        Seconds to wait for the response
+
+    Returns
+    -------
+    metrics : None or dict
+        The content of /metrics. None if it could not be read
+    """
+
+    try:
+        with urllib.request.urlopen(urllib.parse.urljoin(base_url,
+                                                         '/metrics'),
+                                    timeout=timeout) as response:
+            return json.loads(response.read().decode('utf-8'))
+    except (OSError, ValueError):
+        return None
+
+
+def main(base_url='http://127.0.0.1:5000',
+         n_flows=100,
+         concurrency=8,
+         rate=None,
+         sizes=DEFAULT_SIZES,
+         timeout=60.0,
+         similar=False,
+         start=False,
+         output_path=None):
+    """
+    Load tests the app with synthetic images and reports the latencies
+
+    Parameters
+    ----------
+    base_url : str
+        The url of the app
+    n_flows : int
+        The number of upload, confirm and classify flows
+    concurrency : int
+        The maximum number of flows running at a time
+    rate : None or float
+        The number of flows started per second.
+        If None, the flows run back to back
+    sizes : tuple
+        Tuples of (side, weight) of the square images
+    timeout : float
+        Seconds to wait for each response
+    similar : bool
+        Whether to also request the similar images
+    start : bool
+        Whether to start the app in a subprocess first
+    output_path : None or Path
+        Path to store the summary as json
+
+    Returns
+    -------
+    summary : dict
+        See summarize
+    """
+
+    process = start_server(base_url) if start else None
+    try:
+        print('[INFO] Running {} flows against {}'.format(n_flows,
+                                                          base_url))
+        samples, duration = run_load(base_url,
+                                     n_flows=n_flows,
+                                     concurrency=concurrency,
+                                     rate=rate,
+                                     sizes=sizes,
+                                     timeout=timeout,
+                                     similar=similar)
+        metrics = get_metrics(base_url)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    summary = summarize(samples, duration)
+    print_report(summary, duration)
+
+    errors = [sample['error'] for sample in samples if sample['error']]
+    for error in sorted(set(errors))[:5]:
+        print('[WARNING] {} x {}'.format(errors.count(error), error))
+    if metrics is not None:
+        print('\nAdmission: {}'.format(
+            ', '.join('{} {}'.format(key, value)
+                      for key, value in sorted(metrics.items()))))
+
+    if output_path is not None:
+        output_path = Path(output_path)
+        if not output_path.parent.is_dir():
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+        with output_path.open('w') as f:
+            json.dump({'duration': duration,
+                       'settings': {'n_flows': n_flows,
+                                    'concurrency': concurrency,
+                                    'rate': rate,
+                                    'sizes': sizes},
+                       'routes': summary,
+                       'admission': metrics}, f, indent=4)
+        print('[INFO] Saved to {}'.format(output_path))
+
+    return summary
+
+
+if __name__ == '__main__':
+    # Construct the argument parse and parse the arguments
+    parser = argparse.ArgumentParser(description='Load test the app with '
+                                                 'synthetic images')
+    parser.add_argument('-u',
+                        '--url',
+                        default='http://127.0.0.1:5000',
+                        help='The url of the app')
+    parser.add_argument('-n',
+                        '--flows',
+                        type=int,
+                        default=100,
+                        help='The number of upload, confirm and classify '
+                             'flows')
+    parser.add_argument('-c',
+                        '--concurrency',
+                        type=int,
+                        default=8,
+                        help='The maximum number of flows running at a '
+                             'time')
+    parser.add_argument('-r',
+                        '--rate',
+                        type=float,
+                        required=False,
+                        help='The number of flows started per second. '
+                             'Defaults to running the flows back to back')
+    parser.add_argument('-s',
+                        '--sizes',
+                        nargs='+',
+                        default=['{}:{}'.format(side, weight)
+                                 for side, weight in DEFAULT_SIZES],
+                        help="Sides of the square images as '<side>' or "
+                             "'<side>:<weight>'")
+    parser.add_argument('-t',
+                        '--timeout',
+                        type=float,
+                        default=60.0,
+                        help='Seconds to wait for each response')
+    parser.add_argument('--similar',
+                        action='store_true',
+                        help='Also request the similar images')
+    parser.add_argument('--start',
+                        action='store_true',
+                        help='Start the app in a subprocess first')
+    parser.add_argument('-o',
+                        '--output',
+                        required=False,
+                        help='Path to store the summary as json')
+    args = parser.parse_args()
+
+    main(base_url=args.url,
+         n_flows=args.flows,
+         concurrency=args.concurrency,
+         rate=args.rate,
+         sizes=parse_sizes(args.sizes),
+         timeout=args.timeout,
+         similar=args.similar,
+         start=args.start,
+         output_path=args.output)
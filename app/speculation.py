@@ -0,0 +1,259 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import CancelledError
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from app.admission import DeadlineExceededError
+from app.admission import OverloadedError
+
+
+class SpeculativeRunner(object):
+    """
+    Starts jobs before their results are requested
+
+    The jobs run on the admission controller like any other job. Their
+    futures are kept by key, so a later request for the same key waits
+    on the job in flight, or gets its result at once, instead of
+    running it again.
+
+    Results computed on request are kept as well, so that a result
+    shown in several responses (e.g. a page and its image) is computed
+    once.
+
+    Speculation only uses spare capacity: a job is not started when the
+    admission queue is more than max_queue_fraction full, so requests
+    which are actually waited for are never shed because of it.
+
+    Parameters
+    ----------
+    controller : AdmissionController
+        The controller running the jobs
+    max_entries : int
+        The number of results kept. The least recently used results
+        are dropped first
+    max_queue_fraction : float
+        How full the admission queue may be for a job to be started
+    """
+
+    def __init__(self, controller, max_entries=32, max_queue_fraction=0.5):
+        self.controller = controller
+        self.max_entries = max_entries
+        self.max_queue_fraction = max_queue_fraction
+
+        self.lock = threading.Lock()
+        # Maps keys to futures, ordered from the least to the most
+        # recently used
+        self.futures = OrderedDict()
+        self.stats = {'started': 0,
+                      'skipped': 0,
+                      'hits': 0,
+                      'misses': 0}
+
+    def start(self, key, function, *args, **kwargs):
+        """
+        Starts a job in the background if there is spare capacity
+
+        Parameters
+        ----------
+        key : hashable
+            The key the result is requested by
+        function : callable
+            The job
+        args : tuple
+            Positional arguments passed to function
+        kwargs : dict
+            Keyword arguments passed to function
+
+        Returns
+        -------
+        started : bool
+            Whether the job was started (or already had been)
+        """
+
+        with self.lock:
+            if key in self.futures:
+                self.futures.move_to_end(key)
+                return True
+
+        max_depth = self.controller.max_queue * self.max_queue_fraction
+        if self.controller.queue.qsize() >= max_depth:
+            with self.lock:
+                self.stats['skipped'] += 1
+            return False
+
+        try:
+            future = self.controller.submit(function, *args, **kwargs)
+        except OverloadedError:
+            with self.lock:
+                self.stats['skipped'] += 1
+            return False
+
+        with self.lock:
+            self.stats['started'] += 1
+            self._keep(key, future)
+
+        return True
+
+    def _keep(self, key, future):
+        """
+        Stores the future of key, dropping the least recently used ones
+
+        Must be called with the lock held
+        """
+
+        self.futures[key] = future
+        self.futures.move_to_end(key)
+        while len(self.futures) > self.max_entries:
+            # A job nobody will ask for is not run
+            _, dropped = self.futures.popitem(last=False)
+            dropped.cancel()
+
+    def run(self, key, function, *args, deadline=None, **kwargs):
+        """
+        Returns the result of the job started for key, or runs it now
+
+        A result computed now is kept, so later calls to run or get
+        for key do not compute it again
+
+        Parameters
+        ----------
+        key : hashable
+            The key given to start
+        function : callable
+            The job, run if no job was started for key
+        args : tuple
+            Positional arguments passed to function
+        deadline : None or float
+            Seconds the result must be ready within.
+            If None, the default deadline of the controller is used
+        kwargs : dict
+            Keyword arguments passed to function
+
+        Returns
+        -------
+        result : object
+            The return value of the job
+
+        Raises
+        ------
+        QueueFullError
+            If the job must be run and the queue is full
+        DeadlineExceededError
+            If the result was not ready before the deadline
+        """
+
+        if deadline is None:
+            deadline = self.controller.deadline
+
+        with self.lock:
+            future = self.futures.get(key)
+            if future is not None:
+                self.futures.move_to_end(key)
+
+        if future is not None:
+            try:
+                result = future.result(timeout=deadline)
+            except CancelledError:
+                # The job expired in the queue, so it is run again
+                self._discard(key, future)
+            except FutureTimeoutError:
+                raise DeadlineExceededError(
+                    'The request took too long',
+                    self.controller.get_retry_after())
+            except Exception:
+                # The next request runs the job again
+                self._discard(key, future)
+                raise
+            else:
+                with self.lock:
+                    self.stats['hits'] += 1
+                return result
+
+        with self.lock:
+            self.stats['misses'] += 1
+
+        result = self.controller.run(function, *args, deadline=deadline,
+                                     **kwargs)
+
+        future = Future()
+        future.set_result(result)
+        with self.lock:
+            self._keep(key, future)
+
+        return result
+
+    def get(self, key, deadline=None):
+        """
+        Returns the kept result of key without ever running the job
+
+        Parameters
+        ----------
+        key : hashable
+            The key given to start or run
+        deadline : None or float
+            Seconds to wait for a job in flight.
+            If None, the default deadline of the controller is used
+
+        Returns
+        -------
+        result : object
+            The return value of the job
+
+        Raises
+        ------
+        KeyError
+            If no result is kept for key, or its job failed
+        DeadlineExceededError
+            If the job in flight was not done before the deadline
+        """
+
+        if deadline is None:
+            deadline = self.controller.deadline
+
+        with self.lock:
+            future = self.futures.get(key)
+            if future is not None:
+                self.futures.move_to_end(key)
+        if future is None:
+            raise KeyError(key)
+
+        try:
+            return future.result(timeout=deadline)
+        except FutureTimeoutError:
+            raise DeadlineExceededError(
+                'The request took too long',
+                self.controller.get_retry_after())
+        except (CancelledError, Exception):
+            # Cancelled and failed jobs are run again by run, not here
+            self._discard(key, future)
+            raise KeyError(key)
+
+    def _discard(self, key, future):
+        """
+        Forgets the job of key, unless another job has replaced it
+        """
+
+        with self.lock:
+            if self.futures.get(key) is future:
+                del self.futures[key]
+
+    def get_stats(self):
+        """
+        Returns the counters of the runner
+
+        Returns
+        -------
+        stats : dict
+            Dictionary containing
+            - started (jobs started in the background)
+            - skipped (jobs not started for lack of capacity)
+            - hits (results served from a started job)
+            - misses (results which had to be computed on request)
+            - entries (results and jobs kept)
+        """
+
+        with self.lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self.futures)
+
+        return stats
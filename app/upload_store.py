@@ -0,0 +1,275 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+
+class UploadStore(object):
+    """
+    Stores uploaded files per session with a TTL and a byte budget
+
+    Files are named by the hash of their content inside a directory per
+    session, so sessions never see or remove each other's files.
+    The store keeps an in-memory index of the files ordered by last
+    access, so request handlers never scan the directory. Expired files,
+    and the least recently used files when the budget is exceeded, are
+    removed by a background janitor thread.
+
+    Parameters
+    ----------
+    root_dir : Path
+        The directory to store the uploads in
+    ttl : float
+        Seconds since the last access before a file expires
+    max_bytes : int
+        The total number of bytes the files may take up
+    janitor_interval : float
+        Seconds between each run of the janitor
+    """
+
+    def __init__(self,
+                 root_dir,
+                 ttl=3600.0,
+                 max_bytes=256 << 20,
+                 janitor_interval=60.0):
+        self.root_dir = Path(root_dir)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.janitor_interval = janitor_interval
+
+        self.lock = threading.Lock()
+        # Held while a session directory is made or removed
+        self.dir_lock = threading.Lock()
+        # Maps (session_id, name) to [path, size, last_access], ordered
+        # from the least to the most recently accessed
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+
+        self.wake_up = threading.Event()
+        self.stopped = threading.Event()
+        self.janitor = None
+
+        if not self.root_dir.is_dir():
+            self.root_dir.mkdir(parents=True, exist_ok=True)
+        self._load_entries()
+
+    def _load_entries(self):
+        """
+        Indexes the files left by a previous run
+
+        This is the only time the directory is scanned
+        """
+
+        files = list()
+        for session_dir in os.scandir(str(self.root_dir)):
+            if not session_dir.is_dir():
+                continue
+            for entry in os.scandir(session_dir.path):
+                if entry.name.endswith('.tmp') or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                files.append((stat.st_mtime,
+                              (session_dir.name, entry.name),
+                              Path(entry.path),
+                              stat.st_size))
+
+        for last_access, key, path, size in sorted(files):
+            self.entries[key] = [path, size, last_access]
+            self.total_bytes += size
+
+    def start(self):
+        """
+        Starts the janitor thread
+
+        Returns
+        -------
+        self : UploadStore
+            The store
+        """
+
+        if self.janitor is None:
+            self.janitor = threading.Thread(target=self._run_janitor,
+                                            daemon=True)
+            self.janitor.start()
+
+        return self
+
+    def stop(self):
+        """
+        Stops the janitor thread
+        """
+
+        self.stopped.set()
+        self.wake_up.set()
+        if self.janitor is not None:
+            self.janitor.join()
+            self.janitor = None
+
+    def put(self, session_id, data, extension):
+        """
+        Stores an uploaded file
+
+        Parameters
+        ----------
+        session_id : str
+            The id of the session uploading the file
+        data : bytes
+            The content of the file
+        extension : str
+            The file extension (without the dot)
+
+        Returns
+        -------
+        name : str
+            The name of the stored file
+        """
+
+        name = '{}.{}'.format(hashlib.sha1(data).hexdigest(),
+                              extension.lower())
+        key = (session_id, name)
+
+        with self.lock:
+            if key in self.entries:
+                self.entries[key][2] = time.time()
+                self.entries.move_to_end(key)
+                return name
+
+        session_dir = self.root_dir.joinpath(session_id)
+        path = session_dir.joinpath(name)
+        tmp_path = session_dir.joinpath(name + '.tmp')
+        # NOTE: Once the temporary file exists the directory is not
+        #       empty, so the janitor can not remove it before the file
+        #       is moved in place
+        with self.dir_lock:
+            session_dir.mkdir(parents=True, exist_ok=True)
+            f = tmp_path.open('wb')
+        with f:
+            f.write(data)
+
+        # NOTE: The file is moved in place and indexed under the lock,
+        #       so evict either removes it before, or sees it re-added
+        with self.lock:
+            os.replace(str(tmp_path), str(path))
+            if key not in self.entries:
+                self.total_bytes += len(data)
+            self.entries[key] = [path, len(data), time.time()]
+            self.entries.move_to_end(key)
+            over_budget = self.total_bytes > self.max_bytes
+
+        if over_budget:
+            self.wake_up.set()
+
+        return name
+
+    def get_path(self, session_id, name):
+        """
+        Returns the path of a stored file and renews its TTL
+
+        Parameters
+        ----------
+        session_id : str
+            The id of the session which uploaded the file
+        name : str
+            The name returned by put
+
+        Returns
+        -------
+        path : None or Path
+            The path of the file.
+            None if the file does not exist or has expired
+        """
+
+        key = (session_id, name)
+        now = time.time()
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or now - entry[2] > self.ttl:
+                return None
+            entry[2] = now
+            self.entries.move_to_end(key)
+
+        return entry[0]
+
+    def evict(self, now=None):
+        """
+        Removes the expired files and the least recently used files
+        above the byte budget
+
+        Parameters
+        ----------
+        now : None or float
+            The current time.
+            If None, time.time() is used
+
+        Returns
+        -------
+        n_evicted : int
+            The number of removed files
+        """
+
+        if now is None:
+            now = time.time()
+
+        evicted = list()
+        with self.lock:
+            # The entries are ordered by last access, so the expired
+            # files and the least recently used files come first
+            while self.entries:
+                key, (path, size, last_access) = \
+                    next(iter(self.entries.items()))
+                if now - last_access <= self.ttl and \
+                        self.total_bytes <= self.max_bytes:
+                    break
+                del self.entries[key]
+                self.total_bytes -= size
+                evicted.append((key, path))
+
+        for key, path in evicted:
+            with self.lock:
+                # The file may have been uploaded again in the meantime
+                if key in self.entries:
+                    continue
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+            # Remove the directory of the session if it is empty
+            try:
+                with self.dir_lock:
+                    path.parent.rmdir()
+            except OSError:
+                pass
+
+        return len(evicted)
+
+    def clear(self):
+        """
+        Removes all the stored files
+        """
+
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+        for session_dir in os.scandir(str(self.root_dir)):
+            if session_dir.is_dir():
+                shutil.rmtree(session_dir.path, ignore_errors=True)
+
+    def _run_janitor(self):
+        """
+        Evicts files every janitor_interval seconds, or when woken up
+        """
+
+        while not self.stopped.is_set():
+            self.wake_up.wait(self.janitor_interval)
+            self.wake_up.clear()
+            if self.stopped.is_set():
+                break
+            n_evicted = self.evict()
+            if n_evicted > 0:
+                print('[INFO] Evicted {} uploads, {} bytes '
+                      'stored'.format(n_evicted, self.total_bytes))
@@ -0,0 +1,155 @@
+import argparse
+import numpy as np
+from pathlib import Path
+from keras.engine.saving import load_model
+from fruit_classifier.cascade.cascade_utils import calibrate_threshold
+from fruit_classifier.cascade.cascade_utils import save_cascade
+from fruit_classifier.execution.execution_utils import configure_session
+from fruit_classifier.predict.predict_utils import load_label_encoder
+from fruit_classifier.train.train_utils import get_image_paths_and_labels
+from fruit_classifier.train.train_utils import load_data_and_labels
+from fruit_classifier.train.train_utils import \
+    get_image_hashes_and_splits
+from fruit_classifier.train.train_utils import get_manifest_split_indices
+from fruit_classifier.train.sequences import IndexSequence
+
+
+def main(model_path=None,
+         fallback_model_path=None,
+         target_accuracy=None,
+         tolerance=0.01,
+         batch_size=64):
+    """
+    Calibrates the threshold of a cascade on the validation split
+
+    The threshold is the lowest confidence of the cheap model which
+    keeps the accuracy of the cascade at the target, so the cheap
+    model classifies as many images as possible.
+    The cascade is stored in 'generated_data/models/cascade.json', and
+    is used by python -m fruit_classifier.predict --cascade
+
+    Parameters
+    ----------
+    model_path : None or Path
+        Path to the cheap model.
+        If None, 'generated_data/models/model_compressed.h5' is used
+    fallback_model_path : None or Path
+        Path to the fallback model.
+        If None, 'generated_data/models/model.h5' is used
+    target_accuracy : None or float
+        The accuracy the cascade should reach.
+        If None, the accuracy of the fallback model minus tolerance
+    tolerance : float
+        The accuracy the cascade may lose compared to the fallback
+        model when no target is given
+    batch_size : int
+        The number of images classified at a time
+    """
+
+    generated_data_dir = \
+        Path(__file__).absolute().parents[2].joinpath('generated_data')
+    cleaned_dir = generated_data_dir.joinpath('cleaned_data')
+
+    if model_path is None:
+        model_path = generated_data_dir.joinpath('models',
+                                                 'model_compressed.h5')
+    if fallback_model_path is None:
+        fallback_model_path = generated_data_dir.joinpath('models',
+                                                          'model.h5')
+
+    configure_session()
+    model = load_model(str(model_path))
+    fallback_model = load_model(str(fallback_model_path))
+    height, width = model.input_shape[1:3]
+
+    # The same validation split as the models were trained with
+    image_paths, image_labels = \
+        get_image_paths_and_labels(cleaned_dir, refresh=False)
+    image_hashes, image_splits = \
+        get_image_hashes_and_splits(cleaned_dir, image_paths)
+    data, labels = load_data_and_labels(image_paths,
+                                        height,
+                                        width,
+                                        image_labels,
+                                        image_hashes)
+    _, val_indices = get_manifest_split_indices(image_splits)
+    encoded_labels = load_label_encoder().transform(labels)
+
+    val_sequence = IndexSequence(data,
+                                 encoded_labels,
+                                 np.sort(val_indices),
+                                 batch_size=batch_size)
+
+    print('[INFO] Classifying {} validation images'.format(
+        len(val_indices)))
+    probabilities = model.predict_generator(val_sequence)
+    fallback_probabilities = fallback_model.predict_generator(val_sequence)
+    y_val = encoded_labels[np.sort(val_indices)]
+
+    if target_accuracy is None:
+        fallback_accuracy = np.mean(
+            np.argmax(fallback_probabilities, axis=1) == y_val)
+        target_accuracy = fallback_accuracy - tolerance
+
+    calibration = calibrate_threshold(probabilities,
+                                      fallback_probabilities,
+                                      y_val,
+                                      target_accuracy)
+    calibration['target_accuracy'] = float(target_accuracy)
+
+    print('\nCheap model accuracy:    {:.3f}'.format(
+        calibration['first_stage_accuracy']))
+    print('Fallback model accuracy: {:.3f}'.format(
+        calibration['fallback_accuracy']))
+    print('Threshold:               {:.4f}'.format(
+        calibration['threshold']))
+    print('Cascade accuracy:        {:.3f} (target {:.3f})'.format(
+        calibration['accuracy'], target_accuracy))
+    print('Handled by cheap model:  {:.1f}%'.format(
+        calibration['first_stage_fraction'] * 100))
+    if not calibration['reached']:
+        print('[WARNING] The target accuracy can not be reached, the '
+              'most accurate threshold is used')
+
+    save_cascade(model_path, fallback_model_path, calibration)
+
+
+if __name__ == '__main__':
+    # Construct the argument parse and parse the arguments
+    parser = argparse.ArgumentParser(description='Calibrate the threshold '
+                                                 'of a model cascade')
+    parser.add_argument('-m',
+                        '--model',
+                        required=False,
+                        help='Path to the cheap model. Defaults to '
+                             'generated_data/models/model_compressed.h5')
+    parser.add_argument('-f',
+                        '--fallback-model',
+                        required=False,
+                        help='Path to the fallback model. Defaults to '
+                             'generated_data/models/model.h5')
+    parser.add_argument('-a',
+                        '--target-accuracy',
+                        type=float,
+                        required=False,
+                        help='The validation accuracy of the cascade. '
+                             'Defaults to the accuracy of the fallback '
+                             'model minus the tolerance')
+    parser.add_argument('-t',
+                        '--tolerance',
+                        type=float,
+                        default=0.01,
+                        help='The accuracy the cascade may lose compared '
+                             'to the fallback model')
+    parser.add_argument('-b',
+                        '--batch-size',
+                        type=int,
+                        default=64,
+                        help='The number of images classified at a time')
+    args = parser.parse_args()
+
+    main(model_path=args.model,
+         fallback_model_path=args.fallback_model,
+         target_accuracy=args.target_accuracy,
+         tolerance=args.tolerance,
+         batch_size=args.batch_size)
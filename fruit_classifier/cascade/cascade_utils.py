@@ -0,0 +1,204 @@
+import json
+import numpy as np
+from pathlib import Path
+from keras.engine.saving import load_model
+from fruit_classifier.models.layers import CUSTOM_OBJECTS
+from fruit_classifier.serving.serving_utils import check_not_serving
+from fruit_classifier.serving.serving_utils import is_serving_model
+
+
+def get_cascade_path():
+    """
+    Returns the path of the calibrated cascade
+
+    Returns
+    -------
+    cascade_path : Path
+        'generated_data/models/cascade.json'
+    """
+
+    cascade_path = \
+        Path(__file__).absolute().parents[2].joinpath('generated_data',
+                                                      'models',
+                                                      'cascade.json')
+
+    return cascade_path
+
+
+def calibrate_threshold(probabilities,
+                        fallback_probabilities,
+                        labels,
+                        target_accuracy):
+    """
+    Finds the lowest confidence threshold which reaches an accuracy
+
+    A lower threshold lets the cheap model classify more images, so the
+    lowest threshold whose cascade accuracy reaches target_accuracy is
+    the one which escalates the fewest images. If no threshold reaches
+    it, the threshold with the highest accuracy is used.
+
+    All the thresholds are evaluated at once: with the images sorted by
+    decreasing confidence, the cheap model classifies a prefix and the
+    fallback model the rest, so the accuracy of every split follows from
+    two cumulative sums.
+
+    Parameters
+    ----------
+    probabilities : np.array, shape (n_images, n_classes)
+        The probabilities of the cheap model
+    fallback_probabilities : np.array, shape (n_images, n_classes)
+        The probabilities of the fallback model
+    labels : np.array, shape (n_images,)
+        The integer encoded labels
+    target_accuracy : float
+        The accuracy the cascade should reach
+
+    Returns
+    -------
+    calibration : dict
+        Dictionary containing
+        - threshold (inf if every image must be escalated)
+        - accuracy (of the cascade)
+        - first_stage_fraction (of the images not escalated)
+        - first_stage_accuracy (of the cheap model on all the images)
+        - fallback_accuracy (of the fallback model on all the images)
+        - reached (whether target_accuracy was reached)
+    """
+
+    labels = np.asarray(labels)
+    n_images = len(labels)
+
+    confidence = np.max(probabilities, axis=1)
+    first_correct = np.argmax(probabilities, axis=1) == labels
+    fallback_correct = np.argmax(fallback_probabilities, axis=1) == labels
+
+    order = np.argsort(-confidence, kind='stable')
+    confidence = confidence[order]
+    first_correct = first_correct[order]
+    fallback_correct = fallback_correct[order]
+
+    # accuracies[k] is the accuracy when the cheap model classifies the
+    # k most confident images
+    first_hits = np.concatenate(([0], np.cumsum(first_correct)))
+    fallback_hits = np.concatenate(([0], np.cumsum(fallback_correct)))
+    accuracies = (first_hits + fallback_hits[-1] - fallback_hits) / \
+        max(n_images, 1)
+
+    # A threshold can not separate images with the same confidence, so
+    # only prefixes ending where the confidence drops are possible
+    possible = np.ones(n_images + 1, dtype=bool)
+    possible[1:n_images] = confidence[:-1] > confidence[1:]
+
+    reachable = possible & (accuracies >= target_accuracy)
+    if np.any(reachable):
+        k = np.flatnonzero(reachable)[-1]
+    else:
+        # The last of the best prefixes escalates the fewest images
+        best = np.max(accuracies[possible])
+        k = np.flatnonzero(possible & (accuracies == best))[-1]
+
+    threshold = float(confidence[k - 1]) if k > 0 else float('inf')
+
+    calibration = {'threshold': threshold,
+                   'accuracy': float(accuracies[k]),
+                   'first_stage_fraction': k / max(n_images, 1),
+                   'first_stage_accuracy': float(np.mean(first_correct)),
+                   'fallback_accuracy': float(np.mean(fallback_correct)),
+                   'reached': bool(accuracies[k] >= target_accuracy)}
+
+    return calibration
+
+
+def save_cascade(model_path,
+                 fallback_model_path,
+                 calibration,
+                 cascade_path=None):
+    """
+    Stores the models and the threshold of the cascade
+
+    Parameters
+    ----------
+    model_path : Path
+        The path of the cheap model
+    fallback_model_path : Path
+        The path of the fallback model
+    calibration : dict
+        The result of calibrate_threshold
+    cascade_path : None or Path
+        Where to store the cascade.
+        If None, 'generated_data/models/cascade.json' is used
+    """
+
+    if cascade_path is None:
+        cascade_path = get_cascade_path()
+    cascade_path = Path(cascade_path)
+
+    if not cascade_path.parent.is_dir():
+        cascade_path.parent.mkdir(parents=True, exist_ok=True)
+
+    cascade = dict(calibration)
+    cascade['model_path'] = str(Path(model_path).absolute())
+    cascade['fallback_model_path'] = \
+        str(Path(fallback_model_path).absolute())
+
+    with cascade_path.open('w') as f:
+        json.dump(cascade, f, indent=4)
+    print('[INFO] Saved to {}'.format(cascade_path))
+
+
+def load_cascade(cascade_path=None, serving=False):
+    """
+    Loads the models and the threshold of the calibrated cascade
+
+    Both models are loaded into the current Keras session, see
+    configure_session
+
+    Parameters
+    ----------
+    cascade_path : None or Path
+        Where the cascade is stored.
+        If None, 'generated_data/models/cascade.json' is used
+    serving : bool
+        Whether the caller accepts serving models, which take raw uint8
+        images instead of the output of preprocess_image
+
+    Returns
+    -------
+    model : Sequential
+        The cheap model
+    fallback_model : Sequential
+        The fallback model
+    threshold : float
+        The confidence below which images are escalated
+
+    Raises
+    ------
+    ValueError
+        If the models take inputs of different sizes or types, or are
+        serving models and serving is False
+    """
+
+    if cascade_path is None:
+        cascade_path = get_cascade_path()
+
+    with Path(cascade_path).open('r') as f:
+        cascade = json.load(f)
+
+    print('[INFO] loading cascade...')
+    model = load_model(cascade['model_path'],
+                       custom_objects=CUSTOM_OBJECTS)
+    fallback_model = load_model(cascade['fallback_model_path'],
+                                custom_objects=CUSTOM_OBJECTS)
+
+    if model.input_shape != fallback_model.input_shape:
+        raise ValueError('The models of the cascade take inputs of shape '
+                         '{} and {}'.format(model.input_shape,
+                                            fallback_model.input_shape))
+    if is_serving_model(model) != is_serving_model(fallback_model):
+        raise ValueError('Either both or none of the models of the cascade '
+                         'must be serving models')
+    if not serving:
+        check_not_serving(model, cascade['model_path'])
+        check_not_serving(fallback_model, cascade['fallback_model_path'])
+
+    return model, fallback_model, cascade['threshold']
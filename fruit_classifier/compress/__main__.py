@@ -0,0 +1,227 @@
+import argparse
+import json
+from pathlib import Path
+from fruit_classifier.compress.compress_utils import prune_model
+from fruit_classifier.compress.compress_utils import get_student_model
+from fruit_classifier.compress.compress_utils import compile_student
+from fruit_classifier.compress.compress_utils import DistillationSequence
+from fruit_classifier.execution.execution_utils import configure_session
+from fruit_classifier.models.models import ARCHITECTURES
+from fruit_classifier.models.zoo_utils import evaluate_zoo_model
+from fruit_classifier.predict.predict_utils import load_classifier
+from fruit_classifier.predict.predict_utils import load_label_encoder
+from fruit_classifier.train.train_utils import get_image_paths_and_labels
+from fruit_classifier.train.train_utils import load_data_and_labels
+from fruit_classifier.train.train_utils import get_manifest_split_indices
+from fruit_classifier.train.train_utils import \
+    get_image_hashes_and_splits
+from fruit_classifier.train.train_utils import train_model_on_sequences
+from fruit_classifier.train.sequences import IndexSequence
+from fruit_classifier.preprocessing.preprocessing_utils import \
+    get_image_generator
+
+
+def main(method='prune',
+         ratio=0.5,
+         architecture='lenet',
+         alpha=0.25,
+         temperature=4.0,
+         soft_weight=0.7,
+         epochs=10,
+         model_path=None,
+         output_path=None):
+    """
+    Compresses a trained model into a smaller student
+
+    The student is saved as a regular Keras model, so it can be served
+    with load_classifier. A report comparing the teacher and the
+    student is stored next to the student.
+
+    Parameters
+    ----------
+    method : ['prune'|'distill']
+        Whether to prune the teacher and fine-tune it, or to distill
+        the teacher into a narrow network
+    ratio : float
+        The fraction of filters and units to remove when pruning
+    architecture : str
+        The architecture of the student when distilling
+    alpha : float
+        Width multiplier of the student when distilling
+    temperature : float
+        The temperature used to soften the teacher's output
+    soft_weight : float
+        The weight of the soft targets when distilling
+    epochs : int
+        The number of epochs to fine-tune or distill
+    model_path : None or Path
+        Path to the teacher.
+        If None, 'generated_data/models/model.h5' is used
+    output_path : None or Path
+        Path to store the student.
+        If None, 'generated_data/models/model_compressed.h5' is used
+    """
+
+    generated_data_dir = \
+        Path(__file__).absolute().parents[2].joinpath('generated_data')
+    cleaned_dir = generated_data_dir.joinpath('cleaned_data')
+
+    if output_path is None:
+        output_path = generated_data_dir.joinpath('models',
+                                                  'model_compressed.h5')
+    output_path = Path(output_path)
+
+    configure_session()
+    teacher = load_classifier(model_path=model_path)
+
+    height, width = teacher.input_shape[1:3]
+    image_paths, image_labels = \
+        get_image_paths_and_labels(cleaned_dir, refresh=False)
+    image_hashes, image_splits = \
+        get_image_hashes_and_splits(cleaned_dir, image_paths)
+    data, labels = load_data_and_labels(image_paths,
+                                        height,
+                                        width,
+                                        image_labels,
+                                        image_hashes)
+    # The teacher was trained on the split of the manifest, so the
+    # student is validated on images the teacher has not seen
+    train_indices, val_indices = get_manifest_split_indices(image_splits)
+    encoded_labels = load_label_encoder().transform(labels)
+    train_sequence = IndexSequence(data,
+                                   encoded_labels,
+                                   train_indices,
+                                   image_generator=get_image_generator(),
+                                   shuffle=True,
+                                   seed=42)
+    val_sequence = IndexSequence(data, encoded_labels, val_indices)
+
+    if method == 'prune':
+        print('[INFO] Pruning {:.0f}% of the filters and '
+              'units'.format(ratio * 100))
+        student = prune_model(teacher, ratio)
+        # The pruned weights are a good starting point, so a low
+        # learning rate is used for the fine-tuning
+        student = compile_student(student,
+                                  initial_learning_rate=1e-4,
+                                  epochs=epochs)
+    elif method == 'distill':
+        print('[INFO] Distilling into {} with alpha '
+              '{}'.format(architecture, alpha))
+        student = get_student_model(teacher, architecture, alpha)
+        student = compile_student(student,
+                                  epochs=epochs,
+                                  temperature=temperature,
+                                  soft_weight=soft_weight)
+        train_sequence = DistillationSequence(train_sequence,
+                                              teacher,
+                                              temperature=temperature)
+    else:
+        raise ValueError('Unknown method {}'.format(method))
+
+    train_model_on_sequences(
+        student,
+        train_sequence,
+        val_sequence,
+        epochs=epochs,
+        checkpoint_dir=generated_data_dir.joinpath('checkpoints',
+                                                   'compress'),
+        model_path=output_path)
+
+    if method == 'distill':
+        # The distillation loss can not be loaded, so the student is
+        # saved again with the regular loss
+        student = compile_student(student, epochs=epochs)
+        student.save(str(output_path))
+        print('[INFO] Saved to {}'.format(output_path))
+
+    teacher_result = evaluate_zoo_model(teacher, val_sequence)
+    student_result = evaluate_zoo_model(student, val_sequence)
+
+    report = {'method': method,
+              'teacher': teacher_result,
+              'student': student_result,
+              'params_ratio': student_result['params'] /
+              teacher_result['params'],
+              'latency_speedup': teacher_result['latency_ms'] /
+              student_result['latency_ms'],
+              'throughput_speedup': student_result['throughput'] /
+              teacher_result['throughput']}
+
+    print('\n{:<8} {:>10} {:>8} {:>12}'.format('Model', 'Params',
+                                                'Val acc', 'Latency (ms)'))
+    for name in ('teacher', 'student'):
+        print('{:<8} {:>10} {:>8.3f} {:>12.2f}'.format(
+            name,
+            report[name]['params'],
+            report[name]['val_acc'],
+            report[name]['latency_ms']))
+    print('\nLatency speedup: {:.2f}x, throughput speedup: {:.2f}x, '
+          'parameters: {:.1f}%'.format(report['latency_speedup'],
+                                       report['throughput_speedup'],
+                                       report['params_ratio'] * 100))
+
+    report_path = output_path.with_suffix('.json')
+    with report_path.open('w') as f:
+        json.dump(report, f, indent=4)
+    print('[INFO] Saved to {}'.format(report_path))
+
+
+if __name__ == '__main__':
+    # Construct the argument parse and parse the arguments
+    parser = argparse.ArgumentParser(description='Compress a trained '
+                                                 'model')
+    parser.add_argument('method',
+                        choices=('prune', 'distill'),
+                        help='The compression method')
+    parser.add_argument('-r',
+                        '--ratio',
+                        type=float,
+                        default=0.5,
+                        help='Fraction of filters and units to prune')
+    parser.add_argument('-a',
+                        '--architecture',
+                        default='lenet',
+                        choices=sorted(ARCHITECTURES),
+                        help='The student architecture when distilling')
+    parser.add_argument('--alpha',
+                        type=float,
+                        default=0.25,
+                        help='Width multiplier of the student when '
+                             'distilling')
+    parser.add_argument('-t',
+                        '--temperature',
+                        type=float,
+                        default=4.0,
+                        help='Temperature of the soft targets')
+    parser.add_argument('-w',
+                        '--soft-weight',
+                        type=float,
+                        default=0.7,
+                        help='Weight of the soft targets')
+    parser.add_argument('-e',
+                        '--epochs',
+                        type=int,
+                        default=10,
+                        help='The number of epochs to fine-tune')
+    parser.add_argument('-m',
+                        '--model',
+                        required=False,
+                        help='Path to the teacher. Defaults to '
+                             'generated_data/models/model.h5')
+    parser.add_argument('-o',
+                        '--output',
+                        required=False,
+                        help='Path to store the student. Defaults to '
+                             'generated_data/models/model_compressed.h5')
+    args = parser.parse_args()
+
+    main(method=args.method,
+         ratio=args.ratio,
+         architecture=args.architecture,
+         alpha=args.alpha,
+         temperature=args.temperature,
+         soft_weight=args.soft_weight,
+         epochs=args.epochs,
+         model_path=args.model,
+         output_path=args.output)
@@ -0,0 +1,360 @@
+import numpy as np
+from keras import backend as K
+from keras.models import Sequential
+from keras.layers import BatchNormalization
+from keras.layers import Conv2D
+from keras.layers import Dense
+from keras.layers import DepthwiseConv2D
+from keras.layers import Flatten
+from keras.metrics import sparse_categorical_accuracy
+from keras.optimizers import Adam
+from keras.utils import Sequence
+from fruit_classifier.models.models import get_architecture
+
+
+def get_kept_indices(kernel, ratio):
+    """
+    Returns the indices of the filters or units with largest L1 norm
+
+    Parameters
+    ----------
+    kernel : np.array, shape (..., n_out)
+        The kernel of a Conv2D or Dense layer
+    ratio : float
+        The fraction of the filters or units to remove
+
+    Returns
+    -------
+    kept_indices : np.array, shape (n_kept,)
+        The sorted indices of the filters or units to keep
+    """
+
+    n_out = kernel.shape[-1]
+    n_kept = max(int(round(n_out * (1 - ratio))), 1)
+
+    l1_norms = np.abs(kernel.reshape(-1, n_out)).sum(axis=0)
+    kept_indices = np.sort(np.argsort(-l1_norms)[:n_kept])
+
+    return kept_indices
+
+
+def prune_model(model, ratio=0.5):
+    """
+    Removes the filters and units with the smallest magnitude
+
+    The pruning is structured, i.e. whole convolution filters and
+    dense units are removed, so the pruned model is a smaller dense
+    model and not a sparse one. The output layer is never pruned.
+    The returned model is not compiled.
+
+    Parameters
+    ----------
+    model : Sequential
+        The trained model to prune
+    ratio : float
+        The fraction of the filters and units to remove in each layer
+
+    Returns
+    -------
+    pruned_model : Sequential
+        The pruned model with the remaining weights copied over
+    """
+
+    layers = model.layers
+    last_index = max(i for i, layer in enumerate(layers)
+                     if layer.get_weights())
+
+    # The indices of the channels which flow into the current layer
+    kept = np.arange(model.input_shape[-1])
+
+    configs = list()
+    weights = list()
+    for i, layer in enumerate(layers):
+        config = layer.get_config()
+        layer_weights = layer.get_weights()
+
+        # NOTE: DepthwiseConv2D is a subclass of Conv2D, and must be
+        #       checked first
+        if isinstance(layer, DepthwiseConv2D):
+            # Every input channel has its own filters, so the channels
+            # kept by the previous layer are kept here as well
+            depth_multiplier = layer_weights[0].shape[-1]
+            kernel = layer_weights[0][:, :, kept, :]
+            kept = (kept[:, None] * depth_multiplier +
+                    np.arange(depth_multiplier)[None, :]).ravel()
+            layer_weights = [kernel] + [w[kept] for w in layer_weights[1:]]
+
+        elif isinstance(layer, (Conv2D, Dense)):
+            kernel = layer_weights[0]
+            if isinstance(layer, Conv2D):
+                kernel = kernel[:, :, kept, :]
+            else:
+                kernel = kernel[kept, :]
+
+            if i == last_index:
+                kept = np.arange(kernel.shape[-1])
+            else:
+                kept = get_kept_indices(kernel, ratio)
+
+            layer_weights = [kernel[..., kept]] + \
+                [w[kept] for w in layer_weights[1:]]
+
+            if isinstance(layer, Conv2D):
+                config['filters'] = len(kept)
+            else:
+                config['units'] = len(kept)
+
+        elif isinstance(layer, BatchNormalization):
+            layer_weights = [w[kept] for w in layer_weights]
+
+        elif isinstance(layer, Flatten):
+            # With channels last, the flattened index is
+            # spatial_index * n_channels + channel
+            n_channels = layer.input_shape[-1]
+            n_spatial = int(np.prod(layer.input_shape[1:-1]))
+            kept = (np.arange(n_spatial)[:, None] * n_channels +
+                    kept[None, :]).ravel()
+
+        elif layer_weights:
+            raise ValueError('Pruning of {} layers is not '
+                             'supported'.format(type(layer).__name__))
+
+        configs.append((layer.__class__, config))
+        weights.append(layer_weights)
+
+    pruned_model = Sequential([layer_class.from_config(config)
+                               for layer_class, config in configs])
+    for layer, layer_weights in zip(pruned_model.layers, weights):
+        layer.set_weights(layer_weights)
+
+    return pruned_model
+
+
+def get_student_model(teacher, architecture='lenet', alpha=0.25):
+    """
+    Returns an untrained narrow model with the same input and output
+
+    Parameters
+    ----------
+    teacher : Sequential
+        The model to distill from
+    architecture : str
+        The name of the student architecture (see models.ARCHITECTURES)
+    alpha : float
+        Width multiplier of the student
+
+    Returns
+    -------
+    student : Sequential
+        The student model (not compiled)
+    """
+
+    height, width, channels = teacher.input_shape[1:]
+
+    student = get_architecture(architecture,
+                               height=height,
+                               width=width,
+                               channels=channels,
+                               classes=teacher.output_shape[-1],
+                               alpha=alpha)
+
+    return student
+
+
+def soften(probabilities, temperature):
+    """
+    Raises the temperature of a softmax output
+
+    Parameters
+    ----------
+    probabilities : np.array, shape (n_examples, n_classes)
+        The softmax outputs
+    temperature : float
+        The temperature. Values above 1 make the output softer
+
+    Returns
+    -------
+    soft_probabilities : np.array, shape (n_examples, n_classes)
+        The softmax of log(probabilities) / temperature
+    """
+
+    logits = np.log(np.clip(probabilities, 1e-7, 1.0)) / temperature
+    logits -= logits.max(axis=1, keepdims=True)
+    soft_probabilities = np.exp(logits)
+    soft_probabilities /= soft_probabilities.sum(axis=1, keepdims=True)
+
+    return soft_probabilities
+
+
+class DistillationSequence(Sequence):
+    """
+    Batch sequence which adds the teacher targets to the labels
+
+    Wraps a sequence of (augmented) training batches, so that it can be
+    passed to train_model_on_sequences. The targets are computed from
+    the augmented images, so that the student learns the teacher's
+    output on exactly the images it sees. The student must be compiled
+    with compile_student given a temperature, whose loss splits the
+    targets again.
+
+    Parameters
+    ----------
+    sequence : IndexSequence
+        The training batches, with integer encoded labels
+    teacher : Sequential
+        The model to distill from
+    temperature : float
+        The temperature used to soften the teacher's output
+
+    References
+    ----------
+    Hinton et al. - Distilling the Knowledge in a Neural Network
+    https://arxiv.org/abs/1503.02531
+    """
+
+    def __init__(self, sequence, teacher, temperature=4.0):
+        self.sequence = sequence
+        self.teacher = teacher
+        self.temperature = temperature
+
+        # Keras fetches batches in a separate thread, so the predict
+        # function and graph must be available there
+        self.teacher._make_predict_function()
+        self.graph = K.get_session().graph
+
+    def __len__(self):
+        return len(self.sequence)
+
+    def __getitem__(self, index):
+        """
+        Returns an augmented batch with the distillation targets
+
+        Parameters
+        ----------
+        index : int
+            The index of the batch
+
+        Returns
+        -------
+        x_batch : np.array, shape (batch_size, height, width, channels)
+            The augmented images
+        y_batch : np.array, shape (batch_size, n_classes + 1)
+            The soft teacher targets followed by the integer encoded
+            label
+        """
+
+        x_batch, y_batch = self.sequence[index]
+        with self.graph.as_default():
+            probabilities = self.teacher.predict_on_batch(x_batch)
+        soft_targets = soften(probabilities, self.temperature)
+        hard_targets = np.reshape(y_batch, (-1, 1)).astype(
+            soft_targets.dtype)
+
+        return x_batch, np.concatenate((soft_targets, hard_targets),
+                                       axis=1)
+
+    def on_epoch_end(self):
+        self.sequence.on_epoch_end()
+
+
+def get_distillation_loss(temperature, soft_weight):
+    """
+    Returns the loss of a student trained on DistillationSequence
+
+    The soft part compares the softened teacher output with the student
+    output softened at the same temperature, and is scaled by the
+    squared temperature, so that its gradients keep their size relative
+    to the hard part. Targets holding only the integer encoded label
+    (as the validation data does) give the plain cross-entropy.
+
+    Parameters
+    ----------
+    temperature : float
+        The temperature the teacher's output was softened with
+    soft_weight : float
+        The weight of the soft targets. The hard labels are weighted
+        with 1 - soft_weight
+
+    Returns
+    -------
+    distillation_loss : callable
+        The Keras loss
+    """
+
+    def distillation_loss(y_true, y_pred):
+        n_classes = K.int_shape(y_pred)[-1]
+        hard_loss = K.sparse_categorical_crossentropy(y_true[:, -1],
+                                                      y_pred)
+
+        # The softmax of the log probabilities divided by the temperature
+        # is the softmax of the logits divided by it
+        logits = K.log(K.clip(y_pred, K.epsilon(), 1.0))
+        soft_loss = K.categorical_crossentropy(
+            y_true[:, :n_classes],
+            K.softmax(logits / temperature)) * temperature ** 2
+
+        return K.switch(K.equal(K.shape(y_true)[-1], n_classes + 1),
+                        soft_weight * soft_loss +
+                        (1 - soft_weight) * hard_loss,
+                        hard_loss)
+
+    return distillation_loss
+
+
+def acc(y_true, y_pred):
+    """
+    Returns the accuracy on the integer encoded labels, which are the
+    last column of the targets
+
+    Named like the built-in metric, so the history has the same keys
+    """
+
+    return sparse_categorical_accuracy(y_true[:, -1:], y_pred)
+
+
+def compile_student(model,
+                    initial_learning_rate=1e-3,
+                    epochs=10,
+                    temperature=None,
+                    soft_weight=0.7):
+    """
+    Compiles a pruned or distilled model for fine-tuning
+
+    The model is trained on integer encoded labels
+
+    Parameters
+    ----------
+    model : Sequential
+        The model to compile
+    initial_learning_rate : float
+        The initial learning rate for the optimizer
+    epochs : int
+        The number of epochs
+    temperature : None or float
+        The distillation temperature, when the model is trained on
+        DistillationSequence (see get_distillation_loss).
+        If None, the model is trained on the hard labels
+    soft_weight : float
+        The weight of the soft targets when distilling
+
+    Returns
+    -------
+    model : Sequential
+        The compiled model
+    """
+
+    opt = Adam(lr=initial_learning_rate,
+               decay=initial_learning_rate / epochs)
+
+    if temperature is None:
+        model.compile(loss='sparse_categorical_crossentropy',
+                      optimizer=opt,
+                      metrics=['accuracy'])
+    else:
+        # NOTE: The loss can not be loaded by name, so the model must be
+        #       compiled without it before it is saved for serving
+        model.compile(loss=get_distillation_loss(temperature, soft_weight),
+                      optimizer=opt,
+                      metrics=[acc])
+
+    return model
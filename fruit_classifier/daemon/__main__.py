@@ -0,0 +1,179 @@
+import argparse
+import numpy as np
+from pathlib import Path
+from fruit_classifier.daemon.daemon_utils import Batcher
+from fruit_classifier.daemon.daemon_utils import DaemonServer
+from fruit_classifier.daemon.daemon_utils import get_socket_path
+from fruit_classifier.predict.predict_utils import classify
+from fruit_classifier.predict.predict_utils import load_classifier
+from fruit_classifier.cascade.cascade_utils import load_cascade
+from fruit_classifier.execution.execution_utils import configure_session
+from fruit_classifier.serving.serving_utils import fit_to_input
+from fruit_classifier.serving.serving_utils import is_serving_model
+from fruit_classifier.utils.image_utils import open_image
+from fruit_classifier.utils.image_utils import read_image
+from fruit_classifier.preprocessing.preprocessing_utils import \
+    preprocess_image
+
+
+def main(socket_path=None,
+         max_batch_size=32,
+         max_delay=0.005,
+         model_path=None,
+         cascade=False):
+    """
+    Serves classifications over a Unix socket until interrupted
+
+    The model is loaded once and kept in memory. The images of all the
+    connections are classified together in batches.
+    Classify with python -m fruit_classifier.daemon.client <images>
+
+    Parameters
+    ----------
+    socket_path : None or Path
+        The path of the socket.
+        If None, get_socket_path() is used
+    max_batch_size : int
+        The maximum number of images classified at a time
+    max_delay : float
+        Seconds an image waits for more images to batch with
+    model_path : None or Path
+        Path to the model.
+        If None, 'generated_data/models/model.h5' is used.
+        Serving models exported with a fixed input size are given the
+        decoded uint8 images
+    cascade : bool
+        Whether to serve the calibrated cascade instead of model_path.
+        The uncertain images of each batch are escalated together
+    """
+
+    if socket_path is None:
+        socket_path = get_socket_path()
+
+    # NOTE: The model is loaded and used on the thread of the batcher
+    state = {'fallback_model': None, 'threshold': None}
+
+    def initialize():
+        configure_session()
+        if cascade:
+            state['model'], state['fallback_model'], state['threshold'] = \
+                load_cascade(serving=True)
+        else:
+            state['model'] = load_classifier(model_path=model_path,
+                                             serving=True)
+        state['height'], state['width'] = state['model'].input_shape[1:3]
+        state['serving'] = is_serving_model(state['model'])
+        if state['serving'] and state['height'] is None:
+            raise ValueError('The images are classified in batches, so '
+                             'the serving model needs a fixed input size. '
+                             'Export it with --input-size')
+
+    def load_image(path):
+        if state['serving']:
+            # The model resizes and scales the image itself
+            image = read_image(path)
+            if image is None:
+                raise ValueError('{} can not be decoded'.format(path))
+            return fit_to_input(image, state['model'])
+        return preprocess_image(open_image(path),
+                                state['height'],
+                                state['width'])
+
+    def classify_batch(images):
+        labels, probabilities = classify(state['model'],
+                                         np.stack(images),
+                                         state['fallback_model'],
+                                         state['threshold'])
+        return [(str(label), float(np.max(p)))
+                for label, p in zip(labels, probabilities)]
+
+    batcher = Batcher(classify_batch,
+                      max_batch_size=max_batch_size,
+                      max_delay=max_delay,
+                      initializer=initialize).start()
+    batcher.ready.wait()
+    if batcher.error is not None:
+        raise batcher.error
+
+    def process(message):
+        if message.get('type') == 'stats':
+            return {'stats': batcher.get_stats()}
+
+        # The images are decoded on the thread of the connection, and
+        # only the forward pass is batched
+        jobs = list()
+        for path in message.get('paths', list()):
+            try:
+                image = load_image(Path(path))
+            except Exception as error:
+                jobs.append((path, None, error))
+            else:
+                jobs.append((path, batcher.submit(image), None))
+
+        results = list()
+        for path, future, error in jobs:
+            if future is not None:
+                try:
+                    label, probability = future.result()
+                except Exception as future_error:
+                    error = future_error
+                else:
+                    results.append({'path': path,
+                                    'label': label,
+                                    'probability': probability})
+                    continue
+            results.append({'path': path, 'error': str(error)})
+
+        return {'results': results}
+
+    server = DaemonServer(socket_path, process)
+    print('[INFO] Listening on {}'.format(socket_path))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.stop()
+        print('[INFO] Stopped')
+
+
+if __name__ == '__main__':
+    # Construct the argument parse and parse the arguments
+    parser = argparse.ArgumentParser(description='Keep the classifier '
+                                                 'loaded and serve it over '
+                                                 'a Unix socket')
+    parser.add_argument('-s',
+                        '--socket',
+                        required=False,
+                        help='The path of the socket. Defaults to '
+                             '$FRUIT_CLASSIFIER_SOCKET or a file in the '
+                             'temporary directory')
+    parser.add_argument('-b',
+                        '--batch-size',
+                        type=int,
+                        default=32,
+                        help='The maximum number of images classified at '
+                             'a time')
+    parser.add_argument('-d',
+                        '--max-delay',
+                        type=float,
+                        default=5.0,
+                        help='Milliseconds an image waits for more images '
+                             'to batch with')
+    parser.add_argument('-m',
+                        '--model',
+                        required=False,
+                        help='Path to the model')
+    parser.add_argument('-c',
+                        '--cascade',
+                        action='store_true',
+                        help='Serve the cascade calibrated by python -m '
+                             'fruit_classifier.cascade')
+    args = parser.parse_args()
+
+    main(socket_path=args.socket,
+         max_batch_size=args.batch_size,
+         max_delay=args.max_delay / 1000,
+         model_path=args.model,
+         cascade=args.cascade)
@@ -0,0 +1,173 @@
+import argparse
+import os
+import sys
+from fruit_classifier.daemon.daemon_utils import connect
+from fruit_classifier.daemon.daemon_utils import send_message
+from fruit_classifier.daemon.daemon_utils import receive_message
+
+
+# NOTE: Only the standard library is imported, so the client starts in
+#       milliseconds. Everything heavy happens in the daemon
+
+
+def classify_paths(paths, socket_path=None, timeout=60.0, chunk_size=256):
+    """
+    Classifies images with the daemon
+
+    Parameters
+    ----------
+    paths : iterable
+        The paths of the images
+    socket_path : None or Path
+        The path of the socket of the daemon.
+        If None, get_socket_path() is used
+    timeout : float
+        Seconds to wait for each response
+    chunk_size : int
+        The number of paths sent in each message
+
+    Yields
+    ------
+    result : dict
+        Dictionary containing
+        - path
+        - label and probability, or error
+
+    Raises
+    ------
+    ConnectionError
+        If the daemon is not running or closed the connection
+    """
+
+    with connect(socket_path, timeout) as sock:
+        chunk = list()
+        for path in paths:
+            # The daemon runs in another working directory
+            chunk.append(os.path.abspath(path))
+            if len(chunk) == chunk_size:
+                yield from _classify_chunk(sock, chunk)
+                chunk = list()
+        if chunk:
+            yield from _classify_chunk(sock, chunk)
+
+
+def _classify_chunk(sock, paths):
+    """
+    Sends one message of paths and returns the results
+    """
+
+    send_message(sock, {'paths': paths})
+    response = receive_message(sock)
+    if response is None:
+        raise ConnectionError('The daemon closed the connection')
+    if 'error' in response:
+        raise ConnectionError('The daemon failed: {}'.format(
+            response['error']))
+
+    return response['results']
+
+
+def get_stats(socket_path=None, timeout=60.0):
+    """
+    Returns the batching counters of the daemon
+
+    Parameters
+    ----------
+    socket_path : None or Path
+        The path of the socket of the daemon.
+        If None, get_socket_path() is used
+    timeout : float
+        Seconds to wait for the response
+
+    Returns
+    -------
+    stats : dict
+        See Batcher.get_stats
+    """
+
+    with connect(socket_path, timeout) as sock:
+        send_message(sock, {'type': 'stats'})
+        response = receive_message(sock)
+
+    return response['stats']
+
+
+def main(paths, socket_path=None, timeout=60.0):
+    """
+    Prints the label and probability of each image
+
+    Each line is '<path>\t<label>\t<probability>', so the output can be
+    used in shell pipelines. Images which could not be classified are
+    reported on stderr
+
+    Parameters
+    ----------
+    paths : iterable
+        The paths of the images
+    socket_path : None or Path
+        The path of the socket of the daemon
+    timeout : float
+        Seconds to wait for each response
+
+    Returns
+    -------
+    exit_code : int
+        0 if all the images were classified, otherwise 1
+    """
+
+    exit_code = 0
+    try:
+        for result in classify_paths(paths, socket_path, timeout):
+            if 'error' in result:
+                print('{}: {}'.format(result['path'], result['error']),
+                      file=sys.stderr)
+                exit_code = 1
+            else:
+                print('{}\t{}\t{:.4f}'.format(result['path'],
+                                              result['label'],
+                                              result['probability']))
+    except ConnectionError as error:
+        print(error, file=sys.stderr)
+        exit_code = 1
+
+    return exit_code
+
+
+if __name__ == '__main__':
+    # Construct the argument parse and parse the arguments
+    parser = argparse.ArgumentParser(description='Classify images with '
+                                                 'the running daemon')
+    parser.add_argument('images',
+                        nargs='*',
+                        help="Paths of the images. Use '-' to read the "
+                             "paths from stdin, one per line")
+    parser.add_argument('-s',
+                        '--socket',
+                        required=False,
+                        help='The path of the socket of the daemon')
+    parser.add_argument('-t',
+                        '--timeout',
+                        type=float,
+                        default=60.0,
+                        help='Seconds to wait for each response')
+    parser.add_argument('--stats',
+                        action='store_true',
+                        help='Print the batching counters of the daemon')
+    args = parser.parse_args()
+
+    if args.stats:
+        try:
+            stats_ = get_stats(args.socket, args.timeout)
+        except ConnectionError as error_:
+            print(error_, file=sys.stderr)
+            sys.exit(1)
+        for key, value in sorted(stats_.items()):
+            print('{}: {}'.format(key, value))
+        sys.exit(0)
+
+    if args.images == ['-']:
+        paths_ = (line.strip() for line in sys.stdin if line.strip())
+    else:
+        paths_ = args.images
+
+    sys.exit(main(paths_, args.socket, args.timeout))
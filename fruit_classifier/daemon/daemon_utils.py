@@ -0,0 +1,454 @@
+import getpass
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+
+
+# NOTE: This module must not import TensorFlow (directly or through
+#       other modules of the package), as the client imports it
+
+# Each message is a JSON object preceded by its length as a 4 byte
+# big-endian unsigned integer
+HEADER = struct.Struct('>I')
+MAX_MESSAGE_BYTES = 16 << 20
+
+
+def get_socket_path():
+    """
+    Returns the default path of the socket of the daemon
+
+    The path can be set with the FRUIT_CLASSIFIER_SOCKET environment
+    variable. Otherwise it is in the temporary directory, as socket
+    paths are limited to about 100 characters
+
+    Returns
+    -------
+    socket_path : Path
+        The path of the socket
+    """
+
+    socket_path = os.environ.get('FRUIT_CLASSIFIER_SOCKET')
+    if socket_path is None:
+        socket_path = os.path.join(
+            tempfile.gettempdir(),
+            'fruit-classifier-{}.sock'.format(getpass.getuser()))
+
+    return Path(socket_path)
+
+
+def _receive_exactly(sock, n_bytes):
+    """
+    Receives exactly n_bytes from the socket
+
+    Parameters
+    ----------
+    sock : socket.socket
+        The connected socket
+    n_bytes : int
+        The number of bytes to receive
+
+    Returns
+    -------
+    data : None or bytes
+        The received bytes. None if the connection was closed before
+        any byte was received
+
+    Raises
+    ------
+    ConnectionError
+        If the connection was closed in the middle of the data
+    """
+
+    buffer = bytearray(n_bytes)
+    view = memoryview(buffer)
+    n_received = 0
+    while n_received < n_bytes:
+        n = sock.recv_into(view[n_received:])
+        if n == 0:
+            if n_received == 0:
+                return None
+            raise ConnectionError('The connection was closed in the '
+                                  'middle of a message')
+        n_received += n
+
+    return bytes(buffer)
+
+
+def send_message(sock, message):
+    """
+    Sends a message as a length-prefixed JSON object
+
+    Parameters
+    ----------
+    sock : socket.socket
+        The connected socket
+    message : dict
+        The message
+    """
+
+    payload = json.dumps(message).encode('utf-8')
+    if len(payload) > MAX_MESSAGE_BYTES:
+        raise ValueError('The message is {} bytes, but at most {} are '
+                         'allowed'.format(len(payload), MAX_MESSAGE_BYTES))
+
+    sock.sendall(HEADER.pack(len(payload)) + payload)
+
+
+def receive_message(sock):
+    """
+    Receives a length-prefixed JSON object
+
+    Parameters
+    ----------
+    sock : socket.socket
+        The connected socket
+
+    Returns
+    -------
+    message : None or dict
+        The message. None if the connection was closed
+
+    Raises
+    ------
+    ValueError
+        If the message is too large
+    ConnectionError
+        If the connection was closed in the middle of a message
+    """
+
+    header = _receive_exactly(sock, HEADER.size)
+    if header is None:
+        return None
+
+    n_bytes = HEADER.unpack(header)[0]
+    if n_bytes > MAX_MESSAGE_BYTES:
+        raise ValueError('The message is {} bytes, but at most {} are '
+                         'allowed'.format(n_bytes, MAX_MESSAGE_BYTES))
+
+    payload = _receive_exactly(sock, n_bytes)
+    if payload is None:
+        raise ConnectionError('The connection was closed in the middle '
+                              'of a message')
+
+    return json.loads(payload.decode('utf-8'))
+
+
+class Batcher(object):
+    """
+    Runs a function on batches of the items submitted from many threads
+
+    The first item waits at most max_delay seconds for more items to
+    fill the batch, so a single request is served almost at once, while
+    concurrent requests share one call of the function. The function
+    runs on a single thread, which is also the thread the initializer
+    runs on (e.g. to load a model in the thread which uses it).
+
+    Parameters
+    ----------
+    function : callable
+        Takes a list of items and returns a list with a result for each
+    max_batch_size : int
+        The maximum number of items in a batch
+    max_delay : float
+        Seconds the first item of a batch waits for more items
+    initializer : None or callable
+        Called on the batching thread before the first batch
+    """
+
+    def __init__(self,
+                 function,
+                 max_batch_size=32,
+                 max_delay=0.005,
+                 initializer=None):
+        self.function = function
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.initializer = initializer
+
+        self.queue = queue.Queue()
+        self.ready = threading.Event()
+        self.error = None
+        self.lock = threading.Lock()
+        self.stats = {'batches': 0, 'items': 0}
+        self.thread = None
+
+    def start(self):
+        """
+        Starts the batching thread
+
+        Returns
+        -------
+        self : Batcher
+            The batcher
+        """
+
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+        return self
+
+    def stop(self):
+        """
+        Stops the batching thread after the queued items are done
+        """
+
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def submit(self, item):
+        """
+        Queues an item
+
+        Parameters
+        ----------
+        item : object
+            The item
+
+        Returns
+        -------
+        future : Future
+            The future result of the item
+        """
+
+        future = Future()
+        self.queue.put((item, future))
+
+        return future
+
+    def get_stats(self):
+        """
+        Returns the counters of the batcher
+
+        Returns
+        -------
+        stats : dict
+            Dictionary containing
+            - batches
+            - items
+            - mean_batch_size
+            - queue_depth
+        """
+
+        with self.lock:
+            stats = dict(self.stats)
+        stats['mean_batch_size'] = \
+            stats['items'] / stats['batches'] if stats['batches'] else 0.0
+        stats['queue_depth'] = self.queue.qsize()
+
+        return stats
+
+    def _get_batch(self):
+        """
+        Waits for the next batch
+
+        Returns
+        -------
+        batch : list
+            The (item, future) pairs of the batch
+        stopping : bool
+            Whether the batcher was stopped
+        """
+
+        job = self.queue.get()
+        if job is None:
+            return list(), True
+
+        batch = [job]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    job = self.queue.get(timeout=timeout)
+                else:
+                    # Take what is already queued, without waiting
+                    job = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                return batch, True
+            batch.append(job)
+
+        return batch, False
+
+    def _run(self):
+        """
+        Runs the function on the queued items in batches
+        """
+
+        if self.initializer is not None:
+            try:
+                self.initializer()
+            except BaseException as error:
+                self.error = error
+        self.ready.set()
+
+        stopping = False
+        while not stopping:
+            batch, stopping = self._get_batch()
+            if not batch:
+                continue
+
+            items = [item for item, _ in batch]
+            futures = [future for _, future in batch]
+
+            if self.error is not None:
+                for future in futures:
+                    future.set_exception(self.error)
+                continue
+
+            try:
+                results = self.function(items)
+            except BaseException as error:
+                for future in futures:
+                    future.set_exception(error)
+            else:
+                for future, result in zip(futures, results):
+                    future.set_result(result)
+
+            with self.lock:
+                self.stats['batches'] += 1
+                self.stats['items'] += len(items)
+
+
+class DaemonServer(socketserver.ThreadingMixIn,
+                   socketserver.UnixStreamServer):
+    """
+    Unix socket server which handles each connection on a thread
+
+    Each connection may send any number of messages, and each message
+    is answered with the return value of process
+
+    Parameters
+    ----------
+    socket_path : Path
+        The path of the socket
+    process : callable
+        Takes a request message and returns the response message
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, process):
+        self.socket_path = Path(socket_path)
+        self.process = process
+
+        remove_stale_socket(self.socket_path)
+        socketserver.UnixStreamServer.__init__(self,
+                                               str(self.socket_path),
+                                               _MessageHandler)
+        # Only the user running the daemon may connect
+        os.chmod(str(self.socket_path), 0o600)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if self.socket_path.exists():
+            self.socket_path.unlink()
+
+
+class _MessageHandler(socketserver.BaseRequestHandler):
+    """
+    Answers the messages of a connection until it is closed
+    """
+
+    def handle(self):
+        while True:
+            try:
+                message = receive_message(self.request)
+            except (ValueError, ConnectionError) as error:
+                try:
+                    send_message(self.request, {'error': str(error)})
+                except OSError:
+                    pass
+                return
+
+            if message is None:
+                return
+
+            try:
+                response = self.server.process(message)
+            except Exception as error:
+                response = {'error': str(error)}
+
+            send_message(self.request, response)
+
+
+def remove_stale_socket(socket_path):
+    """
+    Removes a socket left by a daemon which is no longer running
+
+    Parameters
+    ----------
+    socket_path : Path
+        The path of the socket
+
+    Raises
+    ------
+    RuntimeError
+        If a daemon is listening on the socket
+    """
+
+    socket_path = Path(socket_path)
+    if not socket_path.exists():
+        return
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(socket_path))
+    except OSError:
+        socket_path.unlink()
+    else:
+        raise RuntimeError('A daemon is already listening on '
+                           '{}'.format(socket_path))
+    finally:
+        sock.close()
+
+
+def connect(socket_path=None, timeout=60.0):
+    """
+    Connects to the daemon
+
+    Parameters
+    ----------
+    socket_path : None or Path
+        The path of the socket.
+        If None, get_socket_path() is used
+    timeout : float
+        Seconds to wait for each response
+
+    Returns
+    -------
+    sock : socket.socket
+        The connected socket
+
+    Raises
+    ------
+    ConnectionError
+        If the daemon is not running
+    """
+
+    if socket_path is None:
+        socket_path = get_socket_path()
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(str(socket_path))
+    except (FileNotFoundError, ConnectionRefusedError):
+        sock.close()
+        raise ConnectionError('No daemon is listening on {}. Start it '
+                              'with python -m '
+                              'fruit_classifier.daemon'.format(socket_path))
+
+    return sock
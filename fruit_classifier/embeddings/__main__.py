@@ -0,0 +1,166 @@
+import argparse
+import time
+import numpy as np
+from pathlib import Path
+from fruit_classifier.embeddings.embedding_utils import DTYPES
+from fruit_classifier.embeddings.embedding_utils import EmbeddingIndex
+from fruit_classifier.embeddings.embedding_utils import extract_embeddings
+from fruit_classifier.embeddings.embedding_utils import get_embedding_model
+from fruit_classifier.embeddings.embedding_utils import get_index_dir
+from fruit_classifier.embeddings.embedding_utils import load_index
+from fruit_classifier.embeddings.embedding_utils import save_index
+from fruit_classifier.execution.execution_utils import configure_session
+from fruit_classifier.predict.predict_utils import load_classifier
+from fruit_classifier.train.train_utils import get_image_paths_and_labels
+from fruit_classifier.train.train_utils import \
+    get_image_hashes_and_splits
+from fruit_classifier.train.train_utils import load_data_and_labels
+from fruit_classifier.utils.image_utils import open_image
+from fruit_classifier.preprocessing.preprocessing_utils import \
+    preprocess_image
+
+
+def build(dtype='float16', n_lists=None, batch_size=256):
+    """
+    Embeds the images in cleaned_data and stores the index
+
+    Parameters
+    ----------
+    dtype : ['float32'|'float16'|'int8']
+        The storage dtype of the vectors
+    n_lists : None or int
+        The number of inverted lists for approximate search.
+        If None, only exact search is available
+    batch_size : int
+        The number of images to embed at a time
+    """
+
+    cleaned_dir = \
+        Path(__file__).absolute().parents[2].joinpath('generated_data',
+                                                      'cleaned_data')
+
+    configure_session()
+    model = load_classifier()
+    embedding_model = get_embedding_model(model)
+    height, width = model.input_shape[1:3]
+
+    # The pre-processed cache is shared with training
+    image_paths, image_labels = \
+        get_image_paths_and_labels(cleaned_dir, refresh=False)
+    image_hashes, _ = get_image_hashes_and_splits(cleaned_dir, image_paths)
+    data, labels = load_data_and_labels(image_paths,
+                                        height,
+                                        width,
+                                        image_labels,
+                                        image_hashes)
+
+    index_dir = get_index_dir()
+    vectors, scales = extract_embeddings(embedding_model,
+                                         data,
+                                         index_dir,
+                                         dtype=dtype,
+                                         batch_size=batch_size)
+
+    items = [{'path': image_path.relative_to(cleaned_dir).as_posix(),
+              'label': str(label)}
+             for image_path, label in zip(image_paths, labels)]
+    index = EmbeddingIndex(vectors, scales, items)
+
+    if n_lists is not None:
+        print('[INFO] Building {} inverted lists'.format(n_lists))
+        index.build_ivf(n_lists)
+
+    save_index(index, index_dir, {'layer': embedding_model.layers[-1].name})
+
+
+def query(image_path, k=10, n_probe=None):
+    """
+    Prints the images most similar to an image
+
+    Parameters
+    ----------
+    image_path : Path
+        The image to find similar images to
+    k : int
+        The number of similar images
+    n_probe : None or int
+        The number of inverted lists to scan.
+        If None, the search is exact
+    """
+
+    index, _ = load_index()
+
+    configure_session()
+    model = load_classifier()
+    embedding_model = get_embedding_model(model)
+    height, width = model.input_shape[1:3]
+
+    image = preprocess_image(open_image(Path(image_path)), height, width)
+    embedding = embedding_model.predict(np.expand_dims(image, axis=0))
+
+    start = time.perf_counter()
+    indices, scores = index.search(embedding, k=k, n_probe=n_probe)
+    duration = time.perf_counter() - start
+
+    print('[INFO] Searched {} images in {:.2f} ms'.format(len(index),
+                                                         duration * 1e3))
+    for i, score in zip(indices[0], scores[0]):
+        if i < 0:
+            continue
+        item = index.items[i]
+        print('    {:.3f} {} ({})'.format(score,
+                                          item['path'],
+                                          item['label']))
+
+
+if __name__ == '__main__':
+    # Construct the argument parse and parse the arguments
+    parser = argparse.ArgumentParser(description='Build and query the '
+                                                 'image embedding index')
+    subparsers = parser.add_subparsers(dest='command')
+
+    build_parser = subparsers.add_parser('build',
+                                         help='Embed the images in '
+                                              'cleaned_data')
+    build_parser.add_argument('-d',
+                              '--dtype',
+                              default='float16',
+                              choices=DTYPES,
+                              help='The storage dtype of the vectors')
+    build_parser.add_argument('-n',
+                              '--n-lists',
+                              type=int,
+                              required=False,
+                              help='Build this many inverted lists for '
+                                   'approximate search')
+    build_parser.add_argument('-b',
+                              '--batch-size',
+                              type=int,
+                              default=256,
+                              help='The number of images to embed at a '
+                                   'time')
+
+    query_parser = subparsers.add_parser('query',
+                                         help='Find similar images')
+    query_parser.add_argument('-i',
+                              '--image',
+                              required=True,
+                              help='Path to the query image')
+    query_parser.add_argument('-k',
+                              type=int,
+                              default=10,
+                              help='The number of similar images')
+    query_parser.add_argument('-p',
+                              '--n-probe',
+                              type=int,
+                              required=False,
+                              help='Scan this many inverted lists instead '
+                                   'of searching exactly')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build(args.dtype, args.n_lists, args.batch_size)
+    elif args.command == 'query':
+        query(args.image, args.k, args.n_probe)
+    else:
+        parser.print_help()
@@ -0,0 +1,565 @@
+import json
+import os
+import numpy as np
+from pathlib import Path
+from keras.models import Model
+from tqdm import tqdm
+
+
+# The dtypes the vectors may be stored as. int8 vectors are stored
+# with a float32 scale per vector
+DTYPES = ('float32', 'float16', 'int8')
+
+
+def get_index_dir():
+    """
+    Returns the default directory of the embedding index
+
+    Returns
+    -------
+    index_dir : Path
+        'generated_data/embeddings'
+    """
+
+    index_dir = \
+        Path(__file__).absolute().parents[2].joinpath('generated_data',
+                                                      'embeddings')
+
+    return index_dir
+
+
+def get_embedding_model(model, layer=-2):
+    """
+    Returns a model which outputs the activations of a layer
+
+    For get_lenet the penultimate layer is the Dense(500) layer before
+    the classification layer
+
+    Parameters
+    ----------
+    model : Model
+        The trained classifier
+    layer : int or str
+        The index or the name of the layer to use as embedding
+
+    Returns
+    -------
+    embedding_model : Model
+        The model mapping images to embeddings
+    """
+
+    if isinstance(layer, str):
+        output = model.get_layer(layer).output
+    else:
+        output = model.layers[layer].output
+
+    embedding_model = Model(inputs=model.input, outputs=output)
+
+    return embedding_model
+
+
+def normalize(vectors):
+    """
+    Scales the vectors to unit length
+
+    The dot product of unit vectors is their cosine similarity
+
+    Parameters
+    ----------
+    vectors : np.array, shape (n_vectors, dim)
+        The vectors
+
+    Returns
+    -------
+    normalized : np.array, shape (n_vectors, dim)
+        The float32 unit vectors
+    """
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    normalized = vectors / np.maximum(norms, 1e-12)
+
+    return normalized
+
+
+def quantize(vectors, dtype='float16'):
+    """
+    Converts unit vectors to the storage dtype
+
+    Parameters
+    ----------
+    vectors : np.array, shape (n_vectors, dim)
+        The float32 unit vectors
+    dtype : ['float32'|'float16'|'int8']
+        The storage dtype
+
+    Returns
+    -------
+    quantized : np.array, shape (n_vectors, dim)
+        The vectors in the storage dtype
+    scales : None or np.array, shape (n_vectors,)
+        The value of one step of each int8 vector.
+        None for the float dtypes
+    """
+
+    if dtype not in DTYPES:
+        raise ValueError('dtype must be one of {}'.format(DTYPES))
+
+    if dtype != 'int8':
+        return vectors.astype(dtype), None
+
+    scales = np.max(np.abs(vectors), axis=1) / 127
+    scales = np.maximum(scales, 1e-12).astype(np.float32)
+    quantized = np.round(vectors / scales[:, None]).astype(np.int8)
+
+    return quantized, scales
+
+
+def extract_embeddings(embedding_model,
+                       data,
+                       index_dir,
+                       dtype='float16',
+                       batch_size=256):
+    """
+    Extracts the embeddings of the data in batches and stores them
+
+    The vectors are normalized to unit length, converted to dtype and
+    written straight into a memory mapped 'vectors.npy', so the
+    embeddings of the whole dataset are never held in memory
+
+    Parameters
+    ----------
+    embedding_model : Model
+        The model mapping images to embeddings
+    data : np.array, shape (n_images, height, width, channels)
+        The pre-processed images (may be a np.memmap)
+    index_dir : Path
+        The directory to store the vectors in
+    dtype : ['float32'|'float16'|'int8']
+        The storage dtype
+    batch_size : int
+        The number of images to embed at a time
+
+    Returns
+    -------
+    vectors : np.memmap, shape (n_images, dim)
+        The stored vectors
+    scales : None or np.memmap, shape (n_images,)
+        The stored scales of the int8 vectors
+    """
+
+    index_dir = Path(index_dir)
+    if not index_dir.is_dir():
+        index_dir.mkdir(parents=True, exist_ok=True)
+
+    n_images = len(data)
+    dim = embedding_model.output_shape[-1]
+
+    vectors_path = index_dir.joinpath('vectors.npy')
+    tmp_vectors_path = index_dir.joinpath('vectors.npy.tmp')
+    scales_path = index_dir.joinpath('scales.npy')
+    tmp_scales_path = index_dir.joinpath('scales.npy.tmp')
+
+    vectors = np.lib.format.open_memmap(str(tmp_vectors_path),
+                                        mode='w+',
+                                        dtype=dtype,
+                                        shape=(n_images, dim))
+    scales = None
+    if dtype == 'int8':
+        scales = np.lib.format.open_memmap(str(tmp_scales_path),
+                                           mode='w+',
+                                           dtype='float32',
+                                           shape=(n_images,))
+
+    for start in tqdm(range(0, n_images, batch_size),
+                      desc='Extracting embeddings'):
+        end = min(start + batch_size, n_images)
+        batch = np.asarray(data[start:end], dtype=np.float32)
+        embeddings = embedding_model.predict(batch,
+                                             batch_size=len(batch))
+        quantized, batch_scales = quantize(normalize(embeddings), dtype)
+        vectors[start:end] = quantized
+        if scales is not None:
+            scales[start:end] = batch_scales
+
+    vectors.flush()
+    del vectors
+    os.replace(str(tmp_vectors_path), str(vectors_path))
+    if scales is not None:
+        scales.flush()
+        del scales
+        os.replace(str(tmp_scales_path), str(scales_path))
+    elif scales_path.is_file():
+        scales_path.unlink()
+    print('[INFO] Saved to {}'.format(vectors_path))
+
+    vectors = np.load(str(vectors_path), mmap_mode='r')
+    scales = np.load(str(scales_path), mmap_mode='r') \
+        if dtype == 'int8' else None
+
+    return vectors, scales
+
+
+def get_scores(vectors, scales, queries):
+    """
+    Returns the cosine similarities between stored vectors and queries
+
+    Parameters
+    ----------
+    vectors : np.array, shape (n_vectors, dim)
+        The stored vectors
+    scales : None or np.array, shape (n_vectors,)
+        The scales of int8 vectors
+    queries : np.array, shape (n_queries, dim)
+        The float32 unit query vectors
+
+    Returns
+    -------
+    scores : np.array, shape (n_queries, n_vectors)
+        The similarities
+    """
+
+    scores = queries @ np.asarray(vectors, dtype=np.float32).T
+    if scales is not None:
+        scores *= np.asarray(scales)[None, :]
+
+    return scores
+
+
+def merge_top_k(indices, scores, new_indices, new_scores, k):
+    """
+    Keeps the k best of two sets of candidates for each query
+
+    Parameters
+    ----------
+    indices : np.array, shape (n_queries, n)
+        The indices of the current candidates
+    scores : np.array, shape (n_queries, n)
+        The scores of the current candidates
+    new_indices : np.array, shape (n_queries, m)
+        The indices of the new candidates
+    new_scores : np.array, shape (n_queries, m)
+        The scores of the new candidates
+    k : int
+        The number of candidates to keep
+
+    Returns
+    -------
+    indices : np.array, shape (n_queries, min(k, n + m))
+        The indices of the best candidates sorted by decreasing score
+    scores : np.array, shape (n_queries, min(k, n + m))
+        Their scores
+    """
+
+    indices = np.concatenate((indices, new_indices), axis=1)
+    scores = np.concatenate((scores, new_scores), axis=1)
+
+    if scores.shape[1] > k:
+        # argpartition finds the k best in linear time
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        indices = np.take_along_axis(indices, best, axis=1)
+        scores = np.take_along_axis(scores, best, axis=1)
+
+    order = np.argsort(-scores, axis=1, kind='stable')
+    indices = np.take_along_axis(indices, order, axis=1)
+    scores = np.take_along_axis(scores, order, axis=1)
+
+    return indices, scores
+
+
+class EmbeddingIndex(object):
+    """
+    Nearest neighbour index over stored embeddings
+
+    Exact search scans the vectors in chunks with a matrix product and
+    keeps the top k of each chunk. Approximate search uses an inverted
+    file (IVF): the vectors are clustered with k-means, and only the
+    lists of the n_probe clusters closest to the query are scanned.
+
+    Parameters
+    ----------
+    vectors : np.array, shape (n_vectors, dim)
+        The unit vectors (may be a np.memmap)
+    scales : None or np.array, shape (n_vectors,)
+        The scales of int8 vectors
+    items : None or list
+        The item (e.g. path and label) of each vector
+    centroids : None or np.array, shape (n_lists, dim)
+        The unit centroids of the inverted lists
+    order : None or np.array, shape (n_vectors,)
+        The indices of the vectors sorted by list
+    offsets : None or np.array, shape (n_lists + 1,)
+        Where each list starts in order
+    """
+
+    def __init__(self,
+                 vectors,
+                 scales=None,
+                 items=None,
+                 centroids=None,
+                 order=None,
+                 offsets=None):
+        self.vectors = vectors
+        self.scales = scales
+        self.items = items
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def build_ivf(self,
+                  n_lists=None,
+                  n_iter=10,
+                  sample_size=None,
+                  chunk_size=65536,
+                  seed=42):
+        """
+        Clusters the vectors into inverted lists with spherical k-means
+
+        Parameters
+        ----------
+        n_lists : None or int
+            The number of lists.
+            If None, the square root of the number of vectors is used
+        n_iter : int
+            The number of k-means iterations
+        sample_size : None or int
+            The number of vectors k-means is trained on.
+            If None, 64 vectors per list are used
+        chunk_size : int
+            The number of vectors assigned to lists at a time
+        seed : int
+            The seed of the sampling
+        """
+
+        n_vectors = len(self.vectors)
+        if n_lists is None:
+            n_lists = int(np.sqrt(n_vectors))
+        n_lists = int(np.clip(n_lists, 1, max(n_vectors, 1)))
+        if sample_size is None:
+            sample_size = 64 * n_lists
+
+        random_state = np.random.RandomState(seed)
+        sample = np.sort(random_state.choice(n_vectors,
+                                             min(sample_size, n_vectors),
+                                             replace=False))
+        sample_scales = None if self.scales is None \
+            else np.asarray(self.scales[sample])
+        sample = self._dequantize(self.vectors[sample], sample_scales)
+
+        centroids = sample[random_state.choice(len(sample),
+                                               n_lists,
+                                               replace=False)]
+        for _ in range(n_iter):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            for i in range(n_lists):
+                members = sample[assignments == i]
+                if len(members) > 0:
+                    centroids[i] = members.sum(axis=0)
+            centroids = normalize(centroids)
+
+        # Assign every vector to the list of its closest centroid
+        assignments = np.empty(n_vectors, dtype=np.int32)
+        for start in range(0, n_vectors, chunk_size):
+            end = min(start + chunk_size, n_vectors)
+            scales = None if self.scales is None \
+                else self.scales[start:end]
+            scores = get_scores(centroids, None, self._dequantize(
+                self.vectors[start:end], scales))
+            assignments[start:end] = np.argmax(scores, axis=1)
+
+        self.centroids = centroids.astype(np.float32)
+        self.order = np.argsort(assignments, kind='stable')
+        self.offsets = np.searchsorted(assignments[self.order],
+                                       np.arange(n_lists + 1))
+
+    def search(self, queries, k=10, n_probe=None, chunk_size=65536):
+        """
+        Finds the vectors most similar to each query
+
+        Parameters
+        ----------
+        queries : np.array, shape (n_queries, dim) or (dim,)
+            The query vectors (normalized here)
+        k : int
+            The number of neighbours to return
+        n_probe : None or int
+            The number of inverted lists to scan.
+            If None, or if the index has no lists, the search is exact
+        chunk_size : int
+            The number of vectors scored at a time in exact search
+
+        Returns
+        -------
+        indices : np.array, shape (n_queries, k)
+            The indices of the neighbours sorted by decreasing
+            similarity (fewer than k if the index is smaller)
+        scores : np.array, shape (n_queries, k)
+            The cosine similarities of the neighbours
+        """
+
+        queries = normalize(np.atleast_2d(queries))
+
+        if n_probe is None or self.centroids is None:
+            return self._search_exact(queries, k, chunk_size)
+
+        return self._search_ivf(queries, k, n_probe)
+
+    def _search_exact(self, queries, k, chunk_size):
+        """
+        Scans all the vectors
+        """
+
+        indices = np.empty((len(queries), 0), dtype=np.int64)
+        scores = np.empty((len(queries), 0), dtype=np.float32)
+
+        for start in range(0, len(self.vectors), chunk_size):
+            end = min(start + chunk_size, len(self.vectors))
+            scales = None if self.scales is None \
+                else self.scales[start:end]
+            chunk_scores = get_scores(self.vectors[start:end],
+                                      scales,
+                                      queries)
+            chunk_indices = np.broadcast_to(np.arange(start, end),
+                                            chunk_scores.shape)
+            indices, scores = merge_top_k(indices,
+                                          scores,
+                                          chunk_indices,
+                                          chunk_scores,
+                                          k)
+
+        return indices, scores
+
+    def _search_ivf(self, queries, k, n_probe):
+        """
+        Scans the n_probe lists closest to each query
+        """
+
+        n_probe = min(n_probe, len(self.centroids))
+        probes = np.argsort(-(queries @ self.centroids.T), axis=1)
+        probes = probes[:, :n_probe]
+
+        all_indices = np.full((len(queries), k), -1, dtype=np.int64)
+        all_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+
+        for i, query in enumerate(queries):
+            candidates = np.concatenate(
+                [self.order[self.offsets[j]:self.offsets[j + 1]]
+                 for j in probes[i]])
+            # Sorted indices read the memory map sequentially
+            candidates = np.sort(candidates)
+            scales = None if self.scales is None \
+                else self.scales[candidates]
+            candidate_scores = get_scores(self.vectors[candidates],
+                                          scales,
+                                          query[None, :])
+            indices, scores = merge_top_k(
+                np.empty((1, 0), dtype=np.int64),
+                np.empty((1, 0), dtype=np.float32),
+                candidates[None, :],
+                candidate_scores,
+                k)
+            all_indices[i, :indices.shape[1]] = indices[0]
+            all_scores[i, :scores.shape[1]] = scores[0]
+
+        return all_indices, all_scores
+
+    @staticmethod
+    def _dequantize(vectors, scales):
+        """
+        Returns stored vectors as float32
+        """
+
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if scales is not None:
+            vectors = vectors * np.asarray(scales)[:, None]
+
+        return vectors
+
+
+def save_index(index, index_dir, metadata=None):
+    """
+    Stores the items and the inverted lists of an index
+
+    The vectors are stored by extract_embeddings
+
+    Parameters
+    ----------
+    index : EmbeddingIndex
+        The index
+    index_dir : Path
+        The directory of the index
+    metadata : None or dict
+        Extra information stored in 'index.json' (e.g. the layer)
+    """
+
+    index_dir = Path(index_dir)
+
+    meta = dict() if metadata is None else dict(metadata)
+    meta['n_vectors'] = len(index)
+    meta['dim'] = int(index.vectors.shape[1])
+    meta['dtype'] = str(index.vectors.dtype)
+    meta['items'] = index.items
+
+    with index_dir.joinpath('index.json').open('w') as f:
+        json.dump(meta, f)
+
+    ivf_path = index_dir.joinpath('ivf.npz')
+    if index.centroids is not None:
+        with ivf_path.open('wb') as f:
+            np.savez(f,
+                     centroids=index.centroids,
+                     order=index.order,
+                     offsets=index.offsets)
+    elif ivf_path.is_file():
+        ivf_path.unlink()
+
+    print('[INFO] Saved to {}'.format(index_dir))
+
+
+def load_index(index_dir=None):
+    """
+    Loads an index stored with extract_embeddings and save_index
+
+    The vectors are memory mapped, so loading is fast even for millions
+    of images
+
+    Parameters
+    ----------
+    index_dir : None or Path
+        The directory of the index.
+        If None, 'generated_data/embeddings' is used
+
+    Returns
+    -------
+    index : EmbeddingIndex
+        The index
+    metadata : dict
+        The content of 'index.json'
+    """
+
+    if index_dir is None:
+        index_dir = get_index_dir()
+    index_dir = Path(index_dir)
+
+    with index_dir.joinpath('index.json').open('r') as f:
+        metadata = json.load(f)
+
+    vectors = np.load(str(index_dir.joinpath('vectors.npy')),
+                      mmap_mode='r')
+    scales_path = index_dir.joinpath('scales.npy')
+    scales = np.load(str(scales_path), mmap_mode='r') \
+        if metadata['dtype'] == 'int8' else None
+
+    index = EmbeddingIndex(vectors, scales, metadata.pop('items'))
+
+    ivf_path = index_dir.joinpath('ivf.npz')
+    if ivf_path.is_file():
+        with np.load(str(ivf_path)) as ivf:
+            index.centroids = ivf['centroids']
+            index.order = ivf['order']
+            index.offsets = ivf['offsets']
+
+    return index, metadata
@@ -0,0 +1,60 @@
+import argparse
+from fruit_classifier.execution.execution_utils import \
+    tune_execution_profile
+from fruit_classifier.execution.execution_utils import \
+    save_execution_profile
+
+
+def main(objective='predict_latency', processes=1, n_runs=20):
+    """
+    Tunes the TensorFlow thread settings for the current machine
+
+    The best profile is stored in 'generated_data/profiles', where it
+    is picked up by training, prediction and the app
+
+    Parameters
+    ----------
+    objective : ['predict_latency'|'batch_predict_latency'|'train_step_time']
+        The measurement to minimize
+    processes : int
+        Number of processes which are going to share the cores
+    n_runs : int
+        Number of timed runs for each candidate
+    """
+
+    profile = tune_execution_profile(objective=objective,
+                                     processes=processes,
+                                     n_runs=n_runs)
+
+    print('[INFO] Best profile: {} intra-op and {} inter-op '
+          'threads'.format(profile['intra_op_threads'],
+                           profile['inter_op_threads']))
+
+    save_execution_profile(profile)
+
+
+if __name__ == '__main__':
+    # Construct the argument parse and parse the arguments
+    parser = argparse.ArgumentParser(description='Tune the TensorFlow '
+                                                 'thread settings')
+    parser.add_argument('-o',
+                        '--objective',
+                        default='predict_latency',
+                        choices=('predict_latency',
+                                 'batch_predict_latency',
+                                 'train_step_time'),
+                        help='The measurement to minimize')
+    parser.add_argument('-p',
+                        '--processes',
+                        type=int,
+                        default=1,
+                        help='Number of processes which are going to '
+                             'share the cores of this machine')
+    parser.add_argument('-n',
+                        '--n-runs',
+                        type=int,
+                        default=20,
+                        help='Number of timed runs for each candidate')
+    args = parser.parse_args()
+
+    main(args.objective, args.processes, args.n_runs)
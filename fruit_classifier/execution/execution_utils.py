@@ -0,0 +1,351 @@
+import json
+import os
+import multiprocessing
+import numpy as np
+import tensorflow as tf
+from pathlib import Path
+from keras import backend as K
+
+
+DEFAULT_PROFILE = {'intra_op_threads': 0,
+                   'inter_op_threads': 0}
+
+# Environment variables which take precedence over the stored profile
+# This makes it possible to split the cores between several processes
+# sharing a node without re-tuning
+INTRA_OP_ENV = 'FRUIT_CLASSIFIER_INTRA_OP_THREADS'
+INTER_OP_ENV = 'FRUIT_CLASSIFIER_INTER_OP_THREADS'
+
+# The session made by configure_session, and the profile it was made with
+_SESSION_CACHE = dict()
+
+
+def get_profile_path():
+    """
+    Returns the default path of the execution profile
+
+    Returns
+    -------
+    profile_path : Path
+        Path to 'generated_data/profiles/execution_profile.json'
+    """
+
+    profile_path = \
+        Path(__file__).absolute().parents[2].joinpath(
+            'generated_data', 'profiles', 'execution_profile.json')
+
+    return profile_path
+
+
+def load_execution_profile(profile_path=None):
+    """
+    Loads the execution profile
+
+    The default profile (where TensorFlow chooses the number of
+    threads) is returned if no profile has been stored, or if the
+    profile was tuned on a machine with a different number of cores.
+    The thread settings can be overridden by the environment variables
+    FRUIT_CLASSIFIER_INTRA_OP_THREADS and
+    FRUIT_CLASSIFIER_INTER_OP_THREADS.
+
+    Parameters
+    ----------
+    profile_path : None or Path
+        Path to the profile.
+        If None, the path from get_profile_path() is used
+
+    Returns
+    -------
+    profile : dict
+        Dictionary containing
+        - intra_op_threads
+        - inter_op_threads
+    """
+
+    if profile_path is None:
+        profile_path = get_profile_path()
+    profile_path = Path(profile_path)
+
+    profile = dict(DEFAULT_PROFILE)
+
+    if profile_path.is_file():
+        with profile_path.open('r') as f:
+            stored_profile = json.load(f)
+
+        cpu_count = stored_profile.get('cpu_count', os.cpu_count())
+        if cpu_count == os.cpu_count():
+            profile['intra_op_threads'] = \
+                stored_profile['intra_op_threads']
+            profile['inter_op_threads'] = \
+                stored_profile['inter_op_threads']
+        else:
+            print('[WARNING] {} was tuned for {} cores, but {} are '
+                  'available. Using default settings'.format(
+                      profile_path, cpu_count, os.cpu_count()))
+
+    if INTRA_OP_ENV in os.environ:
+        profile['intra_op_threads'] = int(os.environ[INTRA_OP_ENV])
+    if INTER_OP_ENV in os.environ:
+        profile['inter_op_threads'] = int(os.environ[INTER_OP_ENV])
+
+    return profile
+
+
+def save_execution_profile(profile, profile_path=None):
+    """
+    Saves the execution profile
+
+    Parameters
+    ----------
+    profile : dict
+        The profile to save
+    profile_path : None or Path
+        Path to store the profile to.
+        If None, the path from get_profile_path() is used
+    """
+
+    if profile_path is None:
+        profile_path = get_profile_path()
+    profile_path = Path(profile_path)
+
+    if not profile_path.parent.is_dir():
+        profile_path.parent.mkdir(parents=True, exist_ok=True)
+
+    with profile_path.open('w') as f:
+        json.dump(profile, f, indent=4)
+    print('[INFO] Saved to {}'.format(profile_path))
+
+
+def get_session_config(profile):
+    """
+    Returns the session configuration of the thread settings
+
+    Parameters
+    ----------
+    profile : dict
+        The execution profile
+
+    Returns
+    -------
+    config : tf.ConfigProto
+        The configuration to create sessions with
+    """
+
+    config = tf.ConfigProto(
+        intra_op_parallelism_threads=profile['intra_op_threads'],
+        inter_op_parallelism_threads=profile['inter_op_threads'],
+        allow_soft_placement=True)
+
+    return config
+
+
+def configure_session(profile=None):
+    """
+    Sets a Keras session using the thread settings of the profile
+
+    The session is made once per process and reused by later calls,
+    so that all models of a process share it. A new session is only
+    made when K.clear_session() has replaced the graph. Entry points
+    call this once, before loading or building their models.
+
+    NOTE: TensorFlow creates its thread pools when the first session
+          of a process is made. The profile must therefore be
+          configured before anything else touches the backend
+
+    Parameters
+    ----------
+    profile : None or dict
+        The execution profile.
+        If None, the profile is loaded with load_execution_profile()
+
+    Returns
+    -------
+    profile : dict
+        The profile which was used
+    """
+
+    if profile is None:
+        profile = _SESSION_CACHE.get('profile')
+        if profile is None:
+            profile = load_execution_profile()
+
+    session = _SESSION_CACHE.get('session')
+    if session is None or session.graph is not tf.get_default_graph():
+        if session is not None:
+            # The graph of the old session has been cleared
+            session.close()
+        session = tf.Session(config=get_session_config(profile))
+        _SESSION_CACHE['session'] = session
+        _SESSION_CACHE['profile'] = profile
+    elif _SESSION_CACHE['profile'] != profile:
+        # The models in the session would be lost with a new one
+        print('[WARNING] The session was configured with {}, ignoring '
+              '{}'.format(_SESSION_CACHE['profile'], profile))
+        profile = _SESSION_CACHE['profile']
+
+    K.set_session(session)
+
+    return profile
+
+
+def get_candidate_profiles(cpu_count=None, processes=1):
+    """
+    Returns the thread settings to benchmark
+
+    Parameters
+    ----------
+    cpu_count : None or int
+        The number of available cores.
+        If None, os.cpu_count() is used
+    processes : int
+        Number of processes which are going to share the cores
+
+    Returns
+    -------
+    candidates : list
+        List of profiles
+    """
+
+    if cpu_count is None:
+        cpu_count = os.cpu_count()
+
+    max_threads = max(cpu_count // processes, 1)
+
+    intra_op_threads = {max_threads}
+    n_threads = 1
+    while n_threads < max_threads:
+        intra_op_threads.add(n_threads)
+        n_threads *= 2
+
+    inter_op_threads = sorted({1, min(2, max_threads)})
+
+    candidates = [{'intra_op_threads': intra, 'inter_op_threads': inter}
+                  for intra in sorted(intra_op_threads)
+                  for inter in inter_op_threads]
+
+    return candidates
+
+
+def benchmark_profile(profile,
+                      height=28,
+                      width=28,
+                      channels=3,
+                      n_classes=3,
+                      batch_size=32,
+                      n_runs=20):
+    """
+    Benchmarks prediction and training with the given profile
+
+    NOTE: As the thread pools can not be changed after they have been
+          created, this should be called in a fresh process
+
+    Parameters
+    ----------
+    profile : dict
+        The profile to benchmark
+    height : int
+        The pixel height of the images
+    width : int
+        The pixel width of the images
+    channels : int
+        The number of channels in the image
+    n_classes : int
+        Number of classes to use in the model
+    batch_size : int
+        The batch size of the training step and batched prediction
+    n_runs : int
+        Number of timed runs
+
+    Returns
+    -------
+    result : dict
+        The profile together with
+        - predict_latency (single image)
+        - batch_predict_latency
+        - train_step_time
+    """
+
+    # NOTE: Imported here to avoid circular imports
+    from fruit_classifier.models.models import get_lenet
+    from fruit_classifier.utils.benchmark_utils import \
+        measure_predict_latency
+    from fruit_classifier.utils.benchmark_utils import \
+        measure_train_step_time
+
+    configure_session(profile)
+
+    model = get_lenet(height=height,
+                      width=width,
+                      channels=channels,
+                      classes=n_classes)
+    model.compile(loss='categorical_crossentropy', optimizer='adam')
+
+    images = np.random.rand(batch_size, height, width, channels)
+    labels = np.eye(n_classes)[np.random.randint(n_classes,
+                                                 size=batch_size)]
+
+    result = dict(profile)
+    result['predict_latency'] = \
+        measure_predict_latency(model, images[:1], n_runs=n_runs)
+    result['batch_predict_latency'] = \
+        measure_predict_latency(model, images, n_runs=n_runs)
+    result['train_step_time'] = \
+        measure_train_step_time(model, images, labels, n_runs=n_runs)
+
+    K.clear_session()
+
+    return result
+
+
+def tune_execution_profile(objective='predict_latency',
+                           processes=1,
+                           n_runs=20,
+                           **benchmark_kwargs):
+    """
+    Finds the fastest thread settings on the current machine
+
+    Each candidate is benchmarked in a separate process, as
+    TensorFlow only reads the thread settings once per process.
+
+    Parameters
+    ----------
+    objective : ['predict_latency'|'batch_predict_latency'|'train_step_time']
+        The measurement to minimize
+    processes : int
+        Number of processes which are going to share the cores
+    n_runs : int
+        Number of timed runs for each candidate
+    benchmark_kwargs : dict
+        Keyword arguments passed to benchmark_profile
+
+    Returns
+    -------
+    profile : dict
+        The best profile containing the thread settings, the number of
+        cores, the objective and the results of all the candidates
+    """
+
+    candidates = get_candidate_profiles(processes=processes)
+
+    context = multiprocessing.get_context('spawn')
+    results = list()
+    for candidate in candidates:
+        print('[INFO] Benchmarking {}'.format(candidate))
+        with context.Pool(processes=1) as pool:
+            result = pool.apply(benchmark_profile,
+                                (candidate,),
+                                dict(n_runs=n_runs, **benchmark_kwargs))
+        print('[INFO] {}: {:.2f} ms'.format(objective,
+                                            result[objective] * 1e3))
+        results.append(result)
+
+    best = min(results, key=lambda r: r[objective])
+
+    profile = {'intra_op_threads': best['intra_op_threads'],
+               'inter_op_threads': best['inter_op_threads'],
+               'cpu_count': os.cpu_count(),
+               'processes': processes,
+               'objective': objective,
+               'benchmarks': results}
+
+    return profile
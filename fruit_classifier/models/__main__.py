@@ -0,0 +1,135 @@
+import argparse
+import keras
+from pathlib import Path
+from fruit_classifier.execution.execution_utils import configure_session
+from fruit_classifier.models.models import ARCHITECTURES
+from fruit_classifier.models.zoo_utils import get_zoo_configs
+from fruit_classifier.models.zoo_utils import get_zoo_name
+from fruit_classifier.models.zoo_utils import evaluate_zoo_model
+from fruit_classifier.models.zoo_utils import save_zoo_report
+from fruit_classifier.train.train_utils import get_image_paths_and_labels
+from fruit_classifier.train.train_utils import \
+    get_image_hashes_and_splits
+from fruit_classifier.train.train_utils import load_data_and_labels
+from fruit_classifier.train.train_utils import encode_labels
+from fruit_classifier.train.train_utils import get_split_indices
+from fruit_classifier.train.train_utils import get_model
+from fruit_classifier.train.train_utils import train_model_on_sequences
+from fruit_classifier.train.sequences import IndexSequence
+from fruit_classifier.preprocessing.preprocessing_utils import \
+    get_image_generator
+
+
+def main(architectures=('lenet', 'mobilenet'),
+         alphas=(0.5, 1.0),
+         sizes=(28, 32),
+         epochs=10):
+    """
+    Trains and benchmarks every model in the zoo
+
+    The trained models are stored in 'generated_data/models/zoo', and
+    a report of accuracy vs. latency vs. number of parameters is
+    stored in 'generated_data/reports'
+
+    Parameters
+    ----------
+    architectures : array-like
+        Names of the architectures (see models.ARCHITECTURES)
+    alphas : array-like
+        The width multipliers
+    sizes : array-like
+        The pixel height and width of the model inputs
+    epochs : int
+        The number of epochs to train each model
+    """
+
+    generated_data_dir = \
+        Path(__file__).absolute().parents[2].joinpath('generated_data')
+    cleaned_dir = generated_data_dir.joinpath('cleaned_data')
+    zoo_dir = generated_data_dir.joinpath('models', 'zoo')
+
+    image_paths, image_labels = get_image_paths_and_labels(cleaned_dir)
+    image_hashes, _ = get_image_hashes_and_splits(cleaned_dir, image_paths)
+    image_generator = get_image_generator()
+
+    configs = get_zoo_configs(architectures, alphas, sizes)
+
+    results = list()
+    # Sort on size so that the images are only processed once per size
+    for config in sorted(configs, key=lambda c: c['size']):
+        size = config['size']
+        if not results or results[-1]['size'] != size:
+            data, labels = load_data_and_labels(image_paths,
+                                                size,
+                                                size,
+                                                image_labels,
+                                                image_hashes)
+            encoded_labels = encode_labels(labels)
+            train_indices, val_indices = get_split_indices(len(labels))
+            # The batches are gathered from the data when needed, instead
+            # of copying the splits
+            train_sequence = IndexSequence(data,
+                                           encoded_labels,
+                                           train_indices,
+                                           image_generator=image_generator,
+                                           shuffle=True,
+                                           seed=42)
+            val_sequence = IndexSequence(data, encoded_labels, val_indices)
+
+        name = get_zoo_name(config)
+        print('[INFO] Training {}'.format(name))
+
+        keras.backend.clear_session()
+        configure_session()
+        model = get_model(len(set(labels)),
+                          width=size,
+                          height=size,
+                          epochs=epochs,
+                          architecture=config['architecture'],
+                          alpha=config['alpha'],
+                          sparse_labels=True)
+
+        train_model_on_sequences(
+            model,
+            train_sequence,
+            val_sequence,
+            epochs=epochs,
+            checkpoint_dir=zoo_dir.joinpath('checkpoints', name),
+            model_path=zoo_dir.joinpath('{}.h5'.format(name)))
+
+        result = dict(config)
+        result.update(evaluate_zoo_model(model, val_sequence))
+        results.append(result)
+
+    save_zoo_report(results)
+
+
+if __name__ == '__main__':
+    # Construct the argument parse and parse the arguments
+    parser = argparse.ArgumentParser(description='Benchmark the model '
+                                                 'zoo')
+    parser.add_argument('-a',
+                        '--architectures',
+                        nargs='+',
+                        default=('lenet', 'mobilenet'),
+                        choices=sorted(ARCHITECTURES),
+                        help='The architectures to benchmark')
+    parser.add_argument('--alphas',
+                        nargs='+',
+                        type=float,
+                        default=(0.5, 1.0),
+                        help='The width multipliers to benchmark')
+    parser.add_argument('-s',
+                        '--sizes',
+                        nargs='+',
+                        type=int,
+                        default=(28, 32),
+                        help='The input resolutions to benchmark')
+    parser.add_argument('-e',
+                        '--epochs',
+                        type=int,
+                        default=10,
+                        help='The number of epochs to train each model')
+    args = parser.parse_args()
+
+    main(args.architectures, args.alphas, args.sizes, args.epochs)
@@ -0,0 +1,69 @@
+import tensorflow as tf
+from keras import backend as K
+from keras.layers import Layer
+
+
+class Resize(Layer):
+    """
+    Resizes images to a fixed size inside the graph
+
+    Area interpolation averages all the pixels covered by each output
+    pixel, which like the anti-aliased resize of preprocess_image does
+    not alias when downscaling
+
+    Parameters
+    ----------
+    height : int
+        The pixel height of the output
+    width : int
+        The pixel width of the output
+    """
+
+    def __init__(self, height, width, **kwargs):
+        super(Resize, self).__init__(**kwargs)
+        self.height = height
+        self.width = width
+
+    def call(self, inputs):
+        images = K.cast(inputs, K.floatx())
+        return tf.image.resize_images(images,
+                                      (self.height, self.width),
+                                      method=tf.image.ResizeMethod.AREA)
+
+    def compute_output_shape(self, input_shape):
+        return (input_shape[0], self.height, self.width, input_shape[3])
+
+    def get_config(self):
+        config = {'height': self.height, 'width': self.width}
+        base_config = super(Resize, self).get_config()
+        return dict(list(base_config.items()) + list(config.items()))
+
+
+class Rescale(Layer):
+    """
+    Casts the input to floats and multiplies it by a constant
+
+    Parameters
+    ----------
+    scale : float
+        The factor, 1 / 255 maps uint8 pixels to [0, 1]
+    """
+
+    def __init__(self, scale=1 / 255, **kwargs):
+        super(Rescale, self).__init__(**kwargs)
+        self.scale = scale
+
+    def call(self, inputs):
+        return K.cast(inputs, K.floatx()) * self.scale
+
+    def compute_output_shape(self, input_shape):
+        return input_shape
+
+    def get_config(self):
+        config = {'scale': self.scale}
+        base_config = super(Rescale, self).get_config()
+        return dict(list(base_config.items()) + list(config.items()))
+
+
+# Pass to load_model to load models containing the layers
+CUSTOM_OBJECTS = {'Resize': Resize, 'Rescale': Rescale}
@@ -1,11 +1,15 @@
 from keras.models import Sequential
+from keras.layers import BatchNormalization
 from keras.layers import Conv2D
+from keras.layers import DepthwiseConv2D
 from keras.layers import MaxPooling2D
 from keras.layers import Flatten
 from keras.layers import Dense
+from keras.layers import GlobalAveragePooling2D
+from keras.layers import ReLU
 
 
-def get_lenet(height, width, channels, classes):
+def get_lenet(height, width, channels, classes, alpha=1.0):
     """
     Implementation of a LeNet like architecture with input (h, w, c)
 
@@ -19,6 +23,8 @@ def get_lenet(height, width, channels, classes):
         Number of channels
     classes : int
         Number of prediction classes
+    alpha : float
+        Width multiplier for the number of filters and hidden units
 
     Returns
     -------
@@ -34,7 +40,7 @@ def get_lenet(height, width, channels, classes):
     model = Sequential()
     input_shape = (height, width, channels)
 
-    model.add(Conv2D(20,
+    model.add(Conv2D(_scale(20, alpha),
                      (5, 5),
                      input_shape=input_shape,
                      padding='same',
@@ -42,15 +48,145 @@ def get_lenet(height, width, channels, classes):
     model.add(MaxPooling2D(pool_size=(2, 2),
                            strides=(2, 2)))
 
-    model.add(Conv2D(50,
+    model.add(Conv2D(_scale(50, alpha),
                      (5, 5),
                      padding='same'))
     model.add(MaxPooling2D(pool_size=(2, 2),
                            strides=(2, 2)))
 
     model.add(Flatten())
-    model.add(Dense(500, activation='relu'))
+    model.add(Dense(_scale(500, alpha), activation='relu'))
     model.add(Dense(classes, activation='softmax'))
 
     return model
 
+
+def get_mobilenet(height, width, channels, classes, alpha=1.0):
+    """
+    Implementation of a small MobileNet like architecture
+
+    The network consists of depthwise-separable convolutions, which
+    need far fewer multiplications than regular convolutions, making
+    it well suited for inference on CPUs
+
+    Parameters
+    ----------
+    height : int
+        Pixel height of the image
+    width : int
+        Pixel width of the image
+    channels : int
+        Number of channels
+    classes : int
+        Number of prediction classes
+    alpha : float
+        Width multiplier for the number of filters
+
+    Returns
+    -------
+    model : Sequential
+        The network architecture
+
+    References
+    ----------
+    Howard et al. - MobileNets: Efficient Convolutional Neural Networks
+    for Mobile Vision Applications
+    https://arxiv.org/abs/1704.04861
+    """
+    model = Sequential()
+    input_shape = (height, width, channels)
+
+    model.add(Conv2D(_scale(32, alpha),
+                     (3, 3),
+                     strides=(2, 2),
+                     input_shape=input_shape,
+                     padding='same',
+                     use_bias=False))
+    model.add(BatchNormalization())
+    model.add(ReLU(6.))
+
+    # Each block is given as (pointwise filters, depthwise strides)
+    blocks = ((64, 1), (128, 2), (128, 1), (256, 2), (256, 1))
+    for filters, strides in blocks:
+        model.add(DepthwiseConv2D((3, 3),
+                                  strides=(strides, strides),
+                                  padding='same',
+                                  use_bias=False))
+        model.add(BatchNormalization())
+        model.add(ReLU(6.))
+
+        model.add(Conv2D(_scale(filters, alpha),
+                         (1, 1),
+                         padding='same',
+                         use_bias=False))
+        model.add(BatchNormalization())
+        model.add(ReLU(6.))
+
+    model.add(GlobalAveragePooling2D())
+    model.add(Dense(classes, activation='softmax'))
+
+    return model
+
+
+# The available architectures
+# All the architectures take the arguments
+# (height, width, channels, classes, alpha)
+ARCHITECTURES = {'lenet': get_lenet,
+                 'mobilenet': get_mobilenet}
+
+
+def get_architecture(name, height, width, channels, classes, alpha=1.0):
+    """
+    Returns the architecture registered under the given name
+
+    Parameters
+    ----------
+    name : str
+        The name of the architecture in ARCHITECTURES
+    height : int
+        Pixel height of the image
+    width : int
+        Pixel width of the image
+    channels : int
+        Number of channels
+    classes : int
+        Number of prediction classes
+    alpha : float
+        Width multiplier of the architecture
+
+    Returns
+    -------
+    model : Sequential
+        The network architecture
+    """
+
+    if name not in ARCHITECTURES:
+        raise ValueError('Unknown architecture {}. Choose from '
+                         '{}'.format(name, sorted(ARCHITECTURES)))
+
+    model = ARCHITECTURES[name](height=height,
+                                width=width,
+                                channels=channels,
+                                classes=classes,
+                                alpha=alpha)
+
+    return model
+
+
+def _scale(n, alpha):
+    """
+    Scales the number of filters or units with the width multiplier
+
+    Parameters
+    ----------
+    n : int
+        The number of filters or units at alpha = 1
+    alpha : float
+        The width multiplier
+
+    Returns
+    -------
+    int
+        The scaled number (at least 1)
+    """
+    return max(int(round(n * alpha)), 1)
@@ -0,0 +1,204 @@
+import csv
+import itertools
+import numpy as np
+from pathlib import Path
+from matplotlib import pyplot as plt
+from fruit_classifier.utils.benchmark_utils import measure_predict_latency
+
+
+def get_zoo_configs(architectures=('lenet', 'mobilenet'),
+                    alphas=(0.5, 1.0),
+                    sizes=(28, 32)):
+    """
+    Returns all the combinations of architectures, alphas and sizes
+
+    Parameters
+    ----------
+    architectures : array-like
+        Names of the architectures (see models.ARCHITECTURES)
+    alphas : array-like
+        The width multipliers
+    sizes : array-like
+        The pixel height and width of the model inputs
+
+    Returns
+    -------
+    configs : list
+        List of dicts containing
+        - architecture
+        - alpha
+        - size
+    """
+
+    configs = [{'architecture': architecture, 'alpha': alpha, 'size': size}
+               for architecture, alpha, size
+               in itertools.product(architectures, alphas, sizes)]
+
+    return configs
+
+
+def get_zoo_name(config):
+    """
+    Returns a name describing the configuration
+
+    Parameters
+    ----------
+    config : dict
+        The configuration as given by get_zoo_configs
+
+    Returns
+    -------
+    str
+        The name of the configuration
+    """
+    return '{}_a{}_s{}'.format(config['architecture'],
+                               config['alpha'],
+                               config['size'])
+
+
+def evaluate_zoo_model(model, val_sequence, n_runs=20):
+    """
+    Measures accuracy, latency and size of a trained model
+
+    The accuracy is computed from the predictions, so it does not
+    depend on the loss the model was compiled with
+
+    Parameters
+    ----------
+    model : Sequential
+        The trained model
+    val_sequence : IndexSequence
+        The sequence of validation batches, with integer encoded labels
+    n_runs : int
+        Number of timed predictions
+
+    Returns
+    -------
+    result : dict
+        Dictionary containing
+        - params
+        - val_acc
+        - latency_ms (single image)
+        - throughput (images per second at the batch size of
+          val_sequence)
+    """
+
+    n_correct = 0
+    n_images = 0
+    for i in range(len(val_sequence)):
+        x_batch, y_batch = val_sequence[i]
+        predictions = np.argmax(model.predict_on_batch(x_batch), axis=1)
+        n_correct += np.sum(predictions == y_batch)
+        n_images += len(y_batch)
+    val_acc = n_correct / n_images
+
+    batch, _ = val_sequence[0]
+    latency = measure_predict_latency(model, batch[:1], n_runs=n_runs)
+    batch_latency = measure_predict_latency(model, batch, n_runs=n_runs)
+
+    result = {'params': model.count_params(),
+              'val_acc': float(val_acc),
+              'latency_ms': latency * 1e3,
+              'throughput': len(batch) / batch_latency}
+
+    return result
+
+
+def mark_pareto_front(results):
+    """
+    Marks the results which are not beaten on both latency and accuracy
+
+    A result is on the Pareto front if no other result is both at
+    least as fast and at least as accurate (and strictly better in one
+    of them)
+
+    Parameters
+    ----------
+    results : list
+        List of dicts containing latency_ms and val_acc
+
+    Returns
+    -------
+    results : list
+        The same results with the key 'pareto' added
+    """
+
+    for result in results:
+        result['pareto'] = not any(
+            (other['latency_ms'] <= result['latency_ms'] and
+             other['val_acc'] >= result['val_acc'] and
+             (other['latency_ms'] < result['latency_ms'] or
+              other['val_acc'] > result['val_acc']))
+            for other in results)
+
+    return results
+
+
+def save_zoo_report(results, report_dir=None):
+    """
+    Saves the zoo results as a csv file and a plot
+
+    The report is sorted by latency.
+    The plot shows the validation accuracy against the latency, where
+    the marker size is given by the number of parameters.
+
+    Parameters
+    ----------
+    results : list
+        List of dicts as given by get_zoo_configs updated with
+        evaluate_zoo_model
+    report_dir : None or Path
+        Directory to store the report in.
+        If None, 'generated_data/reports' is used
+    """
+
+    if report_dir is None:
+        report_dir = \
+            Path(__file__).absolute().parents[2].joinpath('generated_data',
+                                                          'reports')
+    report_dir = Path(report_dir)
+
+    if not report_dir.is_dir():
+        report_dir.mkdir(parents=True, exist_ok=True)
+
+    results = sorted(mark_pareto_front(results),
+                     key=lambda r: r['latency_ms'])
+
+    fields = ('architecture', 'alpha', 'size', 'params', 'val_acc',
+              'latency_ms', 'throughput', 'pareto')
+
+    report_path = report_dir.joinpath('model_zoo.csv')
+    with report_path.open('w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(results)
+    print('[INFO] Saved to {}'.format(report_path))
+
+    print('\n{:<24} {:>10} {:>8} {:>12} {:>8}'.format(
+        'Model', 'Params', 'Val acc', 'Latency (ms)', 'Pareto'))
+    for result in results:
+        print('{:<24} {:>10} {:>8.3f} {:>12.2f} {:>8}'.format(
+            get_zoo_name(result),
+            result['params'],
+            result['val_acc'],
+            result['latency_ms'],
+            'x' if result['pareto'] else ''))
+
+    plt.style.use('ggplot')
+    plt.figure()
+    max_params = max(r['params'] for r in results)
+    for result in results:
+        plt.scatter(result['latency_ms'],
+                    result['val_acc'],
+                    s=20 + 400 * result['params'] / max_params,
+                    alpha=0.6)
+        plt.annotate(get_zoo_name(result),
+                     (result['latency_ms'], result['val_acc']),
+                     fontsize=7)
+    plt.title('Accuracy vs. latency for the model zoo')
+    plt.xlabel('Latency (ms)')
+    plt.ylabel('Validation accuracy')
+
+    plot_path = report_dir.joinpath('model_zoo.png')
+    plt.savefig(str(plot_path))
+    print('[INFO] Saved to {}'.format(plot_path))
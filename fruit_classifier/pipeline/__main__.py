@@ -0,0 +1,198 @@
+import argparse
+from fruit_classifier.models.models import ARCHITECTURES
+from fruit_classifier.pipeline.pipeline_utils import run_pipeline
+from fruit_classifier.pipeline.stages import get_paths
+from fruit_classifier.pipeline.stages import get_stages
+from fruit_classifier.telemetry.telemetry_utils import get_telemetry_path
+
+
+def main(targets=None,
+         force=(),
+         n_workers=None,
+         dry_run=False,
+         scrape=True,
+         categories=('bananas', 'apples', 'oranges'),
+         limit=700,
+         epochs=25,
+         patience=5,
+         architecture='lenet',
+         alpha=1.0,
+         size=28,
+         telemetry=None,
+         workers=1,
+         sync_period=1):
+    """
+    Runs the stages from scraping to the plot of the training
+
+    Stages whose inputs and parameters are unchanged since they last
+    ran are skipped. The stamps of the stages are stored in
+    'generated_data/pipeline'
+
+    Parameters
+    ----------
+    targets : None or array-like
+        The names of the stages to make.
+        If None, all the stages are made
+    force : array-like
+        Names of stages to run even if they are up to date
+    n_workers : None or int
+        The number of stages which may run at the same time.
+        If None, all ready stages run at the same time
+    dry_run : bool
+        Whether to only report which stages would run
+    scrape : bool
+        Whether to scrape the images. If False, the images already in
+        raw_data are used
+    categories : array-like
+        The categories to scrape
+    limit : int
+        The maximum amount of images to scrape for each category
+    epochs : int
+        The number of epochs to train
+    patience : int or None
+        Number of epochs without improvement of the validation loss
+        before stopping early. If None, early stopping is disabled
+    architecture : str
+        The name of the architecture (see models.ARCHITECTURES)
+    alpha : float
+        Width multiplier of the architecture
+    size : int
+        The pixel height and width of the model input
+    telemetry : None or str
+        Destination of the training telemetry.
+        If None, no telemetry is emitted
+    workers : int
+        The number of data-parallel worker processes
+    sync_period : int
+        Number of steps between each averaging of the weights of the
+        workers
+    """
+
+    stages = get_stages(scrape=scrape,
+                        categories=categories,
+                        limit=limit,
+                        epochs=epochs,
+                        patience=patience,
+                        architecture=architecture,
+                        alpha=alpha,
+                        size=size,
+                        telemetry=telemetry,
+                        workers=workers,
+                        sync_period=sync_period)
+
+    statuses = run_pipeline(stages,
+                            get_paths()['stamp_dir'],
+                            targets=targets,
+                            force=force,
+                            n_workers=n_workers,
+                            dry_run=dry_run)
+
+    print('\nResult of the pipeline:')
+    for name, status in statuses.items():
+        print('    {}: {}'.format(name, status))
+
+
+if __name__ == '__main__':
+    # Construct the argument parse and parse the arguments
+    parser = argparse.ArgumentParser(description='Run the pipeline from '
+                                                 'scraping to training')
+    parser.add_argument('targets',
+                        nargs='*',
+                        help='The stages to make (scrape, truncate, '
+                             'clean, preprocess, split, train, plot). '
+                             'Defaults to all the stages')
+    parser.add_argument('-f',
+                        '--force',
+                        nargs='+',
+                        default=(),
+                        help='Stages to run even if they are up to date')
+    parser.add_argument('-j',
+                        '--jobs',
+                        type=int,
+                        required=False,
+                        help='The number of stages which may run at the '
+                             'same time')
+    parser.add_argument('-n',
+                        '--dry-run',
+                        action='store_true',
+                        help='Only report which stages would run')
+    parser.add_argument('--no-scrape',
+                        action='store_true',
+                        help='Use the images already in raw_data instead '
+                             'of scraping')
+    parser.add_argument('-c',
+                        '--categories',
+                        nargs='+',
+                        default=('bananas', 'apples', 'oranges'),
+                        help='Categories to scrape')
+    parser.add_argument('-l',
+                        '--limit',
+                        type=int,
+                        default=700,
+                        help='The maximum amount of images to scrape '
+                             'for each category')
+    parser.add_argument('-e',
+                        '--epochs',
+                        type=int,
+                        default=25,
+                        help='The number of epochs to train')
+    parser.add_argument('-p',
+                        '--patience',
+                        type=int,
+                        default=5,
+                        help='Epochs without improvement of the '
+                             'validation loss before stopping early. '
+                             'Use a negative number to disable')
+    parser.add_argument('-a',
+                        '--architecture',
+                        default='lenet',
+                        choices=sorted(ARCHITECTURES),
+                        help='The model architecture')
+    parser.add_argument('--alpha',
+                        type=float,
+                        default=1.0,
+                        help='Width multiplier of the architecture')
+    parser.add_argument('-s',
+                        '--size',
+                        type=int,
+                        default=28,
+                        help='The pixel height and width of the model '
+                             'input')
+    parser.add_argument('-t',
+                        '--telemetry',
+                        nargs='?',
+                        const=str(get_telemetry_path()),
+                        required=False,
+                        help='Stream training telemetry to a JSON lines '
+                             'file or to udp://host:port')
+    parser.add_argument('-w',
+                        '--workers',
+                        type=int,
+                        default=1,
+                        help='The number of data-parallel worker '
+                             'processes')
+    parser.add_argument('-k',
+                        '--sync-period',
+                        type=int,
+                        default=1,
+                        help='Steps between each averaging of the '
+                             'weights of the workers')
+    args = parser.parse_args()
+
+    patience_ = args.patience if args.patience >= 0 else None
+
+    main(targets=args.targets if args.targets else None,
+         force=args.force,
+         n_workers=args.jobs,
+         dry_run=args.dry_run,
+         scrape=not args.no_scrape,
+         categories=args.categories,
+         limit=args.limit,
+         epochs=args.epochs,
+         patience=patience_,
+         architecture=args.architecture,
+         alpha=args.alpha,
+         size=args.size,
+         telemetry=args.telemetry,
+         workers=args.workers,
+         sync_period=args.sync_period)
@@ -0,0 +1,400 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import wait
+from pathlib import Path
+from fruit_classifier.utils.manifest_utils import update_manifest
+
+
+# Stages running in parallel may read the same directory, and the
+# manifest of a directory must only be updated by one of them at a time
+_MANIFEST_LOCK = threading.Lock()
+
+
+class Stage(object):
+    """
+    A step of the pipeline
+
+    Parameters
+    ----------
+    name : str
+        The name of the stage
+    function : callable
+        Runs the stage. Called without arguments
+    deps : array-like
+        Names of the stages which must run before this stage
+    inputs : array-like
+        Paths (files or directories) the stage reads
+    outputs : array-like
+        Paths (files or directories) the stage writes
+    params : None or dict
+        JSON serializable parameters which change the outputs
+    """
+
+    def __init__(self,
+                 name,
+                 function,
+                 deps=(),
+                 inputs=(),
+                 outputs=(),
+                 params=None):
+        self.name = name
+        self.function = function
+        self.deps = tuple(deps)
+        self.inputs = tuple(Path(path) for path in inputs)
+        self.outputs = tuple(Path(path) for path in outputs)
+        self.params = dict() if params is None else params
+
+
+def get_path_fingerprint(path):
+    """
+    Returns a fingerprint of the content of a file or directory
+
+    Directories are fingerprinted by the paths, labels and hashes in
+    their manifest, which are only recomputed for changed files. Files
+    are fingerprinted by their size and modification time.
+
+    Parameters
+    ----------
+    path : Path
+        The file or directory
+
+    Returns
+    -------
+    fingerprint : None or str
+        The fingerprint. None if the path does not exist
+    """
+
+    path = Path(path)
+
+    if path.is_dir():
+        with _MANIFEST_LOCK:
+            entries = update_manifest(path)
+        sha1 = hashlib.sha1()
+        for entry in entries:
+            sha1.update('{}:{}:{}\n'.format(entry['path'],
+                                            entry['label'],
+                                            entry['sha1']).encode('utf-8'))
+        return sha1.hexdigest()
+
+    if path.is_file():
+        stat = path.stat()
+        return '{}:{}'.format(stat.st_size, stat.st_mtime_ns)
+
+    return None
+
+
+def get_stage_fingerprint(stage):
+    """
+    Returns a fingerprint of everything the outputs of a stage depend on
+
+    Parameters
+    ----------
+    stage : Stage
+        The stage
+
+    Returns
+    -------
+    fingerprint : str
+        The sha1 of the name, the parameters and the input fingerprints
+    """
+
+    description = {'name': stage.name,
+                   'params': stage.params,
+                   'inputs': {str(path): get_path_fingerprint(path)
+                              for path in stage.inputs}}
+    description = json.dumps(description, sort_keys=True, default=str)
+    fingerprint = hashlib.sha1(description.encode('utf-8')).hexdigest()
+
+    return fingerprint
+
+
+def get_stamp_path(stamp_dir, stage):
+    """
+    Returns the path of the stamp of a stage
+
+    Parameters
+    ----------
+    stamp_dir : Path
+        The directory of the stamps
+    stage : Stage
+        The stage
+
+    Returns
+    -------
+    stamp_path : Path
+        The path of the stamp
+    """
+
+    return Path(stamp_dir).joinpath('{}.json'.format(stage.name))
+
+
+def is_up_to_date(stage, stamp_dir):
+    """
+    Checks whether a stage can be skipped
+
+    A stage is up to date if its fingerprint equals the one stored when
+    it last ran, and its outputs are unchanged since then
+
+    Parameters
+    ----------
+    stage : Stage
+        The stage
+    stamp_dir : Path
+        The directory of the stamps
+
+    Returns
+    -------
+    up_to_date : bool
+        Whether the stage can be skipped
+    """
+
+    stamp_path = get_stamp_path(stamp_dir, stage)
+    if not stamp_path.is_file():
+        return False
+
+    with stamp_path.open('r') as f:
+        stamp = json.load(f)
+
+    if stamp.get('fingerprint') != get_stage_fingerprint(stage):
+        return False
+
+    outputs = {str(path): get_path_fingerprint(path)
+               for path in stage.outputs}
+
+    return None not in outputs.values() and stamp.get('outputs') == outputs
+
+
+def write_stamp(stage, stamp_dir, duration=None):
+    """
+    Stores the fingerprint of a stage which has run
+
+    NOTE: The fingerprint is taken after the stage has run, so that
+          stages which modify their inputs in place (e.g. truncating
+          file names) are up to date afterwards
+
+    Parameters
+    ----------
+    stage : Stage
+        The stage
+    stamp_dir : Path
+        The directory of the stamps
+    duration : None or float
+        The number of seconds the stage ran.
+        If None, the duration of the current stamp is kept
+    """
+
+    stamp_path = get_stamp_path(stamp_dir, stage)
+    if duration is None and stamp_path.is_file():
+        with stamp_path.open('r') as f:
+            duration = json.load(f).get('duration')
+
+    stamp = {'fingerprint': get_stage_fingerprint(stage),
+             'outputs': {str(path): get_path_fingerprint(path)
+                         for path in stage.outputs},
+             'params': stage.params,
+             'duration': duration,
+             'time': time.time()}
+
+    if not stamp_path.parent.is_dir():
+        stamp_path.parent.mkdir(parents=True, exist_ok=True)
+
+    tmp_path = stamp_path.with_name(stamp_path.name + '.tmp')
+    with tmp_path.open('w') as f:
+        json.dump(stamp, f, indent=4, default=str)
+    os.replace(str(tmp_path), str(stamp_path))
+
+
+def get_required_stages(stages, targets=None):
+    """
+    Returns the stages needed to make the targets in dependency order
+
+    Parameters
+    ----------
+    stages : list
+        All the stages
+    targets : None or array-like
+        The names of the stages to make.
+        If None, all the stages are made
+
+    Returns
+    -------
+    required : list
+        The required stages, each after its dependencies
+
+    Raises
+    ------
+    ValueError
+        If a stage is unknown or the dependencies contain a cycle
+    """
+
+    by_name = {stage.name: stage for stage in stages}
+    if targets is None:
+        targets = [stage.name for stage in stages]
+
+    required = list()
+    visiting = set()
+    visited = set()
+
+    def visit(name):
+        if name not in by_name:
+            raise ValueError('Unknown stage {}'.format(name))
+        if name in visited:
+            return
+        if name in visiting:
+            raise ValueError('The stages have a cycle through '
+                             '{}'.format(name))
+        visiting.add(name)
+        for dep in by_name[name].deps:
+            visit(dep)
+        visiting.remove(name)
+        visited.add(name)
+        required.append(by_name[name])
+
+    for target in targets:
+        visit(target)
+
+    return required
+
+
+def run_stage(stage, stamp_dir, force=False, dry_run=False):
+    """
+    Runs a stage unless it is up to date
+
+    Parameters
+    ----------
+    stage : Stage
+        The stage
+    stamp_dir : Path
+        The directory of the stamps
+    force : bool
+        Whether to run the stage even if it is up to date
+    dry_run : bool
+        Whether to only report what would run
+
+    Returns
+    -------
+    status : ['skipped'|'ran'|'would run']
+        What happened to the stage
+    """
+
+    if not force and is_up_to_date(stage, stamp_dir):
+        print('[INFO] {} is up to date'.format(stage.name))
+        return 'skipped'
+
+    if dry_run:
+        print('[INFO] {} would run'.format(stage.name))
+        return 'would run'
+
+    print('[INFO] Running {}'.format(stage.name))
+    start = time.perf_counter()
+    stage.function()
+    duration = time.perf_counter() - start
+    write_stamp(stage, stamp_dir, duration)
+    print('[INFO] {} finished in {:.1f} s'.format(stage.name, duration))
+
+    return 'ran'
+
+
+def run_pipeline(stages,
+                 stamp_dir,
+                 targets=None,
+                 force=(),
+                 n_workers=None,
+                 dry_run=False):
+    """
+    Runs the stages in dependency order
+
+    Stages whose dependencies are done run in parallel on a thread pool.
+    A stage is only skipped after all its dependencies are done, so a
+    stage which re-ran with different outputs invalidates the stages
+    depending on it. When all the stages are done, the stamps of the
+    stages which ran are taken again, as a later stage may have
+    modified their outputs in place.
+
+    Parameters
+    ----------
+    stages : list
+        All the stages
+    stamp_dir : Path
+        The directory of the stamps
+    targets : None or array-like
+        The names of the stages to make.
+        If None, all the stages are made
+    force : array-like
+        Names of stages to run even if they are up to date
+    n_workers : None or int
+        The number of stages which may run at the same time.
+        If None, all ready stages run at the same time
+    dry_run : bool
+        Whether to only report what would run. As nothing runs, stages
+        after a stage which would run are reported as up to date or not
+        based on the current outputs
+
+    Returns
+    -------
+    statuses : dict
+        Maps the name of each required stage to 'skipped', 'ran',
+        'would run', 'failed' or 'not run' (a dependency failed)
+
+    Raises
+    ------
+    RuntimeError
+        If a stage failed
+    """
+
+    required = get_required_stages(stages, targets)
+    force = set(force)
+
+    statuses = dict()
+    errors = dict()
+    pending = list(required)
+    running = dict()
+
+    if n_workers is None:
+        n_workers = max(len(required), 1)
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        while pending or running:
+            # Submit every stage whose dependencies are done
+            for stage in list(pending):
+                dep_statuses = [statuses.get(dep) for dep in stage.deps]
+                if any(status in ('failed', 'not run')
+                       for status in dep_statuses):
+                    statuses[stage.name] = 'not run'
+                    pending.remove(stage)
+                elif all(status is not None for status in dep_statuses):
+                    future = executor.submit(run_stage,
+                                             stage,
+                                             stamp_dir,
+                                             stage.name in force,
+                                             dry_run)
+                    running[future] = stage
+                    pending.remove(stage)
+
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    statuses[stage.name] = future.result()
+                except Exception as error:
+                    print('[ERROR] {} failed: {}'.format(stage.name, error))
+                    statuses[stage.name] = 'failed'
+                    errors[stage.name] = error
+
+    for stage in required:
+        if statuses[stage.name] == 'ran':
+            write_stamp(stage, stamp_dir)
+
+    if errors:
+        raise RuntimeError('The stages {} failed'.format(
+            ', '.join(sorted(errors)))) from next(iter(errors.values()))
+
+    return statuses
@@ -0,0 +1,343 @@
+import json
+import pickle
+import numpy as np
+from functools import partial
+from pathlib import Path
+from types import SimpleNamespace
+from fruit_classifier.data_scraping.__main__ import main as scrape_images
+from fruit_classifier.train.__main__ import train
+from fruit_classifier.train.train_utils import get_image_paths_and_labels
+from fruit_classifier.train.train_utils import get_data_and_labels
+from fruit_classifier.train.train_utils import \
+    get_image_hashes_and_splits
+from fruit_classifier.train.train_utils import encode_labels
+from fruit_classifier.train.train_utils import get_manifest_split_indices
+from fruit_classifier.train.train_utils import plot_training
+from fruit_classifier.train.train_utils import save_training_record
+from fruit_classifier.pipeline.pipeline_utils import Stage
+from fruit_classifier.preprocessing.preprocessing_utils import \
+    truncate_filenames
+from fruit_classifier.preprocessing.preprocessing_utils import \
+    remove_non_images
+
+
+def get_paths(generated_data_dir=None):
+    """
+    Returns the paths the stages read and write
+
+    Parameters
+    ----------
+    generated_data_dir : None or Path
+        The directory of the generated data.
+        If None, 'generated_data' in the root of the repository is used
+
+    Returns
+    -------
+    paths : dict
+        Dictionary containing
+        - raw_dir
+        - cleaned_dir
+        - data_path
+        - labels_path
+        - split_path
+        - encoder_path
+        - model_path
+        - history_path
+        - record_path
+        - plot_path
+        - stamp_dir
+    """
+
+    if generated_data_dir is None:
+        generated_data_dir = \
+            Path(__file__).absolute().parents[2].joinpath('generated_data')
+    generated_data_dir = Path(generated_data_dir)
+
+    paths = \
+        {'raw_dir': generated_data_dir.joinpath('raw_data'),
+         'cleaned_dir': generated_data_dir.joinpath('cleaned_data'),
+         'data_path': generated_data_dir.joinpath('preprocessed_data',
+                                                  'data.npy'),
+         'labels_path': generated_data_dir.joinpath('preprocessed_data',
+                                                    'labels.pkl'),
+         'split_path': generated_data_dir.joinpath('splits', 'split.npz'),
+         'encoder_path': generated_data_dir.joinpath('encoders',
+                                                     'encoder.pkl'),
+         'model_path': generated_data_dir.joinpath('models', 'model.h5'),
+         'history_path': generated_data_dir.joinpath('models',
+                                                     'history.json'),
+         'record_path': generated_data_dir.joinpath('models',
+                                                    'trained.json'),
+         'plot_path': generated_data_dir.joinpath('plots',
+                                                  'training_history.png'),
+         'stamp_dir': generated_data_dir.joinpath('pipeline')}
+
+    return paths
+
+
+def preprocess(cleaned_dir, size):
+    """
+    Pre-processes the cleaned images into the memory mapped cache
+
+    Parameters
+    ----------
+    cleaned_dir : Path
+        The directory of the cleaned images
+    size : int
+        The pixel height and width of the pre-processed images
+    """
+
+    # The manifest was brought up to date when cleaned_dir was
+    # fingerprinted, so it is not scanned again
+    image_paths, image_labels = \
+        get_image_paths_and_labels(cleaned_dir, refresh=False)
+    image_hashes, _ = get_image_hashes_and_splits(cleaned_dir, image_paths)
+    get_data_and_labels(image_paths, size, size, image_labels, image_hashes)
+
+
+def split(cleaned_dir, split_path):
+    """
+    Encodes the labels and splits the images in train and validation
+
+    NOTE: The images are in the same order as in preprocess, as both
+          shuffle the manifest of cleaned_dir with a generator seeded
+          the same way. train_on_split checks that the labels agree
+
+    Parameters
+    ----------
+    cleaned_dir : Path
+        The directory of the cleaned images
+    split_path : Path
+        The .npz file to store the encoded labels, the classes, the
+        image hashes and the indices in
+    """
+
+    image_paths, image_labels = \
+        get_image_paths_and_labels(cleaned_dir, refresh=False)
+    image_hashes, image_splits = \
+        get_image_hashes_and_splits(cleaned_dir, image_paths)
+    encoded_labels = encode_labels(np.array(image_labels))
+    train_indices, val_indices = get_manifest_split_indices(image_splits)
+
+    if not split_path.parent.is_dir():
+        split_path.parent.mkdir(parents=True, exist_ok=True)
+
+    with split_path.open('wb') as f:
+        np.savez(f,
+                 labels=encoded_labels,
+                 classes=np.unique(image_labels),
+                 hashes=np.array(image_hashes),
+                 train_indices=train_indices,
+                 val_indices=val_indices)
+    print('[INFO] Saved to {}'.format(split_path))
+
+
+def train_on_split(data_path,
+                   labels_path,
+                   split_path,
+                   history_path,
+                   **train_kwargs):
+    """
+    Trains the model on the pre-processed images and the stored split
+
+    Parameters
+    ----------
+    data_path : Path
+        The memory mapped pre-processed images
+    labels_path : Path
+        The labels of the pre-processed images
+    split_path : Path
+        The encoded labels and the indices of the split
+    history_path : Path
+        The JSON file to store the training history in
+    train_kwargs : dict
+        Keyword arguments passed to train
+    """
+
+    data = np.load(str(data_path), mmap_mode='r')
+    with np.load(str(split_path)) as split_file:
+        encoded_labels = split_file['labels']
+        classes = split_file['classes']
+        image_hashes = split_file['hashes']
+        train_indices = split_file['train_indices']
+        val_indices = split_file['val_indices']
+
+    with labels_path.open('rb') as f:
+        data_labels = pickle.load(f)
+
+    if len(data) != len(encoded_labels):
+        raise ValueError('The pre-processed data has {} images, but the '
+                         'split has {} labels'.format(len(data),
+                                                      len(encoded_labels)))
+    if not np.array_equal(np.asarray(data_labels),
+                          classes[encoded_labels]):
+        raise ValueError('The pre-processed data and the split list the '
+                         'images in different orders')
+
+    history = train(data,
+                    encoded_labels,
+                    train_indices,
+                    val_indices,
+                    **train_kwargs)
+
+    save_training_record(classes, image_hashes[train_indices])
+
+    history_dict = {key: [float(value) for value in values]
+                    for key, values in history.history.items()}
+    with history_path.open('w') as f:
+        json.dump(history_dict, f, indent=4)
+    print('[INFO] Saved to {}'.format(history_path))
+
+
+def plot(history_path):
+    """
+    Plots the stored training history
+
+    Parameters
+    ----------
+    history_path : Path
+        The JSON file with the training history
+    """
+
+    with history_path.open('r') as f:
+        history = SimpleNamespace(history=json.load(f))
+
+    plot_training(history)
+
+
+def get_stages(scrape=True,
+               categories=('bananas', 'apples', 'oranges'),
+               limit=700,
+               epochs=25,
+               patience=5,
+               architecture='lenet',
+               alpha=1.0,
+               size=28,
+               telemetry=None,
+               workers=1,
+               sync_period=1,
+               generated_data_dir=None):
+    """
+    Returns the stages from scraping to the plot of the training
+
+    The stages form the DAG
+        scrape -> truncate -> clean -> preprocess -> train -> plot
+                                    -> split      ->
+    so preprocess and split may run in parallel
+
+    Parameters
+    ----------
+    scrape : bool
+        Whether to scrape the images. If False, the images already in
+        raw_data (e.g. your own dataset) are used
+    categories : array-like
+        The categories to scrape
+    limit : int
+        The maximum amount of images to scrape for each category
+    epochs : int
+        The number of epochs to train
+    patience : int or None
+        Number of epochs without improvement of the validation loss
+        before stopping early. If None, early stopping is disabled
+    architecture : str
+        The name of the architecture (see models.ARCHITECTURES)
+    alpha : float
+        Width multiplier of the architecture
+    size : int
+        The pixel height and width of the model input
+    telemetry : None or str
+        Destination of the training telemetry.
+        It does not change the model, so it is not part of the
+        fingerprint of the train stage
+    workers : int
+        The number of data-parallel worker processes
+    sync_period : int
+        Number of steps between each averaging of the weights of the
+        workers
+    generated_data_dir : None or Path
+        The directory of the generated data.
+        If None, 'generated_data' in the root of the repository is used
+
+    Returns
+    -------
+    stages : list
+        The stages
+    """
+
+    paths = get_paths(generated_data_dir)
+
+    stages = list()
+
+    if scrape:
+        stages.append(
+            Stage('scrape',
+                  partial(scrape_images, categories, limit),
+                  outputs=(paths['raw_dir'],),
+                  params={'categories': sorted(categories),
+                          'limit': limit}))
+
+    # NOTE: truncate renames files in place, so it is fingerprinted by
+    #       raw_data after the renaming
+    stages.append(
+        Stage('truncate',
+              partial(truncate_filenames, paths['raw_dir']),
+              deps=('scrape',) if scrape else (),
+              inputs=(paths['raw_dir'],)))
+    stages.append(
+        Stage('clean',
+              partial(remove_non_images,
+                      paths['raw_dir'],
+                      paths['cleaned_dir']),
+              deps=('truncate',),
+              inputs=(paths['raw_dir'],),
+              outputs=(paths['cleaned_dir'],)))
+    stages.append(
+        Stage('preprocess',
+              partial(preprocess, paths['cleaned_dir'], size),
+              deps=('clean',),
+              inputs=(paths['cleaned_dir'],),
+              outputs=(paths['data_path'], paths['labels_path']),
+              params={'size': size}))
+    stages.append(
+        Stage('split',
+              partial(split, paths['cleaned_dir'], paths['split_path']),
+              deps=('clean',),
+              inputs=(paths['cleaned_dir'],),
+              outputs=(paths['split_path'], paths['encoder_path'])))
+    stages.append(
+        Stage('train',
+              partial(train_on_split,
+                      paths['data_path'],
+                      paths['labels_path'],
+                      paths['split_path'],
+                      paths['history_path'],
+                      epochs=epochs,
+                      patience=patience,
+                      architecture=architecture,
+                      alpha=alpha,
+                      size=size,
+                      telemetry=telemetry,
+                      workers=workers,
+                      sync_period=sync_period),
+              deps=('preprocess', 'split'),
+              inputs=(paths['data_path'],
+                      paths['labels_path'],
+                      paths['split_path']),
+              outputs=(paths['model_path'],
+                       paths['history_path'],
+                       paths['record_path']),
+              params={'epochs': epochs,
+                      'patience': patience,
+                      'architecture': architecture,
+                      'alpha': alpha,
+                      'size': size,
+                      'workers': workers,
+                      'sync_period': sync_period}))
+    stages.append(
+        Stage('plot',
+              partial(plot, paths['history_path']),
+              deps=('train',),
+              inputs=(paths['history_path'],),
+              outputs=(paths['plot_path'],)))
+
+    return stages
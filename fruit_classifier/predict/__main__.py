@@ -1,16 +1,32 @@
 import argparse
+import csv
 import cv2
 import numpy as np
 from pathlib import Path
+from tqdm import tqdm
 from fruit_classifier.predict.predict_utils import draw_class_on_image
 from fruit_classifier.predict.predict_utils import classify
 from fruit_classifier.predict.predict_utils import load_classifier
+from fruit_classifier.cascade.cascade_utils import load_cascade
+from fruit_classifier.execution.execution_utils import configure_session
+from fruit_classifier.predict.localization_utils import localize
+from fruit_classifier.predict.video_utils import FrameReader
+from fruit_classifier.predict.video_utils import classify_frames
+from fruit_classifier.predict.video_utils import get_segments
+from fruit_classifier.predict.video_utils import annotate_frame
+from fruit_classifier.records.record_utils import iterate_batches
 from fruit_classifier.utils.image_utils import open_image
+from fruit_classifier.utils.image_utils import decode_image
 from fruit_classifier.preprocessing.preprocessing_utils import \
     preprocess_image
 
 
-def main(image_path, show_image=False):
+def main(image_path,
+         show_image=False,
+         execution_profile=None,
+         model_path=None,
+         localize_fruits=False,
+         cascade=False):
     """
     Predict the class of an image
 
@@ -20,6 +36,18 @@ def main(image_path, show_image=False):
         The image path as a string
     show_image : bool
         Whether or not to use cv2.imshow to display the image
+    execution_profile : None or dict
+        The thread settings to use.
+        If None, the stored execution profile is used
+    model_path : None or Path
+        Path to the model.
+        If None, 'generated_data/models/model.h5' is used
+    localize_fruits : bool
+        Whether to also localize the fruits with sliding windows and
+        draw their boxes
+    cascade : bool
+        Whether to classify with the calibrated cascade instead of
+        model_path
 
     Returns
     -------
@@ -31,40 +59,347 @@ def main(image_path, show_image=False):
     image = open_image(Path(image_path))
     orig = image.copy()
 
+    # Load the trained convolutional neural network
+    configure_session(execution_profile)
+    fallback_model = None
+    threshold = None
+    if cascade:
+        model, fallback_model, threshold = load_cascade()
+    else:
+        model = load_classifier(model_path)
+
     # Pre-process the image for classification
-    image = preprocess_image(image)
+    height, width = model.input_shape[1:3]
+    image = preprocess_image(image, height, width)
     # Expand the dimension (i.e. make the batch size = 1)
     image = np.expand_dims(image, axis=0)
 
-    # Load the trained convolutional neural network
-    model = load_classifier()
-
     # Classify the input image
-    labels, probabilities = classify(model, image)
+    labels, probabilities = classify(model,
+                                     image,
+                                     fallback_model,
+                                     threshold)
     label = labels[0]
     probability = np.max(probabilities[0])
 
     probability_text = '{}: {:.2f}%'.format(label, probability * 100)
 
+    boxes = None
+    heatmap = None
+    if localize_fruits:
+        boxes, heatmap = localize(model, orig)
+        print('[INFO] Found {} fruits'.format(len(boxes)))
+
     # Draw the label on the image
-    output = draw_class_on_image(orig, probability_text)
+    output = draw_class_on_image(orig, probability_text, boxes)
 
     if show_image:
         # Show the output image
         cv2.imshow('Output', output)
+        if heatmap is not None:
+            # Show the confidence of the most likely label of each cell
+            confidence = np.max(heatmap, axis=2)
+            confidence = cv2.resize((confidence * 255).astype(np.uint8),
+                                    (output.shape[1], output.shape[0]),
+                                    interpolation=cv2.INTER_NEAREST)
+            cv2.imshow('Heatmap',
+                       cv2.applyColorMap(confidence, cv2.COLORMAP_JET))
         cv2.waitKey(0)
 
     return output
 
 
+def predict_records(shard_dir,
+                    output_path=None,
+                    batch_size=64,
+                    execution_profile=None,
+                    model_path=None,
+                    cascade=False):
+    """
+    Predicts the class of every image in the record shards
+
+    The shards are streamed sequentially and classified in batches.
+    The predictions are stored as a csv file.
+
+    Parameters
+    ----------
+    shard_dir : Path
+        The directory containing the shards
+    output_path : None or Path
+        Path to store the predictions.
+        If None, 'generated_data/predictions/records.csv' is used
+    batch_size : int
+        The number of images classified at a time
+    execution_profile : None or dict
+        The thread settings to use.
+        If None, the stored execution profile is used
+    model_path : None or Path
+        Path to the model.
+        If None, 'generated_data/models/model.h5' is used
+    cascade : bool
+        Whether to classify with the calibrated cascade instead of
+        model_path. Only the uncertain images of each batch are
+        escalated to the fallback model
+
+    Returns
+    -------
+    rows : list
+        List of dicts containing
+        - path
+        - label (as stored in the shard)
+        - prediction
+        - probability
+    """
+
+    if output_path is None:
+        output_path = \
+            Path(__file__).absolute().parents[2].joinpath(
+                'generated_data', 'predictions', 'records.csv')
+    output_path = Path(output_path)
+
+    configure_session(execution_profile)
+    fallback_model = None
+    threshold = None
+    if cascade:
+        model, fallback_model, threshold = load_cascade()
+    else:
+        model = load_classifier(model_path)
+    height, width = model.input_shape[1:3]
+
+    rows = list()
+    for labels, paths, data in tqdm(iterate_batches(shard_dir,
+                                                    batch_size=batch_size,
+                                                    shuffle=False),
+                                    desc='Classifying batches'):
+        images = np.array([preprocess_image(decode_image(d), height, width)
+                           for d in data])
+        predictions, probabilities = classify(model,
+                                              images,
+                                              fallback_model,
+                                              threshold)
+
+        for path, label, prediction, probability in \
+                zip(paths, labels, predictions, probabilities):
+            rows.append({'path': path,
+                         'label': label,
+                         'prediction': prediction,
+                         'probability': float(np.max(probability))})
+
+    if not output_path.parent.is_dir():
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    with output_path.open('w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=('path',
+                                               'label',
+                                               'prediction',
+                                               'probability'))
+        writer.writeheader()
+        writer.writerows(rows)
+    print('[INFO] Saved to {}'.format(output_path))
+
+    return rows
+
+
+def predict_video(video_path,
+                  output_path=None,
+                  stride=1,
+                  diff_threshold=None,
+                  segments=False,
+                  video_output_path=None,
+                  batch_size=32,
+                  execution_profile=None,
+                  model_path=None,
+                  cascade=False):
+    """
+    Predicts the class of the frames of a video
+
+    The frames are decoded and pre-processed on a background thread
+    and classified in batches. The predictions are stored as a csv
+    file, either per frame or per segment of frames with the same
+    label.
+
+    Parameters
+    ----------
+    video_path : Path
+        The path to the video
+    output_path : None or Path
+        Path to store the predictions.
+        If None, 'generated_data/predictions/<video name>.csv' is used
+    stride : int
+        Only every stride'th frame is classified
+    diff_threshold : None or float
+        Frames differing less than this (mean absolute pixel difference
+        from 0 to 255) from the last classified frame get its label
+        instead of being classified. If None, all frames are classified
+    segments : bool
+        Whether to store segments instead of single frames
+    video_output_path : None or Path
+        Path to store the annotated video.
+        If None, no video is stored
+    batch_size : int
+        The number of frames classified at a time
+    execution_profile : None or dict
+        The thread settings to use.
+        If None, the stored execution profile is used
+    model_path : None or Path
+        Path to the model.
+        If None, 'generated_data/models/model.h5' is used
+    cascade : bool
+        Whether to classify with the calibrated cascade instead of
+        model_path. Only the uncertain frames of each batch are
+        escalated to the fallback model
+
+    Returns
+    -------
+    rows : list
+        The frame rows (see classify_frames) or the segments
+        (see get_segments)
+    """
+
+    video_path = Path(video_path)
+    if output_path is None:
+        output_path = \
+            Path(__file__).absolute().parents[2].joinpath(
+                'generated_data',
+                'predictions',
+                '{}.csv'.format(video_path.stem))
+    output_path = Path(output_path)
+
+    configure_session(execution_profile)
+    fallback_model = None
+    threshold = None
+    if cascade:
+        model, fallback_model, threshold = load_cascade()
+    else:
+        model = load_classifier(model_path)
+    height, width = model.input_shape[1:3]
+
+    rows = list()
+    writer = None
+    with FrameReader(video_path,
+                     height,
+                     width,
+                     stride=stride,
+                     diff_threshold=diff_threshold,
+                     keep_frames=video_output_path is not None) as reader:
+        if video_output_path is not None:
+            writer = cv2.VideoWriter(str(video_output_path),
+                                     cv2.VideoWriter_fourcc(*'mp4v'),
+                                     reader.fps / stride,
+                                     reader.frame_size)
+
+        results = classify_frames(model,
+                                  reader,
+                                  batch_size=batch_size,
+                                  fallback_model=fallback_model,
+                                  threshold=threshold)
+        for row, frame in tqdm(results,
+                               total=reader.frame_count // stride,
+                               desc='Classifying frames'):
+            row['time'] = row['frame'] / reader.fps
+            rows.append(row)
+            if writer is not None:
+                writer.write(annotate_frame(frame, row))
+        fps = reader.fps
+
+    if writer is not None:
+        writer.release()
+        print('[INFO] Saved to {}'.format(video_output_path))
+
+    n_duplicates = sum(row['duplicate'] for row in rows)
+    print('[INFO] Classified {} of {} sampled frames, {} were '
+          'duplicates'.format(len(rows) - n_duplicates,
+                              len(rows),
+                              n_duplicates))
+
+    if segments:
+        rows = get_segments(rows, fps)
+        fieldnames = ('label', 'start_frame', 'end_frame', 'start_time',
+                      'end_time', 'probability')
+    else:
+        fieldnames = ('frame', 'time', 'label', 'probability', 'duplicate')
+
+    if not output_path.parent.is_dir():
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    with output_path.open('w', newline='') as f:
+        csv_writer = csv.DictWriter(f, fieldnames=fieldnames)
+        csv_writer.writeheader()
+        csv_writer.writerows(rows)
+    print('[INFO] Saved to {}'.format(output_path))
+
+    return rows
+
+
 if __name__ == '__main__':
     # Construct the argument parse and parse the arguments
     parser = argparse.ArgumentParser(description='Predict the class '
                                                  'of an image')
-    parser.add_argument('-i',
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('-i',
                         '--image',
-                        required=True,
                         help='Path to input image')
+    source.add_argument('-r',
+                        '--records',
+                        help='Path to a directory of record shards to '
+                             'classify in batches')
+    source.add_argument('-v',
+                        '--video',
+                        help='Path to a video to classify frame by frame')
+    parser.add_argument('-m',
+                        '--model',
+                        required=False,
+                        help='Path to the model. Defaults to '
+                             'generated_data/models/model.h5')
+    parser.add_argument('-c',
+                        '--cascade',
+                        action='store_true',
+                        help='Classify with the cascade calibrated by '
+                             'python -m fruit_classifier.cascade instead '
+                             'of a single model')
+    parser.add_argument('-l',
+                        '--localize',
+                        action='store_true',
+                        help='Localize the fruits of the image with '
+                             'sliding windows')
+    parser.add_argument('-s',
+                        '--stride',
+                        type=int,
+                        default=1,
+                        help='Only classify every n-th frame of the video')
+    parser.add_argument('-d',
+                        '--diff-threshold',
+                        type=float,
+                        required=False,
+                        help='Give frames which differ less than this '
+                             '(mean absolute pixel difference from 0 to '
+                             '255) from the last classified frame its '
+                             'label instead of classifying them')
+    parser.add_argument('--segments',
+                        action='store_true',
+                        help='Store the labels of the video per segment '
+                             'instead of per frame')
+    parser.add_argument('-o',
+                        '--output-video',
+                        required=False,
+                        help='Path to store the annotated video')
     args = parser.parse_args()
 
-    main(args.image, show_image=True)
+    if args.records is not None:
+        predict_records(args.records,
+                        model_path=args.model,
+                        cascade=args.cascade)
+    elif args.video is not None:
+        predict_video(args.video,
+                      stride=args.stride,
+                      diff_threshold=args.diff_threshold,
+                      segments=args.segments,
+                      video_output_path=args.output_video,
+                      model_path=args.model,
+                      cascade=args.cascade)
+    else:
+        main(args.image,
+             show_image=True,
+             model_path=args.model,
+             localize_fruits=args.localize,
+             cascade=args.cascade)
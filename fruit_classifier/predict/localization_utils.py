@@ -0,0 +1,257 @@
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from fruit_classifier.predict.predict_utils import classify
+from fruit_classifier.preprocessing.preprocessing_utils import \
+    preprocess_image
+
+
+def get_window_views(image, height, width, step_y, step_x):
+    """
+    Returns all the windows of an image as a strided view
+
+    No window is copied: the windows share the memory of the image
+
+    Parameters
+    ----------
+    image : np.array, shape (image_height, image_width, channels)
+        The image to tile
+    height : int
+        The pixel height of the windows
+    width : int
+        The pixel width of the windows
+    step_y : int
+        The number of pixels between the rows of windows
+    step_x : int
+        The number of pixels between the columns of windows
+
+    Returns
+    -------
+    windows : np.array, shape (n_rows, n_cols, height, width, channels)
+        The read-only view of the windows
+    """
+
+    image_height, image_width, channels = image.shape
+    n_rows = (image_height - height) // step_y + 1
+    n_cols = (image_width - width) // step_x + 1
+
+    stride_y, stride_x, stride_c = image.strides
+    windows = as_strided(image,
+                         shape=(n_rows, n_cols, height, width, channels),
+                         strides=(stride_y * step_y,
+                                  stride_x * step_x,
+                                  stride_y,
+                                  stride_x,
+                                  stride_c),
+                         writeable=False)
+
+    return windows
+
+
+def get_windows(image, height, width, scale, overlap=0.5):
+    """
+    Tiles the image into overlapping windows at one scale
+
+    The windows cover scale times the shortest side of the image.
+    Instead of resizing every crop, the whole image is pre-processed
+    once at the size where the windows match the model input, and the
+    windows are taken as views of the pre-processed image.
+
+    Parameters
+    ----------
+    image : np.array, shape (image_height, image_width, channels)
+        The image as opened by open_image
+    height : int
+        The pixel height of the model input
+    width : int
+        The pixel width of the model input
+    scale : float
+        The size of the windows relative to the shortest image side
+    overlap : float
+        The fraction of a window overlapping with its neighbour
+
+    Returns
+    -------
+    windows : np.array, shape (n_windows, height, width, channels)
+        The pre-processed windows
+    boxes : np.array, shape (n_windows, 4)
+        The windows as (x1, y1, x2, y2) in the original image
+    """
+
+    image_height, image_width = image.shape[:2]
+    window_height = min(image_height, image_width) * scale
+    window_width = window_height * width / height
+    if window_height > image_height or window_width > image_width:
+        return np.empty((0, height, width, image.shape[2])), \
+            np.empty((0, 4))
+
+    factor_y = height / window_height
+    factor_x = width / window_width
+    preprocessed = \
+        preprocess_image(image,
+                         max(height, int(round(image_height * factor_y))),
+                         max(width, int(round(image_width * factor_x))))
+    preprocessed = preprocessed.astype(np.float32)
+
+    step_y = max(1, int(height * (1 - overlap)))
+    step_x = max(1, int(width * (1 - overlap)))
+    views = get_window_views(preprocessed, height, width, step_y, step_x)
+    n_rows, n_cols = views.shape[:2]
+
+    # NOTE: The reshape makes the single copy of all the windows,
+    #       which is the batch given to the model
+    windows = views.reshape(-1, height, width, views.shape[-1])
+
+    y1 = np.repeat(np.arange(n_rows) * step_y / factor_y, n_cols)
+    x1 = np.tile(np.arange(n_cols) * step_x / factor_x, n_rows)
+    boxes = np.stack((x1,
+                      y1,
+                      x1 + window_width,
+                      y1 + window_height), axis=1)
+
+    return windows, boxes
+
+
+def non_max_suppression(boxes, scores, iou_threshold=0.3):
+    """
+    Removes boxes overlapping a box with a higher score
+
+    Parameters
+    ----------
+    boxes : np.array, shape (n_boxes, 4)
+        The boxes as (x1, y1, x2, y2)
+    scores : np.array, shape (n_boxes,)
+        The scores of the boxes
+    iou_threshold : float
+        The intersection over union above which a box is removed
+
+    Returns
+    -------
+    keep : np.array, shape (n_kept,)
+        The indices of the kept boxes, ordered by decreasing score
+    """
+
+    x1, y1, x2, y2 = boxes.T
+    areas = (x2 - x1) * (y2 - y1)
+    order = np.argsort(scores)[::-1]
+
+    keep = list()
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+
+        width = np.maximum(0, np.minimum(x2[i], x2[rest]) -
+                           np.maximum(x1[i], x1[rest]))
+        height = np.maximum(0, np.minimum(y2[i], y2[rest]) -
+                            np.maximum(y1[i], y1[rest]))
+        intersection = width * height
+        iou = intersection / (areas[i] + areas[rest] - intersection)
+
+        order = rest[iou <= iou_threshold]
+
+    return np.array(keep, dtype=int)
+
+
+def localize(model,
+             image,
+             scales=(1.0, 0.5, 0.25),
+             overlap=0.5,
+             threshold=0.8,
+             iou_threshold=0.3,
+             batch_size=256,
+             heatmap_cell=8):
+    """
+    Localizes the fruits of an image with sliding windows
+
+    The image is tiled into overlapping windows at several scales.
+    The windows of all the scales are classified in large batches.
+
+    Parameters
+    ----------
+    model : Sequential
+        The model to predict from
+    image : np.array, shape (image_height, image_width, channels)
+        The image as opened by open_image
+    scales : array-like
+        The window sizes relative to the shortest image side
+    overlap : float
+        The fraction of a window overlapping with its neighbour
+    threshold : float
+        The probability a window needs to become a box
+    iou_threshold : float
+        The intersection over union above which boxes of the same
+        label are suppressed
+    batch_size : int
+        The number of windows classified at a time
+    heatmap_cell : int
+        The number of image pixels per heatmap pixel
+
+    Returns
+    -------
+    boxes : list
+        List of dicts containing
+        - box (x1, y1, x2, y2 in pixels of the original image)
+        - label
+        - probability
+    heatmap : np.array, shape (heatmap_height, heatmap_width, n_classes)
+        The mean class probabilities of the windows covering each cell.
+        Cells not covered by any window are zero
+    """
+
+    height, width = model.input_shape[1:3]
+
+    windows = list()
+    window_boxes = list()
+    for scale in scales:
+        scale_windows, scale_boxes = get_windows(image,
+                                                 height,
+                                                 width,
+                                                 scale,
+                                                 overlap)
+        windows.append(scale_windows)
+        window_boxes.append(scale_boxes)
+    windows = np.concatenate(windows)
+    window_boxes = np.concatenate(window_boxes)
+
+    labels = list()
+    probabilities = list()
+    for start in range(0, len(windows), batch_size):
+        batch_labels, batch_probabilities = \
+            classify(model, windows[start:start + batch_size])
+        labels.append(batch_labels)
+        probabilities.append(batch_probabilities)
+    labels = np.concatenate(labels)
+    probabilities = np.concatenate(probabilities)
+
+    # Average the probabilities of the windows covering each cell
+    image_height, image_width = image.shape[:2]
+    heatmap_shape = (int(np.ceil(image_height / heatmap_cell)),
+                     int(np.ceil(image_width / heatmap_cell)))
+    heatmap = np.zeros(heatmap_shape + (probabilities.shape[1],))
+    counts = np.zeros(heatmap_shape + (1,))
+    cells = np.round(window_boxes / heatmap_cell).astype(int)
+    for (x1, y1, x2, y2), probability in zip(cells, probabilities):
+        heatmap[y1:y2, x1:x2] += probability
+        counts[y1:y2, x1:x2] += 1
+    heatmap = np.divide(heatmap,
+                        counts,
+                        out=np.zeros_like(heatmap),
+                        where=counts > 0)
+
+    scores = np.max(probabilities, axis=1)
+    boxes = list()
+    for label in np.unique(labels):
+        candidates = np.flatnonzero((labels == label) &
+                                    (scores >= threshold))
+        keep = non_max_suppression(window_boxes[candidates],
+                                   scores[candidates],
+                                   iou_threshold)
+        for i in candidates[keep]:
+            boxes.append({'box': tuple(int(round(v))
+                                       for v in window_boxes[i]),
+                          'label': label,
+                          'probability': float(scores[i])})
+
+    boxes.sort(key=lambda b: b['probability'], reverse=True)
+
+    return boxes, heatmap
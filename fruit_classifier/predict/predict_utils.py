@@ -4,9 +4,15 @@ import numpy as np
 from pathlib import Path
 from keras.engine.saving import load_model
 from skimage.transform import resize
+from fruit_classifier.models.layers import CUSTOM_OBJECTS
+from fruit_classifier.serving.serving_utils import check_not_serving
 
 
-def draw_class_on_image(image, probability_text):
+# The label encoder read by load_label_encoder and its modification time
+_ENCODER_CACHE = dict()
+
+
+def draw_class_on_image(image, probability_text, boxes=None):
     """
     Draws the class and confidence on the image
 
@@ -16,6 +22,12 @@ def draw_class_on_image(image, probability_text):
         The image to draw on
     probability_text : str
         The text to print
+    boxes : None or list
+        Boxes to draw as dicts containing
+        - box (x1, y1, x2, y2 in pixels of image)
+        - label
+        - probability
+        If None, no boxes are drawn
 
     Returns
     -------
@@ -39,19 +51,42 @@ def draw_class_on_image(image, probability_text):
                 (0, 255, 0),
                 2)
 
+    if boxes is not None:
+        # The boxes are given in pixels of the original image
+        scale = width / orig_shape[0]
+        for box in boxes:
+            x1, y1, x2, y2 = (int(round(v * scale)) for v in box['box'])
+            cv2.rectangle(output_image, (x1, y1), (x2, y2), (0, 255, 0), 2)
+            cv2.putText(output_image,
+                        '{}: {:.0f}%'.format(box['label'],
+                                             box['probability'] * 100),
+                        (x1 + 5, y1 + 20),
+                        cv2.FONT_HERSHEY_SIMPLEX,
+                        0.5,
+                        (0, 255, 0),
+                        1)
+
     return output_image
 
 
-def classify(model, images):
+def classify(model, images, fallback_model=None, threshold=0.9):
     """
     Classifies a single image and returns the label and probability
 
+    If a fallback model is given, the model is the first stage of a
+    cascade (see cascade_predict)
+
     Parameters
     ----------
     model : Sequential
         The model to predict from
     images : np.array (examples,  height, width, channels)
         The images to predict
+    fallback_model : None or Sequential
+        The larger model which classifies the images the model is not
+        confident about. If None, the model classifies all the images
+    threshold : float
+        The confidence below which images are given to fallback_model
 
     Returns
     -------
@@ -61,38 +96,127 @@ def classify(model, images):
         The probabilities of all the classes according to the label
         encoder
     """
-    probabilities = model.predict(images)
+    probabilities, _ = cascade_predict(model,
+                                       images,
+                                       fallback_model,
+                                       threshold)
     labels = np.argmax(probabilities, axis=1)
 
-    # Load the label encoder
-    encoder_dir = \
-        Path(__file__).absolute().parents[2].joinpath('generated_data',
-                                                      'encoders')
-    encoder_path = encoder_dir.joinpath('encoder.pkl')
-
-    with encoder_path.open('rb') as f:
-        label_encoder = pickle.load(f)
-
+    label_encoder = load_label_encoder()
     labels = label_encoder.inverse_transform(labels)
 
     return labels, probabilities
 
 
-def load_classifier():
+def cascade_predict(model,
+                    images,
+                    fallback_model=None,
+                    threshold=0.9,
+                    batch_size=32):
+    """
+    Predicts with a cheap model first and escalates uncertain images
+
+    Every image is classified by model. The images whose highest
+    probability is below threshold are classified again by
+    fallback_model, in one batched call for all of them
+
+    Parameters
+    ----------
+    model : Sequential
+        The cheap first-stage model
+    images : np.array (examples,  height, width, channels)
+        The images to predict
+    fallback_model : None or Sequential
+        The larger second-stage model.
+        If None, nothing is escalated
+    threshold : float
+        The confidence below which images are escalated
+    batch_size : int
+        The batch size of both models
+
+    Returns
+    -------
+    probabilities : np.array, shape (examples, n_classes)
+        The probabilities of the stage which classified each image
+    escalated : np.array, shape (examples,)
+        Whether each image was classified by fallback_model
+    """
+    probabilities = model.predict(images, batch_size=batch_size)
+    escalated = np.zeros(len(images), dtype=bool)
+
+    if fallback_model is not None:
+        escalated = np.max(probabilities, axis=1) < threshold
+        if np.any(escalated):
+            probabilities[escalated] = \
+                fallback_model.predict(images[escalated],
+                                       batch_size=batch_size)
+
+    return probabilities, escalated
+
+
+def load_label_encoder():
+    """
+    Loads the label encoder stored during training
+
+    The encoder is cached, and only read again if the file has changed,
+    so that classifying many batches does not read it for every batch
+
+    Returns
+    -------
+    label_encoder : LabelEncoder
+        The label encoder
+    """
+
+    encoder_path = \
+        Path(__file__).absolute().parents[2].joinpath('generated_data',
+                                                      'encoders',
+                                                      'encoder.pkl')
+
+    mtime = encoder_path.stat().st_mtime
+    if _ENCODER_CACHE.get('mtime') != mtime:
+        with encoder_path.open('rb') as f:
+            _ENCODER_CACHE['label_encoder'] = pickle.load(f)
+        _ENCODER_CACHE['mtime'] = mtime
+
+    return _ENCODER_CACHE['label_encoder']
+
+
+def load_classifier(model_path=None, serving=False):
     """
     Loads the classifier
 
+    The model is loaded into the current Keras session, see
+    configure_session
+
+    Parameters
+    ----------
+    model_path : None or Path
+        Path to the model.
+        If None, 'generated_data/models/model.h5' is used
+    serving : bool
+        Whether the caller accepts models exported by
+        python -m fruit_classifier.serving, which take raw uint8 images
+        instead of the output of preprocess_image
+
     Returns
     -------
     model : Sequential
         The model to classify from
+
+    Raises
+    ------
+    ValueError
+        If the model is a serving model and serving is False
     """
 
     print('[INFO] loading network...')
-    model_dir = \
-        Path(__file__).absolute().parents[2].joinpath('generated_data',
-                                                      'models')
-    model_path = model_dir.joinpath('model.h5')
-    model = load_model(str(model_path))
+    if model_path is None:
+        model_path = \
+            Path(__file__).absolute().parents[2].joinpath(
+                'generated_data', 'models', 'model.h5')
+    # NOTE: The custom layers are needed to load serving models
+    model = load_model(str(model_path), custom_objects=CUSTOM_OBJECTS)
+    if not serving:
+        check_not_serving(model, model_path)
 
     return model
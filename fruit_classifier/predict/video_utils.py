@@ -0,0 +1,368 @@
+import queue
+import threading
+import cv2
+import numpy as np
+from fruit_classifier.predict.predict_utils import classify
+from fruit_classifier.preprocessing.preprocessing_utils import \
+    preprocess_image
+
+
+def get_frame_difference(frame, reference):
+    """
+    Returns a cheap measure of how much two frames differ
+
+    The frames are compared as small grayscale thumbnails, so that
+    noise and small movements do not count
+
+    Parameters
+    ----------
+    frame : np.array, shape (32, 32)
+        The thumbnail of the frame (see get_frame_thumbnail)
+    reference : np.array, shape (32, 32)
+        The thumbnail of the frame to compare with
+
+    Returns
+    -------
+    difference : float
+        The mean absolute difference of the pixels (0 to 255)
+    """
+
+    difference = float(np.mean(cv2.absdiff(frame, reference)))
+
+    return difference
+
+
+def get_frame_thumbnail(frame):
+    """
+    Returns the small grayscale thumbnail used for frame differencing
+
+    Parameters
+    ----------
+    frame : np.array, shape (height, width, 3)
+        The frame as read by cv2.VideoCapture
+
+    Returns
+    -------
+    thumbnail : np.array, shape (32, 32)
+        The thumbnail
+    """
+
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    thumbnail = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA)
+
+    return thumbnail
+
+
+class FrameReader(object):
+    """
+    Decodes and pre-processes video frames on a background thread
+
+    Only every stride'th frame is decoded; the frames in between are
+    grabbed without being decoded. A sampled frame which differs less
+    than diff_threshold from the last new frame is marked as a
+    duplicate, and is not pre-processed.
+
+    Parameters
+    ----------
+    video_path : Path
+        The path to the video
+    height : int
+        The pixel height of the pre-processed frames
+    width : int
+        The pixel width of the pre-processed frames
+    stride : int
+        Number of frames between each sampled frame
+    diff_threshold : None or float
+        The mean absolute pixel difference (0 to 255) below which a
+        frame is a duplicate. If None, no frames are duplicates
+    keep_frames : bool
+        Whether to pass on the decoded frames (e.g. for annotation)
+    queue_size : int
+        The maximum number of frames decoded ahead
+    """
+
+    def __init__(self,
+                 video_path,
+                 height=28,
+                 width=28,
+                 stride=1,
+                 diff_threshold=None,
+                 keep_frames=False,
+                 queue_size=128):
+        self.capture = cv2.VideoCapture(str(video_path))
+        if not self.capture.isOpened():
+            raise IOError('Could not open {}'.format(video_path))
+
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or 25.0
+        self.frame_count = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.frame_size = \
+            (int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+             int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+
+        self.height = height
+        self.width = width
+        self.stride = stride
+        self.diff_threshold = diff_threshold
+        self.keep_frames = keep_frames
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stopped = threading.Event()
+        self.error = None
+        self.thread = threading.Thread(target=self._read, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        # Empty the queue so that a blocked reader can finish
+        while self.thread.is_alive():
+            try:
+                self.queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self.capture.release()
+
+    def __iter__(self):
+        """
+        Yields the sampled frames in order
+
+        Yields
+        ------
+        frame_index : int
+            The index of the frame in the video
+        image : None or np.array, shape (height, width, channels)
+            The pre-processed frame. None if the frame is a duplicate
+        frame : None or np.array, shape (frame_height, frame_width, 3)
+            The decoded frame if keep_frames is True
+        """
+
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            yield item
+
+        if self.error is not None:
+            raise self.error
+
+    def _put(self, item):
+        """
+        Puts an item on the queue unless the reader is stopped
+
+        Parameters
+        ----------
+        item : None or tuple
+            The item to put
+
+        Returns
+        -------
+        put : bool
+            False if the reader was stopped
+        """
+
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+
+        return False
+
+    def _read(self):
+        """
+        Reads the frames until the end of the video
+        """
+
+        reference = None
+        frame_index = -1
+        try:
+            while not self.stopped.is_set():
+                # NOTE: grab() only demuxes the frame, the decoding is
+                #       done by retrieve(), so skipped frames are cheap
+                if not self.capture.grab():
+                    break
+                frame_index += 1
+                if frame_index % self.stride != 0:
+                    continue
+
+                ok, frame = self.capture.retrieve()
+                if not ok:
+                    break
+
+                image = None
+                thumbnail = get_frame_thumbnail(frame)
+                if self.diff_threshold is None or reference is None or \
+                        get_frame_difference(thumbnail, reference) >= \
+                        self.diff_threshold:
+                    reference = thumbnail
+                    image = preprocess_image(frame.astype(np.float32),
+                                             self.height,
+                                             self.width)
+
+                if not self._put((frame_index,
+                                  image,
+                                  frame if self.keep_frames else None)):
+                    return
+        except Exception as error:
+            self.error = error
+
+        self._put(None)
+
+
+def classify_frames(model,
+                    frames,
+                    batch_size=32,
+                    fallback_model=None,
+                    threshold=0.9):
+    """
+    Classifies the frames of a FrameReader in batches
+
+    Duplicate frames get the label of the last new frame before them
+
+    Parameters
+    ----------
+    model : Sequential
+        The model to predict from
+    frames : iterable
+        Yields (frame_index, image, frame) as FrameReader does
+    batch_size : int
+        The number of new frames classified at a time
+    fallback_model : None or Sequential
+        The fallback model of a cascade (see classify). The uncertain
+        frames of each batch are escalated together
+    threshold : float
+        The confidence below which frames are given to fallback_model
+
+    Yields
+    ------
+    row : dict
+        Dict containing
+        - frame
+        - label
+        - probability
+        - duplicate
+    frame : None or np.array, shape (frame_height, frame_width, 3)
+        The decoded frame if it was kept
+    """
+
+    last_result = None
+    pending = list()
+    images = list()
+
+    def flush():
+        nonlocal last_result
+        results = list()
+        if images:
+            labels, probabilities = classify(model,
+                                             np.array(images),
+                                             fallback_model,
+                                             threshold)
+            results = [(label, float(np.max(probability)))
+                       for label, probability in zip(labels, probabilities)]
+
+        for frame_index, position, frame in pending:
+            if position is not None:
+                last_result = results[position]
+            label, probability = last_result if last_result is not None \
+                else (None, 0.0)
+            yield {'frame': frame_index,
+                   'label': label,
+                   'probability': probability,
+                   'duplicate': position is None}, frame
+
+        del pending[:]
+        del images[:]
+
+    for frame_index, image, frame in frames:
+        position = None
+        if image is not None:
+            position = len(images)
+            images.append(image)
+        pending.append((frame_index, position, frame))
+
+        if len(images) == batch_size:
+            yield from flush()
+
+    yield from flush()
+
+
+def get_segments(rows, fps):
+    """
+    Merges consecutive frames with the same label into segments
+
+    Parameters
+    ----------
+    rows : list
+        The rows of classify_frames
+    fps : float
+        The frame rate of the video
+
+    Returns
+    -------
+    segments : list
+        List of dicts containing
+        - label
+        - start_frame
+        - end_frame
+        - start_time
+        - end_time
+        - probability (the mean of the frames)
+    """
+
+    segments = list()
+    probabilities = list()
+    for row in rows:
+        if segments and segments[-1]['label'] == row['label']:
+            segments[-1]['end_frame'] = row['frame']
+            probabilities.append(row['probability'])
+            continue
+
+        if segments:
+            segments[-1]['probability'] = float(np.mean(probabilities))
+        segments.append({'label': row['label'],
+                         'start_frame': row['frame'],
+                         'end_frame': row['frame']})
+        probabilities = [row['probability']]
+
+    if segments:
+        segments[-1]['probability'] = float(np.mean(probabilities))
+
+    for segment in segments:
+        segment['start_time'] = segment['start_frame'] / fps
+        segment['end_time'] = segment['end_frame'] / fps
+
+    return segments
+
+
+def annotate_frame(frame, row):
+    """
+    Draws the label and confidence of a frame on it
+
+    Parameters
+    ----------
+    frame : np.array, shape (height, width, 3)
+        The decoded frame
+    row : dict
+        The row of classify_frames
+
+    Returns
+    -------
+    frame : np.array, shape (height, width, 3)
+        The annotated frame
+    """
+
+    probability_text = '{}: {:.2f}%'.format(row['label'],
+                                            row['probability'] * 100)
+
+    cv2.putText(frame,
+                probability_text,
+                (10, 25),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                0.7,
+                (0, 255, 0),
+                2)
+
+    return frame
@@ -1,9 +1,14 @@
-import cv2
+import os
+import shutil
+from collections import Counter
 from keras.preprocessing.image import ImageDataGenerator
 from tqdm import tqdm
 from skimage.transform import resize
 from pathlib import Path
-from fruit_classifier.utils.file_utils import copytree
+from fruit_classifier.utils.manifest_utils import read_manifest
+from fruit_classifier.utils.manifest_utils import update_manifest
+from fruit_classifier.utils.manifest_utils import write_manifest
+from fruit_classifier.utils.image_utils import read_image
 
 
 def truncate_filenames(raw_dir):
@@ -20,8 +25,9 @@ def truncate_filenames(raw_dir):
 
     """
 
-    subdirectory_list = [p for p in Path(raw_dir).glob('*')
-                         if p.is_dir()]
+    with os.scandir(str(raw_dir)) as it:
+        subdirectory_list = sorted(Path(entry.path) for entry in it
+                                   if entry.is_dir())
     print("Reducing length of filenames so that combined path to a "
           "file is maximum 255 characters long")
     max_windows_path_length = 255
@@ -32,11 +38,11 @@ def truncate_filenames(raw_dir):
         sub_dir_len = len(str(sub_dir_path)) + 1
         # length available for image file name including type
         available_max_len = max_windows_path_length - sub_dir_len
-        # Get all files in directory
-        file_list = list(Path(sub_dir_path).glob('*'))
+        # Get all file names in directory
+        with os.scandir(str(sub_dir_path)) as it:
+            filename_list = [entry.name for entry in it]
         num_renamed = 0
-        for filepath in file_list:
-            filename = filepath.name
+        for filename in filename_list:
             file_path_len = len(filename)
             if file_path_len <= max_windows_path_length:
                 continue
@@ -57,7 +63,13 @@ def truncate_filenames(raw_dir):
 
 def remove_non_images(raw_dir, clean_dir):
     """
-    Removes images which are not readable
+    Copies the readable images from raw_dir to clean_dir
+
+    The manifests of the directories are used to find the files, so
+    only images which are new or changed since the last run are read.
+    Copies of images which were removed from raw_dir, or can no longer
+    be read, are removed from clean_dir. The manifest of clean_dir is
+    updated accordingly.
 
     Parameters
     ----------
@@ -67,34 +79,72 @@ def remove_non_images(raw_dir, clean_dir):
         Path for the cleaned dataset
     """
 
-    copytree(raw_dir, clean_dir)
-
-    # Find all image_paths
-    image_paths = sorted(clean_dir.glob('**/*'))
-    image_paths = [image_path for image_path in image_paths if
-                   image_path.is_file()]
-
-    for image_path in tqdm(image_paths, desc='Checking images'):
-        image = cv2.imread(str(image_path))
+    raw_dir = Path(raw_dir)
+    clean_dir = Path(clean_dir)
+
+    if not clean_dir.is_dir():
+        clean_dir.mkdir(parents=True, exist_ok=True)
+
+    raw_entries = update_manifest(raw_dir)
+    clean_entries = read_manifest(clean_dir)
+
+    stale_paths = set(clean_entries) - \
+        set(entry['path'] for entry in raw_entries)
+    for raw_entry in tqdm(raw_entries, desc='Checking images'):
+        relative_path = raw_entry['path']
+        clean_entry = clean_entries.get(relative_path)
+        if clean_entry is not None and \
+                clean_entry['sha1'] == raw_entry['sha1']:
+            continue
+
+        raw_path = raw_dir.joinpath(relative_path)
+        try:
+            # NOTE: The header is checked before decoding, so that
+            #       decompression bombs are never decoded
+            image = read_image(raw_path)
+        except ValueError as error:
+            print('Skipping {}: {}'.format(raw_path, error))
+            stale_paths.add(relative_path)
+            continue
 
         if image is None:
-            print('Un-linking {}'.format(image_path))
-            image_path.unlink()
-
-    raw_dirs = sorted(raw_dir.glob('*'))
-    raw_dirs = [d for d in raw_dirs if d.is_dir()]
-
-    clean_dirs = sorted(clean_dir.glob('*'))
-    clean_dirs = [d for d in clean_dirs if d.is_dir()]
+            print('Skipping {}'.format(raw_path))
+            stale_paths.add(relative_path)
+            continue
+
+        clean_path = clean_dir.joinpath(relative_path)
+        if not clean_path.parent.is_dir():
+            clean_path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(str(raw_path), str(clean_path))
+
+        # NOTE: copy2 preserves the modification time, so the entry
+        #       stays valid for the copy
+        clean_entry = dict(raw_entry)
+        clean_entry['mtime'] = clean_path.stat().st_mtime_ns
+        clean_entries[relative_path] = clean_entry
+
+    for relative_path in stale_paths:
+        clean_path = clean_dir.joinpath(relative_path)
+        if clean_path.is_file():
+            print('Removing {}'.format(clean_path))
+            clean_path.unlink()
+        clean_entries.pop(relative_path, None)
+
+    write_manifest(clean_dir, clean_entries.values())
+    # Pick up any changes made to clean_dir outside of this function
+    clean_entries = update_manifest(clean_dir)
+
+    n_raw = Counter(entry['label'] for entry in raw_entries)
+    n_clean = Counter(entry['label'] for entry in clean_entries)
 
     print('\nResult of cleaning:')
-    for r, c in zip(raw_dirs, clean_dirs):
-        n_raw = len(list(r.glob('*')))
-        n_clean = len(list(c.glob('*')))
-        print('    {}/{} remaining in {}'.format(n_clean, n_raw, c))
+    for label in sorted(n_raw):
+        print('    {}/{} remaining in {}'.format(n_clean[label],
+                                                 n_raw[label],
+                                                 label))
 
 
-def preprocess_image(image):
+def preprocess_image(image, height=28, width=28):
     """
     Pre-processes a single image
 
@@ -102,6 +152,10 @@ def preprocess_image(image):
     ----------
     image : np.array, shape (height, width, channels)
         The image to resize
+    height : int
+        The pixel height of the preprocessed image
+    width : int
+        The pixel width of the preprocessed image
 
     Returns
     -------
@@ -110,7 +164,7 @@ def preprocess_image(image):
     """
 
     preprocessed_image = resize(image,
-                                output_shape=(28, 28),
+                                output_shape=(height, width),
                                 mode='reflect',
                                 anti_aliasing=True)
     preprocessed_image = preprocessed_image / 255.0
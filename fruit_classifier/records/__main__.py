@@ -0,0 +1,48 @@
+import argparse
+from pathlib import Path
+from fruit_classifier.records.record_utils import write_shards
+
+
+def main(shard_size_mb=64, n_workers=None):
+    """
+    Packs the images in cleaned_data into record shards
+
+    The shards are stored in 'generated_data/records'
+
+    Parameters
+    ----------
+    shard_size_mb : int
+        The approximate size of each shard in megabytes
+    n_workers : None or int
+        The number of processes writing shards.
+        If None, all cores are used
+    """
+
+    generated_data_dir = \
+        Path(__file__).absolute().parents[2].joinpath('generated_data')
+    cleaned_dir = generated_data_dir.joinpath('cleaned_data')
+    shard_dir = generated_data_dir.joinpath('records')
+
+    write_shards(cleaned_dir,
+                 shard_dir,
+                 shard_size=shard_size_mb << 20,
+                 n_workers=n_workers)
+
+
+if __name__ == '__main__':
+    # Construct the argument parse and parse the arguments
+    parser = argparse.ArgumentParser(description='Pack cleaned images '
+                                                 'into record shards')
+    parser.add_argument('-s',
+                        '--shard-size',
+                        type=int,
+                        default=64,
+                        help='The approximate size of each shard in MB')
+    parser.add_argument('-w',
+                        '--workers',
+                        type=int,
+                        required=False,
+                        help='The number of processes writing shards')
+    args = parser.parse_args()
+
+    main(args.shard_size, args.workers)
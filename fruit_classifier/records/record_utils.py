@@ -0,0 +1,330 @@
+import csv
+import os
+import random
+import struct
+import multiprocessing
+from pathlib import Path
+from fruit_classifier.utils.manifest_utils import update_manifest
+
+
+# Each record is stored as a header followed by the utf-8 encoded
+# label, the utf-8 encoded relative path and the encoded image bytes
+RECORD_HEADER = struct.Struct('<HHI')
+INDEX_NAME = 'index.csv'
+INDEX_FIELDS = ('shard', 'offset', 'length', 'label', 'path', 'sha1')
+
+
+def read_index(shard_dir):
+    """
+    Reads the offset index of the shards
+
+    Parameters
+    ----------
+    shard_dir : Path
+        The directory containing the shards
+
+    Returns
+    -------
+    index : list
+        List of dicts with the keys given in INDEX_FIELDS.
+        Empty if there is no index
+    """
+
+    index_path = Path(shard_dir).joinpath(INDEX_NAME)
+
+    if not index_path.is_file():
+        return list()
+
+    with index_path.open('r', newline='') as f:
+        index = list(csv.DictReader(f))
+
+    for row in index:
+        row['offset'] = int(row['offset'])
+        row['length'] = int(row['length'])
+
+    return index
+
+
+def write_shard(shard_path, root_dir, entries):
+    """
+    Writes the files of the entries to a single shard
+
+    The shard is written to a temporary file which is moved in place
+    when complete
+
+    Parameters
+    ----------
+    shard_path : Path
+        The path of the shard
+    root_dir : Path
+        The directory the entry paths are relative to
+    entries : list
+        Manifest entries of the files to write
+
+    Returns
+    -------
+    rows : list
+        The index rows of the written records
+    """
+
+    shard_path = Path(shard_path)
+    tmp_path = shard_path.with_name(shard_path.name + '.tmp')
+
+    rows = list()
+    with tmp_path.open('wb') as f:
+        for entry in entries:
+            data = Path(root_dir).joinpath(entry['path']).read_bytes()
+            label = entry['label'].encode('utf-8')
+            path = entry['path'].encode('utf-8')
+
+            f.write(RECORD_HEADER.pack(len(label), len(path), len(data)))
+            f.write(label)
+            f.write(path)
+            offset = f.tell()
+            f.write(data)
+
+            rows.append({'shard': shard_path.name,
+                         'offset': offset,
+                         'length': len(data),
+                         'label': entry['label'],
+                         'path': entry['path'],
+                         'sha1': entry['sha1']})
+
+    os.replace(str(tmp_path), str(shard_path))
+
+    return rows
+
+
+def _write_shard(args):
+    """
+    Unpacks the arguments of write_shard for use with Pool.map
+    """
+    return write_shard(*args)
+
+
+def write_shards(root_dir, shard_dir, shard_size=64 << 20, n_workers=None):
+    """
+    Packs the files of root_dir into shards
+
+    The shards are append-only: files whose content is already in the
+    shards are skipped, and new files are written to new shards.
+    The shards are written in parallel.
+
+    Parameters
+    ----------
+    root_dir : Path
+        The directory to pack (e.g. cleaned_data)
+    shard_dir : Path
+        The directory to store the shards in
+    shard_size : int
+        The approximate number of bytes in each shard
+    n_workers : None or int
+        The number of processes writing shards.
+        If None, os.cpu_count() is used
+
+    Returns
+    -------
+    index : list
+        The index of all the records in shard_dir
+    """
+
+    shard_dir = Path(shard_dir)
+    if not shard_dir.is_dir():
+        shard_dir.mkdir(parents=True, exist_ok=True)
+
+    index = read_index(shard_dir)
+    packed = {row['sha1'] for row in index}
+    n_shards = len({row['shard'] for row in index})
+
+    entries = [entry for entry in update_manifest(root_dir)
+               if entry['sha1'] not in packed]
+
+    # Group the entries into shards of roughly shard_size bytes
+    jobs = list()
+    shard_entries = list()
+    shard_bytes = 0
+    for entry in entries:
+        shard_entries.append(entry)
+        shard_bytes += entry['size']
+        if shard_bytes >= shard_size:
+            jobs.append(shard_entries)
+            shard_entries = list()
+            shard_bytes = 0
+    if shard_entries:
+        jobs.append(shard_entries)
+
+    jobs = [(shard_dir.joinpath('shard-{:05d}.rec'.format(n_shards + i)),
+             root_dir,
+             job_entries)
+            for i, job_entries in enumerate(jobs)]
+
+    print('[INFO] Writing {} records to {} new shards'.format(len(entries),
+                                                            len(jobs)))
+
+    if jobs:
+        with multiprocessing.Pool(processes=n_workers) as pool:
+            for rows in pool.imap(_write_shard, jobs):
+                index.extend(rows)
+
+        index_path = shard_dir.joinpath(INDEX_NAME)
+        tmp_path = shard_dir.joinpath(INDEX_NAME + '.tmp')
+        with tmp_path.open('w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=INDEX_FIELDS)
+            writer.writeheader()
+            writer.writerows(index)
+        os.replace(str(tmp_path), str(index_path))
+        print('[INFO] Saved to {}'.format(index_path))
+
+    return index
+
+
+def read_record(shard_dir, row):
+    """
+    Reads a single record using the offset index
+
+    Parameters
+    ----------
+    shard_dir : Path
+        The directory containing the shards
+    row : dict
+        The index row of the record
+
+    Returns
+    -------
+    data : bytes
+        The encoded image
+    """
+
+    with Path(shard_dir).joinpath(row['shard']).open('rb') as f:
+        f.seek(row['offset'])
+        data = f.read(row['length'])
+
+    return data
+
+
+def iterate_shard(shard_path):
+    """
+    Reads all the records of a shard sequentially
+
+    Parameters
+    ----------
+    shard_path : Path
+        The path of the shard
+
+    Yields
+    ------
+    label : str
+        The label of the record
+    path : str
+        The path of the original file relative to the packed directory
+    data : bytes
+        The encoded image
+    """
+
+    with Path(shard_path).open('rb') as f:
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                break
+            label_length, path_length, data_length = \
+                RECORD_HEADER.unpack(header)
+            label = f.read(label_length).decode('utf-8')
+            path = f.read(path_length).decode('utf-8')
+            data = f.read(data_length)
+            yield label, path, data
+
+
+def iterate_records(shard_dir, shuffle=True, buffer_size=1024, seed=None):
+    """
+    Streams the records of all the shards
+
+    The shards are read one at a time from start to end, so the disk
+    only sees large sequential reads. When shuffling, the order of the
+    shards is shuffled, and the records are shuffled within a buffer
+    of buffer_size records.
+
+    Parameters
+    ----------
+    shard_dir : Path
+        The directory containing the shards
+    shuffle : bool
+        Whether or not to shuffle the records
+    buffer_size : int
+        The number of records in the shuffle buffer
+    seed : None or int
+        The seed of the shuffling
+
+    Yields
+    ------
+    label : str
+        The label of the record
+    path : str
+        The path of the original file relative to the packed directory
+    data : bytes
+        The encoded image
+    """
+
+    rng = random.Random(seed)
+
+    # NOTE: Only shards in the index are read, so shards left behind
+    #       by an interrupted writer are ignored
+    shard_names = sorted({row['shard'] for row in read_index(shard_dir)})
+    shard_paths = [Path(shard_dir).joinpath(name) for name in shard_names]
+    if shuffle:
+        rng.shuffle(shard_paths)
+
+    buffer = list()
+    for shard_path in shard_paths:
+        for record in iterate_shard(shard_path):
+            if not shuffle:
+                yield record
+            elif len(buffer) < buffer_size:
+                buffer.append(record)
+            else:
+                i = rng.randrange(buffer_size)
+                yield buffer[i]
+                buffer[i] = record
+
+    rng.shuffle(buffer)
+    for record in buffer:
+        yield record
+
+
+def iterate_batches(shard_dir, batch_size=32, **kwargs):
+    """
+    Groups the streamed records into batches
+
+    Parameters
+    ----------
+    shard_dir : Path
+        The directory containing the shards
+    batch_size : int
+        The number of records in each batch
+    kwargs : dict
+        Keyword arguments passed to iterate_records
+
+    Yields
+    ------
+    labels : list
+        The labels of the batch
+    paths : list
+        The relative paths of the batch
+    data : list
+        The encoded images of the batch
+    """
+
+    labels = list()
+    paths = list()
+    data = list()
+    for label, path, record_data in iterate_records(shard_dir, **kwargs):
+        labels.append(label)
+        paths.append(path)
+        data.append(record_data)
+        if len(data) == batch_size:
+            yield labels, paths, data
+            labels = list()
+            paths = list()
+            data = list()
+
+    if data:
+        yield labels, paths, data
@@ -0,0 +1,127 @@
+import argparse
+import json
+from pathlib import Path
+from fruit_classifier.execution.execution_utils import configure_session
+from fruit_classifier.predict.predict_utils import load_classifier
+from fruit_classifier.serving.serving_utils import check_consistency
+from fruit_classifier.serving.serving_utils import get_serving_model
+from fruit_classifier.serving.serving_utils import get_serving_path
+from fruit_classifier.train.train_utils import get_image_paths_and_labels
+
+
+def main(model_path=None,
+         output_path=None,
+         input_size=None,
+         n_images=200,
+         min_agreement=0.99):
+    """
+    Exports a model which takes raw uint8 images
+
+    The resize and scaling of the pre-processing are layers of the
+    exported model, so serving only decodes the images. The exported
+    model is compared with the model on pre-processed images of
+    cleaned_data, and the comparison is stored next to it.
+
+    Parameters
+    ----------
+    model_path : None or Path
+        Path to the trained model.
+        If None, 'generated_data/models/model.h5' is used
+    output_path : None or Path
+        Path to store the serving model.
+        If None, 'generated_data/models/model_serving.h5' is used
+    input_size : None or tuple
+        The (height, width) of the raw images.
+        If None, images of any size are accepted
+    n_images : int
+        The number of images to compare the models on
+    min_agreement : float
+        The fraction of images the models must give the same class
+        for the export not to be warned about
+
+    Returns
+    -------
+    consistency : dict
+        See check_consistency
+    """
+
+    cleaned_dir = \
+        Path(__file__).absolute().parents[2].joinpath('generated_data',
+                                                      'cleaned_data')
+
+    if output_path is None:
+        output_path = get_serving_path()
+    output_path = Path(output_path)
+
+    configure_session()
+    model = load_classifier(model_path=model_path)
+    serving_model = get_serving_model(model, input_size)
+
+    image_paths, _ = get_image_paths_and_labels(cleaned_dir)
+    print('[INFO] Comparing on {} images'.format(
+        min(n_images, len(image_paths))))
+    consistency = check_consistency(model,
+                                    serving_model,
+                                    image_paths[:n_images])
+
+    print('\nSame class:         {:.1f}%'.format(
+        consistency['agreement'] * 100))
+    print('Max difference:     {:.4f}'.format(consistency['max_abs_diff']))
+    print('Mean difference:    {:.4f}'.format(consistency['mean_abs_diff']))
+    if consistency['agreement'] < min_agreement:
+        print('[WARNING] The serving model disagrees with the model on '
+              'more than {:.1f}% of the images'.format(
+                  (1 - min_agreement) * 100))
+
+    if not output_path.parent.is_dir():
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+    serving_model.save(str(output_path))
+    print('[INFO] Saved to {}'.format(output_path))
+
+    report_path = output_path.with_suffix('.json')
+    with report_path.open('w') as f:
+        json.dump(dict(consistency,
+                       input_size=input_size,
+                       model_input_size=list(model.input_shape[1:3])),
+                  f,
+                  indent=4)
+    print('[INFO] Saved to {}'.format(report_path))
+
+    return consistency
+
+
+if __name__ == '__main__':
+    # Construct the argument parse and parse the arguments
+    parser = argparse.ArgumentParser(description='Export a model which '
+                                                 'takes raw uint8 images')
+    parser.add_argument('-m',
+                        '--model',
+                        required=False,
+                        help='Path to the trained model. Defaults to '
+                             'generated_data/models/model.h5')
+    parser.add_argument('-o',
+                        '--output',
+                        required=False,
+                        help='Path to store the serving model. Defaults '
+                             'to generated_data/models/model_serving.h5')
+    parser.add_argument('-s',
+                        '--input-size',
+                        type=int,
+                        nargs=2,
+                        metavar=('HEIGHT', 'WIDTH'),
+                        required=False,
+                        help='Fixed size of the raw images. Needed to '
+                             'classify batches of images, e.g. in the '
+                             'daemon. Defaults to any size')
+    parser.add_argument('-n',
+                        '--n-images',
+                        type=int,
+                        default=200,
+                        help='The number of images to compare the models '
+                             'on')
+    args = parser.parse_args()
+
+    main(model_path=args.model,
+         output_path=args.output,
+         input_size=args.input_size,
+         n_images=args.n_images)
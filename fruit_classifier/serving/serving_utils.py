@@ -0,0 +1,202 @@
+import cv2
+import numpy as np
+from pathlib import Path
+from keras import backend as K
+from keras.layers import Input
+from keras.models import Model
+from fruit_classifier.models.layers import Rescale
+from fruit_classifier.models.layers import Resize
+from fruit_classifier.utils.image_utils import read_image
+from fruit_classifier.preprocessing.preprocessing_utils import \
+    preprocess_image
+
+
+def get_serving_path():
+    """
+    Returns the default path of the serving model
+
+    Returns
+    -------
+    serving_path : Path
+        'generated_data/models/model_serving.h5'
+    """
+
+    serving_path = \
+        Path(__file__).absolute().parents[2].joinpath('generated_data',
+                                                      'models',
+                                                      'model_serving.h5')
+
+    return serving_path
+
+
+def get_serving_model(model, input_size=None):
+    """
+    Wraps a model so that it takes raw uint8 images
+
+    The resize and the scaling of preprocess_image are done by layers
+    in front of the model, so callers only decode the images
+
+    Parameters
+    ----------
+    model : Sequential
+        The trained model, which takes preprocessed images
+    input_size : None or tuple
+        The (height, width) of the raw images.
+        If None, images of any size are accepted, but a batch must
+        consist of images of the same size
+
+    Returns
+    -------
+    serving_model : Model
+        The model taking uint8 images of shape
+        (n_images, height, width, channels), in the BGR channel order
+        given by OpenCV
+    """
+
+    height, width, channels = model.input_shape[1:]
+    if input_size is None:
+        input_size = (None, None)
+
+    inputs = Input(shape=tuple(input_size) + (channels,),
+                   dtype='uint8',
+                   name='raw_image')
+    # Resized first and scaled second, like preprocess_image does
+    x = Resize(height, width)(inputs)
+    x = Rescale(1 / 255)(x)
+    outputs = model(x)
+
+    serving_model = Model(inputs, outputs)
+
+    return serving_model
+
+
+def is_serving_model(model):
+    """
+    Returns whether a model takes raw uint8 images
+
+    Parameters
+    ----------
+    model : Model
+        The model
+
+    Returns
+    -------
+    bool
+        Whether the model was made by get_serving_model
+    """
+
+    return K.dtype(model.input) == 'uint8'
+
+
+def check_not_serving(model, model_path):
+    """
+    Refuses serving models where preprocessed images are given
+
+    A serving model casts its input to uint8, so the floats in [0, 1]
+    made by preprocess_image would be truncated to 0 and 1 and give
+    wrong predictions without any error
+
+    Parameters
+    ----------
+    model : Model
+        The loaded model
+    model_path : Path
+        Where the model was loaded from, for the error message
+
+    Raises
+    ------
+    ValueError
+        If the model is a serving model
+    """
+
+    if is_serving_model(model):
+        raise ValueError('{} is a serving model, which takes raw uint8 '
+                         'images. Only the daemon gives it those, so use '
+                         'the model it was exported from'.format(model_path))
+
+
+def fit_to_input(image, serving_model):
+    """
+    Fits a decoded image to the input size of a serving model
+
+    Only models with a fixed input size need this. The image stays
+    uint8, so this is much cheaper than preprocess_image
+
+    Parameters
+    ----------
+    image : np.array, shape (height, width, channels)
+        The uint8 image, as given by read_image
+    serving_model : Model
+        The model made by get_serving_model
+
+    Returns
+    -------
+    image : np.array, shape (input_height, input_width, channels)
+        The uint8 image
+    """
+
+    input_height, input_width = serving_model.input_shape[1:3]
+    if input_height is None or \
+            image.shape[:2] == (input_height, input_width):
+        return image
+
+    image = cv2.resize(image,
+                       (input_width, input_height),
+                       interpolation=cv2.INTER_AREA)
+
+    return image
+
+
+def check_consistency(model, serving_model, image_paths):
+    """
+    Compares the serving model with the model on preprocessed images
+
+    Parameters
+    ----------
+    model : Sequential
+        The model taking images made by preprocess_image
+    serving_model : Model
+        The model made by get_serving_model
+    image_paths : list
+        The images to compare on
+
+    Returns
+    -------
+    consistency : dict
+        Dictionary containing
+        - n_images
+        - agreement (the fraction of images given the same class)
+        - max_abs_diff (of the probabilities)
+        - mean_abs_diff (of the probabilities)
+    """
+
+    height, width = model.input_shape[1:3]
+
+    differences = list()
+    n_agreed = 0
+    for image_path in image_paths:
+        image = read_image(image_path)
+        if image is None:
+            continue
+
+        expected = model.predict(np.expand_dims(
+            preprocess_image(image.astype('float32'), height, width),
+            axis=0))
+        actual = serving_model.predict(np.expand_dims(
+            fit_to_input(image, serving_model),
+            axis=0))
+
+        differences.append(np.abs(expected - actual))
+        n_agreed += int(np.argmax(expected) == np.argmax(actual))
+
+    n_images = len(differences)
+    if n_images == 0:
+        raise ValueError('None of the images could be decoded')
+    differences = np.concatenate(differences)
+
+    consistency = {'n_images': n_images,
+                   'agreement': n_agreed / n_images,
+                   'max_abs_diff': float(np.max(differences)),
+                   'mean_abs_diff': float(np.mean(differences))}
+
+    return consistency
@@ -0,0 +1,104 @@
+import argparse
+from pathlib import Path
+from fruit_classifier.telemetry.telemetry_utils import get_telemetry_path
+from fruit_classifier.telemetry.telemetry_utils import read_records
+from fruit_classifier.telemetry.telemetry_utils import follow_records
+from fruit_classifier.telemetry.telemetry_utils import receive_records
+from fruit_classifier.telemetry.telemetry_utils import summarize_records
+from fruit_classifier.telemetry.telemetry_utils import format_record
+from fruit_classifier.telemetry.telemetry_utils import format_summary
+from fruit_classifier.telemetry.telemetry_utils import TelemetryWriter
+
+
+def main(command='summary',
+         telemetry_path=None,
+         follow=False,
+         port=None,
+         show_batches=True):
+    """
+    Shows the telemetry written during training
+
+    Parameters
+    ----------
+    command : ['summary'|'tail'|'listen']
+        'summary' prints the throughput and the time spent waiting for
+        data vs. computing per epoch.
+        'tail' prints the records of the file.
+        'listen' prints the records sent to a UDP port and appends them
+        to telemetry_path
+    telemetry_path : None or Path
+        The JSON lines file.
+        If None, 'generated_data/telemetry/training.jsonl' is used
+    follow : bool
+        Whether to keep printing new records when tailing
+    port : None or int
+        The UDP port to listen on
+    show_batches : bool
+        Whether to print the batch records when tailing or listening
+    """
+
+    if telemetry_path is None:
+        telemetry_path = get_telemetry_path()
+    telemetry_path = Path(telemetry_path)
+
+    if command == 'summary':
+        print(format_summary(summarize_records(read_records(telemetry_path))))
+        return
+
+    if command == 'tail':
+        records = follow_records(telemetry_path) if follow \
+            else read_records(telemetry_path)
+        writer = None
+    elif command == 'listen':
+        print('[INFO] Listening on udp://127.0.0.1:{}'.format(port))
+        records = receive_records(port)
+        writer = TelemetryWriter(telemetry_path)
+    else:
+        raise ValueError('Unknown command {}'.format(command))
+
+    try:
+        for record in records:
+            if writer is not None:
+                writer.write(record)
+            if show_batches or record.get('type') != 'batch':
+                print(format_record(record), flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+if __name__ == '__main__':
+    # Construct the argument parse and parse the arguments
+    parser = argparse.ArgumentParser(description='Show the training '
+                                                 'telemetry')
+    parser.add_argument('command',
+                        choices=('summary', 'tail', 'listen'),
+                        help='Summarize the file, print its records or '
+                             'receive records from a UDP port')
+    parser.add_argument('-i',
+                        '--input',
+                        required=False,
+                        help='The telemetry file. Defaults to '
+                             'generated_data/telemetry/training.jsonl')
+    parser.add_argument('-f',
+                        '--follow',
+                        action='store_true',
+                        help='Keep printing records as they are written')
+    parser.add_argument('-p',
+                        '--port',
+                        type=int,
+                        default=9125,
+                        help='The UDP port to listen on')
+    parser.add_argument('-e',
+                        '--epochs-only',
+                        action='store_true',
+                        help='Only print the epoch records')
+    args = parser.parse_args()
+
+    main(command=args.command,
+         telemetry_path=args.input,
+         follow=args.follow,
+         port=args.port,
+         show_batches=not args.epochs_only)
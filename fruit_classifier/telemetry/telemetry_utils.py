@@ -0,0 +1,389 @@
+import json
+import os
+import resource
+import socket
+import sys
+import time
+from collections import OrderedDict
+from pathlib import Path
+from urllib.parse import urlparse
+
+
+def get_telemetry_path():
+    """
+    Returns the default path of the training telemetry
+
+    Returns
+    -------
+    telemetry_path : Path
+        The 'generated_data/telemetry/training.jsonl' file
+    """
+
+    telemetry_path = \
+        Path(__file__).absolute().parents[2].joinpath('generated_data',
+                                                      'telemetry',
+                                                      'training.jsonl')
+
+    return telemetry_path
+
+
+def get_rss():
+    """
+    Returns the resident set size of the current process
+
+    Returns
+    -------
+    rss : int
+        The resident set size in bytes.
+        Where /proc is not available the peak resident set size is
+        returned instead
+    """
+
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # NOTE: ru_maxrss is given in bytes on macOS and in kilobytes
+        #       elsewhere
+        return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+class TelemetryWriter(object):
+    """
+    Writes telemetry records to a JSON lines file or a UDP socket
+
+    Each record is flushed as soon as it is written, so that the
+    file can be followed while training is running.
+
+    Parameters
+    ----------
+    destination : str or Path
+        Either the path of a JSON lines file which is appended to, or
+        an address on the form 'udp://host:port'
+    """
+
+    def __init__(self, destination):
+        self.destination = str(destination)
+        self.file = None
+        self.socket = None
+        self.address = None
+
+        url = urlparse(self.destination)
+        if url.scheme == 'udp':
+            self.address = (url.hostname or '127.0.0.1', url.port)
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        else:
+            path = Path(self.destination)
+            if not path.parent.is_dir():
+                path.parent.mkdir(parents=True, exist_ok=True)
+            self.file = path.open('a')
+
+    def write(self, record):
+        """
+        Writes a single record
+
+        Parameters
+        ----------
+        record : dict
+            The JSON serializable record
+        """
+
+        line = json.dumps(record)
+        if self.socket is not None:
+            # NOTE: Telemetry must never stop training, so records
+            #       which cannot be delivered are dropped
+            try:
+                self.socket.sendto(line.encode('utf-8'), self.address)
+            except OSError:
+                pass
+        else:
+            self.file.write(line + '\n')
+            self.file.flush()
+
+    def close(self):
+        """
+        Closes the file or the socket
+        """
+
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+
+def read_records(path):
+    """
+    Reads the records of a telemetry file
+
+    Parameters
+    ----------
+    path : Path
+        The path of the JSON lines file
+
+    Returns
+    -------
+    records : list
+        The records as dicts. A partially written last line is ignored
+    """
+
+    records = list()
+    with Path(path).open('r') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+
+    return records
+
+
+def follow_records(path, poll_interval=0.5):
+    """
+    Yields the records of a telemetry file as they are written
+
+    Parameters
+    ----------
+    path : Path
+        The path of the JSON lines file
+    poll_interval : float
+        Seconds to wait before looking for new lines
+
+    Yields
+    ------
+    record : dict
+        The next record
+    """
+
+    with Path(path).open('r') as f:
+        partial = ''
+        while True:
+            line = f.readline()
+            if not line:
+                time.sleep(poll_interval)
+                continue
+            partial += line
+            if not partial.endswith('\n'):
+                continue
+            try:
+                record = json.loads(partial)
+            except ValueError:
+                record = None
+            partial = ''
+            if record is not None:
+                yield record
+
+
+def receive_records(port, host='127.0.0.1'):
+    """
+    Yields the records sent to a UDP socket
+
+    Parameters
+    ----------
+    port : int
+        The port to listen on
+    host : str
+        The address to bind to
+
+    Yields
+    ------
+    record : dict
+        The next record
+    """
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind((host, port))
+        while True:
+            data, _ = sock.recvfrom(65536)
+            try:
+                yield json.loads(data.decode('utf-8'))
+            except ValueError:
+                continue
+
+
+def summarize_records(records):
+    """
+    Summarizes the records of a run per epoch
+
+    Epochs which have an epoch record are summarized from it. The
+    epoch in progress is summarized from its batch records.
+    Only the last run is summarized if several runs were appended to
+    the same file.
+
+    Parameters
+    ----------
+    records : list
+        The telemetry records
+
+    Returns
+    -------
+    summary : list
+        One dict per epoch with the keys
+        - epoch
+        - images
+        - images_per_sec
+        - data_wait
+        - compute
+        - input_bound_fraction
+        - rss
+        - complete
+        and the metrics of the epoch (e.g. loss, val_acc)
+    """
+
+    # Only keep the last run
+    start = 0
+    for i, record in enumerate(records):
+        if record.get('type') == 'start':
+            start = i
+    records = records[start:]
+
+    summary = OrderedDict()
+    for record in records:
+        if record.get('type') == 'epoch':
+            epoch_summary = {key: value for key, value in record.items()
+                             if key not in ('type', 'time')}
+            epoch_summary['complete'] = True
+            summary[record['epoch']] = epoch_summary
+        elif record.get('type') == 'batch':
+            epoch_summary = summary.get(record['epoch'])
+            if epoch_summary is None:
+                epoch_summary = {'epoch': record['epoch'],
+                                 'images': 0,
+                                 'data_wait': 0.0,
+                                 'compute': 0.0,
+                                 'complete': False}
+                summary[record['epoch']] = epoch_summary
+            if epoch_summary['complete']:
+                continue
+            epoch_summary['images'] += record['size']
+            epoch_summary['data_wait'] += record['data_wait']
+            epoch_summary['compute'] += record['compute']
+            epoch_summary['rss'] = record['rss']
+            for key in ('loss', 'acc'):
+                if key in record:
+                    epoch_summary[key] = record[key]
+
+    summary = list(summary.values())
+    for epoch_summary in summary:
+        busy = epoch_summary['data_wait'] + epoch_summary['compute']
+        epoch_summary['input_bound_fraction'] = \
+            epoch_summary['data_wait'] / busy if busy > 0 else 0.0
+        if not epoch_summary['complete']:
+            epoch_summary['images_per_sec'] = \
+                epoch_summary['images'] / busy if busy > 0 else 0.0
+
+    return summary
+
+
+def format_record(record):
+    """
+    Formats a record as a single line
+
+    Parameters
+    ----------
+    record : dict
+        The telemetry record
+
+    Returns
+    -------
+    line : str
+        The formatted record
+    """
+
+    if record.get('type') == 'start':
+        return 'Training started with {} epochs'.format(record['epochs'])
+
+    if record.get('type') not in ('batch', 'epoch'):
+        return json.dumps(record)
+
+    metrics = ' '.join('{}={:.4f}'.format(key, record[key])
+                       for key in ('loss', 'acc', 'val_loss', 'val_acc')
+                       if key in record)
+
+    if record['type'] == 'batch':
+        prefix = 'epoch {:>3} batch {:>5}'.format(record['epoch'],
+                                                  record['batch'])
+    else:
+        prefix = 'epoch {:>3} done       '.format(record['epoch'])
+
+    line = '{} {:>8.1f} img/s wait {:>7.1f} ms compute {:>7.1f} ms ' \
+           'rss {:>6.0f} MB {}'.format(prefix,
+                                       record['images_per_sec'],
+                                       record['data_wait'] * 1e3,
+                                       record['compute'] * 1e3,
+                                       record['rss'] / (1 << 20),
+                                       metrics)
+
+    return line.rstrip()
+
+
+def format_summary(summary):
+    """
+    Formats the summary as a table
+
+    Parameters
+    ----------
+    summary : list
+        The output of summarize_records
+
+    Returns
+    -------
+    table : str
+        The formatted table, ending with an overall verdict
+    """
+
+    lines = ['{:>5} {:>8} {:>10} {:>9} {:>9} {:>7} {:>8} {:>8} '
+             '{:>8}'.format('Epoch', 'Images', 'Img/s', 'Wait (s)',
+                            'Comp (s)', 'Wait %', 'RSS (MB)', 'Loss',
+                            'Val acc')]
+
+    for epoch_summary in summary:
+        lines.append('{:>5}{} {:>8} {:>10.1f} {:>9.2f} {:>9.2f} {:>6.0f}% '
+                     '{:>8.0f} {:>8} {:>8}'.format(
+                         epoch_summary['epoch'],
+                         ' ' if epoch_summary['complete'] else '*',
+                         epoch_summary['images'],
+                         epoch_summary['images_per_sec'],
+                         epoch_summary['data_wait'],
+                         epoch_summary['compute'],
+                         epoch_summary['input_bound_fraction'] * 100,
+                         epoch_summary.get('rss', 0) / (1 << 20),
+                         _format_metric(epoch_summary.get('loss')),
+                         _format_metric(epoch_summary.get('val_acc'))))
+
+    if summary:
+        data_wait = sum(s['data_wait'] for s in summary)
+        compute = sum(s['compute'] for s in summary)
+        if data_wait > compute:
+            verdict = 'input-bound: more time is spent waiting for ' \
+                      'batches than computing them'
+        else:
+            verdict = 'compute-bound: more time is spent computing ' \
+                      'batches than waiting for them'
+        lines.append('')
+        lines.append('The run is {}'.format(verdict))
+        if not summary[-1]['complete']:
+            lines.append('* Epoch in progress')
+
+    return '\n'.join(lines)
+
+
+def _format_metric(value):
+    """
+    Formats an optional metric
+
+    Parameters
+    ----------
+    value : None or float
+        The metric
+
+    Returns
+    -------
+    formatted : str
+        The metric with four decimals, or '-' if None
+    """
+
+    return '-' if value is None else '{:.4f}'.format(value)
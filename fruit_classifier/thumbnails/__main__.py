@@ -0,0 +1,45 @@
+import argparse
+from pathlib import Path
+from fruit_classifier.thumbnails.thumbnail_utils import THUMBNAIL_SIZES
+from fruit_classifier.thumbnails.thumbnail_utils import build_thumbnails
+
+
+def main(sizes=THUMBNAIL_SIZES):
+    """
+    Stores thumbnails of the images in cleaned_data
+
+    The thumbnails are stored in 'generated_data/thumbnails'. Training
+    at a resolution no larger than the largest thumbnail then resizes
+    the thumbnails instead of decoding the original images
+
+    Parameters
+    ----------
+    sizes : iterable
+        The lengths of the short sides of the thumbnails
+    """
+
+    cleaned_dir = \
+        Path(__file__).absolute().parents[2].joinpath('generated_data',
+                                                      'cleaned_data')
+
+    cache = build_thumbnails(cleaned_dir, sizes=sizes)
+
+    for size in cache.sizes:
+        print('{:>4} pixels: {:.1f} MB'.format(size,
+                                               cache.data[size].nbytes / 1e6))
+
+
+if __name__ == '__main__':
+    # Construct the argument parse and parse the arguments
+    parser = argparse.ArgumentParser(description='Cache downscaled copies '
+                                                 'of the cleaned images')
+    parser.add_argument('-s',
+                        '--sizes',
+                        type=int,
+                        nargs='+',
+                        default=list(THUMBNAIL_SIZES),
+                        help='The lengths of the short sides of the '
+                             'thumbnails')
+    args = parser.parse_args()
+
+    main(args.sizes)
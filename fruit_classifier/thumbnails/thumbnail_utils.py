@@ -0,0 +1,384 @@
+import json
+import os
+import cv2
+import numpy as np
+from pathlib import Path
+from tqdm import tqdm
+from fruit_classifier.utils.image_utils import read_image
+from fruit_classifier.utils.manifest_utils import read_manifest
+from fruit_classifier.utils.manifest_utils import update_manifest
+
+
+# The lengths of the short side of the cached thumbnails
+THUMBNAIL_SIZES = (32, 64, 128)
+
+
+def get_thumbnail_dir():
+    """
+    Returns the default directory of the thumbnail cache
+
+    Returns
+    -------
+    thumbnail_dir : Path
+        'generated_data/thumbnails'
+    """
+
+    thumbnail_dir = \
+        Path(__file__).absolute().parents[2].joinpath('generated_data',
+                                                      'thumbnails')
+
+    return thumbnail_dir
+
+
+def get_data_path(thumbnail_dir, size):
+    """
+    Returns the path of the file holding the thumbnails of a size
+
+    Parameters
+    ----------
+    thumbnail_dir : Path
+        The directory of the cache
+    size : int
+        The thumbnail size
+
+    Returns
+    -------
+    data_path : Path
+        'thumbnails_<size>.bin' in thumbnail_dir
+    """
+
+    data_path = Path(thumbnail_dir).joinpath('thumbnails_{}.bin'.format(size))
+
+    return data_path
+
+
+def make_thumbnail(image, size):
+    """
+    Downscales an image so that its short side is size pixels
+
+    The aspect ratio is kept, and images which are already small
+    enough are not upscaled, so no detail is added or lost compared to
+    resizing the original image
+
+    Parameters
+    ----------
+    image : np.array, shape (height, width, channels)
+        The uint8 image
+    size : int
+        The length of the short side of the thumbnail
+
+    Returns
+    -------
+    thumbnail : np.array, shape (new_h, new_w, channels)
+        The uint8 thumbnail
+    """
+
+    height, width = image.shape[:2]
+    scale = size / min(height, width)
+    if scale >= 1:
+        return np.ascontiguousarray(image, dtype=np.uint8)
+
+    new_size = (max(int(round(width * scale)), 1),
+                max(int(round(height * scale)), 1))
+    # INTER_AREA averages the pixels, so the thumbnail does not alias
+    thumbnail = cv2.resize(image, new_size, interpolation=cv2.INTER_AREA)
+
+    return thumbnail.astype(np.uint8)
+
+
+def get_thumbnail_size(height, width, sizes=THUMBNAIL_SIZES):
+    """
+    Returns the smallest thumbnail size which can be resized to a shape
+
+    Both sides of a thumbnail are at least its size, so it is only
+    downscaled when resized to a shape no larger than its size
+
+    Parameters
+    ----------
+    height : int
+        The pixel height of the preprocessed images
+    width : int
+        The pixel width of the preprocessed images
+    sizes : iterable
+        The cached thumbnail sizes
+
+    Returns
+    -------
+    size : None or int
+        The thumbnail size.
+        None if the shape is larger than all the thumbnails
+    """
+
+    for size in sorted(sizes):
+        if size >= max(height, width):
+            return size
+
+    return None
+
+
+class ThumbnailCache(object):
+    """
+    Downscaled copies of the images of a directory
+
+    The thumbnails of each size are stored back to back in one uint8
+    file, which is memory mapped. A thumbnail is found through the
+    SHA-1 of its image in the manifest, so changed images are never
+    served from stale thumbnails.
+
+    Parameters
+    ----------
+    image_dir : Path
+        The directory of the original images
+    hashes : list
+        The SHA-1 of each cached image
+    data : dict
+        The flat uint8 thumbnails of each size
+    offsets : dict
+        Where each thumbnail starts in the data of each size,
+        shape (n_images,)
+    shapes : dict
+        The shape of each thumbnail of each size, shape (n_images, 3)
+    """
+
+    def __init__(self, image_dir, hashes, data, offsets, shapes):
+        self.image_dir = Path(image_dir)
+        self.hashes = list(hashes)
+        self.data = data
+        self.offsets = offsets
+        self.shapes = shapes
+        self.sizes = tuple(sorted(data))
+
+        self.slots = {sha1: i for i, sha1 in enumerate(self.hashes)}
+        self.entries = read_manifest(self.image_dir)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def get_by_hash(self, sha1, size):
+        """
+        Returns the thumbnail of the image with the given SHA-1
+
+        Parameters
+        ----------
+        sha1 : str
+            The SHA-1 of the image
+        size : int
+            The thumbnail size
+
+        Returns
+        -------
+        thumbnail : None or np.array, shape (new_h, new_w, channels)
+            The uint8 thumbnail (a view of the memory map).
+            None if the image or the size is not cached
+        """
+
+        slot = self.slots.get(sha1)
+        if slot is None or size not in self.data:
+            return None
+
+        offset = self.offsets[size][slot]
+        shape = tuple(self.shapes[size][slot])
+        n_bytes = int(np.prod(shape))
+
+        return self.data[size][offset:offset + n_bytes].reshape(shape)
+
+    def get(self, image_path, size):
+        """
+        Returns the thumbnail of the image at the given path
+
+        Parameters
+        ----------
+        image_path : Path
+            The path of the original image
+        size : int
+            The thumbnail size
+
+        Returns
+        -------
+        thumbnail : None or np.array, shape (new_h, new_w, channels)
+            The uint8 thumbnail.
+            None if the image is not in the cache
+        """
+
+        try:
+            relative_path = \
+                Path(image_path).absolute().relative_to(self.image_dir)
+        except ValueError:
+            return None
+
+        entry = self.entries.get(relative_path.as_posix())
+        if entry is None:
+            return None
+
+        return self.get_by_hash(entry['sha1'], size)
+
+
+def build_thumbnails(image_dir,
+                     thumbnail_dir=None,
+                     sizes=THUMBNAIL_SIZES):
+    """
+    Stores thumbnails of the images in image_dir
+
+    Each image is decoded once and downscaled to all the sizes.
+    Thumbnails of images which are unchanged since the last build are
+    copied from the previous cache instead of being decoded again.
+
+    Parameters
+    ----------
+    image_dir : Path
+        The directory of the original images
+    thumbnail_dir : None or Path
+        The directory of the cache.
+        If None, 'generated_data/thumbnails' is used
+    sizes : iterable
+        The lengths of the short sides of the thumbnails
+
+    Returns
+    -------
+    cache : ThumbnailCache
+        The updated cache
+    """
+
+    image_dir = Path(image_dir).absolute()
+    if thumbnail_dir is None:
+        thumbnail_dir = get_thumbnail_dir()
+    thumbnail_dir = Path(thumbnail_dir)
+    sizes = tuple(sorted(set(sizes)))
+
+    if not thumbnail_dir.is_dir():
+        thumbnail_dir.mkdir(parents=True, exist_ok=True)
+
+    old_cache = load_thumbnails(thumbnail_dir)
+    if old_cache is not None and not set(sizes) <= set(old_cache.sizes):
+        old_cache = None
+
+    entries = update_manifest(image_dir)
+    hashes = list()
+    offsets = {size: list() for size in sizes}
+    shapes = {size: list() for size in sizes}
+    data_paths = {size: get_data_path(thumbnail_dir, size)
+                  for size in sizes}
+    tmp_paths = {size: data_path.with_name(data_path.name + '.tmp')
+                 for size, data_path in data_paths.items()}
+    files = {size: tmp_paths[size].open('wb') for size in sizes}
+    positions = {size: 0 for size in sizes}
+
+    n_decoded = 0
+    try:
+        seen = set()
+        for entry in tqdm(entries, desc='Making thumbnails'):
+            sha1 = entry['sha1']
+            # Duplicated images share their thumbnails
+            if sha1 in seen:
+                continue
+
+            if old_cache is not None and sha1 in old_cache.slots:
+                thumbnails = [old_cache.get_by_hash(sha1, size)
+                              for size in sizes]
+            else:
+                image_path = image_dir.joinpath(entry['path'])
+                try:
+                    image = read_image(image_path)
+                except ValueError as error:
+                    tqdm.write('Skipping {}: {}'.format(image_path, error))
+                    continue
+                if image is None:
+                    tqdm.write('Skipping {}'.format(image_path))
+                    continue
+                n_decoded += 1
+                thumbnails = [make_thumbnail(image, size) for size in sizes]
+
+            seen.add(sha1)
+            hashes.append(sha1)
+            for size, thumbnail in zip(sizes, thumbnails):
+                files[size].write(np.ascontiguousarray(thumbnail).tobytes())
+                offsets[size].append(positions[size])
+                shapes[size].append(thumbnail.shape)
+                positions[size] += thumbnail.size
+    finally:
+        for f in files.values():
+            f.close()
+
+    # The memory maps of the old cache must be closed before the files
+    # are replaced
+    del old_cache
+
+    # index.json is removed first and written last, so an interrupted
+    # build is never loaded with the files of another build
+    json_path = thumbnail_dir.joinpath('index.json')
+    if json_path.is_file():
+        json_path.unlink()
+
+    for size in sizes:
+        os.replace(str(tmp_paths[size]), str(data_paths[size]))
+
+    index_arrays = {'hashes': np.array(hashes, dtype='U40')}
+    for size in sizes:
+        index_arrays['offsets_{}'.format(size)] = \
+            np.array(offsets[size], dtype=np.int64)
+        index_arrays['shapes_{}'.format(size)] = \
+            np.array(shapes[size], dtype=np.int64).reshape(-1, 3)
+
+    tmp_index_path = thumbnail_dir.joinpath('index.npz.tmp')
+    with tmp_index_path.open('wb') as f:
+        np.savez(f, **index_arrays)
+    os.replace(str(tmp_index_path),
+               str(thumbnail_dir.joinpath('index.npz')))
+
+    with json_path.open('w') as f:
+        json.dump({'image_dir': str(image_dir),
+                   'sizes': list(sizes),
+                   'n_images': len(hashes)}, f)
+
+    print('[INFO] Decoded {} of {} images'.format(n_decoded, len(hashes)))
+    print('[INFO] Saved to {}'.format(thumbnail_dir))
+
+    return load_thumbnails(thumbnail_dir)
+
+
+def load_thumbnails(thumbnail_dir=None):
+    """
+    Loads the thumbnail cache stored with build_thumbnails
+
+    Parameters
+    ----------
+    thumbnail_dir : None or Path
+        The directory of the cache.
+        If None, 'generated_data/thumbnails' is used
+
+    Returns
+    -------
+    cache : None or ThumbnailCache
+        The cache. None if no cache has been built
+    """
+
+    if thumbnail_dir is None:
+        thumbnail_dir = get_thumbnail_dir()
+    thumbnail_dir = Path(thumbnail_dir)
+
+    json_path = thumbnail_dir.joinpath('index.json')
+    if not json_path.is_file():
+        return None
+
+    with json_path.open('r') as f:
+        meta = json.load(f)
+
+    data = dict()
+    offsets = dict()
+    shapes = dict()
+    with np.load(str(thumbnail_dir.joinpath('index.npz'))) as arrays:
+        hashes = [str(sha1) for sha1 in arrays['hashes']]
+        for size in meta['sizes']:
+            offsets[size] = arrays['offsets_{}'.format(size)]
+            shapes[size] = arrays['shapes_{}'.format(size)]
+
+            data_path = get_data_path(thumbnail_dir, size)
+            if data_path.stat().st_size == 0:
+                # Empty files can not be memory mapped
+                data[size] = np.empty(0, dtype=np.uint8)
+            else:
+                data[size] = np.memmap(str(data_path),
+                                       dtype=np.uint8,
+                                       mode='r')
+
+    return ThumbnailCache(meta['image_dir'], hashes, data, offsets, shapes)
@@ -1,68 +1,483 @@
-import pickle
+import argparse
+import numpy as np
 from pathlib import Path
-from fruit_classifier.train.train_utils import get_image_paths
-from fruit_classifier.train.train_utils import get_data_and_labels
-from fruit_classifier.train.train_utils import get_model_input
+from fruit_classifier.execution.execution_utils import configure_session
+from fruit_classifier.models.models import ARCHITECTURES
+from fruit_classifier.train.train_utils import get_image_paths_and_labels
+from fruit_classifier.train.train_utils import load_data_and_labels
+from fruit_classifier.train.train_utils import \
+    get_data_and_labels_from_records
+from fruit_classifier.train.train_utils import \
+    get_image_hashes_and_splits
+from fruit_classifier.train.train_utils import encode_labels
+from fruit_classifier.train.train_utils import get_split_indices
+from fruit_classifier.train.train_utils import get_manifest_split_indices
 from fruit_classifier.train.train_utils import get_model
-from fruit_classifier.train.train_utils import train_model
+from fruit_classifier.train.train_utils import train_model_on_sequences
+from fruit_classifier.train.train_utils import load_checkpoint
+from fruit_classifier.train.train_utils import get_incremental_model
+from fruit_classifier.train.train_utils import get_incremental_indices
+from fruit_classifier.train.train_utils import load_training_record
+from fruit_classifier.train.train_utils import save_training_record
 from fruit_classifier.train.train_utils import plot_training
+from fruit_classifier.train.sequences import IndexSequence
+from fruit_classifier.train.parallel_utils import train_model_parallel
+from fruit_classifier.telemetry.telemetry_utils import get_telemetry_path
+from fruit_classifier.predict.predict_utils import load_label_encoder
 from fruit_classifier.preprocessing.preprocessing_utils import \
     get_image_generator
 
 
-def main():
+def main(epochs=25,
+         resume=False,
+         patience=5,
+         architecture='lenet',
+         alpha=1.0,
+         size=28,
+         records=False,
+         telemetry=None,
+         workers=1,
+         sync_period=1,
+         incremental=False,
+         replay=1.0):
     """
     This is the main module for training the fruit-classifier
 
     This method will
-    1. Load all the images from the 'raw_dir' directory
-        - NOTE: The images must be sorted in directories according to
-          class in 'raw_dir'
-    2. Split the data in train and validate
+    1. Load all the images from the 'cleaned_data' directory
+        - NOTE: The labels are read from the manifest of
+          'cleaned_data', which defaults to the directory names
+    2. Split the data in train and validate as the manifest does
     3. Initialize a model
     4. Train the model
     5. Plot the training
+
+    Parameters
+    ----------
+    epochs : int
+        The number of epochs to train
+    resume : bool
+        Whether or not to resume from the last checkpoint
+    patience : int or None
+        Number of epochs without improvement of the validation loss
+        before stopping early. If None, early stopping is disabled
+    architecture : str
+        The name of the architecture (see models.ARCHITECTURES)
+    alpha : float
+        Width multiplier of the architecture
+    size : int
+        The pixel height and width of the model input
+    records : bool
+        Whether to stream the images from the record shards in
+        'generated_data/records' instead of reading cleaned_data
+    telemetry : None or str
+        Destination of the training telemetry, either a JSON lines file
+        or an address on the form 'udp://host:port'.
+        If None, no telemetry is emitted
+    workers : int
+        The number of data-parallel worker processes
+    sync_period : int
+        Number of steps between each averaging of the weights of the
+        workers
+    incremental : bool
+        Whether to fine-tune the trained model on the images added
+        since it was trained (see train_incremental) instead of
+        training from scratch
+    replay : float
+        The number of old images replayed per new image when training
+        incrementally
     """
 
+    if incremental and records:
+        raise ValueError('Incremental training needs the manifest of '
+                         'cleaned_data, and can not read records')
+
     generated_data_dir = \
         Path(__file__).absolute().parents[2].joinpath('generated_data')
     cleaned_dir = generated_data_dir.joinpath('cleaned_data')
-    preprocessed_dir = generated_data_dir.joinpath('preprocessed_data')
-
-    # Grab the image paths and randomly shuffle them
-    image_paths = get_image_paths(cleaned_dir)
-
-    # Load the data and and label and split to train and validation
-    data_path = preprocessed_dir.joinpath('data.pkl')
-    labels_path = preprocessed_dir.joinpath('labels.pkl')
-    if data_path.is_file() and labels_path.is_file():
-        with data_path.open('rb') as f:
-            data = pickle.load(f)
-        with labels_path.open('rb') as f:
-            labels = pickle.load(f)
+
+    if records:
+        # Stream the shuffled images from the shards
+        data, labels = get_data_and_labels_from_records(
+            generated_data_dir.joinpath('records'), size, size)
     else:
-        data, labels = get_data_and_labels(image_paths)
+        # Grab the image paths and randomly shuffle them
+        image_paths, image_labels = \
+            get_image_paths_and_labels(cleaned_dir)
 
-    x_train, x_val, y_train, y_val = \
-        get_model_input(data, labels)
+        image_hashes, image_splits = \
+            get_image_hashes_and_splits(cleaned_dir, image_paths)
 
-    # Construct the image generator for data augmentation
-    image_generator = get_image_generator()
+        # Load the data and and label and split to train and validation
+        data, labels = load_data_and_labels(image_paths,
+                                            size,
+                                            size,
+                                            image_labels,
+                                            image_hashes)
+
+    if incremental:
+        history = train_incremental(data,
+                                    labels,
+                                    image_hashes,
+                                    image_splits,
+                                    epochs=epochs,
+                                    replay=replay,
+                                    patience=patience,
+                                    telemetry=telemetry)
+        if history is not None:
+            plot_training(history)
+        return
+
+    # The split is kept as indices into the data, and the labels as
+    # integers, so the data is never copied as a whole
+    encoded_labels = encode_labels(labels)
+    if records:
+        train_indices, val_indices = get_split_indices(len(labels))
+    else:
+        # The split of the manifest is the one incremental training
+        # uses, so the images validated on are never trained on
+        train_indices, val_indices = \
+            get_manifest_split_indices(image_splits)
 
-    # Initialize the model
-    model = get_model(len(set(labels)))
+    history = train(data,
+                    encoded_labels,
+                    train_indices,
+                    val_indices,
+                    epochs=epochs,
+                    resume=resume,
+                    patience=patience,
+                    architecture=architecture,
+                    alpha=alpha,
+                    size=size,
+                    telemetry=telemetry,
+                    workers=workers,
+                    sync_period=sync_period)
 
-    # Train the network
-    history = train_model(model,
-                          image_generator,
-                          x_train,
-                          y_train,
-                          x_val,
-                          y_val)
+    if not records:
+        # Remember which images the model has seen, so that later
+        # incremental training only needs the new ones
+        save_training_record(np.unique(labels),
+                             np.asarray(image_hashes)[train_indices])
 
     # Plot the training loss and accuracy
     plot_training(history)
 
 
+def train_incremental(data,
+                      labels,
+                      image_hashes,
+                      image_splits,
+                      epochs=3,
+                      replay=1.0,
+                      patience=5,
+                      telemetry=None):
+    """
+    Fine-tunes the trained model on the images added since it was trained
+
+    The new images are found by comparing their hashes with the record
+    stored when the model was last trained. New classes get a new
+    output, and the label encoder is extended with them.
+    The validation split is the one of the manifest, which does not
+    change when images are added.
+
+    Parameters
+    ----------
+    data : np.array, shape (n_images, size, size, channels)
+        The pre-processed images (may be a np.memmap)
+    labels : np.array, shape (n_images,)
+        The labels
+    image_hashes : list
+        The SHA-1 of each image
+    image_splits : list
+        The manifest split of each image
+    epochs : int
+        The number of epochs to fine-tune
+    replay : float
+        The number of old images replayed per new image
+    patience : int or None
+        Number of epochs without improvement of the validation loss
+        before stopping early. If None, early stopping is disabled
+    telemetry : None or str
+        Destination of the training telemetry.
+        If None, no telemetry is emitted
+
+    Returns
+    -------
+    history : None or History
+        History object containing
+        - loss
+        - val_loss
+        - acc
+        - val_acc
+        None if there was nothing new to train on
+    """
+
+    record = load_training_record()
+    if record is None:
+        # NOTE: The model was trained before the record existed, so
+        #       every image is treated as new
+        print('[INFO] No record of the trained images, fine-tuning on '
+              'all of them')
+        old_classes = [str(c) for c in load_label_encoder().classes_]
+        trained_hashes = list()
+    else:
+        old_classes = record['classes']
+        trained_hashes = record['hashes']
+
+    # The label encoder sorts the classes, as np.unique does
+    new_classes = np.unique(np.concatenate((np.asarray(labels, dtype=str),
+                                            old_classes)))
+    added_classes = sorted(set(new_classes) - set(old_classes))
+
+    train_indices, val_indices, new_indices = \
+        get_incremental_indices(image_hashes,
+                                image_splits,
+                                trained_hashes,
+                                replay=replay)
+
+    if len(new_indices) == 0 and not added_classes:
+        print('[INFO] No new images, the model is up to date')
+        return None
+
+    print('[INFO] Fine-tuning on {} new and {} replayed images'.format(
+        len(new_indices), len(train_indices) - len(new_indices)))
+    if added_classes:
+        print('[INFO] Adding the classes {}'.format(
+            ', '.join(added_classes)))
+
+    encoded_labels = encode_labels(labels, classes=new_classes)
+    configure_session()
+    model = get_incremental_model(old_classes, new_classes, epochs=epochs)
+
+    train_sequence = IndexSequence(data,
+                                   encoded_labels,
+                                   train_indices,
+                                   image_generator=get_image_generator(),
+                                   shuffle=True,
+                                   seed=42)
+    val_sequence = IndexSequence(data, encoded_labels, val_indices)
+
+    history = train_model_on_sequences(model,
+                                       train_sequence,
+                                       val_sequence,
+                                       epochs=epochs,
+                                       patience=patience,
+                                       telemetry=telemetry)
+
+    trained_hashes = set(trained_hashes)
+    trained_hashes.update(np.asarray(image_hashes)[train_indices])
+    save_training_record(new_classes, trained_hashes)
+
+    return history
+
+
+def train(data,
+          encoded_labels,
+          train_indices,
+          val_indices,
+          epochs=25,
+          resume=False,
+          patience=5,
+          architecture='lenet',
+          alpha=1.0,
+          size=28,
+          telemetry=None,
+          workers=1,
+          sync_period=1):
+    """
+    Trains the model on a split of the data
+
+    The model is saved to 'generated_data/models/model.h5'
+
+    Parameters
+    ----------
+    data : np.array, shape (n_images, size, size, channels)
+        The pre-processed images (may be a np.memmap)
+    encoded_labels : np.array, shape (n_images,)
+        The integer encoded labels
+    train_indices : np.array
+        The indices of the training samples
+    val_indices : np.array
+        The indices of the validation samples
+    epochs : int
+        The number of epochs to train
+    resume : bool
+        Whether or not to resume from the last checkpoint
+    patience : int or None
+        Number of epochs without improvement of the validation loss
+        before stopping early. If None, early stopping is disabled
+    architecture : str
+        The name of the architecture (see models.ARCHITECTURES)
+    alpha : float
+        Width multiplier of the architecture
+    size : int
+        The pixel height and width of the model input
+    telemetry : None or str
+        Destination of the training telemetry, either a JSON lines file
+        or an address on the form 'udp://host:port'.
+        If None, no telemetry is emitted
+    workers : int
+        The number of data-parallel worker processes
+    sync_period : int
+        Number of steps between each averaging of the weights of the
+        workers
+
+    Returns
+    -------
+    history : History
+        History object containing
+        - loss
+        - val_loss
+        - acc
+        - val_acc
+    """
+
+    if workers > 1:
+        # Train in data-parallel worker processes
+        history = train_model_parallel(data,
+                                       encoded_labels,
+                                       train_indices,
+                                       val_indices,
+                                       n_workers=workers,
+                                       period=sync_period,
+                                       architecture=architecture,
+                                       alpha=alpha,
+                                       width=size,
+                                       height=size,
+                                       epochs=epochs,
+                                       patience=patience,
+                                       resume=resume,
+                                       telemetry=telemetry)
+    else:
+        # Construct the image generator for data augmentation
+        image_generator = get_image_generator()
+
+        train_sequence = IndexSequence(data,
+                                       encoded_labels,
+                                       train_indices,
+                                       image_generator=image_generator,
+                                       shuffle=True,
+                                       seed=42)
+        val_sequence = IndexSequence(data, encoded_labels, val_indices)
+
+        # Initialize the model
+        configure_session()
+        model = None
+        initial_epoch = 0
+        if resume:
+            model, initial_epoch = load_checkpoint()
+            if model is None:
+                print('[INFO] No checkpoint found, starting from scratch')
+
+        if model is None:
+            model = get_model(len(set(encoded_labels)),
+                              width=size,
+                              height=size,
+                              epochs=epochs,
+                              architecture=architecture,
+                              alpha=alpha,
+                              sparse_labels=True)
+
+        # Train the network
+        history = train_model_on_sequences(model,
+                                           train_sequence,
+                                           val_sequence,
+                                           epochs=epochs,
+                                           initial_epoch=initial_epoch,
+                                           patience=patience,
+                                           telemetry=telemetry)
+
+    return history
+
+
 if __name__ == '__main__':
-    main()
+    # Construct the argument parse and parse the arguments
+    parser = argparse.ArgumentParser(description='Train the classifier')
+    parser.add_argument('-e',
+                        '--epochs',
+                        type=int,
+                        required=False,
+                        help='The number of epochs to train. Defaults '
+                             'to 25, or 3 when training incrementally')
+    parser.add_argument('-r',
+                        '--resume',
+                        action='store_true',
+                        help='Resume training from the last checkpoint')
+    parser.add_argument('-p',
+                        '--patience',
+                        type=int,
+                        default=5,
+                        help='Epochs without improvement of the '
+                             'validation loss before stopping early. '
+                             'Use a negative number to disable')
+    parser.add_argument('-a',
+                        '--architecture',
+                        default='lenet',
+                        choices=sorted(ARCHITECTURES),
+                        help='The model architecture')
+    parser.add_argument('--alpha',
+                        type=float,
+                        default=1.0,
+                        help='Width multiplier of the architecture')
+    parser.add_argument('-s',
+                        '--size',
+                        type=int,
+                        default=28,
+                        help='The pixel height and width of the model '
+                             'input')
+    parser.add_argument('--records',
+                        action='store_true',
+                        help='Read the images from the record shards '
+                             'made by python -m fruit_classifier.records')
+    parser.add_argument('-t',
+                        '--telemetry',
+                        nargs='?',
+                        const=str(get_telemetry_path()),
+                        required=False,
+                        help='Stream training telemetry to a JSON lines '
+                             'file or to udp://host:port. Defaults to '
+                             'generated_data/telemetry/training.jsonl '
+                             'when no destination is given')
+    parser.add_argument('-w',
+                        '--workers',
+                        type=int,
+                        default=1,
+                        help='The number of data-parallel worker '
+                             'processes')
+    parser.add_argument('-k',
+                        '--sync-period',
+                        type=int,
+                        default=1,
+                        help='Steps between each averaging of the '
+                             'weights of the workers')
+    parser.add_argument('-i',
+                        '--incremental',
+                        action='store_true',
+                        help='Fine-tune the trained model on the images '
+                             'added since it was trained')
+    parser.add_argument('--replay',
+                        type=float,
+                        default=1.0,
+                        help='Old images replayed per new image when '
+                             'training incrementally')
+    args = parser.parse_args()
+
+    patience_ = args.patience if args.patience >= 0 else None
+
+    if args.epochs is None:
+        epochs_ = 3 if args.incremental else 25
+    else:
+        epochs_ = args.epochs
+
+    main(epochs=epochs_,
+         resume=args.resume,
+         patience=patience_,
+         architecture=args.architecture,
+         alpha=args.alpha,
+         size=args.size,
+         records=args.records,
+         telemetry=args.telemetry,
+         workers=args.workers,
+         sync_period=args.sync_period,
+         incremental=args.incremental,
+         replay=args.replay)
@@ -0,0 +1,392 @@
+import json
+import os
+import time
+import numpy as np
+from pathlib import Path
+from keras.callbacks import Callback
+from fruit_classifier.telemetry.telemetry_utils import TelemetryWriter
+from fruit_classifier.telemetry.telemetry_utils import get_rss
+
+
+class EpochCheckpoint(Callback):
+    """
+    Periodically saves the full model together with the epoch counter
+
+    The model is stored with its optimizer state, and the state of the
+    early stopping (the epochs waited, the best validation loss and the
+    best weights) is stored with it. Training can therefore be resumed
+    from the checkpoint as if it was never interrupted.
+    All files are written to a temporary file first and then moved
+    in place, so that a crash during saving never corrupts the last
+    good checkpoint.
+
+    NOTE: The early stopping callback must come before this one, so
+          that its state is up to date when it is stored, and is not
+          reset after it is restored
+
+    Parameters
+    ----------
+    checkpoint_dir : Path
+        Directory to store the checkpoint in
+    period : int
+        Number of epochs between each checkpoint
+    early_stopping : None or EarlyStopping
+        The early stopping callback to store the state of
+    resume : bool
+        Whether to restore the stored state of early_stopping when
+        training begins
+    """
+
+    def __init__(self,
+                 checkpoint_dir,
+                 period=1,
+                 early_stopping=None,
+                 resume=False):
+        super(EpochCheckpoint, self).__init__()
+        self.checkpoint_dir = Path(checkpoint_dir)
+        self.period = period
+        self.early_stopping = early_stopping
+        self.resume = resume
+
+    def on_train_begin(self, logs=None):
+        if not self.resume or self.early_stopping is None:
+            return
+
+        state_path = self.checkpoint_dir.joinpath('checkpoint.json')
+        if not state_path.is_file():
+            return
+        with state_path.open('r') as f:
+            state = json.load(f).get('early_stopping')
+        if state is None:
+            return
+
+        self.early_stopping.wait = state['wait']
+        self.early_stopping.best = state['best']
+        weights_path = self.checkpoint_dir.joinpath('checkpoint_best.npz')
+        if weights_path.is_file():
+            with np.load(str(weights_path)) as weights:
+                self.early_stopping.best_weights = \
+                    [weights['arr_{}'.format(i)]
+                     for i in range(len(weights.files))]
+
+    def on_epoch_end(self, epoch, logs=None):
+        if (epoch + 1) % self.period != 0:
+            return
+
+        if not self.checkpoint_dir.is_dir():
+            self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+
+        model_path = self.checkpoint_dir.joinpath('checkpoint.h5')
+        tmp_model_path = self.checkpoint_dir.joinpath('checkpoint.h5.tmp')
+        self.model.save(str(tmp_model_path), include_optimizer=True)
+        os.replace(str(tmp_model_path), str(model_path))
+
+        state = {'epoch': epoch + 1}
+        if self.early_stopping is not None:
+            state['early_stopping'] = \
+                {'wait': self.early_stopping.wait,
+                 'best': float(self.early_stopping.best)}
+            best_weights = self.early_stopping.best_weights
+            if best_weights is not None:
+                weights_path = \
+                    self.checkpoint_dir.joinpath('checkpoint_best.npz')
+                # NOTE: np.savez appends .npz to names without it
+                tmp_weights_path = \
+                    self.checkpoint_dir.joinpath('checkpoint_best.tmp.npz')
+                np.savez(str(tmp_weights_path), *best_weights)
+                os.replace(str(tmp_weights_path), str(weights_path))
+
+        # NOTE: The state is written after the model, so the stored
+        #       epoch never points past the stored weights
+        state_path = self.checkpoint_dir.joinpath('checkpoint.json')
+        tmp_state_path = self.checkpoint_dir.joinpath('checkpoint.json.tmp')
+        with tmp_state_path.open('w') as f:
+            json.dump(state, f)
+        os.replace(str(tmp_state_path), str(state_path))
+
+
+class Telemetry(Callback):
+    """
+    Streams per-batch and per-epoch training telemetry
+
+    The time between the end of a batch and the start of the next is
+    the time spent waiting for the data (loading, decoding and
+    augmenting), and the time between the start and the end of a batch
+    is the time spent computing it. Comparing the two shows whether
+    training is input-bound or compute-bound.
+
+    Parameters
+    ----------
+    destination : str or Path
+        Either the path of a JSON lines file, or an address on the
+        form 'udp://host:port'
+    batch_period : int
+        Number of batches between each batch record.
+        The epoch records always cover all the batches
+    """
+
+    def __init__(self, destination, batch_period=1):
+        super(Telemetry, self).__init__()
+        self.destination = destination
+        self.batch_period = batch_period
+        self.writer = None
+        self.epoch = 0
+        self.last_time = None
+        self.batch_start = None
+        self.epoch_start = None
+        self.epoch_images = 0
+        self.epoch_data_wait = 0.0
+        self.epoch_compute = 0.0
+
+    def on_train_begin(self, logs=None):
+        self.writer = TelemetryWriter(self.destination)
+        self.writer.write({'type': 'start',
+                           'time': time.time(),
+                           'epochs': self.params.get('epochs')})
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch = epoch
+        self.epoch_start = time.perf_counter()
+        self.last_time = self.epoch_start
+        self.epoch_images = 0
+        self.epoch_data_wait = 0.0
+        self.epoch_compute = 0.0
+
+    def on_batch_begin(self, batch, logs=None):
+        self.batch_start = time.perf_counter()
+
+    def on_batch_end(self, batch, logs=None):
+        logs = logs or dict()
+        end = time.perf_counter()
+
+        data_wait = self.batch_start - self.last_time
+        compute = end - self.batch_start
+        self.last_time = end
+
+        size = int(logs.get('size', 0))
+        self.epoch_images += size
+        self.epoch_data_wait += data_wait
+        self.epoch_compute += compute
+
+        if batch % self.batch_period != 0:
+            return
+
+        record = {'type': 'batch',
+                  'time': time.time(),
+                  'epoch': self.epoch,
+                  'batch': int(batch),
+                  'size': size,
+                  'data_wait': data_wait,
+                  'compute': compute,
+                  'images_per_sec': size / (data_wait + compute),
+                  'rss': get_rss()}
+        record.update(_get_metrics(logs))
+        self.writer.write(record)
+
+    def on_epoch_end(self, epoch, logs=None):
+        duration = time.perf_counter() - self.epoch_start
+        busy = self.epoch_data_wait + self.epoch_compute
+
+        record = {'type': 'epoch',
+                  'time': time.time(),
+                  'epoch': epoch,
+                  'images': self.epoch_images,
+                  'duration': duration,
+                  'data_wait': self.epoch_data_wait,
+                  'compute': self.epoch_compute,
+                  'images_per_sec': self.epoch_images / busy
+                  if busy > 0 else 0.0,
+                  'rss': get_rss()}
+        record.update(_get_metrics(logs or dict()))
+        self.writer.write(record)
+
+    def on_train_end(self, logs=None):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+class WeightAveraging(Callback):
+    """
+    Averages the weights of data-parallel workers through shared memory
+
+    Every worker trains the same model on its own shard of the batches.
+    Every period steps (and at the end of every epoch) each worker
+    writes its weights and optimizer moments to its slot of the shared
+    array, and continues from the mean of all the slots. With period=1
+    the workers take the same steps as a single process using the
+    combined batch, up to the second moments of the optimizer.
+
+    The weights of the first worker are broadcast to the others when
+    training begins, and the first worker decides when to stop, so
+    that only it needs to validate.
+
+    Parameters
+    ----------
+    shared_weights : multiprocessing.RawArray
+        Array of 'f' with one slot of slot_size values per worker
+    slot_size : int
+        The number of values in each slot
+    barrier : multiprocessing.Barrier
+        Barrier shared by all the workers
+    stop_flag : multiprocessing.Value
+        Flag the first worker sets when training should stop
+    rank : int
+        The index of this worker
+    n_workers : int
+        The number of workers
+    period : int
+        Number of steps between each averaging
+    """
+
+    def __init__(self,
+                 shared_weights,
+                 slot_size,
+                 barrier,
+                 stop_flag,
+                 rank,
+                 n_workers,
+                 period=1):
+        super(WeightAveraging, self).__init__()
+        self.slots = np.frombuffer(shared_weights,
+                                   dtype=np.float32).reshape(n_workers,
+                                                             slot_size)
+        self.barrier = barrier
+        self.stop_flag = stop_flag
+        self.rank = rank
+        self.period = period
+
+    def _get_arrays(self):
+        """
+        Returns the weights and the optimizer moments to average
+
+        Returns
+        -------
+        arrays : list
+            The model weights followed by the optimizer weights which
+            are not scalars (e.g. not the iteration counter)
+        """
+
+        return get_averaged_arrays(self.model)
+
+    def _set_arrays(self, flat):
+        """
+        Sets the weights and optimizer moments from a flat array
+
+        Parameters
+        ----------
+        flat : np.array
+            The values in the order given by _get_arrays
+        """
+
+        model_weights = self.model.get_weights()
+        optimizer_weights = self.model.optimizer.get_weights()
+
+        offset = 0
+        for i, w in enumerate(model_weights):
+            model_weights[i] = flat[offset:offset + w.size].reshape(w.shape)
+            offset += w.size
+        for i, w in enumerate(optimizer_weights):
+            if np.ndim(w) > 0:
+                optimizer_weights[i] = \
+                    flat[offset:offset + w.size].reshape(w.shape)
+                offset += w.size
+
+        self.model.set_weights(model_weights)
+        if optimizer_weights:
+            self.model.optimizer.set_weights(optimizer_weights)
+
+    def _write(self):
+        """
+        Writes the arrays of this worker to its slot
+
+        Returns
+        -------
+        size : int
+            The number of values written
+        """
+
+        flat = np.concatenate([w.ravel() for w in self._get_arrays()])
+        if flat.size > self.slots.shape[1]:
+            raise ValueError('The model and optimizer need {} values, but '
+                             'the slots only hold {}'.format(
+                                 flat.size, self.slots.shape[1]))
+        self.slots[self.rank, :flat.size] = flat
+
+        return flat.size
+
+    def average(self):
+        """
+        Replaces the weights of this worker with the mean of all workers
+        """
+
+        size = self._write()
+        self.barrier.wait()
+        self._set_arrays(self.slots[:, :size].mean(axis=0))
+        # NOTE: Nobody may write the next weights before everybody has
+        #       read the current ones
+        self.barrier.wait()
+
+    def on_train_begin(self, logs=None):
+        if self.rank == 0:
+            self._write()
+        self.barrier.wait()
+        if self.rank != 0:
+            self._set_arrays(self.slots[0])
+        self.barrier.wait()
+
+    def on_batch_end(self, batch, logs=None):
+        if (batch + 1) % self.period == 0 or \
+                batch + 1 == self.params['steps']:
+            self.average()
+
+    def on_epoch_end(self, epoch, logs=None):
+        if self.rank == 0:
+            self.stop_flag.value = int(bool(self.model.stop_training))
+        self.barrier.wait()
+        self.model.stop_training = bool(self.stop_flag.value)
+
+
+def get_averaged_arrays(model):
+    """
+    Returns the weights and the optimizer moments WeightAveraging shares
+
+    The optimizer only creates its weights when the train function is
+    made (e.g. Adam also makes a placeholder per weight for amsgrad),
+    so this must be called after that
+
+    Parameters
+    ----------
+    model : Model
+        The compiled model
+
+    Returns
+    -------
+    arrays : list
+        The model weights followed by the optimizer weights which are
+        not scalars (e.g. not the iteration counter)
+    """
+
+    arrays = model.get_weights()
+    arrays += [w for w in model.optimizer.get_weights() if np.ndim(w) > 0]
+
+    return arrays
+
+
+def _get_metrics(logs):
+    """
+    Returns the metrics of the Keras logs as floats
+
+    Parameters
+    ----------
+    logs : dict
+        The logs passed to the callback
+
+    Returns
+    -------
+    metrics : dict
+        The metrics without the batch number and size
+    """
+
+    return {key: float(value) for key, value in logs.items()
+            if key not in ('batch', 'size')}
@@ -0,0 +1,405 @@
+import os
+import queue
+import multiprocessing
+import numpy as np
+from keras import backend as K
+from keras.callbacks import History
+from keras.utils import Sequence
+from fruit_classifier.execution.execution_utils import configure_session
+from fruit_classifier.execution.execution_utils import load_execution_profile
+from fruit_classifier.models.models import get_architecture
+from fruit_classifier.train.callbacks import WeightAveraging
+from fruit_classifier.train.callbacks import get_averaged_arrays
+from fruit_classifier.train.sequences import IndexSequence
+from fruit_classifier.train.train_utils import compile_model
+from fruit_classifier.train.train_utils import get_model
+from fruit_classifier.train.train_utils import load_checkpoint
+from fruit_classifier.train.train_utils import train_model_on_sequences
+from fruit_classifier.preprocessing.preprocessing_utils import \
+    get_image_generator
+
+
+def get_worker_profile(n_workers):
+    """
+    Returns the thread settings of each data-parallel worker
+
+    A stored profile (or the environment variables) is used as is, so
+    the profile should be tuned with
+    python -m fruit_classifier.execution -p <n_workers>.
+    Otherwise the cores are split evenly between the workers.
+
+    Parameters
+    ----------
+    n_workers : int
+        The number of workers sharing the cores
+
+    Returns
+    -------
+    profile : dict
+        Dictionary containing
+        - intra_op_threads
+        - inter_op_threads
+    """
+
+    profile = load_execution_profile()
+
+    if profile['intra_op_threads'] == 0:
+        profile['intra_op_threads'] = max(os.cpu_count() // n_workers, 1)
+    if profile['inter_op_threads'] == 0:
+        profile['inter_op_threads'] = 1
+
+    return profile
+
+
+def get_slot_size(n_classes, width, height, channels, architecture, alpha):
+    """
+    Returns the number of values each worker shares
+
+    The slots hold the weights and all the optimizer weights which are
+    averaged, counted on a compiled model with its train function made,
+    as the workers have when they first write to the slots
+
+    Parameters
+    ----------
+    n_classes : int
+        Number of classes to use in the model
+    width : int
+        The pixel width of the images
+    height : int
+        The pixel height of the images
+    channels : int
+        The number of channels in the image
+    architecture : str
+        The name of the architecture (see models.ARCHITECTURES)
+    alpha : float
+        Width multiplier of the architecture
+
+    Returns
+    -------
+    slot_size : int
+        The number of float32 values in each slot
+    """
+
+    model = get_architecture(architecture,
+                             height=height,
+                             width=width,
+                             channels=channels,
+                             classes=n_classes,
+                             alpha=alpha)
+    compile_model(model, sparse_labels=True)
+    # The optimizer weights are only created with the train function
+    model._make_train_function()
+    slot_size = sum(w.size for w in get_averaged_arrays(model))
+    K.clear_session()
+
+    return slot_size
+
+
+def train_worker(rank,
+                 n_workers,
+                 data,
+                 labels,
+                 train_indices,
+                 val_indices,
+                 model_kwargs,
+                 fit_kwargs,
+                 batch_size,
+                 period,
+                 resume,
+                 seed,
+                 shared_weights,
+                 slot_size,
+                 barrier,
+                 stop_flag,
+                 results):
+    """
+    Trains one data-parallel worker
+
+    The first worker validates, checkpoints, stops early and saves the
+    model exactly as single-process training does. The other workers
+    only train on their shard and follow the first worker.
+
+    Parameters
+    ----------
+    rank : int
+        The index of this worker
+    n_workers : int
+        The number of workers
+    data : str or np.array
+        The path of a .npy file to memory map, or the data itself
+    labels : np.array, shape (n_images,)
+        The integer encoded labels
+    train_indices : np.array
+        The indices of all the training samples
+    val_indices : np.array
+        The indices of the validation samples
+    model_kwargs : dict
+        Keyword arguments passed to get_model
+    fit_kwargs : dict
+        Keyword arguments passed to train_model_on_sequences
+    batch_size : int
+        The combined batch size of all the workers
+    period : int
+        Number of steps between each averaging of the weights
+    resume : bool
+        Whether to resume from the last checkpoint
+    seed : int
+        The seed of the shuffling (offset by the rank)
+    shared_weights : multiprocessing.RawArray
+        The slots of the workers
+    slot_size : int
+        The number of values in each slot
+    barrier : multiprocessing.Barrier
+        Barrier shared by all the workers
+    stop_flag : multiprocessing.Value
+        Flag the first worker sets when training should stop
+    results : multiprocessing.Queue
+        The first worker puts its history here
+    """
+
+    try:
+        if isinstance(data, str):
+            data = np.load(data, mmap_mode='r')
+
+        profile = get_worker_profile(n_workers)
+
+        # Every worker takes every n_workers'th training sample, and
+        # contributes 1/n_workers of each combined batch
+        worker_batch_size = max(batch_size // n_workers, 1)
+        steps_per_epoch = max(len(train_indices) // batch_size, 1)
+        train_sequence = IndexSequence(data,
+                                       labels,
+                                       train_indices[rank::n_workers],
+                                       batch_size=worker_batch_size,
+                                       image_generator=get_image_generator(),
+                                       shuffle=True,
+                                       seed=seed + rank)
+        train_sequence = _Steps(train_sequence, steps_per_epoch)
+
+        configure_session(profile)
+        model = None
+        initial_epoch = 0
+        if resume:
+            # NOTE: Every worker resumes from the same checkpoint, so the
+            #       optimizer state is the same in all of them
+            model, initial_epoch = load_checkpoint()
+        if model is None:
+            model = get_model(**model_kwargs)
+
+        averaging = WeightAveraging(shared_weights,
+                                    slot_size,
+                                    barrier,
+                                    stop_flag,
+                                    rank,
+                                    n_workers,
+                                    period=period)
+
+        if rank == 0:
+            val_sequence = IndexSequence(data,
+                                         labels,
+                                         val_indices,
+                                         batch_size=batch_size)
+            history = train_model_on_sequences(
+                model,
+                train_sequence,
+                val_sequence,
+                initial_epoch=initial_epoch,
+                callbacks=[averaging],
+                **fit_kwargs)
+            results.put((history.history, history.params))
+        else:
+            model.fit_generator(train_sequence,
+                                steps_per_epoch=steps_per_epoch,
+                                epochs=fit_kwargs['epochs'],
+                                initial_epoch=initial_epoch,
+                                callbacks=[averaging],
+                                verbose=0)
+    except BaseException:
+        # Release the other workers waiting for this one
+        barrier.abort()
+        raise
+
+
+class _Steps(Sequence):
+    """
+    Makes a sequence report a given number of steps per epoch
+
+    The shards of the workers may differ by a batch, but all the
+    workers must take the same number of steps for the averaging to
+    line up. The wrapped sequence is reshuffled after every epoch, so
+    a batch left out in one epoch is used in the next
+
+    Parameters
+    ----------
+    sequence : IndexSequence
+        The sequence to wrap
+    steps : int
+        The number of steps per epoch
+    """
+
+    def __init__(self, sequence, steps):
+        self.sequence = sequence
+        self.steps = steps
+
+    def __len__(self):
+        return self.steps
+
+    def __getitem__(self, index):
+        return self.sequence[index % len(self.sequence)]
+
+    def on_epoch_end(self):
+        self.sequence.on_epoch_end()
+
+
+def train_model_parallel(data,
+                         labels,
+                         train_indices,
+                         val_indices,
+                         n_workers=2,
+                         period=1,
+                         batch_size=32,
+                         architecture='lenet',
+                         alpha=1.0,
+                         width=28,
+                         height=28,
+                         channels=3,
+                         epochs=25,
+                         patience=5,
+                         resume=False,
+                         seed=42,
+                         telemetry=None):
+    """
+    Trains the model in several data-parallel processes
+
+    The workers average their weights every period steps through
+    shared memory (see WeightAveraging). The model is saved to
+    'generated_data/models/model.h5' as with train_model.
+
+    Parameters
+    ----------
+    data : np.array, shape (n_images, height, width, channels)
+        The images. A memory map is opened by each worker instead of
+        being copied to it
+    labels : np.array, shape (n_images,)
+        The integer encoded labels
+    train_indices : np.array
+        The indices of the training samples
+    val_indices : np.array
+        The indices of the validation samples
+    n_workers : int
+        The number of worker processes
+    period : int
+        Number of steps between each averaging of the weights
+    batch_size : int
+        The combined batch size of all the workers
+    architecture : str
+        The name of the architecture (see models.ARCHITECTURES)
+    alpha : float
+        Width multiplier of the architecture
+    width : int
+        The pixel width of the images
+    height : int
+        The pixel height of the images
+    channels : int
+        The number of channels in the image
+    epochs : int
+        The number of epochs
+    patience : int or None
+        Number of epochs without improvement of the validation loss
+        before stopping early. If None, early stopping is disabled
+    resume : bool
+        Whether to resume from the last checkpoint
+    seed : int
+        The seed of the shuffling
+    telemetry : None or str
+        Destination of the telemetry of the first worker
+
+    Returns
+    -------
+    history : History
+        History object of the first worker containing
+        - loss
+        - val_loss
+        - acc
+        - val_acc
+    """
+
+    n_classes = len(np.unique(labels))
+    model_kwargs = {'n_classes': n_classes,
+                    'width': width,
+                    'height': height,
+                    'channels': channels,
+                    'epochs': epochs,
+                    'architecture': architecture,
+                    'alpha': alpha,
+                    'sparse_labels': True}
+    fit_kwargs = {'epochs': epochs,
+                  'patience': patience,
+                  'telemetry': telemetry}
+
+    if isinstance(data, np.memmap):
+        data = data.filename
+
+    slot_size = get_slot_size(n_classes,
+                              width,
+                              height,
+                              channels,
+                              architecture,
+                              alpha)
+
+    context = multiprocessing.get_context('spawn')
+    shared_weights = context.RawArray('f', n_workers * slot_size)
+    barrier = context.Barrier(n_workers)
+    stop_flag = context.Value('i', 0, lock=False)
+    results = context.Queue()
+
+    print('[INFO] Training with {} workers, averaging every {} '
+          'steps'.format(n_workers, period))
+
+    workers = [context.Process(target=train_worker,
+                               args=(rank,
+                                     n_workers,
+                                     data,
+                                     labels,
+                                     train_indices,
+                                     val_indices,
+                                     model_kwargs,
+                                     fit_kwargs,
+                                     batch_size,
+                                     period,
+                                     resume,
+                                     seed,
+                                     shared_weights,
+                                     slot_size,
+                                     barrier,
+                                     stop_flag,
+                                     results))
+               for rank in range(n_workers)]
+    for worker in workers:
+        worker.start()
+
+    try:
+        while True:
+            try:
+                history_dict, params = results.get(timeout=1)
+                break
+            except queue.Empty:
+                if any(worker.exitcode not in (None, 0)
+                       for worker in workers):
+                    raise RuntimeError('A training worker failed')
+                if all(worker.exitcode == 0 for worker in workers):
+                    raise RuntimeError('The training workers stopped '
+                                       'without a result')
+    except BaseException:
+        for worker in workers:
+            worker.terminate()
+        raise
+
+    for worker in workers:
+        worker.join()
+
+    history = History()
+    history.history = history_dict
+    history.params = params
+
+    return history
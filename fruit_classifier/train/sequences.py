@@ -0,0 +1,74 @@
+import math
+import numpy as np
+from keras import backend as K
+from keras.utils import Sequence
+
+
+class IndexSequence(Sequence):
+    """
+    Batches gathered on demand from the data through an index array
+
+    The data is never copied as a whole. Each batch is gathered with
+    its indices when requested, so the data may be a memory map.
+
+    Parameters
+    ----------
+    data : np.array, shape (n_images, height, width, channels)
+        The images (may be a np.memmap)
+    labels : np.array, shape (n_images,) or (n_images, n_classes)
+        The integer encoded or one-hot encoded labels
+    indices : np.array, shape (n_samples,)
+        The indices of the samples in this sequence
+    batch_size : int
+        The batch size
+    image_generator : None or ImageDataGenerator
+        The image data generator used for augmentation.
+        If None, the images are not augmented
+    shuffle : bool
+        Whether or not to shuffle the samples after each epoch
+    seed : None or int
+        The seed of the shuffling
+    """
+
+    def __init__(self,
+                 data,
+                 labels,
+                 indices,
+                 batch_size=32,
+                 image_generator=None,
+                 shuffle=False,
+                 seed=None):
+        self.data = data
+        self.labels = labels
+        self.indices = np.array(indices)
+        self.batch_size = batch_size
+        self.image_generator = image_generator
+        self.shuffle = shuffle
+        self.random_state = np.random.RandomState(seed)
+
+        if self.shuffle:
+            self.random_state.shuffle(self.indices)
+
+    def __len__(self):
+        return math.ceil(len(self.indices) / self.batch_size)
+
+    def __getitem__(self, index):
+        batch_indices = self.indices[index * self.batch_size:
+                                     (index + 1) * self.batch_size]
+        # Gathering in sorted order gives sequential reads from a
+        # memory map. The order within a batch does not matter
+        batch_indices = np.sort(batch_indices)
+
+        x_batch = np.asarray(self.data[batch_indices], dtype=K.floatx())
+        y_batch = self.labels[batch_indices]
+
+        if self.image_generator is not None:
+            for i in range(len(x_batch)):
+                x = self.image_generator.random_transform(x_batch[i])
+                x_batch[i] = self.image_generator.standardize(x)
+
+        return x_batch, y_batch
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            self.random_state.shuffle(self.indices)
@@ -1,19 +1,35 @@
+import hashlib
+import json
+import os
 import random
 import pickle
 import numpy as np
 from pathlib import Path
 from tqdm import tqdm
+from keras.callbacks import EarlyStopping
+from keras.engine.saving import load_model
+from keras.layers import Dense
+from keras.models import Model
 from keras.optimizers import Adam
 from keras.preprocessing.image import ImageDataGenerator
 from keras.utils import to_categorical
 from matplotlib import pyplot as plt
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import LabelEncoder
-from fruit_classifier.models.models import get_lenet
+from fruit_classifier.models.models import get_architecture
+from fruit_classifier.train.callbacks import EpochCheckpoint
+from fruit_classifier.train.callbacks import Telemetry
+from fruit_classifier.records.record_utils import iterate_records
+from fruit_classifier.records.record_utils import read_index
+from fruit_classifier.thumbnails.thumbnail_utils import get_thumbnail_size
+from fruit_classifier.thumbnails.thumbnail_utils import load_thumbnails
 from fruit_classifier.preprocessing.preprocessing_utils import \
     preprocess_image
 
 from fruit_classifier.utils.image_utils import open_image
+from fruit_classifier.utils.image_utils import decode_image
+from fruit_classifier.utils.manifest_utils import read_manifest
+from fruit_classifier.utils.manifest_utils import update_manifest
 
 
 def get_image_paths(path):
@@ -31,76 +47,368 @@ def get_image_paths(path):
         Random shuffled image paths
     """
 
+    image_paths, _ = get_image_paths_and_labels(path)
+
+    return image_paths
+
+
+def get_image_paths_and_labels(path, refresh=True):
+    """
+    Returns random shuffled image paths and their labels
+
+    The paths and labels are read from the manifest of the directory,
+    which is updated first unless refresh is False
+
+    Parameters
+    ----------
+    path : Path
+        Path to the training images
+    refresh : bool
+        Whether to scan the directory for changes. If False, the stored
+        manifest is read as is (e.g. by stages after one which has
+        just updated it)
+
+    Returns
+    -------
+    image_paths : list
+        Random shuffled image paths
+    image_labels : list
+        The corresponding labels
+    """
+
     print('[INFO] Loading images...')
 
-    image_paths = sorted(path.glob('**/*'))
-    image_paths = [p for p in image_paths if p.is_file()]
-    random.seed(42)
-    random.shuffle(image_paths)
+    entries = update_manifest(path, refresh=refresh)
+    # NOTE: A generator of its own keeps the order the same when other
+    #       threads (e.g. parallel pipeline stages) use the random module
+    random.Random(42).shuffle(entries)
 
-    return image_paths
+    image_paths = [Path(path).joinpath(entry['path']) for entry in entries]
+    image_labels = [entry['label'] for entry in entries]
+
+    return image_paths, image_labels
+
+
+def get_image_hashes_and_splits(path, image_paths):
+    """
+    Returns the content hashes and manifest splits of the images
+
+    Parameters
+    ----------
+    path : Path
+        Path to the training images
+    image_paths : list
+        The image paths returned by get_image_paths_and_labels
+
+    Returns
+    -------
+    image_hashes : list
+        The SHA-1 of each image
+    image_splits : list
+        The split ('train' or 'val') the manifest gives each image.
+        The split depends only on the hash, so it is the same for an
+        image however much data is added
+    """
+
+    entries = read_manifest(path)
+    relative_paths = [Path(image_path).relative_to(path).as_posix()
+                      for image_path in image_paths]
+
+    image_hashes = [entries[p]['sha1'] for p in relative_paths]
+    image_splits = [entries[p]['split'] for p in relative_paths]
+
+    return image_hashes, image_splits
+
+
+def get_data_key(image_paths,
+                 height,
+                 width,
+                 image_labels=None,
+                 image_hashes=None):
+    """
+    Returns a digest identifying the pre-processed data of images
+
+    The digest changes when an image is added, removed, moved, replaced
+    or relabelled, or when the images come in another order
+
+    Parameters
+    ----------
+    image_paths : list
+        List of Paths of the image paths
+    height : int
+        The pixel height of the preprocessed images
+    width : int
+        The pixel width of the preprocessed images
+    image_labels : None or list
+        The labels of the images.
+        If None, the name of the parent directory is used
+    image_hashes : None or list
+        The SHA-1 of each image, as given by get_image_hashes_and_splits.
+        If None, the size and modification time of each file is used
+
+    Returns
+    -------
+    key : str
+        The hex digest
+    """
+
+    sha1 = hashlib.sha1('{}x{}\n'.format(height, width).encode('utf-8'))
+    for i, image_path in enumerate(image_paths):
+        label = Path(image_path).parts[-2] if image_labels is None \
+            else image_labels[i]
+        if image_hashes is None:
+            stat = os.stat(str(image_path))
+            content = '{}:{}'.format(stat.st_size, stat.st_mtime_ns)
+        else:
+            content = image_hashes[i]
+        sha1.update('{}\t{}\t{}\n'.format(Path(image_path).as_posix(),
+                                           label,
+                                           content).encode('utf-8'))
+
+    return sha1.hexdigest()
 
 
-def get_data_and_labels(image_paths):
+def get_data_and_labels(image_paths,
+                        height=28,
+                        width=28,
+                        image_labels=None,
+                        image_hashes=None):
     """
     Returns the data and the labels from the input paths
 
+    If a thumbnail cache has been built with
+    python -m fruit_classifier.thumbnails, and the resolution is no
+    larger than the largest thumbnail, the images are resized from the
+    nearest larger thumbnail instead of being decoded
+
     Parameters
     ----------
     image_paths : list
         List of Paths of the image paths
+    height : int
+        The pixel height of the preprocessed images
+    width : int
+        The pixel width of the preprocessed images
+    image_labels : None or list
+        The labels of the images.
+        If None, the name of the parent directory is used
+    image_hashes : None or list
+        The SHA-1 of each image, which the cache is keyed on
+        (see get_data_key)
 
     Returns
     -------
-    data : np.array, shape (len(image_paths), height, width, channels)
-        The images as numpy array
+    data : np.memmap, shape (len(image_paths), height, width, channels)
+        The images as a read-only memory map of the cached data
     labels : np.array, shape (len(image_paths,)
         The corresponding labels
     """
 
-    data = list()
+    processed_dir =  \
+        Path(__file__).absolute().parents[2].\
+        joinpath('generated_data', 'preprocessed_data')
+
+    if not processed_dir.is_dir():
+        processed_dir.mkdir(parents=True, exist_ok=True)
+
+    data_path = processed_dir.joinpath('data.npy')
+    tmp_data_path = processed_dir.joinpath('data.npy.tmp')
+    key_path = processed_dir.joinpath('data.json')
+
+    # The key is removed first and written last, so an interrupted run
+    # never leaves a cache which looks valid
+    if key_path.is_file():
+        key_path.unlink()
+
+    thumbnails = load_thumbnails()
+    thumbnail_size = None
+    if thumbnails is not None:
+        thumbnail_size = get_thumbnail_size(height, width, thumbnails.sizes)
+    if thumbnail_size is not None:
+        print('[INFO] Resizing from the {} pixel thumbnails'.format(
+            thumbnail_size))
+
+    # NOTE: The images are written straight into a memory mapped file,
+    #       so the data is never held twice in memory
+    data = None
     labels = list()
     # Loop over the input images
-    for image_path in tqdm(image_paths,
-                           desc='Loading and pre-processing images'):
-        tqdm.write(str(image_path))
-        # Load the image, pre-process it, and store it in the data list
-        image_array = open_image(image_path)
-        processed_image = preprocess_image(image_array)
-        data.append(processed_image)
+    for i, image_path in enumerate(tqdm(image_paths,
+                                        desc='Loading and pre-processing '
+                                             'images')):
+        # Load the image, pre-process it, and store it in the data array
+        thumbnail = None
+        if thumbnail_size is not None:
+            thumbnail = thumbnails.get(image_path, thumbnail_size)
+        if thumbnail is not None:
+            image_array = thumbnail.astype('float32')
+        else:
+            tqdm.write(str(image_path))
+            image_array = open_image(image_path)
+        processed_image = preprocess_image(image_array, height, width)
+        if data is None:
+            data = np.lib.format.open_memmap(
+                str(tmp_data_path),
+                mode='w+',
+                dtype='float32',
+                shape=(len(image_paths),) + processed_image.shape)
+        data[i] = processed_image
 
         # Extract the class label from the image path and update the
         # labels list
-        label = image_path.parts[-2]
+        if image_labels is None:
+            label = image_path.parts[-2]
+        else:
+            label = image_labels[i]
         labels.append(label)
-    # Scale the raw pixel intensities to the range [0, 1]
-    data = np.array(data, dtype='float')
+
+    if data is None:
+        np.save(str(tmp_data_path),
+                np.empty((0, height, width, 3), dtype='float32'),
+                allow_pickle=False)
+    else:
+        data.flush()
+        del data
     labels = np.array(labels)
 
-    # Pickle the data and labels
-    processed_dir =  \
+    os.replace(str(tmp_data_path), str(data_path))
+    print('[INFO] Saved to {}'.format(data_path))
+    data = np.load(str(data_path), mmap_mode='r')
+
+    labels_path = processed_dir.joinpath('labels.pkl')
+
+    with labels_path.open('wb') as f:
+        pickle.dump(labels, f, pickle.HIGHEST_PROTOCOL)
+        print('[INFO] Saved to {}'.format(labels_path))
+
+    with key_path.open('w') as f:
+        json.dump({'key': get_data_key(image_paths,
+                                       height,
+                                       width,
+                                       image_labels,
+                                       image_hashes)}, f)
+
+    return data, labels
+
+
+def load_data_and_labels(image_paths,
+                         height=28,
+                         width=28,
+                         image_labels=None,
+                         image_hashes=None):
+    """
+    Returns the cached data and labels if they match the images
+
+    Falls back to get_data_and_labels if there is no cache, or if the
+    cache was made from other images, labels, order or resolution
+    (see get_data_key)
+
+    Parameters
+    ----------
+    image_paths : list
+        List of Paths of the image paths
+    height : int
+        The pixel height of the preprocessed images
+    width : int
+        The pixel width of the preprocessed images
+    image_labels : None or list
+        The labels of the images.
+        If None, the name of the parent directory is used
+    image_hashes : None or list
+        The SHA-1 of each image, as given by get_image_hashes_and_splits.
+        If None, the size and modification time of each file is used
+
+    Returns
+    -------
+    data : np.memmap, shape (len(image_paths), height, width, channels)
+        The images as a read-only memory map of the cached data
+    labels : np.array, shape (len(image_paths,)
+        The corresponding labels
+    """
+
+    processed_dir = \
         Path(__file__).absolute().parents[2].\
         joinpath('generated_data', 'preprocessed_data')
+    data_path = processed_dir.joinpath('data.npy')
+    labels_path = processed_dir.joinpath('labels.pkl')
+    key_path = processed_dir.joinpath('data.json')
 
-    if not processed_dir.is_dir():
-        processed_dir.mkdir(parents=True, exist_ok=True)
+    if data_path.is_file() and labels_path.is_file() and key_path.is_file():
+        with key_path.open('r') as f:
+            cached_key = json.load(f)['key']
+        key = get_data_key(image_paths,
+                           height,
+                           width,
+                           image_labels,
+                           image_hashes)
+        if cached_key == key:
+            data = np.load(str(data_path), mmap_mode='r')
+            with labels_path.open('rb') as f:
+                labels = pickle.load(f)
+            return data, labels
 
-    data_path = processed_dir.joinpath('data.pkl')
+        print('[INFO] The images have changed since they were '
+              'pre-processed, re-processing them')
 
-    with data_path.open('wb') as f:
-        pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
-        print('[INFO] Saved to {}'.format(data_path))
+    data, labels = get_data_and_labels(image_paths,
+                                       height,
+                                       width,
+                                       image_labels,
+                                       image_hashes)
 
-    labels_path = processed_dir.joinpath('labels.pkl')
+    return data, labels
 
-    with labels_path.open('wb') as f:
-        pickle.dump(labels, f, pickle.HIGHEST_PROTOCOL)
-        print('[INFO] Saved to {}'.format(labels_path))
+
+def get_data_and_labels_from_records(shard_dir,
+                                     height=28,
+                                     width=28,
+                                     seed=42):
+    """
+    Returns the data and the labels streamed from record shards
+
+    The records are read sequentially and shuffled across shards and
+    within a buffer, so the images come in a random order
+
+    Parameters
+    ----------
+    shard_dir : Path
+        The directory containing the shards
+    height : int
+        The pixel height of the preprocessed images
+    width : int
+        The pixel width of the preprocessed images
+    seed : int
+        The seed of the shuffling
+
+    Returns
+    -------
+    data : np.array, shape (n_records, height, width, channels)
+        The images as numpy array
+    labels : np.array, shape (n_records,)
+        The corresponding labels
+    """
+
+    # The number of records is known from the index, so the data can
+    # be allocated up front instead of being copied from a list
+    n_records = len(read_index(shard_dir))
+    data = np.empty((n_records, height, width, 3), dtype='float32')
+    labels = list()
+    for i, (label, _, record_data) in \
+            enumerate(tqdm(iterate_records(shard_dir,
+                                           shuffle=True,
+                                           seed=seed),
+                           total=n_records,
+                           desc='Loading and pre-processing records')):
+        image_array = decode_image(record_data)
+        data[i] = preprocess_image(image_array, height, width)
+        labels.append(label)
+
+    labels = np.array(labels)
 
     return data, labels
 
 
-def get_model_input(data, labels):
+def get_model_input(data, labels, image_splits=None):
     """
     Returns the input to the model
 
@@ -110,6 +418,9 @@ def get_model_input(data, labels):
         The images as numpy array
     labels : np.array, shape (n_images,)
         The corresponding labels
+    image_splits : None or array-like
+        The manifest split of each image.
+        If None, the images are split at random
 
     Returns
     -------
@@ -123,8 +434,48 @@ def get_model_input(data, labels):
         The validation labels
     """
 
+    encoded_labels = encode_labels(labels)
+    num_classes = len(set(labels))
+
+    # Partition the data into training and testing splits using 75% of
+    # the data for training and the remaining 25% for testing
+    if image_splits is None:
+        train_indices, val_indices = get_split_indices(len(labels))
+    else:
+        train_indices, val_indices = get_manifest_split_indices(image_splits)
+    x_train = data[train_indices]
+    x_val = data[val_indices]
+    y_train = encoded_labels[train_indices]
+    y_val = encoded_labels[val_indices]
+
+    # Convert the labels from integers to vectors
+    y_train = to_categorical(y_train, num_classes=num_classes)
+    y_val = to_categorical(y_val, num_classes=num_classes)
+
+    return x_train, x_val, y_train, y_val
+
+
+def encode_labels(labels, classes=None):
+    """
+    Encodes the labels as integers and saves the label encoder
+
+    Parameters
+    ----------
+    labels : np.array, shape (n_images,)
+        The labels
+    classes : None or array-like
+        All the classes of the encoder, which may include classes
+        without any labels (e.g. classes the model already knows).
+        If None, the classes of the labels are used
+
+    Returns
+    -------
+    encoded_labels : np.array, shape (n_images,)
+        The labels as integers
+    """
+
     label_encoder = LabelEncoder()
-    label_encoder.fit(labels)
+    label_encoder.fit(labels if classes is None else classes)
     encoded_labels = label_encoder.transform(labels)
 
     encoder_dir =  \
@@ -139,20 +490,78 @@ def get_model_input(data, labels):
         pickle.dump(label_encoder, f, pickle.HIGHEST_PROTOCOL)
         print('[INFO] Saved to {}'.format(encoder_path))
 
-    num_classes = len(set(labels))
+    return encoded_labels
 
-    # Partition the data into training and testing splits using 75% of
-    # the data for training and the remaining 25% for testing
-    (x_train, x_val, y_train, y_val) = train_test_split(data,
-                                                        encoded_labels,
-                                                        test_size=0.25,
-                                                        random_state=42)
 
-    # Convert the labels from integers to vectors
-    y_train = to_categorical(y_train, num_classes=num_classes)
-    y_val = to_categorical(y_val, num_classes=num_classes)
+def get_split_indices(n_samples, test_size=0.25, random_state=42):
+    """
+    Returns the indices of the training and validation splits
 
-    return x_train, x_val, y_train, y_val
+    The split is the same as train_test_split gives for the data
+    itself, but no data is copied
+
+    Parameters
+    ----------
+    n_samples : int
+        The number of samples
+    test_size : float
+        The fraction of the samples to use for validation
+    random_state : int
+        The seed of the split
+
+    Returns
+    -------
+    train_indices : np.array, shape (n_train,)
+        The indices of the training samples
+    val_indices : np.array, shape (n_val,)
+        The indices of the validation samples
+    """
+
+    train_indices, val_indices = train_test_split(np.arange(n_samples),
+                                                  test_size=test_size,
+                                                  random_state=random_state)
+
+    return train_indices, val_indices
+
+
+def get_manifest_split_indices(image_splits):
+    """
+    Returns the indices of the training and validation splits of the manifest
+
+    The manifest split depends only on the content of an image, so
+    full and incremental training, and the models compared on the
+    validation split, all agree on which images were trained on
+
+    Parameters
+    ----------
+    image_splits : array-like
+        The split ('train' or 'val') of each image, as given by
+        get_image_hashes_and_splits
+
+    Returns
+    -------
+    train_indices : np.array, shape (n_train,)
+        The indices of the training samples
+    val_indices : np.array, shape (n_val,)
+        The indices of the validation samples
+
+    Raises
+    ------
+    ValueError
+        If one of the splits is empty
+    """
+
+    image_splits = np.asarray(image_splits)
+    train_indices = np.flatnonzero(image_splits == 'train')
+    val_indices = np.flatnonzero(image_splits == 'val')
+
+    if len(train_indices) == 0 or len(val_indices) == 0:
+        raise ValueError('The manifest splits {} images in {} for training '
+                         'and {} for validation'.format(len(image_splits),
+                                                        len(train_indices),
+                                                        len(val_indices)))
+
+    return train_indices, val_indices
 
 
 def get_model(n_classes,
@@ -160,7 +569,10 @@ def get_model(n_classes,
               height=28,
               channels=3,
               initial_learning_rate=1e-3,
-              epochs=25):
+              epochs=25,
+              architecture='lenet',
+              alpha=1.0,
+              sparse_labels=False):
     """
     Returns a compiled model
 
@@ -178,6 +590,13 @@ def get_model(n_classes,
         The initial learning rate for the optimizer
     epochs : int
         The number of epochs
+    architecture : str
+        The name of the architecture (see models.ARCHITECTURES)
+    alpha : float
+        Width multiplier of the architecture
+    sparse_labels : bool
+        Whether the labels are given as integers instead of one-hot
+        vectors
 
     Returns
     -------
@@ -187,21 +606,288 @@ def get_model(n_classes,
 
     print('[INFO] compiling model...')
 
-    model = get_lenet(height=height,
-                      width=width,
-                      channels=channels,
-                      classes=n_classes)
+    model = get_architecture(architecture,
+                             height=height,
+                             width=width,
+                             channels=channels,
+                             classes=n_classes,
+                             alpha=alpha)
+
+    compile_model(model, initial_learning_rate, epochs, sparse_labels)
+
+    return model
+
+
+def compile_model(model,
+                  initial_learning_rate=1e-3,
+                  epochs=25,
+                  sparse_labels=False):
+    """
+    Compiles the model with the Adam optimizer
+
+    Parameters
+    ----------
+    model : Model
+        The model to compile
+    initial_learning_rate : float
+        The initial learning rate for the optimizer
+    epochs : int
+        The number of epochs the learning rate decays over
+    sparse_labels : bool
+        Whether the labels are given as integers instead of one-hot
+        vectors
+    """
 
     opt = Adam(lr=initial_learning_rate,
                decay=initial_learning_rate / epochs)
 
-    model.compile(loss='categorical_crossentropy',
+    if sparse_labels:
+        loss = 'sparse_categorical_crossentropy'
+    else:
+        loss = 'categorical_crossentropy'
+
+    model.compile(loss=loss,
                   optimizer=opt,
                   metrics=['accuracy'])
 
+
+def extend_output_layer(model, old_classes, new_classes):
+    """
+    Gives the model an output for each of the new classes
+
+    The classes are sorted by the label encoder, so a new class may
+    come before the old ones. The weights of the old outputs are moved
+    to the positions of their classes, and the outputs of the added
+    classes are initialized as in a new model
+
+    Parameters
+    ----------
+    model : Model
+        The trained model, whose outputs are the old classes
+    old_classes : array-like
+        The sorted classes the model was trained on
+    new_classes : array-like
+        The sorted classes to predict, including all the old classes
+
+    Returns
+    -------
+    model : Model
+        The model with an output for each new class.
+        The model itself if the classes are unchanged
+    """
+
+    old_classes = list(old_classes)
+    new_classes = list(new_classes)
+
+    if old_classes == new_classes:
+        return model
+
+    missing = set(old_classes) - set(new_classes)
+    if missing:
+        raise ValueError('The classes {} would be dropped'.format(
+            sorted(missing)))
+
+    positions = [new_classes.index(c) for c in old_classes]
+    weights, biases = model.layers[-1].get_weights()
+
+    output = Dense(len(new_classes),
+                   activation='softmax')(model.layers[-2].output)
+    extended_model = Model(inputs=model.input, outputs=output)
+
+    new_weights, new_biases = extended_model.layers[-1].get_weights()
+    new_weights[:, positions] = weights
+    new_biases[positions] = biases
+    extended_model.layers[-1].set_weights([new_weights, new_biases])
+
+    return extended_model
+
+
+def get_incremental_model(old_classes,
+                          new_classes,
+                          initial_learning_rate=1e-4,
+                          epochs=3,
+                          model_path=None):
+    """
+    Returns the trained model prepared for fine-tuning
+
+    Parameters
+    ----------
+    old_classes : array-like
+        The sorted classes the model was trained on
+    new_classes : array-like
+        The sorted classes to predict, including all the old classes
+    initial_learning_rate : float
+        The initial learning rate for fine-tuning, lower than when
+        training from scratch so the trained weights are kept
+    epochs : int
+        The number of epochs
+    model_path : None or Path
+        Path to the model.
+        If None, 'generated_data/models/model.h5' is used
+
+    Returns
+    -------
+    model : Model
+        The compiled model, taking integer encoded labels
+    """
+
+    if model_path is None:
+        model_path = \
+            Path(__file__).absolute().parents[2].joinpath(
+                'generated_data', 'models', 'model.h5')
+
+    print('[INFO] Loading model...')
+    model = load_model(str(model_path))
+
+    if model.output_shape[-1] != len(old_classes):
+        raise ValueError('The model has {} outputs, but was trained on '
+                         '{} classes'.format(model.output_shape[-1],
+                                             len(old_classes)))
+
+    model = extend_output_layer(model, old_classes, new_classes)
+    compile_model(model, initial_learning_rate, epochs, sparse_labels=True)
+
     return model
 
 
+def get_incremental_indices(image_hashes,
+                            image_splits,
+                            trained_hashes,
+                            replay=1.0,
+                            seed=42):
+    """
+    Returns the samples to fine-tune on
+
+    The new training samples are mixed with a random sample of the
+    training samples the model has already seen, so that the model
+    does not forget the old data
+
+    Parameters
+    ----------
+    image_hashes : array-like
+        The SHA-1 of each image
+    image_splits : array-like
+        The split ('train' or 'val') of each image
+    trained_hashes : array-like
+        The hashes of the images the model was trained on
+    replay : float
+        The number of old samples per new sample
+    seed : int
+        The seed of the replay sample
+
+    Returns
+    -------
+    train_indices : np.array
+        The indices of the new and the replayed samples
+    val_indices : np.array
+        The indices of all the validation samples
+    new_indices : np.array
+        The indices of the new training samples
+    """
+
+    image_hashes = np.asarray(image_hashes)
+    is_train = np.asarray(image_splits) == 'train'
+    is_new = ~np.isin(image_hashes, list(trained_hashes))
+
+    new_indices = np.flatnonzero(is_train & is_new)
+    old_indices = np.flatnonzero(is_train & ~is_new)
+
+    n_replay = min(int(round(replay * len(new_indices))), len(old_indices))
+    replay_indices = np.empty(0, dtype=old_indices.dtype)
+    if n_replay > 0:
+        random_state = np.random.RandomState(seed)
+        replay_indices = np.sort(random_state.choice(old_indices,
+                                                     n_replay,
+                                                     replace=False))
+
+    train_indices = np.concatenate((new_indices, replay_indices))
+    val_indices = np.flatnonzero(~is_train)
+
+    return train_indices, val_indices, new_indices
+
+
+def get_training_record_path():
+    """
+    Returns the path of the record of what the model was trained on
+
+    Returns
+    -------
+    record_path : Path
+        'generated_data/models/trained.json'
+    """
+
+    record_path = \
+        Path(__file__).absolute().parents[2].joinpath('generated_data',
+                                                      'models',
+                                                      'trained.json')
+
+    return record_path
+
+
+def save_training_record(classes, image_hashes, record_path=None):
+    """
+    Stores the classes and the images the model was trained on
+
+    Parameters
+    ----------
+    classes : array-like
+        The sorted classes of the outputs of the model
+    image_hashes : array-like
+        The SHA-1 of each image the model was trained on
+    record_path : None or Path
+        Where to store the record.
+        If None, 'generated_data/models/trained.json' is used
+    """
+
+    if record_path is None:
+        record_path = get_training_record_path()
+    record_path = Path(record_path)
+
+    if not record_path.parent.is_dir():
+        record_path.parent.mkdir(parents=True, exist_ok=True)
+
+    record = {'classes': [str(c) for c in classes],
+              'hashes': sorted(set(str(h) for h in image_hashes))}
+
+    tmp_path = record_path.with_name(record_path.name + '.tmp')
+    with tmp_path.open('w') as f:
+        json.dump(record, f)
+    os.replace(str(tmp_path), str(record_path))
+    print('[INFO] Saved to {}'.format(record_path))
+
+
+def load_training_record(record_path=None):
+    """
+    Loads the record stored by save_training_record
+
+    Parameters
+    ----------
+    record_path : None or Path
+        Where the record is stored.
+        If None, 'generated_data/models/trained.json' is used
+
+    Returns
+    -------
+    record : None or dict
+        Dictionary containing
+        - classes
+        - hashes
+        None if there is no record
+    """
+
+    if record_path is None:
+        record_path = get_training_record_path()
+    record_path = Path(record_path)
+
+    if not record_path.is_file():
+        return None
+
+    with record_path.open('r') as f:
+        record = json.load(f)
+
+    return record
+
+
 def train_model(model,
                 image_generator,
                 x_train,
@@ -209,10 +895,21 @@ def train_model(model,
                 x_val,
                 y_val,
                 batch_size=32,
-                epochs=25):
+                epochs=25,
+                initial_epoch=0,
+                patience=5,
+                checkpoint_dir=None,
+                checkpoint_period=1,
+                model_path=None,
+                telemetry=None):
     """
     Trains and saves the model
 
+    A checkpoint containing the model, the optimizer state and the
+    epoch counter is stored every checkpoint_period epochs, so that an
+    interrupted training can be resumed with load_checkpoint.
+    The checkpoint is removed once the model has been saved.
+
     Parameters
     ----------
     model : Sequential
@@ -231,6 +928,24 @@ def train_model(model,
         The batch size
     epochs : int
         The number of epochs
+    initial_epoch : int
+        The epoch to start from (used when resuming training)
+    patience : int or None
+        Number of epochs without improvement of the validation loss
+        before training is stopped and the best weights are restored.
+        If None, early stopping is disabled
+    checkpoint_dir : None or Path
+        Directory to store the checkpoints in.
+        If None, 'generated_data/checkpoints' is used
+    checkpoint_period : int
+        Number of epochs between each checkpoint
+    model_path : None or Path
+        Path to save the model to.
+        If None, 'generated_data/models/model.h5' is used
+    telemetry : None or str or Path
+        Destination of the training telemetry, either a JSON lines file
+        or an address on the form 'udp://host:port'.
+        If None, no telemetry is emitted
 
     Returns
     -------
@@ -242,37 +957,271 @@ def train_model(model,
         - val_acc
     """
 
-    print('[INFO] Training network...')
-
     train_batch_ratio = len(x_train) // batch_size
     steps_per_epoch = train_batch_ratio if train_batch_ratio > 0 else 1
 
+    history = fit_model(model,
+                        image_generator.flow(x_train,
+                                             y_train,
+                                             batch_size=batch_size),
+                        (x_val, y_val),
+                        steps_per_epoch,
+                        epochs=epochs,
+                        initial_epoch=initial_epoch,
+                        patience=patience,
+                        checkpoint_dir=checkpoint_dir,
+                        checkpoint_period=checkpoint_period,
+                        model_path=model_path,
+                        telemetry=telemetry)
+
+    return history
+
+
+def train_model_on_sequences(model,
+                             train_sequence,
+                             val_sequence,
+                             epochs=25,
+                             initial_epoch=0,
+                             patience=5,
+                             checkpoint_dir=None,
+                             checkpoint_period=1,
+                             model_path=None,
+                             telemetry=None,
+                             callbacks=None):
+    """
+    Trains and saves the model using batch sequences
+
+    Unlike train_model, the data is not split into copies up front.
+    The sequences gather each batch from the data when it is needed.
+
+    Parameters
+    ----------
+    model : Sequential
+        The model to train
+    train_sequence : IndexSequence
+        The sequence of (augmented) training batches
+    val_sequence : IndexSequence
+        The sequence of validation batches
+    epochs : int
+        The number of epochs
+    initial_epoch : int
+        The epoch to start from (used when resuming training)
+    patience : int or None
+        Number of epochs without improvement of the validation loss
+        before training is stopped and the best weights are restored.
+        If None, early stopping is disabled
+    checkpoint_dir : None or Path
+        Directory to store the checkpoints in.
+        If None, 'generated_data/checkpoints' is used
+    checkpoint_period : int
+        Number of epochs between each checkpoint
+    model_path : None or Path
+        Path to save the model to.
+        If None, 'generated_data/models/model.h5' is used
+    telemetry : None or str or Path
+        Destination of the training telemetry, either a JSON lines file
+        or an address on the form 'udp://host:port'.
+        If None, no telemetry is emitted
+    callbacks : None or list
+        Additional callbacks, called after the built-in ones
+
+    Returns
+    -------
+    history : History
+        History object containing
+        - loss
+        - val_loss
+        - acc
+        - val_acc
+    """
+
+    history = fit_model(model,
+                        train_sequence,
+                        val_sequence,
+                        len(train_sequence),
+                        epochs=epochs,
+                        initial_epoch=initial_epoch,
+                        patience=patience,
+                        checkpoint_dir=checkpoint_dir,
+                        checkpoint_period=checkpoint_period,
+                        model_path=model_path,
+                        telemetry=telemetry,
+                        callbacks=callbacks)
+
+    return history
+
+
+def fit_model(model,
+              generator,
+              validation_data,
+              steps_per_epoch,
+              epochs=25,
+              initial_epoch=0,
+              patience=5,
+              checkpoint_dir=None,
+              checkpoint_period=1,
+              model_path=None,
+              telemetry=None,
+              callbacks=None):
+    """
+    Fits the model with checkpointing and early stopping and saves it
+
+    Parameters
+    ----------
+    model : Sequential
+        The model to train
+    generator : generator or Sequence
+        Yields the training batches
+    validation_data : tuple or Sequence
+        The validation data as (x_val, y_val) or as a Sequence
+    steps_per_epoch : int
+        The number of batches in each epoch
+    epochs : int
+        The number of epochs
+    initial_epoch : int
+        The epoch to start from (used when resuming training).
+        If above 0, the state of the early stopping is restored from
+        the checkpoint
+    patience : int or None
+        Number of epochs without improvement of the validation loss
+        before training is stopped and the best weights are restored.
+        If None, early stopping is disabled
+    checkpoint_dir : None or Path
+        Directory to store the checkpoints in.
+        If None, 'generated_data/checkpoints' is used
+    checkpoint_period : int
+        Number of epochs between each checkpoint
+    model_path : None or Path
+        Path to save the model to.
+        If None, 'generated_data/models/model.h5' is used
+    telemetry : None or str or Path
+        Destination of the training telemetry, either a JSON lines file
+        or an address on the form 'udp://host:port'.
+        If None, no telemetry is emitted
+    callbacks : None or list
+        Additional callbacks, called after the built-in ones
+
+    Returns
+    -------
+    history : History
+        History object containing
+        - loss
+        - val_loss
+        - acc
+        - val_acc
+    """
+
+    print('[INFO] Training network...')
+
+    if checkpoint_dir is None:
+        checkpoint_dir = get_checkpoint_dir()
+
+    extra_callbacks = callbacks or list()
+    callbacks = list()
+    early_stopping = None
+    if patience is not None:
+        early_stopping = EarlyStopping(monitor='val_loss',
+                                       patience=patience,
+                                       verbose=1,
+                                       restore_best_weights=True)
+        callbacks.append(early_stopping)
+    # NOTE: The checkpoint comes after the early stopping, so that it
+    #       stores and restores its state (see EpochCheckpoint)
+    callbacks.append(EpochCheckpoint(checkpoint_dir,
+                                     period=checkpoint_period,
+                                     early_stopping=early_stopping,
+                                     resume=initial_epoch > 0))
+    if telemetry is not None:
+        callbacks.append(Telemetry(telemetry))
+    callbacks.extend(extra_callbacks)
+
     history = \
-        model.fit_generator(image_generator.flow(x_train,
-                                                 y_train,
-                                                 batch_size=batch_size),
-                            validation_data=(x_val, y_val),
+        model.fit_generator(generator,
+                            validation_data=validation_data,
                             steps_per_epoch=steps_per_epoch,
                             epochs=epochs,
+                            initial_epoch=initial_epoch,
+                            callbacks=callbacks,
                             verbose=1)
 
     # Save the model to disk
     print('[INFO] Serializing network...')
 
-    model_dir = \
-        Path(__file__).absolute().parents[2].joinpath('generated_data',
-                                                      'models')
-    model_path = model_dir.joinpath('model.h5')
+    if model_path is None:
+        model_path = \
+            Path(__file__).absolute().parents[2].joinpath(
+                'generated_data', 'models', 'model.h5')
+    model_path = Path(model_path)
 
-    if not model_dir.is_dir():
-        model_dir.mkdir(parents=True, exist_ok=True)
+    if not model_path.parent.is_dir():
+        model_path.parent.mkdir(parents=True, exist_ok=True)
 
     model.save(str(model_path))
     print('[INFO] Saved to {}'.format(model_path))
 
+    # The checkpoint is only needed to recover from interruptions
+    for name in ('checkpoint.h5', 'checkpoint.json', 'checkpoint_best.npz'):
+        path = Path(checkpoint_dir).joinpath(name)
+        if path.is_file():
+            path.unlink()
+
     return history
 
 
+def get_checkpoint_dir():
+    """
+    Returns the default checkpoint directory
+
+    Returns
+    -------
+    checkpoint_dir : Path
+        The 'generated_data/checkpoints' directory
+    """
+
+    checkpoint_dir = \
+        Path(__file__).absolute().parents[2].joinpath('generated_data',
+                                                      'checkpoints')
+
+    return checkpoint_dir
+
+
+def load_checkpoint(checkpoint_dir=None):
+    """
+    Loads the last checkpoint stored by train_model
+
+    Parameters
+    ----------
+    checkpoint_dir : None or Path
+        Directory the checkpoints are stored in.
+        If None, 'generated_data/checkpoints' is used
+
+    Returns
+    -------
+    model : None or Sequential
+        The compiled model with its optimizer state.
+        None if no checkpoint exists
+    initial_epoch : int
+        The epoch to resume training from
+    """
+
+    if checkpoint_dir is None:
+        checkpoint_dir = get_checkpoint_dir()
+
+    model_path = Path(checkpoint_dir).joinpath('checkpoint.h5')
+    state_path = Path(checkpoint_dir).joinpath('checkpoint.json')
+
+    if not (model_path.is_file() and state_path.is_file()):
+        return None, 0
+
+    print('[INFO] Loading checkpoint...')
+    model = load_model(str(model_path))
+    with state_path.open('r') as f:
+        initial_epoch = json.load(f)['epoch']
+    print('[INFO] Resuming from epoch {}'.format(initial_epoch))
+
+    return model, initial_epoch
+
+
 def plot_training(history):
     """
     Plots the training loss and accuracy
@@ -0,0 +1,78 @@
+import time
+import numpy as np
+
+
+def measure_predict_latency(model, images, n_runs=20, n_warmup=3):
+    """
+    Measures the latency of model.predict
+
+    Parameters
+    ----------
+    model : Model
+        The model to benchmark
+    images : np.array, shape (batch_size, height, width, channels)
+        The batch to predict
+    n_runs : int
+        Number of timed predictions
+    n_warmup : int
+        Number of predictions run before timing
+
+    Returns
+    -------
+    latency : float
+        The median number of seconds of one predict call
+    """
+
+    batch_size = len(images)
+
+    for _ in range(n_warmup):
+        model.predict(images, batch_size=batch_size)
+
+    timings = list()
+    for _ in range(n_runs):
+        start = time.perf_counter()
+        model.predict(images, batch_size=batch_size)
+        timings.append(time.perf_counter() - start)
+
+    latency = float(np.median(timings))
+
+    return latency
+
+
+def measure_train_step_time(model, images, labels, n_runs=10, n_warmup=2):
+    """
+    Measures the time of a single training step
+
+    NOTE: The weights of the model are updated by the measurement
+
+    Parameters
+    ----------
+    model : Model
+        The compiled model to benchmark
+    images : np.array, shape (batch_size, height, width, channels)
+        The batch to train on
+    labels : np.array, shape (batch_size, n_classes)
+        The targets of the batch
+    n_runs : int
+        Number of timed training steps
+    n_warmup : int
+        Number of training steps run before timing
+
+    Returns
+    -------
+    step_time : float
+        The median number of seconds of one training step
+    """
+
+    for _ in range(n_warmup):
+        model.train_on_batch(images, labels)
+
+    timings = list()
+    for _ in range(n_runs):
+        start = time.perf_counter()
+        model.train_on_batch(images, labels)
+        timings.append(time.perf_counter() - start)
+
+    step_time = float(np.median(timings))
+
+    return step_time
@@ -1,7 +1,353 @@
+import io
+import struct
 import cv2
+import numpy as np
+from pathlib import Path
 from keras.preprocessing.image import img_to_array
 
 
+# Files larger than MAX_IMAGE_BYTES, or with more pixels than
+# MAX_IMAGE_PIXELS, are refused before they are decoded.
+# Images with more pixels than MAX_DECODE_PIXELS are downscaled while
+# decoding, which bounds the memory of the float32 copy of an image
+MAX_IMAGE_BYTES = 32 << 20
+MAX_IMAGE_PIXELS = 8192 * 8192
+MAX_DECODE_PIXELS = 2048 * 2048
+
+# The flags which make OpenCV decode at 1/2, 1/4 and 1/8 of the size.
+# JPEGs are downscaled inside the decoder, so the full size image is
+# never in memory
+REDUCED_FLAGS = {1: cv2.IMREAD_COLOR,
+                 2: cv2.IMREAD_REDUCED_COLOR_2,
+                 4: cv2.IMREAD_REDUCED_COLOR_4,
+                 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+# The JPEG start of frame markers, which are followed by the size
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+                    0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+class ImageTooLargeError(ValueError):
+    """
+    Raised when an image is too large to be decoded safely
+    """
+
+
+def get_image_size(image_file):
+    """
+    Reads the size of an image from its header without decoding it
+
+    PNG, JPEG, GIF, BMP, WebP, TIFF and PNM (PBM, PGM, PPM) are
+    supported. Other formats OpenCV can decode (e.g. JPEG 2000 or
+    OpenEXR) are refused, as their size can not be checked
+
+    Parameters
+    ----------
+    image_file : file object
+        The image opened in binary mode
+
+    Returns
+    -------
+    width : int
+        The pixel width of the image
+    height : int
+        The pixel height of the image
+
+    Raises
+    ------
+    ValueError
+        If the format is not supported or the header is broken
+    """
+
+    header = image_file.read(30)
+
+    if header.startswith(b'\x89PNG\r\n\x1a\n') and header[12:16] == b'IHDR':
+        width, height = struct.unpack('>II', header[16:24])
+        return width, height
+
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        width, height = struct.unpack('<HH', header[6:10])
+        return width, height
+
+    if header.startswith(b'BM') and len(header) >= 26:
+        width, height = struct.unpack('<ii', header[18:26])
+        return width, abs(height)
+
+    if header.startswith(b'RIFF') and header[8:12] == b'WEBP':
+        chunk = header[12:16]
+        if chunk == b'VP8X':
+            width = 1 + int.from_bytes(header[24:27], 'little')
+            height = 1 + int.from_bytes(header[27:30], 'little')
+            return width, height
+        if chunk == b'VP8 ':
+            width, height = struct.unpack('<HH', header[26:30])
+            return width & 0x3FFF, height & 0x3FFF
+        if chunk == b'VP8L':
+            b0, b1, b2, b3 = header[21:25]
+            width = 1 + (b0 | (b1 & 0x3F) << 8)
+            height = 1 + (b1 >> 6 | b2 << 2 | (b3 & 0x0F) << 10)
+            return width, height
+
+    if header.startswith(b'\xff\xd8'):
+        # Walk the segments until the start of frame
+        image_file.seek(2)
+        while True:
+            marker = image_file.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                break
+            if marker[1] in (0xD8, 0x01) or 0xD0 <= marker[1] <= 0xD7:
+                continue
+            length = image_file.read(2)
+            if len(length) < 2:
+                break
+            length = struct.unpack('>H', length)[0]
+            if marker[1] in JPEG_SOF_MARKERS:
+                height, width = struct.unpack('>xHH', image_file.read(5))
+                return width, height
+            image_file.seek(length - 2, io.SEEK_CUR)
+        raise ValueError('Broken JPEG header')
+
+    if header[:4] in (b'II*\x00', b'MM\x00*'):
+        return _get_tiff_size(image_file, header)
+
+    if header[:1] == b'P' and header[1:2] in b'123456' and \
+            header[2:3].isspace():
+        return _get_pnm_size(image_file)
+
+    raise ValueError('Unsupported image format')
+
+
+def _get_tiff_size(image_file, header):
+    """
+    Reads the size of a TIFF image from its first image file directory
+    """
+
+    order = '<' if header.startswith(b'II') else '>'
+    offset = struct.unpack(order + 'I', header[4:8])[0]
+    image_file.seek(offset)
+    n_entries = image_file.read(2)
+    if len(n_entries) < 2:
+        raise ValueError('Broken TIFF header')
+
+    size = dict()
+    for _ in range(struct.unpack(order + 'H', n_entries)[0]):
+        entry = image_file.read(12)
+        if len(entry) < 12:
+            break
+        tag, kind = struct.unpack(order + 'HH', entry[:4])
+        # The width (256) and height (257) are SHORT (3) or LONG (4)
+        if tag in (256, 257):
+            if kind == 3:
+                size[tag] = struct.unpack(order + 'H', entry[8:10])[0]
+            else:
+                size[tag] = struct.unpack(order + 'I', entry[8:12])[0]
+        if len(size) == 2:
+            return size[256], size[257]
+
+    raise ValueError('Broken TIFF header')
+
+
+def _get_pnm_size(image_file):
+    """
+    Reads the size of a PBM, PGM or PPM image from its text header
+    """
+
+    # Comments may make the header long
+    image_file.seek(0)
+    header = image_file.read(1024)
+
+    values = list()
+    i = 2
+    while len(values) < 2 and i < len(header):
+        if header[i:i + 1] == b'#':
+            # Comments run to the end of the line
+            end = header.find(b'\n', i)
+            i = len(header) if end < 0 else end + 1
+        elif header[i:i + 1].isspace():
+            i += 1
+        else:
+            j = i
+            while j < len(header) and header[j:j + 1].isdigit():
+                j += 1
+            # A number must be followed by whitespace, so that it is not
+            # cut short by the end of the header
+            if j == i or j == len(header):
+                break
+            values.append(int(header[i:j]))
+            i = j
+
+    if len(values) < 2:
+        raise ValueError('Broken PNM header')
+
+    return values[0], values[1]
+
+
+def check_image(image_file,
+                n_bytes,
+                max_bytes=MAX_IMAGE_BYTES,
+                max_pixels=MAX_IMAGE_PIXELS):
+    """
+    Checks that an image is small enough to be decoded
+
+    Parameters
+    ----------
+    image_file : file object
+        The image opened in binary mode
+    n_bytes : int
+        The size of the file
+    max_bytes : int
+        The maximum size of the file
+    max_pixels : int
+        The maximum number of pixels of the image
+
+    Returns
+    -------
+    width : int
+        The pixel width of the image
+    height : int
+        The pixel height of the image
+
+    Raises
+    ------
+    ImageTooLargeError
+        If the file or the image is too large
+    ValueError
+        If the format is not supported or the header is broken
+    """
+
+    if n_bytes > max_bytes:
+        raise ImageTooLargeError('The file is {} bytes, but at most {} '
+                                 'are allowed'.format(n_bytes, max_bytes))
+
+    width, height = get_image_size(image_file)
+    if width * height > max_pixels:
+        raise ImageTooLargeError('The image is {}x{} pixels, but at most '
+                                 '{} pixels are allowed'.format(
+                                     width, height, max_pixels))
+
+    return width, height
+
+
+def get_reduction(width, height, max_decode_pixels=MAX_DECODE_PIXELS):
+    """
+    Returns the smallest factor the image must be downscaled by
+
+    Parameters
+    ----------
+    width : int
+        The pixel width of the image
+    height : int
+        The pixel height of the image
+    max_decode_pixels : int
+        The maximum number of pixels of the decoded image
+
+    Returns
+    -------
+    factor : int
+        1, 2, 4 or 8
+    """
+
+    for factor in (1, 2, 4):
+        if (width // factor) * (height // factor) <= max_decode_pixels:
+            return factor
+
+    return 8
+
+
+def _decode(image_file,
+            n_bytes,
+            decode,
+            max_bytes,
+            max_pixels,
+            max_decode_pixels):
+    """
+    Checks the header of an image and decodes it at a bounded size
+
+    Parameters
+    ----------
+    image_file : file object
+        The image opened in binary mode
+    n_bytes : int
+        The size of the file
+    decode : callable
+        Decodes the image given an OpenCV imread flag
+    max_bytes : int
+        The maximum size of the file
+    max_pixels : int
+        The maximum number of pixels of the image
+    max_decode_pixels : int
+        The maximum number of pixels of the decoded image
+
+    Returns
+    -------
+    image : None or np.array, shape (height, width, 3)
+        The decoded uint8 image. None if OpenCV can not decode it
+    """
+
+    width, height = check_image(image_file, n_bytes, max_bytes, max_pixels)
+    factor = get_reduction(width, height, max_decode_pixels)
+
+    image = decode(REDUCED_FLAGS[factor])
+
+    if image is not None and \
+            image.shape[0] * image.shape[1] > max_decode_pixels:
+        # Only reached for images even larger than 8 times the budget
+        scale = np.sqrt(max_decode_pixels / (image.shape[0] *
+                                             image.shape[1]))
+        image = cv2.resize(image,
+                           (int(image.shape[1] * scale),
+                            int(image.shape[0] * scale)),
+                           interpolation=cv2.INTER_AREA)
+
+    return image
+
+
+def read_image(image_path,
+               max_bytes=MAX_IMAGE_BYTES,
+               max_pixels=MAX_IMAGE_PIXELS,
+               max_decode_pixels=MAX_DECODE_PIXELS):
+    """
+    Decodes the image at the given path at a bounded size
+
+    The size is read from the header first. Too large images are
+    refused, and large images are downscaled while decoding.
+
+    Parameters
+    ----------
+    image_path : Path
+        The path to the image
+    max_bytes : int
+        The maximum size of the file
+    max_pixels : int
+        The maximum number of pixels of the image
+    max_decode_pixels : int
+        The maximum number of pixels of the decoded image
+
+    Returns
+    -------
+    image : None or np.array, shape (height, width, 3)
+        The decoded uint8 image. None if OpenCV can not decode it
+
+    Raises
+    ------
+    ImageTooLargeError
+        If the file or the image is too large
+    ValueError
+        If the format is not supported or the header is broken
+    """
+
+    image_path = Path(image_path)
+    with image_path.open('rb') as f:
+        image = _decode(f,
+                        image_path.stat().st_size,
+                        lambda flag: cv2.imread(str(image_path), flag),
+                        max_bytes,
+                        max_pixels,
+                        max_decode_pixels)
+
+    return image
+
+
 def open_image(image_path):
     """
     Opens the image at the given path
@@ -14,10 +360,49 @@ def open_image(image_path):
     Returns
     -------
     image_array : np.array, shape (height, width, channels)
-        The image as a numpy array
+        The image as a numpy array.
+        Images with more than MAX_DECODE_PIXELS pixels are downscaled
+
+    Raises
+    ------
+    ImageTooLargeError
+        If the file or the image is too large
+    """
+
+    image = read_image(image_path)
+    image_array = img_to_array(image)
+
+    return image_array
+
+
+def decode_image(data):
+    """
+    Decodes an encoded image (e.g. the bytes of a jpg file)
+
+    Parameters
+    ----------
+    data : bytes
+        The encoded image
+
+    Returns
+    -------
+    image_array : np.array, shape (height, width, channels)
+        The image as a numpy array.
+        Images with more than MAX_DECODE_PIXELS pixels are downscaled
+
+    Raises
+    ------
+    ImageTooLargeError
+        If the data or the image is too large
     """
 
-    image = cv2.imread(str(image_path))
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    image = _decode(io.BytesIO(data),
+                    len(data),
+                    lambda flag: cv2.imdecode(buffer, flag),
+                    MAX_IMAGE_BYTES,
+                    MAX_IMAGE_PIXELS,
+                    MAX_DECODE_PIXELS)
     image_array = img_to_array(image)
 
     return image_array
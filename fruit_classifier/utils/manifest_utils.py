@@ -0,0 +1,258 @@
+import csv
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+
+# The manifest is stored in the root of the directory it describes
+MANIFEST_NAME = '.manifest.csv'
+FIELDS = ('path', 'label', 'size', 'mtime', 'sha1', 'split')
+
+
+def get_manifest_path(root_dir):
+    """
+    Returns the path of the manifest describing root_dir
+
+    Parameters
+    ----------
+    root_dir : Path
+        The directory described by the manifest
+
+    Returns
+    -------
+    Path
+        The path to the manifest
+    """
+    return Path(root_dir).joinpath(MANIFEST_NAME)
+
+
+def scan_files(root_dir):
+    """
+    Recursively yields the files in root_dir using os.scandir
+
+    The manifest itself and hidden files are skipped
+
+    Parameters
+    ----------
+    root_dir : Path
+        The directory to scan
+
+    Yields
+    ------
+    relative_path : str
+        The path relative to root_dir (with '/' as separator)
+    stat : os.stat_result
+        The stat of the file
+    """
+
+    root_dir = str(root_dir)
+    stack = ['']
+    while stack:
+        relative_dir = stack.pop()
+        with os.scandir(os.path.join(root_dir, relative_dir)) as it:
+            for entry in it:
+                if entry.name.startswith('.'):
+                    continue
+                relative_path = '/'.join((relative_dir, entry.name)) \
+                    if relative_dir else entry.name
+                if entry.is_dir():
+                    stack.append(relative_path)
+                elif entry.is_file():
+                    yield relative_path, entry.stat()
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """
+    Returns the SHA-1 of the content of a file
+
+    Parameters
+    ----------
+    path : Path
+        The path to the file
+    chunk_size : int
+        Number of bytes read at a time
+
+    Returns
+    -------
+    str
+        The hex digest
+    """
+
+    sha1 = hashlib.sha1()
+    with open(str(path), 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+
+    return sha1.hexdigest()
+
+
+def get_split(sha1, val_fraction=0.25):
+    """
+    Returns the split of a file given its content hash
+
+    As the split is derived from the content, it is stable when files
+    are renamed, moved or when new files are added
+
+    Parameters
+    ----------
+    sha1 : str
+        The hex digest of the file content
+    val_fraction : float
+        The fraction of the files to put in the validation split
+
+    Returns
+    -------
+    ['train'|'val']
+        The split
+    """
+    return 'val' if int(sha1[:8], 16) / 2 ** 32 < val_fraction else 'train'
+
+
+def get_directory_label(relative_path):
+    """
+    Returns the name of the parent directory as the label
+
+    Parameters
+    ----------
+    relative_path : str
+        The path relative to the root of the manifest
+
+    Returns
+    -------
+    str
+        The label (empty if the file is in the root)
+    """
+
+    parts = relative_path.split('/')
+
+    return parts[-2] if len(parts) > 1 else ''
+
+
+def read_manifest(root_dir):
+    """
+    Reads the manifest of root_dir
+
+    Parameters
+    ----------
+    root_dir : Path
+        The directory described by the manifest
+
+    Returns
+    -------
+    entries : OrderedDict
+        The entries of the manifest with the relative path as key.
+        Each entry is a dict with the keys given in FIELDS.
+        Empty if there is no manifest
+    """
+
+    manifest_path = get_manifest_path(root_dir)
+    entries = OrderedDict()
+
+    if not manifest_path.is_file():
+        return entries
+
+    with manifest_path.open('r', newline='') as f:
+        for row in csv.DictReader(f):
+            row['size'] = int(row['size'])
+            row['mtime'] = int(row['mtime'])
+            entries[row['path']] = row
+
+    return entries
+
+
+def write_manifest(root_dir, entries):
+    """
+    Writes the manifest of root_dir
+
+    The manifest is written to a temporary file which is moved in
+    place, so readers never see a half written manifest
+
+    Parameters
+    ----------
+    root_dir : Path
+        The directory described by the manifest
+    entries : iterable
+        The entries to write (dicts with the keys given in FIELDS)
+    """
+
+    manifest_path = get_manifest_path(root_dir)
+    # Each writer has its own temporary file, so concurrent updates do
+    # not move each other's files
+    tmp_path = manifest_path.with_name('{}.{}.{}.tmp'.format(
+        MANIFEST_NAME, os.getpid(), threading.get_ident()))
+
+    with tmp_path.open('w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(sorted(entries, key=lambda e: e['path']))
+
+    os.replace(str(tmp_path), str(manifest_path))
+
+
+def update_manifest(root_dir,
+                    label_function=get_directory_label,
+                    val_fraction=0.25,
+                    refresh=True):
+    """
+    Brings the manifest of root_dir up to date and returns its entries
+
+    Only files which are new, or whose size or modification time has
+    changed, are hashed. Files which no longer exist are dropped.
+    Labels and splits of files already in the manifest are kept, so
+    the manifest may be edited to re-label files.
+
+    Parameters
+    ----------
+    root_dir : Path
+        The directory to describe
+    label_function : callable
+        Function taking the relative path of a new file and returning
+        its label
+    val_fraction : float
+        The fraction of new files to put in the validation split
+    refresh : bool
+        If False and a manifest exists, it is returned without
+        scanning the directory
+
+    Returns
+    -------
+    entries : list
+        The entries sorted by path
+    """
+
+    entries = read_manifest(root_dir)
+    if entries and not refresh:
+        return list(entries.values())
+
+    updated_entries = OrderedDict()
+    n_hashed = 0
+    for relative_path, stat in scan_files(root_dir):
+        entry = entries.get(relative_path)
+        if entry is not None and \
+                entry['size'] == stat.st_size and \
+                entry['mtime'] == stat.st_mtime_ns:
+            updated_entries[relative_path] = entry
+            continue
+
+        sha1 = hash_file(Path(root_dir).joinpath(relative_path))
+        n_hashed += 1
+        updated_entries[relative_path] = \
+            {'path': relative_path,
+             'label': entry['label'] if entry is not None
+             else label_function(relative_path),
+             'size': stat.st_size,
+             'mtime': stat.st_mtime_ns,
+             'sha1': sha1,
+             'split': entry['split'] if entry is not None
+             else get_split(sha1, val_fraction)}
+
+    n_removed = len(set(entries) - set(updated_entries))
+    if n_hashed > 0 or n_removed > 0 or \
+            not get_manifest_path(root_dir).is_file():
+        write_manifest(root_dir, updated_entries.values())
+        print('[INFO] Manifest of {}: {} new or changed, {} '
+              'removed'.format(root_dir, n_hashed, n_removed))
+
+    return sorted(updated_entries.values(), key=lambda e: e['path'])
@@ -0,0 +1,53 @@
+import unittest
+import threading
+from app.admission import AdmissionController
+from app.admission import QueueFullError
+from app.admission import DeadlineExceededError
+
+
+class TestAdmissionController(unittest.TestCase):
+
+    def test_run(self):
+        controller = AdmissionController(n_workers=1, max_queue=2)
+        self.assertEqual(controller.run(pow, 2, 3), 8)
+
+        with self.assertRaises(ZeroDivisionError):
+            controller.run(divmod, 1, 0)
+
+        stats = controller.get_stats()
+        self.assertEqual(stats['admitted'], 2)
+        self.assertEqual(stats['completed'], 1)
+        self.assertEqual(stats['failed'], 1)
+
+    def test_shed_and_expire(self):
+        controller = AdmissionController(n_workers=1, max_queue=1)
+        started = threading.Event()
+        release = threading.Event()
+
+        def block():
+            started.set()
+            release.wait()
+
+        # Occupy the worker
+        running = controller.submit(block)
+        started.wait()
+
+        # The job waits in the queue until after its deadline
+        with self.assertRaises(DeadlineExceededError):
+            controller.run(pow, 2, 3, deadline=0.01)
+
+        # The cancelled job holds its place until a worker drops it
+        with self.assertRaises(QueueFullError) as context:
+            controller.submit(pow, 2, 3)
+        self.assertGreaterEqual(context.exception.retry_after, 1)
+
+        release.set()
+        running.result()
+        self.assertEqual(controller.run(pow, 2, 3), 8)
+
+        stats = controller.get_stats()
+        self.assertEqual(stats['shed'], 1)
+        self.assertEqual(stats['timed_out'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
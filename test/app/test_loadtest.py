@@ -0,0 +1,118 @@
+import struct
+import threading
+import unittest
+import zlib
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from socketserver import ThreadingMixIn
+from app.loadtest import get_percentile
+from app.loadtest import make_png
+from app.loadtest import parse_sizes
+from app.loadtest import run_load
+from app.loadtest import summarize
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    Mimics the routes of the app. Every other classification is shed
+    """
+
+    classified = 0
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        body = self.rfile.read(length)
+        self.send_response(302)
+        if b'\x89PNG' in body:
+            self.send_header('Location', '/confirm/image.png')
+            self.send_header('Set-Cookie', 'session=1; Path=/')
+        else:
+            self.send_header('Location', '/')
+        self.end_headers()
+
+    def do_GET(self):
+        status = 200
+        if 'session=1' not in (self.headers.get('Cookie') or ''):
+            status = 302
+        elif self.path.startswith('/classify/'):
+            with _Handler.lock:
+                _Handler.classified += 1
+                if _Handler.classified % 2 == 0:
+                    status = 503
+        self.send_response(status)
+        self.send_header('Content-Length', '2')
+        if status == 302:
+            self.send_header('Location', '/')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+
+class TestLoadtest(unittest.TestCase):
+
+    def test_make_png(self):
+        data = make_png(20, 10, seed=1)
+        self.assertTrue(data.startswith(b'\x89PNG\r\n\x1a\n'))
+        width, height = struct.unpack('>II', data[16:24])
+        self.assertEqual((width, height), (20, 10))
+
+        # The rows hold the filter byte and the pixels
+        length = struct.unpack('>I', data[33:37])[0]
+        rows = zlib.decompress(data[41:41 + length])
+        self.assertEqual(len(rows), 10 * (1 + 20 * 3))
+
+        self.assertEqual(data, make_png(20, 10, seed=1))
+        self.assertNotEqual(data, make_png(20, 10, seed=2))
+
+    def test_parse_sizes(self):
+        self.assertEqual(parse_sizes(['64', '256:0.5']),
+                         ((64, 1.0), (256, 0.5)))
+        with self.assertRaises(ValueError):
+            parse_sizes(['0:1'])
+        with self.assertRaises(ValueError):
+            parse_sizes(['large'])
+
+    def test_get_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(get_percentile(values, 50), 50)
+        self.assertEqual(get_percentile(values, 99), 99)
+        self.assertEqual(get_percentile([3], 95), 3)
+        self.assertNotEqual(get_percentile([], 50),
+                            get_percentile([], 50))
+
+    def test_run_load(self):
+        server = _Server(('127.0.0.1', 0), _Handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        base_url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+        try:
+            samples, duration = run_load(base_url,
+                                         n_flows=10,
+                                         concurrency=4,
+                                         rate=200,
+                                         sizes=((16, 1), (32, 1)),
+                                         timeout=5)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        summary = summarize(samples, duration)
+        self.assertEqual(summary['upload']['requests'], 10)
+        self.assertEqual(summary['upload']['error_rate'], 0)
+        self.assertEqual(summary['confirm']['error_rate'], 0)
+        self.assertEqual(summary['classify']['shed'], 5)
+        self.assertEqual(summary['classify']['error_rate'], 0.5)
+        self.assertEqual(summary['all']['requests'], 30)
+        self.assertGreater(summary['all']['throughput'], 0)
+        self.assertLessEqual(summary['all']['p50'], summary['all']['p99'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import threading
+import unittest
+from app.admission import AdmissionController
+from app.admission import DeadlineExceededError
+from app.speculation import SpeculativeRunner
+
+
+class TestSpeculativeRunner(unittest.TestCase):
+
+    def test_run(self):
+        calls = list()
+
+        def square(x):
+            calls.append(x)
+            return x * x
+
+        controller = AdmissionController(n_workers=1, max_queue=4)
+        runner = SpeculativeRunner(controller)
+        self.assertTrue(runner.start('a', square, 3))
+        # Starting the same key again does not run the job twice
+        self.assertTrue(runner.start('a', square, 3))
+
+        self.assertEqual(runner.run('a', square, 3), 9)
+        self.assertEqual(runner.run('a', square, 3), 9)
+        self.assertEqual(runner.run('b', square, 4), 16)
+        self.assertEqual(calls, [3, 4])
+
+        stats = runner.get_stats()
+        self.assertEqual(stats['started'], 1)
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_keep_missed_result(self):
+        calls = list()
+
+        def square(x):
+            calls.append(x)
+            return x * x
+
+        controller = AdmissionController(n_workers=1, max_queue=4)
+        runner = SpeculativeRunner(controller)
+        with self.assertRaises(KeyError):
+            runner.get('a')
+
+        # A result computed on a miss is kept for the later lookup
+        self.assertEqual(runner.run('a', square, 3), 9)
+        self.assertEqual(runner.get('a'), 9)
+        self.assertEqual(calls, [3])
+
+    def test_spare_capacity(self):
+        controller = AdmissionController(n_workers=1, max_queue=2)
+        runner = SpeculativeRunner(controller, max_queue_fraction=0.5)
+        started = threading.Event()
+        release = threading.Event()
+
+        def block():
+            started.set()
+            release.wait()
+            return 'done'
+
+        # Occupy the worker, and fill the queue up to the fraction
+        self.assertTrue(runner.start('running', block))
+        started.wait()
+        controller.submit(pow, 2, 3)
+        self.assertFalse(runner.start('skipped', pow, 2, 3))
+        self.assertEqual(runner.get_stats()['skipped'], 1)
+
+        # Waiting on a job in flight respects the deadline
+        with self.assertRaises(DeadlineExceededError):
+            runner.run('running', block, deadline=0.01)
+        release.set()
+        self.assertEqual(runner.run('running', block), 'done')
+
+    def test_errors_and_eviction(self):
+        def fail():
+            raise ValueError('Broken')
+
+        controller = AdmissionController(n_workers=1, max_queue=4)
+        runner = SpeculativeRunner(controller, max_entries=2)
+        runner.start('fail', fail)
+        with self.assertRaises(ValueError):
+            runner.run('fail', fail)
+        # Failed jobs are not kept
+        self.assertEqual(runner.run('fail', pow, 2, 3), 8)
+
+        for key in range(3):
+            runner.start(key, pow, key, 2)
+        self.assertEqual(runner.get_stats()['entries'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
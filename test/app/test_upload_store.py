@@ -0,0 +1,102 @@
+import unittest
+import shutil
+import time
+from pathlib import Path
+from app.upload_store import UploadStore
+
+
+class TestUploadStore(unittest.TestCase):
+
+    def setUp(self):
+        test_dir = Path(__file__).absolute().parents[1]
+        self.tmp_dir_path = test_dir.joinpath('tmp_uploads')
+
+    def tearDown(self):
+        if self.tmp_dir_path.is_dir():
+            shutil.rmtree(self.tmp_dir_path)
+
+    def test_sessions(self):
+        store = UploadStore(self.tmp_dir_path)
+        name_a = store.put('a', b'apple', 'jpg')
+        name_b = store.put('b', b'apple', 'jpg')
+
+        # Equal content gives equal names, but the sessions are apart
+        self.assertEqual(name_a, name_b)
+        self.assertNotEqual(store.get_path('a', name_a),
+                            store.get_path('b', name_b))
+        self.assertIsNone(store.get_path('a', 'missing.jpg'))
+        self.assertEqual(store.get_path('a', name_a).read_bytes(),
+                         b'apple')
+
+        # Storing the same content again does not count twice
+        store.put('a', b'apple', 'jpg')
+        self.assertEqual(store.total_bytes, 10)
+
+    def test_evict(self):
+        store = UploadStore(self.tmp_dir_path, ttl=10, max_bytes=8)
+        old = store.put('a', b'1234', 'png')
+        new = store.put('a', b'5678', 'png')
+        path = store.get_path('a', old)
+
+        # Over budget: the least recently used file goes first
+        store.put('b', b'9', 'png')
+        self.assertEqual(store.evict(), 1)
+        self.assertIsNone(store.get_path('a', new))
+        self.assertTrue(path.is_file())
+
+        # Expired files are removed
+        self.assertEqual(store.evict(now=time.time() + 60), 2)
+        self.assertEqual(store.total_bytes, 0)
+        self.assertFalse(path.is_file())
+        self.assertEqual(list(self.tmp_dir_path.iterdir()), [])
+
+    def test_evict_uploaded_again(self):
+        store = UploadStore(self.tmp_dir_path, ttl=10)
+        name = store.put('a', b'apple', 'jpg')
+
+        # Upload the file again right after evict has dropped its entry,
+        # before the file is removed
+        lock = store.lock
+        n_locked = list()
+
+        class Lock(object):
+            def __enter__(self):
+                n_locked.append(1)
+                if len(n_locked) == 2:
+                    store.put('a', b'apple', 'jpg')
+                lock.acquire()
+
+            def __exit__(self, *args):
+                lock.release()
+
+        store.lock = Lock()
+        self.assertEqual(store.evict(now=time.time() + 60), 1)
+        store.lock = lock
+        self.assertEqual(store.get_path('a', name).read_bytes(), b'apple')
+
+    def test_reload(self):
+        store = UploadStore(self.tmp_dir_path)
+        name = store.put('a', b'apple', 'jpg')
+
+        # The files of a previous run are indexed
+        store = UploadStore(self.tmp_dir_path)
+        self.assertIsNotNone(store.get_path('a', name))
+        self.assertEqual(store.total_bytes, 5)
+
+    def test_janitor(self):
+        store = UploadStore(self.tmp_dir_path,
+                            max_bytes=4,
+                            janitor_interval=60).start()
+        store.put('a', b'1234', 'png')
+        # Exceeding the budget wakes up the janitor
+        store.put('a', b'5678', 'png')
+        for _ in range(100):
+            if store.total_bytes <= 4:
+                break
+            time.sleep(0.01)
+        store.stop()
+        self.assertEqual(store.total_bytes, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
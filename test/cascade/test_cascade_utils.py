@@ -0,0 +1,123 @@
+import shutil
+import unittest
+import numpy as np
+from pathlib import Path
+from fruit_classifier.cascade.cascade_utils import calibrate_threshold
+from fruit_classifier.cascade.cascade_utils import save_cascade
+from fruit_classifier.predict.predict_utils import cascade_predict
+
+
+class ConstantModel(object):
+    """
+    Model returning fixed probabilities, indexed by the first pixel
+    """
+
+    def __init__(self, probabilities):
+        self.probabilities = np.array(probabilities, dtype=float)
+        self.n_predicted = 0
+
+    def predict(self, images, batch_size=32):
+        self.n_predicted += len(images)
+        return self.probabilities[images[:, 0, 0, 0].astype(int)].copy()
+
+
+class TestCascadeUtils(unittest.TestCase):
+
+    def setUp(self):
+        test_dir = Path(__file__).absolute().parents[1]
+        self.tmp_dir = test_dir.joinpath('tmp_cascade')
+
+        # The cheap model is wrong on its two least confident images
+        self.probabilities = np.array([[0.99, 0.01],
+                                       [0.05, 0.95],
+                                       [0.80, 0.20],
+                                       [0.60, 0.40],
+                                       [0.45, 0.55]])
+        self.fallback_probabilities = np.array([[0.9, 0.1],
+                                                [0.1, 0.9],
+                                                [0.9, 0.1],
+                                                [0.1, 0.9],
+                                                [0.9, 0.1]])
+        self.labels = np.array([0, 1, 0, 1, 0])
+
+    def tearDown(self):
+        if self.tmp_dir.is_dir():
+            shutil.rmtree(self.tmp_dir)
+
+    def test_calibrate_threshold(self):
+        calibration = calibrate_threshold(self.probabilities,
+                                          self.fallback_probabilities,
+                                          self.labels,
+                                          target_accuracy=1.0)
+        self.assertEqual(calibration['threshold'], 0.8)
+        self.assertEqual(calibration['accuracy'], 1.0)
+        self.assertEqual(calibration['first_stage_fraction'], 0.6)
+        self.assertEqual(calibration['first_stage_accuracy'], 0.6)
+        self.assertTrue(calibration['reached'])
+
+        # A lower target lets the cheap model classify more images
+        calibration = calibrate_threshold(self.probabilities,
+                                          self.fallback_probabilities,
+                                          self.labels,
+                                          target_accuracy=0.8)
+        self.assertEqual(calibration['threshold'], 0.6)
+        self.assertEqual(calibration['first_stage_fraction'], 0.8)
+
+    def test_calibrate_unreachable(self):
+        fallback_probabilities = 1 - self.fallback_probabilities
+        calibration = calibrate_threshold(self.probabilities,
+                                          fallback_probabilities,
+                                          self.labels,
+                                          target_accuracy=1.0)
+        # The cheap model alone is the most accurate
+        self.assertFalse(calibration['reached'])
+        self.assertEqual(calibration['accuracy'], 0.6)
+        self.assertEqual(calibration['threshold'], 0.55)
+
+    def test_calibrate_ties(self):
+        probabilities = np.array([[0.7, 0.3],
+                                  [0.7, 0.3],
+                                  [0.3, 0.7]])
+        calibration = calibrate_threshold(probabilities,
+                                          probabilities,
+                                          np.array([0, 1, 1]),
+                                          target_accuracy=1.0)
+        # The tied images can only be escalated together
+        self.assertFalse(calibration['reached'])
+        self.assertEqual(calibration['first_stage_fraction'], 1.0)
+
+    def test_cascade_predict(self):
+        images = np.arange(5).reshape(5, 1, 1, 1)
+        model = ConstantModel(self.probabilities)
+        fallback_model = ConstantModel(self.fallback_probabilities)
+
+        probabilities, escalated = cascade_predict(model,
+                                                   images,
+                                                   fallback_model,
+                                                   threshold=0.8)
+        np.testing.assert_array_equal(escalated,
+                                      [False, False, False, True, True])
+        np.testing.assert_array_equal(np.argmax(probabilities, axis=1),
+                                      self.labels)
+        # Only the escalated images reach the fallback model
+        self.assertEqual(fallback_model.n_predicted, 2)
+
+        probabilities, escalated = cascade_predict(model, images)
+        self.assertFalse(np.any(escalated))
+        np.testing.assert_array_equal(probabilities, self.probabilities)
+
+    def test_save_cascade(self):
+        cascade_path = self.tmp_dir.joinpath('cascade.json')
+        calibration = calibrate_threshold(self.probabilities,
+                                          self.fallback_probabilities,
+                                          self.labels,
+                                          target_accuracy=1.0)
+        save_cascade(Path('small.h5'),
+                     Path('large.h5'),
+                     calibration,
+                     cascade_path)
+        self.assertTrue(cascade_path.is_file())
+
+
+if __name__ == '__main__':
+    unittest.main()
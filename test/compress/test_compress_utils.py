@@ -0,0 +1,102 @@
+import unittest
+import numpy as np
+from keras import backend as K
+from fruit_classifier.compress.compress_utils import DistillationSequence
+from fruit_classifier.compress.compress_utils import get_distillation_loss
+from fruit_classifier.compress.compress_utils import get_kept_indices
+from fruit_classifier.compress.compress_utils import prune_model
+from fruit_classifier.compress.compress_utils import soften
+from fruit_classifier.models.models import get_lenet
+from fruit_classifier.models.models import get_mobilenet
+from fruit_classifier.train.sequences import IndexSequence
+
+
+class TestCompressUtils(unittest.TestCase):
+
+    def setUp(self):
+        self.images = np.random.rand(2, 28, 28, 3)
+
+    def test_get_kept_indices(self):
+        kernel = np.array([[1.0, -5.0, 0.1, 3.0]])
+        kept_indices = get_kept_indices(kernel, ratio=0.5)
+        np.testing.assert_array_equal(kept_indices, [1, 3])
+
+    def test_prune_lenet(self):
+        model = get_lenet(28, 28, 3, 2)
+        pruned_model = prune_model(model, ratio=0.5)
+
+        self.assertLess(pruned_model.count_params(),
+                        model.count_params() / 2)
+        self.assertEqual(pruned_model.input_shape, model.input_shape)
+        self.assertEqual(pruned_model.output_shape, model.output_shape)
+
+        probabilities = pruned_model.predict(self.images)
+        np.testing.assert_allclose(probabilities.sum(axis=1), 1,
+                                   rtol=1e-5)
+
+    def test_prune_nothing(self):
+        # Pruning nothing must give exactly the same predictions
+        model = get_lenet(28, 28, 3, 2)
+        pruned_model = prune_model(model, ratio=0.0)
+
+        np.testing.assert_allclose(pruned_model.predict(self.images),
+                                   model.predict(self.images),
+                                   rtol=1e-5)
+
+    def test_prune_mobilenet(self):
+        model = get_mobilenet(28, 28, 3, 2)
+        pruned_model = prune_model(model, ratio=0.5)
+
+        self.assertLess(pruned_model.count_params(),
+                        model.count_params())
+        self.assertEqual(pruned_model.output_shape, model.output_shape)
+
+    def test_distillation_loss(self):
+        loss = get_distillation_loss(temperature=4.0, soft_weight=0.7)
+        y_pred = np.array([[0.7, 0.2, 0.1]], dtype=np.float32)
+        # The integer encoded label
+        hard = np.array([[0.0]], dtype=np.float32)
+        soft = soften(np.array([[0.6, 0.3, 0.1]]), 4.0).astype(np.float32)
+
+        hard_loss = -np.log(0.7)
+        soft_pred = soften(y_pred, 4.0)
+        soft_loss = -np.sum(soft * np.log(soft_pred)) * 16
+
+        # Only the hard labels, as in the validation data
+        value = K.eval(loss(K.constant(hard), K.constant(y_pred)))
+        np.testing.assert_allclose(value, [hard_loss], rtol=1e-4)
+
+        targets = np.concatenate((soft, hard), axis=1)
+        value = K.eval(loss(K.constant(targets), K.constant(y_pred)))
+        np.testing.assert_allclose(value,
+                                   [0.7 * soft_loss + 0.3 * hard_loss],
+                                   rtol=1e-4)
+
+    def test_distillation_sequence(self):
+        teacher = get_lenet(28, 28, 3, 3)
+        labels = np.array([2, 0])
+        sequence = DistillationSequence(IndexSequence(self.images,
+                                                      labels,
+                                                      [0, 1]),
+                                        teacher)
+
+        # The soft targets are followed by the integer encoded labels
+        x_batch, y_batch = sequence[0]
+        self.assertEqual(len(sequence), 1)
+        self.assertEqual(y_batch.shape, (2, 4))
+        np.testing.assert_allclose(y_batch[:, :3].sum(axis=1), 1.0,
+                                   rtol=1e-5)
+        np.testing.assert_array_equal(y_batch[:, -1], labels)
+
+    def test_soften(self):
+        probabilities = np.array([[0.9, 0.05, 0.05]])
+        soft_probabilities = soften(probabilities, temperature=4.0)
+
+        self.assertAlmostEqual(soft_probabilities.sum(), 1.0)
+        self.assertLess(soft_probabilities.max(), probabilities.max())
+        self.assertEqual(soft_probabilities.argmax(),
+                         probabilities.argmax())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from fruit_classifier.daemon.daemon_utils import Batcher
+from fruit_classifier.daemon.daemon_utils import DaemonServer
+from fruit_classifier.daemon.daemon_utils import connect
+from fruit_classifier.daemon.daemon_utils import send_message
+from fruit_classifier.daemon.daemon_utils import receive_message
+from fruit_classifier.daemon.daemon_utils import remove_stale_socket
+from fruit_classifier.daemon.daemon_utils import HEADER
+from fruit_classifier.daemon.daemon_utils import MAX_MESSAGE_BYTES
+from fruit_classifier.daemon.client import classify_paths
+
+
+class TestDaemonUtils(unittest.TestCase):
+
+    def setUp(self):
+        # Socket paths are limited to about 100 characters, so the
+        # temporary directory is used instead of the test directory
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.socket_path = Path(self.tmp_dir.name).joinpath('test.sock')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_messages(self):
+        left, right = socket.socketpair()
+        with left, right:
+            send_message(left, {'paths': ['a.jpg', 'b.jpg']})
+            send_message(left, {'type': 'stats'})
+            self.assertEqual(receive_message(right),
+                             {'paths': ['a.jpg', 'b.jpg']})
+            self.assertEqual(receive_message(right), {'type': 'stats'})
+
+            # Too large messages are refused before they are read
+            left.sendall(HEADER.pack(MAX_MESSAGE_BYTES + 1))
+            with self.assertRaises(ValueError):
+                receive_message(right)
+
+            # A message cut short
+            left.sendall(HEADER.pack(10) + b'{}')
+            left.close()
+            with self.assertRaises(ConnectionError):
+                receive_message(right)
+
+        left, right = socket.socketpair()
+        with right:
+            left.close()
+            self.assertIsNone(receive_message(right))
+
+    def test_batcher(self):
+        sizes = list()
+        release = threading.Event()
+
+        def function(items):
+            release.wait(timeout=5)
+            sizes.append(len(items))
+            return [item * 2 for item in items]
+
+        batcher = Batcher(function, max_batch_size=4, max_delay=0.05)
+        batcher.start()
+        # The first item blocks the batcher while the others queue up
+        futures = [batcher.submit(i) for i in range(9)]
+        release.set()
+        results = [future.result(timeout=5) for future in futures]
+        batcher.stop()
+
+        self.assertEqual(results, [i * 2 for i in range(9)])
+        self.assertEqual(sum(sizes), 9)
+        self.assertLessEqual(max(sizes), 4)
+        self.assertLess(len(sizes), 9)
+        self.assertEqual(batcher.get_stats()['items'], 9)
+
+    def test_batcher_errors(self):
+        def fail(items):
+            raise RuntimeError('Broken')
+
+        batcher = Batcher(fail).start()
+        with self.assertRaises(RuntimeError):
+            batcher.submit(1).result(timeout=5)
+        batcher.stop()
+
+        def fail_initializer():
+            raise OSError('No model')
+
+        batcher = Batcher(lambda items: items,
+                          initializer=fail_initializer).start()
+        batcher.ready.wait(timeout=5)
+        self.assertIsInstance(batcher.error, OSError)
+        with self.assertRaises(OSError):
+            batcher.submit(1).result(timeout=5)
+        batcher.stop()
+
+    def test_server(self):
+        def process(message):
+            if 'paths' not in message:
+                raise KeyError('paths')
+            return {'results': [{'path': path,
+                                 'label': Path(path).stem,
+                                 'probability': 1.0}
+                                for path in message['paths']]}
+
+        server = DaemonServer(self.socket_path, process)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            # A second daemon must not take over the socket
+            with self.assertRaises(RuntimeError):
+                remove_stale_socket(self.socket_path)
+
+            paths = ['/images/{}.jpg'.format(i) for i in range(5)]
+            results = list(classify_paths(paths,
+                                          self.socket_path,
+                                          chunk_size=2))
+            self.assertEqual([r['path'] for r in results], paths)
+            self.assertEqual(results[3]['label'], '3')
+
+            # Errors are answered instead of closing the connection
+            with connect(self.socket_path, timeout=5) as sock:
+                send_message(sock, {'type': 'unknown'})
+                self.assertIn('error', receive_message(sock))
+                send_message(sock, {'paths': ['x.jpg']})
+                self.assertEqual(
+                    receive_message(sock)['results'][0]['label'], 'x')
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertFalse(self.socket_path.exists())
+        with self.assertRaises(ConnectionError):
+            list(classify_paths(['a.jpg'], self.socket_path))
+
+    def test_remove_stale_socket(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(str(self.socket_path))
+        sock.close()
+
+        # Nobody listens on the socket, so it is removed
+        remove_stale_socket(self.socket_path)
+        self.assertFalse(self.socket_path.exists())
+
+    def test_client_imports(self):
+        # The client must start without the heavy dependencies
+        code = ('import sys\n'
+                'import fruit_classifier.daemon.client\n'
+                'heavy = {"numpy", "keras", "tensorflow", "cv2"}\n'
+                'sys.exit(len(heavy & set(sys.modules)))\n')
+        root_dir = Path(__file__).absolute().parents[2]
+        exit_code = subprocess.call([sys.executable, '-c', code],
+                                    cwd=str(root_dir))
+        self.assertEqual(exit_code, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import shutil
+import unittest
+import numpy as np
+from pathlib import Path
+from fruit_classifier.embeddings.embedding_utils import get_scores
+from fruit_classifier.embeddings.embedding_utils import normalize
+from fruit_classifier.embeddings.embedding_utils import quantize
+from fruit_classifier.embeddings.embedding_utils import EmbeddingIndex
+from fruit_classifier.embeddings.embedding_utils import save_index
+from fruit_classifier.embeddings.embedding_utils import load_index
+
+
+class TestEmbeddingUtils(unittest.TestCase):
+
+    def setUp(self):
+        test_dir = Path(__file__).absolute().parents[1]
+        self.tmp_dir = test_dir.joinpath('tmp_embeddings')
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+
+        random_state = np.random.RandomState(0)
+        # Clustered vectors, so that inverted lists are meaningful
+        centers = random_state.normal(size=(8, 16))
+        self.vectors = normalize(
+            centers[random_state.randint(8, size=1000)] +
+            0.1 * random_state.normal(size=(1000, 16)))
+        self.queries = self.vectors[:5] + \
+            0.01 * random_state.normal(size=(5, 16))
+
+    def tearDown(self):
+        if self.tmp_dir.is_dir():
+            shutil.rmtree(self.tmp_dir)
+
+    def get_expected(self, k):
+        scores = normalize(self.queries) @ self.vectors.T
+        return np.argsort(-scores, axis=1)[:, :k]
+
+    def test_quantize(self):
+        quantized, scales = quantize(self.vectors, 'float16')
+        self.assertEqual(quantized.dtype, np.float16)
+        self.assertIsNone(scales)
+
+        quantized, scales = quantize(self.vectors, 'int8')
+        self.assertEqual(quantized.dtype, np.int8)
+        restored = quantized.astype(np.float32) * scales[:, None]
+        np.testing.assert_allclose(restored, self.vectors, atol=0.01)
+
+        with self.assertRaises(ValueError):
+            quantize(self.vectors, 'float64')
+
+    def test_search_exact(self):
+        expected = self.get_expected(10)
+        for dtype in ('float32', 'float16', 'int8'):
+            quantized, scales = quantize(self.vectors, dtype)
+            index = EmbeddingIndex(quantized, scales)
+            # A small chunk size makes the top k merge across chunks
+            indices, scores = index.search(self.queries,
+                                           k=10,
+                                           chunk_size=64)
+            self.assertEqual(indices.shape, (5, 10))
+            np.testing.assert_array_equal(indices[:, 0], np.arange(5))
+            self.assertTrue(np.all(np.diff(scores, axis=1) <= 0))
+
+            # The search is exact for the stored vectors. Comparing the
+            # scores rather than the indices allows near ties to swap
+            all_scores = get_scores(quantized,
+                                    scales,
+                                    normalize(self.queries))
+            expected_scores = -np.sort(-all_scores, axis=1)[:, :10]
+            np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
+
+            # int8 reorders the near tied neighbours of the clusters, so
+            # its recall of the float32 ranking has a lower bound. It
+            # measures at about 0.76 on these vectors
+            overlap = np.mean([len(set(a) & set(b)) / 10
+                               for a, b in zip(indices, expected)])
+            self.assertGreater(overlap, 0.7 if dtype == 'int8' else 0.9)
+
+        # Fewer vectors than k
+        index = EmbeddingIndex(self.vectors[:3])
+        indices, _ = index.search(self.queries[0], k=10)
+        self.assertEqual(indices.shape, (1, 3))
+
+    def test_search_ivf(self):
+        index = EmbeddingIndex(self.vectors)
+        index.build_ivf(n_lists=8)
+        self.assertEqual(index.offsets[-1], len(self.vectors))
+        self.assertEqual(sorted(index.order), list(range(1000)))
+
+        expected = self.get_expected(10)
+        indices, _ = index.search(self.queries, k=10, n_probe=2)
+        recall = np.mean([len(set(a) & set(b)) / 10
+                          for a, b in zip(indices, expected)])
+        self.assertGreater(recall, 0.9)
+
+        # Probing every list is exact
+        indices, _ = index.search(self.queries, k=10, n_probe=8)
+        np.testing.assert_array_equal(indices, expected)
+
+    def test_save_and_load_index(self):
+        quantized, scales = quantize(self.vectors, 'int8')
+        np.save(str(self.tmp_dir.joinpath('vectors.npy')), quantized)
+        np.save(str(self.tmp_dir.joinpath('scales.npy')), scales)
+        items = [{'path': '{}.jpg'.format(i), 'label': 'apples'}
+                 for i in range(len(self.vectors))]
+
+        index = EmbeddingIndex(quantized, scales, items)
+        index.build_ivf(n_lists=4)
+        save_index(index, self.tmp_dir, {'layer': 'dense_1'})
+
+        loaded, metadata = load_index(self.tmp_dir)
+        self.assertEqual(metadata['layer'], 'dense_1')
+        self.assertEqual(metadata['dtype'], 'int8')
+        self.assertEqual(loaded.items, items)
+        self.assertIsInstance(loaded.vectors, np.memmap)
+        np.testing.assert_array_equal(loaded.offsets, index.offsets)
+
+        indices, _ = loaded.search(self.queries, k=5, n_probe=4)
+        expected, _ = index.search(self.queries, k=5)
+        np.testing.assert_array_equal(indices, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+import shutil
+from pathlib import Path
+from keras import backend as K
+from fruit_classifier.execution.execution_utils import \
+    get_candidate_profiles
+from fruit_classifier.execution.execution_utils import \
+    load_execution_profile
+from fruit_classifier.execution.execution_utils import \
+    save_execution_profile
+from fruit_classifier.execution.execution_utils import configure_session
+from fruit_classifier.execution.execution_utils import DEFAULT_PROFILE
+
+
+class TestExecutionUtils(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir_path = \
+            Path(__file__).absolute().parents[1].joinpath('tmp_profiles')
+        self.profile_path = \
+            self.tmp_dir_path.joinpath('execution_profile.json')
+
+    def tearDown(self):
+        if self.tmp_dir_path.is_dir():
+            shutil.rmtree(self.tmp_dir_path)
+
+    def test_get_candidate_profiles(self):
+        candidates = get_candidate_profiles(cpu_count=8)
+        intra_op_threads = {c['intra_op_threads'] for c in candidates}
+        self.assertEqual(intra_op_threads, {1, 2, 4, 8})
+
+        # Sharing the cores must limit the number of threads
+        candidates = get_candidate_profiles(cpu_count=8, processes=4)
+        for candidate in candidates:
+            self.assertLessEqual(candidate['intra_op_threads'], 2)
+
+    def test_save_and_load_execution_profile(self):
+        # A missing profile falls back to the default
+        profile = load_execution_profile(self.profile_path)
+        self.assertEqual(profile, DEFAULT_PROFILE)
+
+        saved_profile = get_candidate_profiles()[0]
+        save_execution_profile(saved_profile, self.profile_path)
+        profile = load_execution_profile(self.profile_path)
+        self.assertEqual(profile, saved_profile)
+
+    def test_configure_session(self):
+        profile = configure_session({'intra_op_threads': 1,
+                                     'inter_op_threads': 1})
+        self.assertEqual(profile['intra_op_threads'], 1)
+
+        # The session is reused until the graph is cleared
+        session = K.get_session()
+        configure_session()
+        self.assertIs(K.get_session(), session)
+        K.clear_session()
+        configure_session()
+        self.assertIsNot(K.get_session(), session)
+
+
+if __name__ == '__main__':
+    unittest.main()
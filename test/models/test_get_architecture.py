@@ -0,0 +1,38 @@
+import unittest
+from fruit_classifier.models.models import get_architecture
+from fruit_classifier.models.models import get_lenet
+
+
+class TestGetArchitecture(unittest.TestCase):
+    def test_get_mobilenet(self):
+        intended_height = 32
+        intended_width = 24
+        intended_channels = 3
+        intended_classes = 4
+
+        model = get_architecture('mobilenet',
+                                 intended_height,
+                                 intended_width,
+                                 intended_channels,
+                                 intended_classes)
+        shape = model.input_shape
+
+        self.assertEqual(intended_height, shape[1])
+        self.assertEqual(intended_width, shape[2])
+        self.assertEqual(intended_channels, shape[3])
+        self.assertEqual(intended_classes, model.output_shape[1])
+
+    def test_alpha(self):
+        full_model = get_lenet(28, 28, 3, 2)
+        narrow_model = get_lenet(28, 28, 3, 2, alpha=0.5)
+
+        self.assertLess(narrow_model.count_params(),
+                        full_model.count_params())
+
+    def test_unknown_architecture(self):
+        with self.assertRaises(ValueError):
+            get_architecture('not_an_architecture', 28, 28, 3, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
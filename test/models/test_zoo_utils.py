@@ -0,0 +1,25 @@
+import unittest
+from fruit_classifier.models.zoo_utils import get_zoo_configs
+from fruit_classifier.models.zoo_utils import mark_pareto_front
+
+
+class TestZooUtils(unittest.TestCase):
+    def test_get_zoo_configs(self):
+        configs = get_zoo_configs(architectures=('lenet', 'mobilenet'),
+                                  alphas=(0.5, 1.0),
+                                  sizes=(28,))
+        self.assertEqual(len(configs), 4)
+
+    def test_mark_pareto_front(self):
+        results = [{'latency_ms': 1.0, 'val_acc': 0.8},
+                   {'latency_ms': 2.0, 'val_acc': 0.9},
+                   # Slower and less accurate than the first
+                   {'latency_ms': 3.0, 'val_acc': 0.7}]
+
+        results = mark_pareto_front(results)
+        pareto = [result['pareto'] for result in results]
+        self.assertEqual(pareto, [True, True, False])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import shutil
+import threading
+import unittest
+from pathlib import Path
+from fruit_classifier.pipeline.pipeline_utils import Stage
+from fruit_classifier.pipeline.pipeline_utils import run_pipeline
+from fruit_classifier.pipeline.pipeline_utils import get_required_stages
+
+
+class TestPipelineUtils(unittest.TestCase):
+
+    def setUp(self):
+        test_dir = Path(__file__).absolute().parents[1]
+        self.tmp_dir = test_dir.joinpath('tmp_pipeline')
+        self.src_dir = self.tmp_dir.joinpath('src')
+        self.stamp_dir = self.tmp_dir.joinpath('stamps')
+        self.src_dir.joinpath('a').mkdir(parents=True)
+        self.src_dir.joinpath('a', 'x.txt').write_text('x')
+        self.calls = list()
+
+    def tearDown(self):
+        if self.tmp_dir.is_dir():
+            shutil.rmtree(self.tmp_dir)
+
+    def get_stages(self, scale=2, barrier=None):
+        """
+        Returns the stages src -> (double, count) -> report
+        """
+
+        def copy_text(name, factor):
+            def function():
+                if barrier is not None:
+                    # Both branches must run at the same time to pass
+                    barrier.wait(timeout=5)
+                self.calls.append(name)
+                text = self.src_dir.joinpath('a', 'x.txt').read_text()
+                self.tmp_dir.joinpath(name + '.txt').write_text(
+                    text * factor)
+            return function
+
+        def report():
+            self.calls.append('report')
+            text = self.tmp_dir.joinpath('double.txt').read_text() + \
+                self.tmp_dir.joinpath('count.txt').read_text()
+            self.tmp_dir.joinpath('report.txt').write_text(text)
+
+        stages = [Stage('double',
+                        copy_text('double', scale),
+                        inputs=(self.src_dir,),
+                        outputs=(self.tmp_dir.joinpath('double.txt'),),
+                        params={'scale': scale}),
+                  Stage('count',
+                        copy_text('count', 1),
+                        inputs=(self.src_dir,),
+                        outputs=(self.tmp_dir.joinpath('count.txt'),)),
+                  Stage('report',
+                        report,
+                        deps=('double', 'count'),
+                        inputs=(self.tmp_dir.joinpath('double.txt'),
+                                self.tmp_dir.joinpath('count.txt')),
+                        outputs=(self.tmp_dir.joinpath('report.txt'),))]
+
+        return stages
+
+    def test_run_pipeline(self):
+        statuses = run_pipeline(self.get_stages(), self.stamp_dir)
+        self.assertEqual(set(statuses.values()), {'ran'})
+        self.assertEqual(self.calls[-1], 'report')
+        self.assertEqual(
+            self.tmp_dir.joinpath('report.txt').read_text(), 'xxx')
+
+        # Nothing has changed, so everything is skipped
+        self.calls = list()
+        statuses = run_pipeline(self.get_stages(), self.stamp_dir)
+        self.assertEqual(set(statuses.values()), {'skipped'})
+        self.assertEqual(self.calls, [])
+
+        # A changed parameter only re-runs the stage and its dependants
+        statuses = run_pipeline(self.get_stages(scale=3), self.stamp_dir)
+        self.assertEqual(statuses, {'double': 'ran',
+                                    'count': 'skipped',
+                                    'report': 'ran'})
+
+        # A changed input re-runs everything depending on it
+        self.src_dir.joinpath('a', 'x.txt').write_text('y')
+        statuses = run_pipeline(self.get_stages(scale=3), self.stamp_dir)
+        self.assertEqual(set(statuses.values()), {'ran'})
+        self.assertEqual(
+            self.tmp_dir.joinpath('report.txt').read_text(), 'yyyy')
+
+        # A removed output re-runs its stage
+        self.tmp_dir.joinpath('report.txt').unlink()
+        statuses = run_pipeline(self.get_stages(scale=3),
+                                self.stamp_dir,
+                                dry_run=True)
+        self.assertEqual(statuses['report'], 'would run')
+        self.assertFalse(self.tmp_dir.joinpath('report.txt').is_file())
+
+        # Only the dependencies of the targets are made
+        statuses = run_pipeline(self.get_stages(scale=3),
+                                self.stamp_dir,
+                                targets=('count',),
+                                force=('count',))
+        self.assertEqual(statuses, {'count': 'ran'})
+
+    def test_run_pipeline_parallel(self):
+        barrier = threading.Barrier(2)
+        statuses = run_pipeline(self.get_stages(barrier=barrier),
+                                self.stamp_dir)
+        self.assertEqual(set(statuses.values()), {'ran'})
+
+    def test_run_pipeline_failure(self):
+        stages = self.get_stages()
+
+        def fail():
+            raise OSError('Broken')
+        stages[1].function = fail
+
+        with self.assertRaises(RuntimeError):
+            run_pipeline(stages, self.stamp_dir)
+        self.assertFalse(self.tmp_dir.joinpath('report.txt').is_file())
+        self.assertFalse(self.stamp_dir.joinpath('count.json').is_file())
+
+    def test_get_required_stages(self):
+        stages = [Stage('a', None, deps=('b',)),
+                  Stage('b', None, deps=('a',))]
+        with self.assertRaises(ValueError):
+            get_required_stages(stages)
+
+        with self.assertRaises(ValueError):
+            get_required_stages(stages, targets=('c',))
+
+
+if __name__ == '__main__':
+    unittest.main()
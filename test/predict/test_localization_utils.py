@@ -0,0 +1,44 @@
+import unittest
+import numpy as np
+from fruit_classifier.predict.localization_utils import get_window_views
+from fruit_classifier.predict.localization_utils import get_windows
+from fruit_classifier.predict.localization_utils import non_max_suppression
+
+
+class TestLocalizationUtils(unittest.TestCase):
+
+    def test_get_window_views(self):
+        image = np.arange(6 * 8 * 3, dtype=np.float32).reshape(6, 8, 3)
+        windows = get_window_views(image, 4, 4, 2, 2)
+
+        self.assertEqual(windows.shape, (2, 3, 4, 4, 3))
+        # The windows must be views of the image
+        self.assertTrue(np.shares_memory(windows, image))
+        np.testing.assert_array_equal(windows[1, 2], image[2:6, 4:8])
+
+    def test_get_windows(self):
+        image = np.random.uniform(0, 255, (100, 200, 3))
+        windows, boxes = get_windows(image, 28, 28, 0.5, overlap=0.5)
+
+        self.assertEqual(windows.shape[1:], (28, 28, 3))
+        self.assertEqual(len(windows), len(boxes))
+        # The windows cover half of the shortest side
+        np.testing.assert_allclose(boxes[:, 2] - boxes[:, 0], 50)
+        self.assertLessEqual(boxes[:, 2].max(), 200)
+        self.assertLessEqual(boxes[:, 3].max(), 100)
+
+        # Windows larger than the image are not made
+        windows, boxes = get_windows(image, 28, 28, 2.0)
+        self.assertEqual(len(windows), 0)
+
+    def test_non_max_suppression(self):
+        boxes = np.array([[0, 0, 10, 10],
+                          [1, 1, 11, 11],
+                          [20, 20, 30, 30]], dtype=float)
+        scores = np.array([0.8, 0.9, 0.7])
+        keep = non_max_suppression(boxes, scores, iou_threshold=0.3)
+        np.testing.assert_array_equal(keep, [1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
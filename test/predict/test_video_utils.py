@@ -0,0 +1,60 @@
+import unittest
+import shutil
+import cv2
+import numpy as np
+from pathlib import Path
+from fruit_classifier.predict.video_utils import FrameReader
+from fruit_classifier.predict.video_utils import get_segments
+
+
+class TestVideoUtils(unittest.TestCase):
+
+    def setUp(self):
+        test_dir = Path(__file__).absolute().parents[1]
+        self.tmp_dir_path = test_dir.joinpath('tmp_video')
+        self.tmp_dir_path.mkdir(parents=True, exist_ok=True)
+        self.video_path = self.tmp_dir_path.joinpath('video.avi')
+
+        # Write 5 black frames followed by 5 white frames
+        writer = cv2.VideoWriter(str(self.video_path),
+                                 cv2.VideoWriter_fourcc(*'MJPG'),
+                                 10.0,
+                                 (64, 48))
+        for value in (0,) * 5 + (255,) * 5:
+            writer.write(np.full((48, 64, 3), value, dtype=np.uint8))
+        writer.release()
+
+    def tearDown(self):
+        if self.tmp_dir_path.is_dir():
+            shutil.rmtree(self.tmp_dir_path)
+
+    def test_frame_reader(self):
+        with FrameReader(self.video_path, 28, 28, stride=2) as reader:
+            frames = list(reader)
+        self.assertEqual([f[0] for f in frames], [0, 2, 4, 6, 8])
+        self.assertEqual(frames[0][1].shape, (28, 28, 3))
+        self.assertIsNone(frames[0][2])
+
+        # Only the first black and the first white frame are new
+        with FrameReader(self.video_path,
+                         diff_threshold=10.0,
+                         keep_frames=True) as reader:
+            frames = list(reader)
+        new_frames = [f[0] for f in frames if f[1] is not None]
+        self.assertEqual(new_frames, [0, 5])
+        self.assertEqual(frames[1][2].shape, (48, 64, 3))
+
+    def test_get_segments(self):
+        rows = [{'frame': 0, 'label': 'apple', 'probability': 0.8},
+                {'frame': 2, 'label': 'apple', 'probability': 0.6},
+                {'frame': 4, 'label': 'banana', 'probability': 0.9}]
+        segments = get_segments(rows, fps=2.0)
+
+        self.assertEqual(len(segments), 2)
+        self.assertEqual(segments[0]['end_frame'], 2)
+        self.assertAlmostEqual(segments[0]['probability'], 0.7)
+        self.assertEqual(segments[1]['start_time'], 2.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,6 +7,9 @@ from fruit_classifier.preprocessing.preprocessing_utils \
     import truncate_filenames
 from fruit_classifier.preprocessing.preprocessing_utils \
     import preprocess_image
+from fruit_classifier.preprocessing.preprocessing_utils \
+    import remove_non_images
+from fruit_classifier.utils.manifest_utils import read_manifest
 
 
 class TestPreprocessingUtils(unittest.TestCase):
@@ -41,6 +44,11 @@ class TestPreprocessingUtils(unittest.TestCase):
         # Assert that dimensions on original image are correct
         self.assertEqual(self.comp.shape, tuple(self.test_comp_shape))
 
+    def test_preprocess_image_size(self):
+        # Assert that the resolution can be configured
+        comp = preprocess_image(self.raw, height=32, width=16)
+        self.assertEqual(comp.shape, (32, 16, 3))
+
     def test_verify_legal_max_min(self):
         self.assertLessEqual(np.amax(self.raw), 255)
         self.assertGreaterEqual(np.amin(self.raw), 0)
@@ -89,6 +97,36 @@ class TestPreprocessingUtils(unittest.TestCase):
         for filepath in file_list:
             self.assertLessEqual(len(str(filepath)), 255)
 
+    def test_remove_non_images(self):
+        raw_dir = self.test_dir.joinpath('test_data', 'raw_data')
+        tmp_raw_dir = self.tmp_dir_path.joinpath('raw_data')
+        clean_dir = self.tmp_dir_path.joinpath('cleaned_data')
+        shutil.copytree(str(raw_dir), str(tmp_raw_dir))
+
+        remove_non_images(tmp_raw_dir, clean_dir)
+
+        # Every image in the manifest must be readable
+        clean_entries = read_manifest(clean_dir)
+        self.assertGreater(len(clean_entries), 0)
+        for relative_path in clean_entries:
+            image = cv2.imread(str(clean_dir.joinpath(relative_path)))
+            self.assertIsNotNone(image)
+
+        # Running again must not change the result
+        remove_non_images(tmp_raw_dir, clean_dir)
+        self.assertEqual(read_manifest(clean_dir), clean_entries)
+
+        # Copies of removed and broken images must be removed
+        removed_path, broken_path = sorted(clean_entries)[:2]
+        tmp_raw_dir.joinpath(removed_path).unlink()
+        tmp_raw_dir.joinpath(broken_path).write_bytes(b'Not an image')
+        remove_non_images(tmp_raw_dir, clean_dir)
+        new_entries = read_manifest(clean_dir)
+        self.assertEqual(set(new_entries),
+                         set(clean_entries) - {removed_path, broken_path})
+        self.assertFalse(clean_dir.joinpath(removed_path).exists())
+        self.assertFalse(clean_dir.joinpath(broken_path).exists())
+
 
 if __name__ == '__main__':
     unittest.main()
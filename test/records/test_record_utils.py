@@ -0,0 +1,66 @@
+import unittest
+import shutil
+from pathlib import Path
+from fruit_classifier.records.record_utils import write_shards
+from fruit_classifier.records.record_utils import read_index
+from fruit_classifier.records.record_utils import read_record
+from fruit_classifier.records.record_utils import iterate_records
+from fruit_classifier.records.record_utils import iterate_batches
+
+
+class TestRecordUtils(unittest.TestCase):
+
+    def setUp(self):
+        test_dir = Path(__file__).absolute().parents[1]
+        self.tmp_dir_path = test_dir.joinpath('tmp_records')
+        self.root_dir = self.tmp_dir_path.joinpath('raw_data')
+        self.shard_dir = self.tmp_dir_path.joinpath('records')
+        shutil.copytree(str(test_dir.joinpath('test_data', 'raw_data')),
+                        str(self.root_dir))
+
+    def tearDown(self):
+        if self.tmp_dir_path.is_dir():
+            shutil.rmtree(self.tmp_dir_path)
+
+    def test_write_and_read_shards(self):
+        # Use small shards to get several of them
+        index = write_shards(self.root_dir,
+                             self.shard_dir,
+                             shard_size=1,
+                             n_workers=2)
+        self.assertEqual(len(index), 6)
+        self.assertEqual(index, read_index(self.shard_dir))
+
+        # Random access must give back the original bytes
+        for row in index:
+            data = read_record(self.shard_dir, row)
+            original = self.root_dir.joinpath(row['path']).read_bytes()
+            self.assertEqual(data, original)
+
+        # Nothing new to append
+        index = write_shards(self.root_dir, self.shard_dir, shard_size=1)
+        self.assertEqual(len(index), 6)
+        self.assertEqual(len(list(self.shard_dir.glob('*.rec'))), 6)
+
+    def test_iterate_records(self):
+        write_shards(self.root_dir, self.shard_dir, shard_size=1)
+
+        ordered = list(iterate_records(self.shard_dir, shuffle=False))
+        shuffled = list(iterate_records(self.shard_dir,
+                                        shuffle=True,
+                                        buffer_size=2,
+                                        seed=1))
+        self.assertEqual(len(ordered), 6)
+        self.assertEqual(sorted(ordered), sorted(shuffled))
+
+        for label, path, _ in ordered:
+            self.assertEqual(label, path.split('/')[0])
+
+        batches = list(iterate_batches(self.shard_dir,
+                                       batch_size=4,
+                                       shuffle=False))
+        self.assertEqual([len(b[2]) for b in batches], [4, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import shutil
+import unittest
+import numpy as np
+from pathlib import Path
+from keras.engine.saving import load_model
+from fruit_classifier.models.layers import CUSTOM_OBJECTS
+from fruit_classifier.models.models import get_lenet
+from fruit_classifier.predict.predict_utils import load_classifier
+from fruit_classifier.serving.serving_utils import fit_to_input
+from fruit_classifier.serving.serving_utils import get_serving_model
+from fruit_classifier.serving.serving_utils import is_serving_model
+
+
+class TestServingUtils(unittest.TestCase):
+
+    def setUp(self):
+        test_dir = Path(__file__).absolute().parents[1]
+        self.tmp_dir = test_dir.joinpath('tmp_serving')
+        self.model = get_lenet(28, 28, 3, 2)
+        self.images = np.random.randint(0, 256, (2, 28, 28, 3),
+                                        dtype=np.uint8)
+
+    def tearDown(self):
+        if self.tmp_dir.is_dir():
+            shutil.rmtree(self.tmp_dir)
+
+    def test_get_serving_model(self):
+        serving_model = get_serving_model(self.model)
+        self.assertTrue(is_serving_model(serving_model))
+        self.assertFalse(is_serving_model(self.model))
+
+        # Without resizing, only the scaling is left
+        np.testing.assert_allclose(serving_model.predict(self.images),
+                                   self.model.predict(self.images / 255),
+                                   rtol=1e-5)
+
+        # Any size is resized to the input of the model
+        large_images = np.random.randint(0, 256, (2, 100, 60, 3),
+                                         dtype=np.uint8)
+        probabilities = serving_model.predict(large_images)
+        self.assertEqual(probabilities.shape, (2, 2))
+
+    def test_fixed_input_size(self):
+        serving_model = get_serving_model(self.model, input_size=(64, 48))
+        self.assertEqual(serving_model.input_shape, (None, 64, 48, 3))
+
+        image = np.random.randint(0, 256, (100, 60, 3), dtype=np.uint8)
+        fitted = fit_to_input(image, serving_model)
+        self.assertEqual(fitted.shape, (64, 48, 3))
+        self.assertEqual(fitted.dtype, np.uint8)
+
+        # Models taking any size get the image as it is
+        self.assertIs(fit_to_input(image, get_serving_model(self.model)),
+                      image)
+
+    def test_save_and_load(self):
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        model_path = self.tmp_dir.joinpath('model_serving.h5')
+
+        serving_model = get_serving_model(self.model, input_size=(28, 28))
+        serving_model.save(str(model_path))
+        loaded_model = load_model(str(model_path),
+                                  custom_objects=CUSTOM_OBJECTS)
+
+        np.testing.assert_allclose(loaded_model.predict(self.images),
+                                   serving_model.predict(self.images),
+                                   rtol=1e-5)
+
+    def test_load_classifier(self):
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        model_path = self.tmp_dir.joinpath('model_serving.h5')
+        get_serving_model(self.model).save(str(model_path))
+
+        # Only callers giving raw images may load serving models
+        with self.assertRaises(ValueError):
+            load_classifier(model_path=model_path)
+        model = load_classifier(model_path=model_path, serving=True)
+        self.assertTrue(is_serving_model(model))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+import shutil
+from pathlib import Path
+from fruit_classifier.telemetry.telemetry_utils import TelemetryWriter
+from fruit_classifier.telemetry.telemetry_utils import read_records
+from fruit_classifier.telemetry.telemetry_utils import summarize_records
+from fruit_classifier.telemetry.telemetry_utils import format_record
+from fruit_classifier.telemetry.telemetry_utils import format_summary
+from fruit_classifier.telemetry.telemetry_utils import get_rss
+
+
+def get_batch_record(epoch, batch, data_wait, compute):
+    return {'type': 'batch',
+            'time': 0.0,
+            'epoch': epoch,
+            'batch': batch,
+            'size': 32,
+            'data_wait': data_wait,
+            'compute': compute,
+            'images_per_sec': 32 / (data_wait + compute),
+            'rss': 1 << 20,
+            'loss': 1.0,
+            'acc': 0.5}
+
+
+class TestTelemetryUtils(unittest.TestCase):
+
+    def setUp(self):
+        test_dir = Path(__file__).absolute().parents[1]
+        self.tmp_dir_path = test_dir.joinpath('tmp_telemetry')
+        self.telemetry_path = self.tmp_dir_path.joinpath('training.jsonl')
+
+    def tearDown(self):
+        if self.tmp_dir_path.is_dir():
+            shutil.rmtree(self.tmp_dir_path)
+
+    def test_get_rss(self):
+        self.assertGreater(get_rss(), 0)
+
+    def test_write_and_summarize(self):
+        epoch_record = {'type': 'epoch',
+                        'time': 0.0,
+                        'epoch': 0,
+                        'images': 64,
+                        'duration': 1.0,
+                        'data_wait': 0.6,
+                        'compute': 0.2,
+                        'images_per_sec': 80.0,
+                        'rss': 1 << 20,
+                        'loss': 1.0,
+                        'val_loss': 1.2,
+                        'val_acc': 0.4}
+
+        writer = TelemetryWriter(self.telemetry_path)
+        # The first run must be ignored in the summary
+        writer.write({'type': 'start', 'time': 0.0, 'epochs': 5})
+        writer.write(get_batch_record(0, 0, 1.0, 1.0))
+        writer.write({'type': 'start', 'time': 0.0, 'epochs': 2})
+        writer.write(get_batch_record(0, 0, 0.3, 0.1))
+        writer.write(get_batch_record(0, 1, 0.3, 0.1))
+        writer.write(epoch_record)
+        writer.write(get_batch_record(1, 0, 0.1, 0.3))
+        writer.close()
+
+        # A partially written line is skipped
+        with self.telemetry_path.open('a') as f:
+            f.write('{"type": "bat')
+
+        records = read_records(self.telemetry_path)
+        self.assertEqual(len(records), 7)
+
+        summary = summarize_records(records)
+        self.assertEqual(len(summary), 2)
+
+        self.assertTrue(summary[0]['complete'])
+        self.assertEqual(summary[0]['images'], 64)
+        self.assertAlmostEqual(summary[0]['input_bound_fraction'], 0.75)
+
+        self.assertFalse(summary[1]['complete'])
+        self.assertEqual(summary[1]['images'], 32)
+        self.assertAlmostEqual(summary[1]['images_per_sec'], 80.0)
+        self.assertAlmostEqual(summary[1]['input_bound_fraction'], 0.25)
+
+        table = format_summary(summary)
+        self.assertIn('input-bound', table)
+
+        for record in records:
+            self.assertIsInstance(format_record(record), str)
+
+
+if __name__ == '__main__':
+    unittest.main()
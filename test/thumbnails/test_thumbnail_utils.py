@@ -0,0 +1,86 @@
+import shutil
+import unittest
+import numpy as np
+from pathlib import Path
+from fruit_classifier.thumbnails.thumbnail_utils import build_thumbnails
+from fruit_classifier.thumbnails.thumbnail_utils import get_thumbnail_size
+from fruit_classifier.thumbnails.thumbnail_utils import load_thumbnails
+from fruit_classifier.thumbnails.thumbnail_utils import make_thumbnail
+from fruit_classifier.utils.image_utils import read_image
+from fruit_classifier.utils.manifest_utils import update_manifest
+
+
+class TestThumbnailUtils(unittest.TestCase):
+
+    def setUp(self):
+        test_dir = Path(__file__).absolute().parents[1]
+        self.tmp_dir_path = test_dir.joinpath('tmp_thumbnails')
+        self.image_dir = self.tmp_dir_path.joinpath('cleaned_data')
+        self.thumbnail_dir = self.tmp_dir_path.joinpath('thumbnails')
+        shutil.copytree(str(test_dir.joinpath('test_data', 'raw_data')),
+                        str(self.image_dir))
+
+    def tearDown(self):
+        if self.tmp_dir_path.is_dir():
+            shutil.rmtree(self.tmp_dir_path)
+
+    def test_make_thumbnail(self):
+        image = np.random.randint(0, 256, (100, 40, 3)).astype(np.uint8)
+
+        thumbnail = make_thumbnail(image, 20)
+        self.assertEqual(thumbnail.shape, (50, 20, 3))
+        self.assertEqual(thumbnail.dtype, np.uint8)
+
+        # Small images are not upscaled
+        self.assertEqual(make_thumbnail(image, 64).shape, image.shape)
+
+    def test_get_thumbnail_size(self):
+        self.assertEqual(get_thumbnail_size(28, 28), 32)
+        self.assertEqual(get_thumbnail_size(32, 48), 64)
+        self.assertEqual(get_thumbnail_size(128, 128), 128)
+        self.assertIsNone(get_thumbnail_size(224, 224))
+
+    def test_build_thumbnails(self):
+        self.assertIsNone(load_thumbnails(self.thumbnail_dir))
+
+        cache = build_thumbnails(self.image_dir,
+                                 self.thumbnail_dir,
+                                 sizes=(16, 32))
+        self.assertGreater(len(cache), 0)
+        self.assertEqual(cache.sizes, (16, 32))
+
+        n_found = 0
+        for image_path in self.image_dir.glob('*/*'):
+            thumbnail = cache.get(image_path, 16)
+            if thumbnail is None:
+                continue
+            n_found += 1
+            image = read_image(image_path)
+            self.assertEqual(min(thumbnail.shape[:2]),
+                             min(16, *image.shape[:2]))
+            self.assertEqual(min(cache.get(image_path, 32).shape[:2]),
+                             min(32, *image.shape[:2]))
+        self.assertEqual(n_found, len(cache))
+
+        # Images outside the directory are not cached
+        self.assertIsNone(cache.get(self.tmp_dir_path.joinpath('x.jpg'), 16))
+
+        # A rebuild reuses the stored thumbnails
+        image_path = next(p for p in self.image_dir.glob('*/*')
+                          if cache.get(p, 16) is not None)
+        expected = np.array(cache.get(image_path, 32))
+        del cache
+        cache = build_thumbnails(self.image_dir,
+                                 self.thumbnail_dir,
+                                 sizes=(16, 32))
+        np.testing.assert_array_equal(cache.get(image_path, 32), expected)
+
+        # A changed image is not served from its old thumbnail
+        image_path.write_bytes(b'not an image')
+        update_manifest(self.image_dir)
+        reloaded = load_thumbnails(self.thumbnail_dir)
+        self.assertIsNone(reloaded.get(image_path, 32))
+
+
+if __name__ == '__main__':
+    unittest.main()
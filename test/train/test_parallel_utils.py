@@ -0,0 +1,50 @@
+import unittest
+import numpy as np
+from keras import backend as K
+from fruit_classifier.train.callbacks import get_averaged_arrays
+from fruit_classifier.train.parallel_utils import get_slot_size
+from fruit_classifier.train.parallel_utils import get_worker_profile
+from fruit_classifier.train.parallel_utils import train_model_parallel
+from fruit_classifier.train.train_utils import get_model
+
+
+class TestParallelUtils(unittest.TestCase):
+
+    def test_get_worker_profile(self):
+        profile = get_worker_profile(2)
+        self.assertGreater(profile['intra_op_threads'], 0)
+        self.assertGreater(profile['inter_op_threads'], 0)
+
+    def test_get_slot_size(self):
+        slot_size = get_slot_size(2, 28, 28, 3, 'lenet', 1.0)
+
+        model = get_model(2, sparse_labels=True)
+        model._make_train_function()
+        arrays = get_averaged_arrays(model)
+        n_params = model.count_params()
+        K.clear_session()
+
+        # Adam adds a placeholder per weight to the two moments
+        self.assertGreater(slot_size, 3 * n_params)
+        self.assertEqual(slot_size, sum(w.size for w in arrays))
+
+    def test_train_model_parallel(self):
+        data = np.random.rand(40, 28, 28, 3).astype(np.float32)
+        labels = np.arange(40) % 2
+        train_indices = np.arange(32)
+        val_indices = np.arange(32, 40)
+
+        history = train_model_parallel(data,
+                                       labels,
+                                       train_indices,
+                                       val_indices,
+                                       n_workers=2,
+                                       period=2,
+                                       batch_size=8,
+                                       epochs=2,
+                                       patience=None)
+        self.assertEqual(len(history.history['val_loss']), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
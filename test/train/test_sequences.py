@@ -0,0 +1,49 @@
+import unittest
+import numpy as np
+from fruit_classifier.train.sequences import IndexSequence
+from fruit_classifier.preprocessing.preprocessing_utils import \
+    get_image_generator
+
+
+class TestIndexSequence(unittest.TestCase):
+
+    def setUp(self):
+        self.data = np.arange(10 * 4 * 4 * 3, dtype='float32').\
+            reshape(10, 4, 4, 3)
+        self.labels = np.arange(10)
+        self.indices = np.array([9, 1, 5, 3, 7])
+
+    def test_batches(self):
+        sequence = IndexSequence(self.data,
+                                 self.labels,
+                                 self.indices,
+                                 batch_size=2)
+        self.assertEqual(len(sequence), 3)
+
+        # Every sample must be gathered exactly once with its label
+        gathered_labels = list()
+        for i in range(len(sequence)):
+            x_batch, y_batch = sequence[i]
+            np.testing.assert_array_equal(x_batch, self.data[y_batch])
+            gathered_labels.extend(y_batch)
+        self.assertEqual(sorted(gathered_labels), sorted(self.indices))
+
+    def test_shuffle_and_augment(self):
+        sequence = IndexSequence(self.data,
+                                 self.labels,
+                                 self.indices,
+                                 batch_size=5,
+                                 image_generator=get_image_generator(),
+                                 shuffle=True,
+                                 seed=0)
+        sequence.on_epoch_end()
+        x_batch, y_batch = sequence[0]
+
+        self.assertEqual(x_batch.shape, (5, 4, 4, 3))
+        self.assertEqual(sorted(y_batch), sorted(self.indices))
+        # The data itself must never be modified
+        self.assertEqual(self.data[0, 0, 0, 0], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,13 +1,28 @@
 import unittest
 from fruit_classifier.train.train_utils import get_image_paths
 from fruit_classifier.train.train_utils import get_data_and_labels
+from fruit_classifier.train.train_utils import get_data_key
 from fruit_classifier.train.train_utils import get_model_input
 from fruit_classifier.train.train_utils import get_model
 from fruit_classifier.train.train_utils import train_model
 from fruit_classifier.train.train_utils import plot_training
+from fruit_classifier.train.train_utils import load_checkpoint
+from fruit_classifier.train.train_utils import encode_labels
+from fruit_classifier.train.train_utils import get_split_indices
+from fruit_classifier.train.train_utils import get_manifest_split_indices
+from fruit_classifier.train.train_utils import train_model_on_sequences
+from fruit_classifier.train.train_utils import extend_output_layer
+from fruit_classifier.train.train_utils import get_incremental_indices
+from fruit_classifier.train.train_utils import save_training_record
+from fruit_classifier.train.train_utils import load_training_record
+from fruit_classifier.train.sequences import IndexSequence
+from fruit_classifier.train.callbacks import EpochCheckpoint
+from keras.callbacks import EarlyStopping
+from fruit_classifier.telemetry.telemetry_utils import read_records
 from fruit_classifier.preprocessing.preprocessing_utils import \
     get_image_generator
 from pathlib import Path
+import numpy as np
 import shutil
 
 
@@ -55,6 +70,29 @@ class TestTrainUtils(unittest.TestCase):
         self.assertGreater(len(data), 0)
         self.assertGreater(len(labels), 0)
 
+    def test_get_data_key(self):
+        key = get_data_key(self.image_paths, 28, 28)
+        self.assertEqual(key, get_data_key(self.image_paths, 28, 28))
+
+        # Relabelling, reordering, resizing or replacing images changes
+        # the key
+        self.assertNotEqual(key, get_data_key(self.image_paths,
+                                              28,
+                                              28,
+                                              ['class_c', 'class_c']))
+        self.assertNotEqual(key, get_data_key(self.image_paths[::-1],
+                                              28,
+                                              28))
+        self.assertNotEqual(key, get_data_key(self.image_paths, 32, 32))
+        self.assertNotEqual(get_data_key(self.image_paths,
+                                         28,
+                                         28,
+                                         image_hashes=['a', 'b']),
+                            get_data_key(self.image_paths,
+                                         28,
+                                         28,
+                                         image_hashes=['a', 'c']))
+
     def test_get_model_input(self):
         # Run get_model_input and verify outputs
         data, labels = get_data_and_labels(self.image_paths)
@@ -64,6 +102,22 @@ class TestTrainUtils(unittest.TestCase):
         self.assertEqual(1, len(y_train))
         self.assertEqual(1, len(y_val))
 
+    def test_get_split_indices(self):
+        train_indices, val_indices = get_split_indices(8)
+        self.assertEqual(len(train_indices), 6)
+        self.assertEqual(len(val_indices), 2)
+        self.assertEqual(sorted(list(train_indices) + list(val_indices)),
+                         list(range(8)))
+
+    def test_get_manifest_split_indices(self):
+        splits = ['train', 'val', 'train', 'train', 'val']
+        train_indices, val_indices = get_manifest_split_indices(splits)
+        self.assertEqual(list(train_indices), [0, 2, 3])
+        self.assertEqual(list(val_indices), [1, 4])
+
+        with self.assertRaises(ValueError):
+            get_manifest_split_indices(['train', 'train'])
+
     def test_get_image_generator(self):
         # Run get_image_generator and verify outputs
         rotation_range = 30
@@ -118,6 +172,129 @@ class TestTrainUtils(unittest.TestCase):
         num_epochs = history.params['epochs']
         self.assertEqual(num_epochs, self.num_intended_epochs)
 
+    def test_train_model_on_sequences(self):
+        # Train with an index split and sparse labels
+        data, labels = get_data_and_labels(self.image_paths)
+        encoded_labels = encode_labels(labels)
+        train_indices, val_indices = get_split_indices(len(labels))
+
+        train_sequence = IndexSequence(data,
+                                       encoded_labels,
+                                       train_indices,
+                                       image_generator=get_image_generator(),
+                                       shuffle=True)
+        val_sequence = IndexSequence(data, encoded_labels, val_indices)
+
+        model = get_model(self.n_classes,
+                          epochs=self.num_intended_epochs,
+                          sparse_labels=True)
+
+        telemetry_path = self.directory_name.joinpath('training.jsonl')
+        history = train_model_on_sequences(model,
+                                           train_sequence,
+                                           val_sequence,
+                                           epochs=self.num_intended_epochs,
+                                           telemetry=telemetry_path)
+        num_epochs = history.params['epochs']
+        self.assertEqual(num_epochs, self.num_intended_epochs)
+
+        # One start record, and one batch and epoch record per epoch
+        records = read_records(telemetry_path)
+        types = [record['type'] for record in records]
+        self.assertEqual(types, ['start'] + ['batch', 'epoch'] * num_epochs)
+        self.assertIn('val_loss', records[-1])
+
+    def test_load_checkpoint(self):
+        # Store a checkpoint and verify that it can be resumed from
+        checkpoint_dir = self.directory_name.joinpath('checkpoints')
+        model, initial_epoch = load_checkpoint(checkpoint_dir)
+        self.assertIsNone(model)
+        self.assertEqual(initial_epoch, 0)
+
+        model = get_model(self.n_classes,
+                          epochs=self.num_intended_epochs)
+        checkpoint = EpochCheckpoint(checkpoint_dir)
+        checkpoint.set_model(model)
+        checkpoint.on_epoch_end(0)
+
+        model, initial_epoch = load_checkpoint(checkpoint_dir)
+        self.assertIsNotNone(model.optimizer)
+        self.assertEqual(initial_epoch, 1)
+
+        # The state of the early stopping is resumed as well
+        early_stopping = EarlyStopping(patience=5,
+                                       restore_best_weights=True)
+        early_stopping.wait = 2
+        early_stopping.best = 0.5
+        early_stopping.best_weights = model.get_weights()
+        checkpoint = EpochCheckpoint(checkpoint_dir,
+                                     early_stopping=early_stopping)
+        checkpoint.set_model(model)
+        checkpoint.on_epoch_end(1)
+
+        early_stopping = EarlyStopping(patience=5,
+                                       restore_best_weights=True)
+        checkpoint = EpochCheckpoint(checkpoint_dir,
+                                     early_stopping=early_stopping,
+                                     resume=True)
+        early_stopping.on_train_begin()
+        checkpoint.on_train_begin()
+        self.assertEqual(early_stopping.wait, 2)
+        self.assertEqual(early_stopping.best, 0.5)
+        self.assertEqual(len(early_stopping.best_weights),
+                         len(model.get_weights()))
+
+    def test_extend_output_layer(self):
+        # The old outputs must keep their weights at their new positions
+        model = get_model(2, epochs=self.num_intended_epochs)
+        old_weights, old_biases = model.layers[-1].get_weights()
+
+        extended_model = extend_output_layer(model,
+                                             ['b', 'd'],
+                                             ['a', 'b', 'c', 'd'])
+        self.assertEqual(extended_model.output_shape[-1], 4)
+        weights, biases = extended_model.layers[-1].get_weights()
+        np.testing.assert_array_equal(weights[:, [1, 3]], old_weights)
+        np.testing.assert_array_equal(biases[[1, 3]], old_biases)
+
+        self.assertIs(extend_output_layer(model, ['a', 'b'], ['a', 'b']),
+                      model)
+        with self.assertRaises(ValueError):
+            extend_output_layer(model, ['a', 'b'], ['a', 'c'])
+
+    def test_get_incremental_indices(self):
+        hashes = ['h0', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6']
+        splits = ['train', 'train', 'train', 'val', 'train', 'train', 'val']
+        trained_hashes = ['h0', 'h1', 'h2', 'h3']
+
+        train_indices, val_indices, new_indices = \
+            get_incremental_indices(hashes,
+                                    splits,
+                                    trained_hashes,
+                                    replay=1.0)
+        np.testing.assert_array_equal(new_indices, [4, 5])
+        np.testing.assert_array_equal(val_indices, [3, 6])
+        # Two old samples are replayed along with the two new ones
+        self.assertEqual(len(train_indices), 4)
+        self.assertTrue(set(train_indices[2:]) <= {0, 1, 2})
+
+        # Nothing is new
+        train_indices, _, new_indices = \
+            get_incremental_indices(hashes, splits, hashes)
+        self.assertEqual(len(new_indices), 0)
+        self.assertEqual(len(train_indices), 0)
+
+    def test_save_and_load_training_record(self):
+        record_path = self.directory_name.joinpath('trained.json')
+        self.assertIsNone(load_training_record(record_path))
+
+        save_training_record(np.array(['a', 'b']),
+                             np.array(['h1', 'h0', 'h1']),
+                             record_path)
+        record = load_training_record(record_path)
+        self.assertEqual(record['classes'], ['a', 'b'])
+        self.assertEqual(record['hashes'], ['h0', 'h1'])
+
     def test_plot_training(self):
         # Run plot_training and verify it does not crash
         class History(object):
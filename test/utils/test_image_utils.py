@@ -1,8 +1,15 @@
+import io
+import struct
 import unittest
 from pathlib import Path
 import numpy as np
 
 from fruit_classifier.utils.image_utils import open_image
+from fruit_classifier.utils.image_utils import read_image
+from fruit_classifier.utils.image_utils import decode_image
+from fruit_classifier.utils.image_utils import get_image_size
+from fruit_classifier.utils.image_utils import check_image
+from fruit_classifier.utils.image_utils import ImageTooLargeError
 
 
 class TestImageUtils(unittest.TestCase):
@@ -26,6 +33,57 @@ class TestImageUtils(unittest.TestCase):
         self.open_image_function(self.jpg_image_file_name)
         self.open_image_function(self.png_image_file_name)
 
+    def test_get_image_size(self):
+        for path in (self.jpg_image_file_name, self.png_image_file_name):
+            with path.open('rb') as f:
+                width, height = get_image_size(f)
+            self.assertEqual((height, width), tuple(self.test_orig_shape[:2]))
+
+        with self.assertRaises(ValueError):
+            get_image_size(io.BytesIO(b'not an image at all'))
+
+    def test_get_image_size_tiff_and_pnm(self):
+        # A little endian TIFF with the width and height as SHORT
+        tiff = b'II*\x00' + struct.pack('<I', 8) + struct.pack('<H', 2) + \
+            struct.pack('<HHIH2x', 256, 3, 1, 73) + \
+            struct.pack('<HHIH2x', 257, 3, 1, 115)
+        self.assertEqual(get_image_size(io.BytesIO(tiff)), (73, 115))
+
+        # A big endian TIFF with the width and height as LONG
+        tiff = b'MM\x00*' + struct.pack('>I', 8) + struct.pack('>H', 2) + \
+            struct.pack('>HHII', 256, 4, 1, 73) + \
+            struct.pack('>HHII', 257, 4, 1, 115)
+        self.assertEqual(get_image_size(io.BytesIO(tiff)), (73, 115))
+
+        ppm = b'P6\n# A comment longer than the first bytes read\n' \
+            b'73 115\n255\n'
+        self.assertEqual(get_image_size(io.BytesIO(ppm)), (73, 115))
+
+        with self.assertRaises(ValueError):
+            get_image_size(io.BytesIO(b'P6\n73'))
+
+    def test_check_image(self):
+        # A PNG header claiming 100000x100000 pixels is never decoded
+        header = b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + \
+            struct.pack('>II', 100000, 100000) + b'\x08\x02\x00\x00\x00'
+        with self.assertRaises(ImageTooLargeError):
+            check_image(io.BytesIO(header), len(header))
+        with self.assertRaises(ImageTooLargeError):
+            decode_image(header)
+
+        data = self.png_image_file_name.read_bytes()
+        with self.assertRaises(ImageTooLargeError):
+            check_image(io.BytesIO(data), len(data), max_bytes=10)
+
+    def test_read_image_reduced(self):
+        # The image is downscaled by 2 to fit within the pixel budget
+        image = read_image(self.jpg_image_file_name, max_decode_pixels=3000)
+        # How the halved sides are rounded depends on the OpenCV build
+        for side, orig_side in zip(image.shape[:2],
+                                   self.test_orig_shape[:2]):
+            self.assertIn(side, (orig_side // 2, -(-orig_side // 2)))
+        self.assertEqual(image.shape[2], 3)
+
     def open_image_function(self, file):
         image = open_image(file)
 
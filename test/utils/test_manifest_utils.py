@@ -0,0 +1,73 @@
+import os
+import unittest
+import shutil
+from pathlib import Path
+from unittest.mock import patch
+from fruit_classifier.utils import manifest_utils
+from fruit_classifier.utils.manifest_utils import update_manifest
+from fruit_classifier.utils.manifest_utils import read_manifest
+from fruit_classifier.utils.manifest_utils import get_manifest_path
+from fruit_classifier.utils.manifest_utils import get_split
+
+
+class TestManifestUtils(unittest.TestCase):
+
+    def setUp(self):
+        test_dir = Path(__file__).absolute().parents[1]
+        self.src_path = test_dir.joinpath('test_data', 'raw_data')
+        self.tmp_dir_path = test_dir.joinpath('tmp_manifest')
+        shutil.copytree(str(self.src_path), str(self.tmp_dir_path))
+
+    def tearDown(self):
+        if self.tmp_dir_path.is_dir():
+            shutil.rmtree(self.tmp_dir_path)
+
+    def test_update_manifest(self):
+        entries = update_manifest(self.tmp_dir_path)
+
+        self.assertTrue(get_manifest_path(self.tmp_dir_path).is_file())
+        self.assertEqual(len(entries), 6)
+        self.assertEqual({e['label'] for e in entries},
+                         {'apples', 'bananas'})
+        for entry in entries:
+            self.assertIn(entry['split'], ('train', 'val'))
+            self.assertTrue(
+                self.tmp_dir_path.joinpath(entry['path']).is_file())
+
+        # The stored manifest must match what was returned
+        stored_entries = read_manifest(self.tmp_dir_path)
+        self.assertEqual(list(stored_entries.values()), entries)
+
+    def test_incremental_update(self):
+        update_manifest(self.tmp_dir_path)
+
+        # Nothing has changed, so nothing should be hashed
+        with patch.object(manifest_utils, 'hash_file') as mock_hash:
+            entries = update_manifest(self.tmp_dir_path)
+            mock_hash.assert_not_called()
+        self.assertEqual(len(entries), 6)
+
+        # Remove one file and add another
+        removed_path = self.tmp_dir_path.joinpath(entries[0]['path'])
+        added_path = self.tmp_dir_path.joinpath('apples', 'new.jpeg')
+        shutil.copy2(str(removed_path), str(added_path))
+        os.remove(str(removed_path))
+
+        with patch.object(manifest_utils,
+                          'hash_file',
+                          wraps=manifest_utils.hash_file) as mock_hash:
+            entries = update_manifest(self.tmp_dir_path)
+            mock_hash.assert_called_once_with(added_path)
+
+        paths = [e['path'] for e in entries]
+        self.assertIn('apples/new.jpeg', paths)
+        self.assertNotIn(removed_path.relative_to(
+            self.tmp_dir_path).as_posix(), paths)
+
+    def test_get_split(self):
+        self.assertEqual(get_split('0' * 40), 'val')
+        self.assertEqual(get_split('f' * 40), 'train')
+
+
+if __name__ == '__main__':
+    unittest.main()